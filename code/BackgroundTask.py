@@ -0,0 +1,60 @@
+# Background startup work for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Runs one slow startup step (database load, model warm up, picture encoding) on its own thread
+#   so the camera can be opened and shown while it happens
+# The main loop polls Done() between frames, then collects Result() on its own thread
+#   (anything that touches databaseArray still happens on the main thread)
+
+
+import threading  # task thread
+import time  # task timing
+
+
+class BackgroundTask:
+    # One function call on its own thread
+
+    # Inputs:   name (thread name, used in error messages)
+    #           function, arguments (what to run)
+
+    # Process:  starts right away
+    #           Done - True once the function returned (or raised)
+    #           Result - waits for it, returns its return value
+    #               (an exception raised on the task's thread is raised again here)
+    #           seconds - how long it ran
+
+    def __init__(self, name, function, *arguments):
+
+        self.name = name
+        self.seconds = 0.0
+
+        self.result = None
+        self.error = None
+
+        self.thread = threading.Thread(target=self.Run, args=(
+            function, arguments), name=name, daemon=True)
+        self.thread.start()
+
+    def Run(self, function, arguments):
+
+        startTime = time.perf_counter()
+
+        try:
+            self.result = function(*arguments)
+
+        except BaseException as error:
+            self.error = error
+
+        self.seconds = time.perf_counter() - startTime
+
+    def Done(self):
+        return not self.thread.is_alive()
+
+    def Result(self):
+
+        self.thread.join()
+
+        if self.error is not None:
+            raise RuntimeError(self.name + ' failed') from self.error
+
+        return self.result
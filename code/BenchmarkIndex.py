@@ -0,0 +1,168 @@
+# Recall / latency benchmark for FaceMatching's PartitionIndex
+# Copyright Doug Hardy and John Granholm
+
+# Builds synthetic face databases, then times exact search against the k-means bucket
+#   index for a sweep of bucket and probe counts
+# Recall = how often the index returns the same nearest row as the exact full scan
+# Use it to pick partitionCount and probeCount in DatabasingFromWebcam.py
+# A second table compares the encodingStorage settings (float64 / float32 / int8):
+#   agreement with the float64 answer, latency, and resident bytes per identity
+
+# Run:      python3 BenchmarkIndex.py                  (10k and 100k identities)
+#           python3 BenchmarkIndex.py 10000 1000000    (any database sizes)
+
+
+import argparse  # command line database sizes
+import time  # benchmark timing
+import numpy as np  # array library
+from FaceMatching import EncodingMatcher  # the matcher being measured
+from EncodingStorage import encodingStorages, EncodingType  # storage settings being compared
+
+
+def SyntheticEncodings(identityCount, queryCount, randomGenerator):
+    # Fakes face_recognition encodings with a similar distance profile
+
+    # Inputs:   identityCount (database rows to make)
+    #           queryCount (live faces to look up)
+    #           randomGenerator (numpy Generator - keeps runs repeatable)
+
+    # Process:  identities are scattered around 64 loose groups (real faces cluster too),
+    #               two different people end up roughly 0.9 apart
+    #           each query is a known identity plus about 0.35 of noise (a new photo of the same person)
+
+    # Returns:  databaseEncodings (identityCount x 128)
+    #           queryEncodings (queryCount x 128)
+    #           queryIdentities (which database row each query was made from)
+
+    groupCenters = randomGenerator.normal(0, 0.06, (64, 128))
+    groups = randomGenerator.integers(0, 64, identityCount)
+
+    databaseEncodings = groupCenters[groups] + \
+        randomGenerator.normal(0, 0.045, (identityCount, 128))
+
+    queryIdentities = randomGenerator.integers(0, identityCount, queryCount)
+    queryEncodings = databaseEncodings[queryIdentities] + \
+        randomGenerator.normal(0, 0.031, (queryCount, 128))
+
+    return databaseEncodings, queryEncodings, queryIdentities
+
+
+def TimeMatcher(databaseMatcher, queryEncodings, facesPerFrame):
+    # Runs every query through databaseMatcher, one frame's worth of faces at a time
+
+    # Returns:  matchIndexes (row found per query)
+    #           millisecondsPerFrame
+
+    matchIndexes = []
+
+    startTime = time.perf_counter()
+
+    for frameStart in range(0, len(queryEncodings), facesPerFrame):
+        frameIndexes, frameDistances = databaseMatcher.Match(
+            queryEncodings[frameStart:frameStart + facesPerFrame])
+        matchIndexes.append(frameIndexes)
+
+    elapsed = time.perf_counter() - startTime
+    frameCount = -(-len(queryEncodings) // facesPerFrame)
+
+    return np.concatenate(matchIndexes), elapsed / frameCount * 1000
+
+
+def RunBenchmark(identityCount, queryCount=2000, facesPerFrame=4):
+    # Prints one table of bucket / probe settings for one database size
+
+    randomGenerator = np.random.default_rng(identityCount)
+
+    databaseEncodings, queryEncodings, queryIdentities = SyntheticEncodings(
+        identityCount, queryCount, randomGenerator)
+
+    print('\n{0} identities, {1} queries, {2} faces per frame\n'.format(
+        identityCount, queryCount, facesPerFrame))
+    print('{0:>10} {1:>7} {2:>10} {3:>10} {4:>11} {5:>10}'.format(
+        'partitions', 'probes', 'build s', 'ms/frame', 'recall@1', 'ID recall'))
+
+    # Exact full scan - the answer every index setting is scored against
+    exactMatcher = EncodingMatcher(partitionMinimumSize=0)
+    exactMatcher.Sync(databaseEncodings)
+
+    exactIndexes, exactMilliseconds = TimeMatcher(
+        exactMatcher, queryEncodings, facesPerFrame)
+
+    print('{0:>10} {1:>7} {2:>10} {3:>10.3f} {4:>11.4f} {5:>10.4f}'.format(
+        'exact', '-', '-', exactMilliseconds, 1.0, np.mean(exactIndexes == queryIdentities)))
+
+    autoPartitions = int(4 * np.sqrt(identityCount))
+
+    for partitionCount in (autoPartitions // 4, autoPartitions // 2, autoPartitions, autoPartitions * 2):
+        for probeCount in (1, 4, 8, 16, 32):
+
+            indexMatcher = EncodingMatcher(
+                partitionMinimumSize=1, partitionCount=partitionCount, probeCount=probeCount)
+
+            buildStart = time.perf_counter()
+            indexMatcher.Sync(databaseEncodings)
+            buildSeconds = time.perf_counter() - buildStart
+
+            indexIndexes, indexMilliseconds = TimeMatcher(
+                indexMatcher, queryEncodings, facesPerFrame)
+
+            print('{0:>10} {1:>7} {2:>10.2f} {3:>10.3f} {4:>11.4f} {5:>10.4f}'.format(
+                partitionCount, probeCount, buildSeconds, indexMilliseconds,
+                np.mean(indexIndexes == exactIndexes), np.mean(indexIndexes == queryIdentities)))
+
+
+def RunStorageBenchmark(identityCount, queryCount=2000, facesPerFrame=4):
+    # Prints one table comparing encodingStorage settings for one database size (full scan, no buckets)
+
+    # Resident bytes per identity is what the matcher needs in RAM:
+    #   float64 / float32 - the encodings plus their squared lengths
+    #   int8 - codes, scales and squared lengths (the float32 encodings stay memory-mapped,
+    #              only the few re-ranked rows per face are paged in)
+
+    randomGenerator = np.random.default_rng(identityCount)
+
+    databaseEncodings, queryEncodings, queryIdentities = SyntheticEncodings(
+        identityCount, queryCount, randomGenerator)
+
+    print('\n{0} identities, encoding storage\n'.format(identityCount))
+    print('{0:>10} {1:>10} {2:>11} {3:>10} {4:>13}'.format(
+        'storage', 'ms/frame', 'agreement', 'ID recall', 'bytes/identity'))
+
+    exactIndexes = None
+
+    for encodingStorage in encodingStorages:
+
+        storageMatcher = EncodingMatcher(
+            partitionMinimumSize=0, quantize=encodingStorage == 'int8')
+        storageMatcher.Sync(databaseEncodings.astype(
+            EncodingType(encodingStorage)))
+
+        storageIndexes, storageMilliseconds = TimeMatcher(
+            storageMatcher, queryEncodings, facesPerFrame)
+
+        # float64 comes first - it's the answer the others are scored against
+        if exactIndexes is None:
+            exactIndexes = storageIndexes
+
+        residentBytes = storageMatcher.squaredNorms.nbytes
+        if encodingStorage == 'int8':
+            residentBytes += storageMatcher.codes.nbytes + storageMatcher.scales.nbytes
+        else:
+            residentBytes += storageMatcher.encodingMatrix.nbytes
+
+        print('{0:>10} {1:>10.3f} {2:>11.4f} {3:>10.4f} {4:>13.0f}'.format(
+            encodingStorage, storageMilliseconds, np.mean(storageIndexes == exactIndexes),
+            np.mean(storageIndexes == queryIdentities), residentBytes / identityCount))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Recall and latency of the k-means bucket index and each encodingStorage setting.')
+    parser.add_argument('sizes', type=int, nargs='*', default=[10000, 100000],
+                        help='database sizes (identities)')
+    arguments = parser.parse_args()
+
+    for identityCount in arguments.sizes:
+        RunBenchmark(identityCount)
+        RunStorageBenchmark(identityCount)
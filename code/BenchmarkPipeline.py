@@ -0,0 +1,397 @@
+# Stage-by-stage benchmark for DatabasingFromWebcam.py's recognition pipeline
+# Copyright Doug Hardy and John Granholm
+
+# Times BuildArray, ProcessFrame, CheckDatabase, AppendDatabase and SaveArray on synthetic workloads,
+#   no webcam (or dlib models) needed
+# face_recognition is replaced by SyntheticFaceRecognition before DatabasingFromWebcam.py is imported:
+#   face_locations / face_encodings hand back whatever faces the benchmark planned for the frame,
+#   so every run sees exactly the same faces and only this project's own code is being timed
+#   (cv2's resize and the BGR -> RGB conversion in DetectFaces still run for real, which is what frame size changes,
+#   and the stand-in makes the contiguous copy of a reversed-channel view that dlib would)
+# Sweeps database size, faces per frame and frame size; reports the median time, peak memory
+#   and garbage collector time per stage
+# ProcessFrame is timed twice: allocating every frame, and reusing FrameBuffers.py's buffers ('reuse')
+# Results can be saved as a baseline and later runs compared against it - slower stages are flagged
+
+# Run:      python3 BenchmarkPipeline.py                                   (100 -> 1M identities)
+#           python3 BenchmarkPipeline.py --sizes 100 10000 --save-baseline baseline.json
+#           python3 BenchmarkPipeline.py --sizes 100 10000 --baseline baseline.json   (exit status 1 on a regression)
+
+
+import os  # temporary working folder
+import io  # discarded print output
+import sys  # stand-in face_recognition module, exit status
+import json  # baselines
+import time  # stage timing
+import types  # stand-in face_recognition module
+import argparse  # command line
+import platform  # baseline context
+import tempfile  # temporary working folder
+import tracemalloc  # peak memory per stage
+import contextlib  # discarded print output
+import numpy as np  # array library
+from BenchmarkIndex import SyntheticEncodings  # face_recognition-like encodings
+from Metrics import GarbageCollectionWatch  # garbage collector pauses
+from FrameBuffers import FrameBuffer, LiveTable  # reused per-frame buffers
+
+
+class SyntheticFaceRecognition(types.ModuleType):
+    # Deterministic stand-in for the face_recognition module
+
+    # Process:  Plan sets the (locations, encodings) the next DetectFaces call will "find"
+    #           face_locations / face_encodings return the plan
+    #               (after making the image contiguous, as dlib does - a copy for a [:, :, ::-1] view)
+    #           compare_faces / face_distance work like the real ones (euclidean distance, 0.6 tolerance)
+    #           load_image_file isn't needed - BuildArray's ./*.jpg enrollment isn't part of the benchmark
+
+    def __init__(self):
+
+        super().__init__('face_recognition')
+
+        self.plannedLocations = []
+        self.plannedEncodings = []
+
+    def Plan(self, faceLocations, faceEncodings):
+
+        self.plannedLocations = list(faceLocations)
+        self.plannedEncodings = list(faceEncodings)
+
+    def face_locations(self, image, *arguments, **keywordArguments):
+        np.ascontiguousarray(image)
+        return list(self.plannedLocations)
+
+    def face_encodings(self, image, knownFaceLocations=None, *arguments, **keywordArguments):
+        np.ascontiguousarray(image)
+        return list(self.plannedEncodings)
+
+    def face_distance(self, faceEncodings, faceToCompare):
+
+        if len(faceEncodings) == 0:
+            return np.empty(0)
+
+        return np.linalg.norm(np.asarray(faceEncodings) - faceToCompare, axis=1)
+
+    def compare_faces(self, knownFaceEncodings, faceEncodingToCheck, tolerance=0.6):
+        return list(self.face_distance(knownFaceEncodings, faceEncodingToCheck) <= tolerance)
+
+    def load_image_file(self, filePath, mode='RGB'):
+        raise RuntimeError('SyntheticFaceRecognition does not load pictures')
+
+
+# Has to be in place before DatabasingFromWebcam.py (and FaceDetection.py) import face_recognition
+syntheticFaceRecognition = SyntheticFaceRecognition()
+sys.modules['face_recognition'] = syntheticFaceRecognition
+
+import DatabasingFromWebcam as Webcam  # noqa: E402 - the pipeline being measured
+from FaceMatching import EncodingMatcher  # noqa: E402
+from EncodingStorage import SaveDatabase  # noqa: E402
+
+
+def FaceLocations(faceCount, frameWidth, frameHeight):
+    # faceCount face boxes spread across a frame, in DetectFaces' 1/2 size coordinates
+
+    smallWidth, smallHeight = frameWidth // 2, frameHeight // 2
+    boxSize = max(8, min(smallWidth, smallHeight) // 6)
+
+    faceLocations = []
+    for faceIndex in range(faceCount):
+        left = (faceIndex * boxSize * 5 // 4) % max(1, smallWidth - boxSize)
+        top = ((faceIndex * boxSize * 5 // 4) // max(1, smallWidth - boxSize)
+               * boxSize) % max(1, smallHeight - boxSize)
+        faceLocations.append((top, left + boxSize, top + boxSize, left))
+
+    return faceLocations
+
+
+def TimeStage(stage, repeatCount, setup=None):
+    # Median seconds for stage() over repeatCount runs, then its peak traced memory on one more run
+
+    # Inputs:   stage (function to time)
+    #           repeatCount (timed runs)
+    #           setup (function run, untimed, before every run - returns stage's argument)
+
+    # Process:  print output is discarded (SaveArray / AppendDatabase print per row)
+    #           the memory run is separate - tracemalloc slows everything it watches
+    #           garbage collector pauses are added up over the timed runs (setup's included - it's allocation too)
+
+    # Returns:  milliseconds (median)
+    #           peakMegabytes (largest traced allocation total during the stage)
+    #           gcMilliseconds (garbage collector time per run)
+
+    timings = []
+
+    gcWatch = GarbageCollectionWatch().Start()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+
+        for repeat in range(repeatCount):
+
+            argument = setup() if setup is not None else None
+
+            startTime = time.perf_counter()
+            stage(argument)
+            timings.append(time.perf_counter() - startTime)
+
+        gcWatch.Stop()
+        gcSeconds, gcCollections = gcWatch.Take()
+
+        argument = setup() if setup is not None else None
+
+        tracemalloc.start()
+        stage(argument)
+        currentBytes, peakBytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return float(np.median(timings)) * 1000, peakBytes / 1e6, gcSeconds * 1000 / max(1, repeatCount)
+
+
+def RunDatabaseSize(identityCount, facesPerFrameList, frameSizes, repeatCount, encodingStorage, databaseBackend, randomGenerator):
+    # Every stage for one database size
+
+    # Process:  write a synthetic testDatabase2 checkpoint in a temporary folder
+    #           BuildArray: load it (plus an empty journal)
+    #           for each faces per frame / frame size:
+    #               ProcessFrame (cold: no last frame, every face goes to the database)
+    #               ProcessFrame (warm: every face was in last frame)
+    #               ProcessFrame cold / warm again, reusing a LiveTable and FrameBuffer
+    #               CheckDatabase (databaseMatcher.Sync + Match - the batched lookup on its own)
+    #               AppendDatabase (every face is new)
+    #           SaveArray: final checkpoint, as on exit
+
+    # Returns:  results (list of dicts: stage, identities, faces, frameSize, ms, peakMB, gcMs)
+
+    results = []
+
+    def Record(stage, facesPerFrame, frameSize, timing):
+        results.append({'stage': stage, 'identities': identityCount, 'faces': facesPerFrame,
+                        'frameSize': frameSize, 'ms': round(timing[0], 4), 'peakMB': round(timing[1], 3),
+                        'gcMs': round(timing[2], 4)})
+
+    databaseEncodings, queryEncodings, queryIdentities = SyntheticEncodings(
+        identityCount, max(facesPerFrameList), randomGenerator)
+
+    savedArray = np.zeros(identityCount, Webcam.databaseStructure)
+    savedArray['Key'] = np.arange(1, identityCount + 1)
+    savedArray['NameId'] = np.arange(identityCount)
+    savedArray['FaceEncoding'] = databaseEncodings
+    savedNames = ['Person' + str(index) for index in range(identityCount)]
+
+    SaveDatabase('./Data/Database/testDatabase2.npy',
+                 savedArray, savedNames, encodingStorage)
+    del savedArray, databaseEncodings
+
+    # Nothing here should reach the journal's own schedule
+    databaseJournal = Webcam.OpenDatabaseBackend(
+        databaseBackend, Webcam.databaseStructure, 3600, 1e9, encodingStorage)
+
+    # SQLite: copy the checkpoint in up front, so BuildArray times loading rather than the one-off import
+    if databaseBackend == 'sqlite':
+        databaseJournal.Import('./Data/Database/testDatabase2.npy')
+
+    def NewMatcher():
+        return EncodingMatcher(partitionMinimumSize=Webcam.partitionMinimumSize, partitionCount=Webcam.partitionCount,
+                               probeCount=Webcam.probeCount, quantize=encodingStorage == 'int8')
+
+    buildState = {}
+
+    def BuildStage(argument):
+        buildState['matcher'] = NewMatcher()
+        buildState['database'] = Webcam.BuildArray(Webcam.databaseStructure, buildState['matcher'],
+                                                   databaseJournal, 0, encodingStorage, Webcam.exemplarLimit)
+
+    Record('BuildArray', 0, '-', TimeStage(BuildStage, max(1, repeatCount // 10)))
+
+    # BuildArray hooked the store up to the journal - keep journal writes out of the read-only stages
+    databaseArray = buildState['database']
+    databaseMatcher = buildState['matcher']
+
+    for facesPerFrame in facesPerFrameList:
+        for frameWidth, frameHeight in frameSizes:
+
+            frameSize = '{0}x{1}'.format(frameWidth, frameHeight)
+            frame = randomGenerator.integers(
+                0, 256, (frameHeight, frameWidth, 3), np.uint8)
+
+            faceLocations = FaceLocations(
+                facesPerFrame, frameWidth, frameHeight)
+            faceEncodings = queryEncodings[:facesPerFrame]
+
+            syntheticFaceRecognition.Plan(faceLocations, faceEncodings)
+
+            emptyLastFrame = np.array([], Webcam.liveDataStructure)
+
+            Record('ProcessFrame cold', facesPerFrame, frameSize, TimeStage(lambda argument: Webcam.ProcessFrame(
+                frame, emptyLastFrame, databaseArray, databaseMatcher, Webcam.liveDataStructure,
+                Webcam.databaseRecheckTrigger), repeatCount))
+
+            # Last frame saw the same faces, recently enough not to need a database recheck
+            warmLastFrame = Webcam.ProcessFrame(frame, emptyLastFrame, databaseArray, databaseMatcher,
+                                                Webcam.liveDataStructure, Webcam.databaseRecheckTrigger)
+
+            Record('ProcessFrame warm', facesPerFrame, frameSize, TimeStage(lambda argument: Webcam.ProcessFrame(
+                frame, warmLastFrame, databaseArray, databaseMatcher, Webcam.liveDataStructure,
+                Webcam.databaseRecheckTrigger), repeatCount))
+
+            # The same frames through the reused buffers (warmLastFrame isn't one of liveTable's, so it stays put)
+            liveTable = LiveTable(Webcam.liveDataStructure)
+            frameBuffer = FrameBuffer()
+
+            Record('ProcessFrame cold reuse', facesPerFrame, frameSize, TimeStage(lambda argument: Webcam.ProcessFrame(
+                frame, emptyLastFrame, databaseArray, databaseMatcher, Webcam.liveDataStructure,
+                Webcam.databaseRecheckTrigger, liveTable=liveTable, frameBuffer=frameBuffer), repeatCount))
+
+            Record('ProcessFrame warm reuse', facesPerFrame, frameSize, TimeStage(lambda argument: Webcam.ProcessFrame(
+                frame, warmLastFrame, databaseArray, databaseMatcher, Webcam.liveDataStructure,
+                Webcam.databaseRecheckTrigger, liveTable=liveTable, frameBuffer=frameBuffer), repeatCount))
+
+        # Independent of frame size
+        def CheckDatabaseStage(argument):
+            Webcam.SyncMatcher(databaseMatcher, databaseArray)
+            databaseMatcher.Match(queryEncodings[:facesPerFrame])
+
+        Record('CheckDatabase', facesPerFrame, '-',
+               TimeStage(CheckDatabaseStage, repeatCount))
+
+        # Every face is someone new, seen long enough to be added
+        def NewFacesArray():
+            liveArray = np.zeros(facesPerFrame, Webcam.liveDataStructure)
+            liveArray['FrameCount'] = Webcam.frameCountTrigger
+            liveArray['FaceEncoding'] = randomGenerator.normal(
+                0, 0.06, (facesPerFrame, 128))
+            return liveArray
+
+        Record('AppendDatabase', facesPerFrame, '-', TimeStage(lambda liveArray: Webcam.AppendDatabase(
+            liveArray, databaseArray, Webcam.databaseStructure, Webcam.frameCountTrigger), repeatCount, NewFacesArray))
+
+    Record('SaveArray', 0, '-', TimeStage(lambda argument: Webcam.SaveArray(
+        databaseArray, databaseJournal), max(1, repeatCount // 10)))
+
+    databaseJournal.Stop()
+
+    return results
+
+
+def CompareBaseline(results, baseline, threshold, floorMilliseconds):
+    # Flags stages that got slower than the baseline
+
+    # Inputs:   results (this run)
+    #           baseline (an earlier run's saved results)
+    #           threshold (fraction slower that counts as a regression, e.g. 0.25)
+    #           floorMilliseconds (differences smaller than this are noise, never flagged)
+
+    # Returns:  regressions (list of (result, baselineMilliseconds))
+
+    def ResultKey(result):
+        return (result['stage'], result['identities'], result['faces'], result['frameSize'])
+
+    baselineTimes = {ResultKey(result): result['ms']
+                     for result in baseline['results']}
+
+    regressions = []
+
+    for result in results:
+
+        baselineMilliseconds = baselineTimes.get(ResultKey(result))
+
+        if baselineMilliseconds is None:
+            continue
+
+        if result['ms'] > baselineMilliseconds * (1 + threshold) and result['ms'] - baselineMilliseconds > floorMilliseconds:
+            regressions.append((result, baselineMilliseconds))
+
+    return regressions
+
+
+def ParseArguments():
+
+    parser = argparse.ArgumentParser(
+        description='Time each stage of the recognition pipeline on synthetic workloads.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000, 1000000],
+                        help='database sizes (identities)')
+    parser.add_argument('--faces', type=int, nargs='+', default=[1, 4, 16],
+                        help='faces per frame')
+    parser.add_argument('--frame-sizes', nargs='+', default=['640x480', '1920x1080'],
+                        help='frame sizes, WIDTHxHEIGHT')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='timed runs per per-frame stage (BuildArray / SaveArray run a tenth as often)')
+    parser.add_argument('--storage', default=Webcam.encodingStorage,
+                        help='encodingStorage setting (float64 / float32 / int8)')
+    parser.add_argument('--backend', default=Webcam.databaseBackend,
+                        help='databaseBackend setting (npy / sqlite)')
+    parser.add_argument('--save-baseline', default=None,
+                        help='write this run to a baseline .json')
+    parser.add_argument('--baseline', default=None,
+                        help='compare this run against a baseline .json')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fraction slower than the baseline that counts as a regression (default 0.25)')
+    parser.add_argument('--floor-ms', type=float, default=0.05,
+                        help='differences under this many ms are never flagged (default 0.05)')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    arguments = ParseArguments()
+
+    frameSizes = [tuple(int(value) for value in frameSize.lower().split('x'))
+                  for frameSize in arguments.frame_sizes]
+
+    results = []
+    workingFolder = os.getcwd()
+
+    print('{0:<24} {1:>10} {2:>6} {3:>10} {4:>12} {5:>10} {6:>8}'.format(
+        'stage', 'identities', 'faces', 'frame', 'ms (median)', 'peak MB', 'gc ms'))
+
+    for identityCount in arguments.sizes:
+
+        # BuildArray / SaveArray work on ./Data/ - give them a scratch copy, leave the real database alone
+        with tempfile.TemporaryDirectory() as scratchFolder:
+
+            os.chdir(scratchFolder)
+            os.makedirs('./Data/Database/')
+
+            try:
+                sizeResults = RunDatabaseSize(identityCount, arguments.faces, frameSizes, arguments.repeat,
+                                              arguments.storage, arguments.backend, np.random.default_rng(identityCount))
+            finally:
+                os.chdir(workingFolder)
+
+        for result in sizeResults:
+            print('{0:<24} {1:>10} {2:>6} {3:>10} {4:>12.3f} {5:>10.2f} {6:>8.3f}'.format(
+                result['stage'], result['identities'], result['faces'], result['frameSize'], result['ms'], result['peakMB'],
+                result['gcMs']))
+
+        results += sizeResults
+
+    runRecord = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                 'cpus': os.cpu_count(), 'storage': arguments.storage,
+                 'backend': arguments.backend, 'results': results}
+
+    if arguments.save_baseline is not None:
+        with open(arguments.save_baseline, 'w', encoding='utf-8') as baselineFile:
+            json.dump(runRecord, baselineFile, indent=1)
+        print('\nBaseline written to ' + arguments.save_baseline)
+
+    exitStatus = 0
+
+    if arguments.baseline is not None:
+
+        with open(arguments.baseline, 'r', encoding='utf-8') as baselineFile:
+            baseline = json.load(baselineFile)
+
+        regressions = CompareBaseline(
+            results, baseline, arguments.threshold, arguments.floor_ms)
+
+        print('\nCompared against ' + arguments.baseline + ': ' +
+              str(len(regressions)) + ' regression(s)')
+
+        for result, baselineMilliseconds in regressions:
+            print('  SLOWER  {0:<24} {1:>10} identities  {2:>3} faces  {3:>10}  {4:0.3f} ms -> {5:0.3f} ms'.format(
+                result['stage'], result['identities'], result['faces'], result['frameSize'],
+                baselineMilliseconds, result['ms']))
+
+        if len(regressions) > 0:
+            exitStatus = 1
+
+    sys.exit(exitStatus)
@@ -0,0 +1,243 @@
+# Multi-camera ingestion for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Runs several capture sources (webcam device indexes or video files) in one process,
+#   all matching against and appending to the one databaseArray
+# Each CaptureSource keeps its own live state (lastFrameArray, tracking, clicks) and its own capture thread
+# SourceScheduler decides which source's frame is worked on next:
+#   tracking-only frames (cheap) go round-robin,
+#   detections go to the waiting source that has used the least detection time so far (fair share of the CPU),
+#   and maxDetectionsPerSecond caps detections across every source combined
+# Every source reports its own FPS and lag (capture to finished processing)
+
+
+import time  # scheduling, FPS and lag
+from collections import deque  # recent frame times
+import cv2  # capture devices and video files
+import numpy as np  # array library
+from FrameCapture import CaptureThread  # per-source reader thread
+from FaceDetection import DetectionPlanner  # per-source detection scale / search regions
+from FrameBuffers import LiveTable  # per-source liveArray tables, reused every frame
+from MotionGate import MotionGate  # per-source skipping of frames where nothing moved
+
+
+class CaptureSource:
+    # One camera or video file plus the live state ProcessFrame / TrackFaces keep for it
+
+    # Inputs:   sourceId (position in captureSources)
+    #           sourceSpec (webcam device index, or a video file path / stream URL)
+    #           liveDataStructure (liveArray's numpy columns)
+    #           bufferSize, bufferPolicy (see FrameCapture.CaptureThread)
+    #           windowName (cv2 window the source is shown in)
+    #           detectionPlanner (FaceDetection.DetectionPlanner - this source's detection scale / search regions)
+    #           reuseFrameBuffers (build every liveArray in the same two tables - see FrameBuffers.py)
+    #           motionGate (MotionGate.MotionGate - skips detection on frames where nothing moved, None = off)
+
+    # Process:  Start opens the device / file and starts its capture thread
+    #           Read takes the next frame (never waits) and remembers when it was captured
+    #           FrameDone records FPS and lag once the main loop has finished a frame
+    #           Stop ends the capture thread and releases the device / file
+
+    def __init__(self, sourceId, sourceSpec, liveDataStructure, bufferSize=2, bufferPolicy='latest', windowName='Video',
+                 detectionPlanner=None, reuseFrameBuffers=True, motionGate=None):
+
+        self.sourceId = sourceId
+        self.sourceSpec = sourceSpec
+        self.windowName = windowName
+
+        self.videoCapture = None
+        self.captureThread = None
+        self.bufferSize = bufferSize
+        self.bufferPolicy = bufferPolicy
+
+        # Live state - what used to be DatabasingFromWebcam.py's globals, one set per source
+        self.lastFrameArray = np.array([], liveDataStructure)
+        self.lastGrayFrame = None
+        self.forceDetection = False
+        self.framesSinceDetection = 0
+        self.mouseClick = [-1, -1]
+
+        # The two tables this source's liveArrays are built in, in turn (None = a new array every frame)
+        self.liveTable = LiveTable(liveDataStructure) if reuseFrameBuffers else None
+        self.detectionPlanner = detectionPlanner if detectionPlanner is not None else DetectionPlanner()
+        self.motionGate = motionGate if motionGate is not None else MotionGate(enabled=False)
+
+        # Scheduling
+        self.detectionSeconds = 0.0
+        self.detectedFrames = 0
+
+        # FPS / lag
+        self.frameTimes = deque()
+        self.processedFrames = 0
+        self.lagSeconds = 0.0
+        self.worstLagSeconds = 0.0
+
+    def Start(self):
+        # Opens the device / file and starts reading it
+
+        self.videoCapture = cv2.VideoCapture(self.sourceSpec)
+
+        if not self.videoCapture.isOpened():
+            print('ERROR: Unable to open capture source ' + str(self.sourceSpec))
+
+        self.captureThread = CaptureThread(
+            self.videoCapture, self.bufferSize, self.bufferPolicy).Start()
+
+        return self
+
+    def FrameWaiting(self):
+        return self.captureThread.FrameWaiting()
+
+    def Ended(self):
+        return self.captureThread.Ended()
+
+    def DetectionDue(self, detectEveryNFrames):
+        # True if this source's next frame needs a full detection rather than tracking
+
+        return detectEveryNFrames <= 1 or self.lastGrayFrame is None or self.forceDetection or \
+            self.framesSinceDetection + 1 >= detectEveryNFrames
+
+    def Read(self):
+        # Takes the next buffered frame without waiting
+
+        # Returns:  ret (False if there's no frame right now, or the source has ended)
+        #           frame
+        #           captureTime (time.perf_counter() when the frame was captured)
+
+        ret, frame = self.captureThread.Read(timeout=0)
+
+        return ret, frame, self.captureThread.lastCaptureTime
+
+    def FrameDone(self, captureTime, fpsWindow=2.0):
+        # Records one finished frame
+
+        # Inputs:   captureTime (from Read)
+        #           fpsWindow (seconds of frames FPS is averaged over)
+
+        now = time.perf_counter()
+
+        self.frameTimes.append(now)
+        while now - self.frameTimes[0] > fpsWindow:
+            self.frameTimes.popleft()
+
+        self.processedFrames += 1
+        self.lagSeconds = now - captureTime
+        self.worstLagSeconds = max(self.worstLagSeconds, self.lagSeconds)
+
+    def FPS(self):
+        # Frames finished per second over the last fpsWindow seconds
+
+        if len(self.frameTimes) < 2:
+            return 0.0
+
+        return (len(self.frameTimes) - 1) / max(self.frameTimes[-1] - self.frameTimes[0], 1e-6)
+
+    def Stop(self):
+        # Ends the capture thread, releases the device / file
+
+        self.captureThread.Stop()
+        self.videoCapture.release()
+
+    def Report(self):
+        # One line summary for this source
+
+        return 'Source {0} ({1})  FPS: {2:0.1f}  lag: {3:0.0f} ms (worst {4:0.0f} ms)  detections: {5} ({6:0.1f} s)  {7}  {8}  {9}'.format(
+            self.sourceId, self.sourceSpec, self.FPS(), self.lagSeconds * 1000, self.worstLagSeconds * 1000,
+            self.detectedFrames, self.detectionSeconds, self.captureThread.Report(), self.detectionPlanner.Report(),
+            self.motionGate.Report())
+
+
+class SourceScheduler:
+    # Picks which CaptureSource the main loop works on next
+
+    # Inputs:   sources (CaptureSource list)
+    #           maxDetectionsPerSecond (detections allowed per second across every source, 0 = no limit)
+
+    # Process:  NextSource looks at the sources with a frame waiting
+    #               any that only need tracking go first, round-robin
+    #               otherwise, if the detection budget allows, the one with the least detectionSeconds
+    #           Charge adds a finished detection's time to its source
+    #           Refund hands back the budget of a detection that wasn't needed after all (MotionGate skipped the frame)
+    #           the budget is a token bucket: maxDetectionsPerSecond tokens a second, up to one second's worth saved up
+
+    def __init__(self, sources, maxDetectionsPerSecond=0):
+
+        self.sources = sources
+        self.maxDetectionsPerSecond = maxDetectionsPerSecond
+
+        self.detectionTokens = max(1.0, maxDetectionsPerSecond)
+        self.lastRefillTime = time.perf_counter()
+
+        # Where the round-robin for tracking frames picks up next
+        self.nextTrackingSource = 0
+
+    def RefillTokens(self):
+
+        if self.maxDetectionsPerSecond <= 0:
+            return
+
+        now = time.perf_counter()
+        self.detectionTokens = min(max(1.0, self.maxDetectionsPerSecond), self.detectionTokens +
+                                   (now - self.lastRefillTime) * self.maxDetectionsPerSecond)
+        self.lastRefillTime = now
+
+    def NextSource(self, detectEveryNFrames=1):
+        # Picks the next source to work on
+
+        # Inputs:   detectEveryNFrames (same setting as the main loop - 1 = every frame is a detection)
+
+        # Returns:  source (None if nothing is waiting, or only detections are waiting and the budget is spent)
+        #           detectionDue (True = run a full detection on its frame, False = track)
+
+        waitingSources = [
+            source for source in self.sources if source.FrameWaiting()]
+
+        if len(waitingSources) == 0:
+            return None, False
+
+        # Cheap tracking frames first, taking turns
+        for offset in range(len(self.sources)):
+            source = self.sources[(self.nextTrackingSource +
+                                   offset) % len(self.sources)]
+
+            if source in waitingSources and not source.DetectionDue(detectEveryNFrames):
+                self.nextTrackingSource = (source.sourceId + 1) % len(self.sources)
+                return source, False
+
+        # Detection budget
+        self.RefillTokens()
+        if self.maxDetectionsPerSecond > 0:
+
+            if self.detectionTokens < 1.0:
+                return None, False
+
+            self.detectionTokens -= 1.0
+
+        # Least detection time used so far gets the next one
+        source = min(waitingSources, key=lambda waitingSource: (
+            waitingSource.detectionSeconds, waitingSource.sourceId))
+
+        return source, True
+
+    def Charge(self, source, detectionSeconds):
+        # Adds a finished detection to its source's share
+
+        source.detectionSeconds += detectionSeconds
+        source.detectedFrames += 1
+
+    def Refund(self):
+        # Gives back the token NextSource took for a detection that didn't run
+
+        if self.maxDetectionsPerSecond > 0:
+            self.detectionTokens = min(
+                max(1.0, self.maxDetectionsPerSecond), self.detectionTokens + 1.0)
+
+    def AllEnded(self):
+        # True once every source has stopped and its frames were all read
+
+        return all(source.Ended() for source in self.sources)
+
+    def Report(self):
+        # One line per source
+
+        return [source.Report() for source in self.sources]
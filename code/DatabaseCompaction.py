@@ -0,0 +1,540 @@
+# Duplicate Unknown compaction for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# AppendDatabase mints an 'UnknownN' row for every face it can't ID - over a long session the same person
+#   can end up as many of them, and every one is another row in every CheckDatabase lookup
+#   and another folder in ./Data/Screenshots/
+# FindDuplicates groups Unknown rows that are the same face (blocked pairwise distances - memory stays flat,
+#   so it works through hundreds of thousands of rows)
+# CompactDatabase folds each group into its first row (the others' encodings become its exemplars),
+#   fills the merged-away rows' places with rows from the end ('Key' = row + 1 - every other row keeps its key,
+#   and every row keeps its name) and rewrites the database atomically (databaseJournal.Rewrite),
+#   then renumbers the sightings that changed and folds the merged-away folders in ./Data/Screenshots/ into theirs
+# Those last two steps follow ./Data/Database/compaction.npz - a crash part way through is finished
+#   by the next LoadArray (FinishCompaction)
+
+# Run:      python3 DatabaseCompaction.py                 (with the webcam program closed)
+#           python3 DatabaseCompaction.py --dry-run       (report only, nothing is changed)
+#           (or set backgroundCompaction = True in DatabasingFromWebcam.py: the search runs while the webcam does,
+#            the merge happens when q is pressed)
+
+
+import os  # plan file, screenshot folders
+import sys  # thread priority (Linux only)
+import threading  # native thread id
+import time  # lookup timing, yielding between blocks
+import argparse  # command line
+import numpy as np  # array library
+from FaceMatching import EncodingMatcher, AddExemplar, defaultTolerance  # lookup timing, merged encodings
+from FaceDatabase import DatabaseStore, ExemplarTable  # the compacted databaseArray, merged exemplars
+from EncodingStorage import ReplaceFile  # fsync + rename
+from SightingsLog import RemapSegments, ReplaceRemappedSegments  # renumbered sightings
+from BackgroundTask import BackgroundTask  # low-priority duplicate search
+
+
+# Unknown rows at least this close are the same person (stricter than the 0.6 match tolerance -
+#   a wrong merge can't be undone)
+defaultCompactionTolerance = 0.4
+
+# Rows on each side of one distance block (2048 x 2048 float32 = 16 MB)
+defaultBlockRows = 2048
+
+# Where the steps after the database rewrite are kept until they're done
+defaultPlanPath = './Data/Database/compaction.npz'
+
+
+def IsUnknownName(name):
+    # True for the 'UnknownN' names AppendDatabase makes (PromoteUnknown only accepts letters)
+
+    return name.startswith('Unknown') and name[len('Unknown'):].isdigit()
+
+
+def UnknownRows(databaseArray):
+    # Rows of a DatabaseStore still named 'UnknownN'
+
+    unknownNameIds = [nameId for nameId, name in enumerate(
+        databaseArray.names) if IsUnknownName(name)]
+
+    return np.flatnonzero(np.isin(databaseArray['NameId'], unknownNameIds))
+
+
+def FindDuplicates(encodings, tolerance=defaultCompactionTolerance, rowIndexes=None, blockRows=defaultBlockRows,
+                   lowPriority=False):
+    # Groups rows that are the same face
+
+    # Inputs:   encodings (rows x 128 - the Unknown rows' 'FaceEncoding')
+    #           tolerance (rows this close are linked)
+    #           rowIndexes (what to call each row in the result - None = its position in encodings)
+    #           blockRows (rows on each side of one distance block)
+    #           lowPriority (running beside the webcam loop: this thread gets the lowest CPU priority
+    #                        and gives the main loop a turn between blocks)
+
+    # Process:  squared distances one block pair at a time, upper triangle only:
+    #               from float32 dot products, pairs inside tolerance re-measured in float64
+    #           linked rows are joined into groups (connected components), each led by its first row
+    #           a row further than defaultTolerance from its group's first row stays on its own
+    #               (a chain of close pairs can't merge two different people)
+
+    # Returns:  groups (list of row index arrays, first row first - only groups of 2 or more)
+
+    if lowPriority and sys.platform.startswith('linux'):
+        # Linux priorities are per thread - only this one drops
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except OSError:
+            pass
+
+    encodings = np.asarray(encodings, np.float64).reshape(-1, 128)
+    rowCount = len(encodings)
+
+    if rowIndexes is None:
+        rowIndexes = np.arange(rowCount)
+    rowIndexes = np.asarray(rowIndexes)
+
+    if rowCount == 0:
+        return []
+
+    compactEncodings = encodings.astype(np.float32)
+
+    # |a - b|^2 <= tolerance^2  is  ab - |a|^2 / 2 - |b|^2 / 2 >= -tolerance^2 / 2
+    #   (worked out in place on the block's dot products - no block sized temporaries)
+    halfSquaredNorms = np.einsum(
+        'ij,ij->i', compactEncodings, compactEncodings) / 2
+
+    # A little slack for float32 rounding - the float64 check below has the final say
+    linkLimit = np.float32(-tolerance * tolerance * 1.001 / 2)
+
+    firstRows = []
+    secondRows = []
+
+    for blockStart in range(0, rowCount, blockRows):
+
+        block = compactEncodings[blockStart:blockStart + blockRows]
+        blockHalfNorms = halfSquaredNorms[blockStart:blockStart + blockRows]
+
+        for otherStart in range(blockStart, rowCount, blockRows):
+
+            otherBlock = compactEncodings[otherStart:otherStart + blockRows]
+
+            blockProducts = block @ otherBlock.T
+            blockProducts -= blockHalfNorms[:, None]
+            blockProducts -= halfSquaredNorms[None,
+                                              otherStart:otherStart + len(otherBlock)]
+
+            linked = blockProducts >= linkLimit
+
+            # The diagonal block compares rows with themselves - keep each pair once
+            if otherStart == blockStart:
+                linked = np.triu(linked, 1)
+
+            # (flatnonzero is much faster than nonzero on a mostly False block)
+            blockFirst, blockSecond = np.divmod(
+                np.flatnonzero(linked), linked.shape[1])
+            firstRows.append(blockFirst + blockStart)
+            secondRows.append(blockSecond + otherStart)
+
+            if lowPriority:
+                time.sleep(0.001)
+
+    firstRows = np.concatenate(firstRows)
+    secondRows = np.concatenate(secondRows)
+
+    pairDistances = np.linalg.norm(
+        encodings[firstRows] - encodings[secondRows], axis=1)
+    closePairs = pairDistances <= tolerance
+    firstRows, secondRows = firstRows[closePairs], secondRows[closePairs]
+
+    # Every row takes the smallest label it's linked to until nothing changes - the label is the group's first row
+    labels = np.arange(rowCount)
+    while True:
+
+        pairLabels = np.minimum(labels[firstRows], labels[secondRows])
+
+        newLabels = labels.copy()
+        np.minimum.at(newLabels, firstRows, pairLabels)
+        np.minimum.at(newLabels, secondRows, pairLabels)
+        newLabels = newLabels[newLabels]
+
+        if np.array_equal(newLabels, labels):
+            break
+
+        labels = newLabels
+
+    groups = []
+
+    # Rows sorted by group (stable - first row first), split where the label changes
+    sortedRows = np.argsort(labels, kind='stable')
+    groupStarts = np.flatnonzero(
+        np.diff(labels[sortedRows], prepend=-1) != 0)
+
+    for members in np.split(sortedRows, groupStarts[1:]):
+
+        if len(members) < 2:
+            continue
+
+        groupLabel = members[0]
+
+        leaderDistances = np.linalg.norm(
+            encodings[members] - encodings[groupLabel], axis=1)
+        members = members[leaderDistances <= defaultTolerance]
+
+        if len(members) > 1:
+            groups.append(rowIndexes[members])
+
+    return groups
+
+
+def DuplicateSearch(databaseArray, tolerance=defaultCompactionTolerance, lowPriority=True):
+    # Starts FindDuplicates on databaseArray's Unknown rows on a background thread
+
+    # Inputs:   databaseArray (a FaceDatabase.DatabaseStore - read here, on the calling thread)
+    #           tolerance, lowPriority (see FindDuplicates)
+
+    # Returns:  BackgroundTask (Result() = groups of databaseArray rows, for CompactDatabase)
+
+    unknownRows = UnknownRows(databaseArray)
+
+    # A copy - rows appended while the search runs are left for next time
+    unknownEncodings = np.array(databaseArray['FaceEncoding'][unknownRows])
+
+    return BackgroundTask('DuplicateSearch', FindDuplicates, unknownEncodings, tolerance, unknownRows,
+                          defaultBlockRows, lowPriority)
+
+
+def MergeGroups(savedArray, names, groups, savedExemplars=None):
+    # Folds each group of rows into its first row, moves rows from the end into the places that leaves
+
+    # Inputs:   savedArray (databaseArray.ToArray())
+    #           names (databaseArray.names)
+    #           groups (row index arrays, first row first - see FindDuplicates)
+    #           savedExemplars (databaseArray.exemplars.Arrays(), None = no exemplars - merged encodings are dropped)
+
+    # Process:  each merged row's encodings (its exemplars, or 'FaceEncoding') go to the first row through AddExemplar,
+    #               'FrameSaved' becomes the latest of the group
+    #           each merged-away row's place below the new row count gets one of the kept rows past it
+    #               (everything else keeps its row, so its 'Key', sightings and folder don't change)
+    #           names stay as they are - an 'UnknownN' no longer matches its 'Key' once moved, and the merged-away
+    #               ones stay interned, so AppendDatabase never mints them again
+
+    # Returns:  compactedArray, compactedNames, compactedExemplars (rows moved like compactedArray's)
+    #           keyMap (old 'Key' -> new 'Key', 0 stays 0)
+    #           folderMoves ((merged-away row's folder name, its first row's folder name))
+
+    savedArray = savedArray.copy()
+
+    exemplarRows, exemplarBlocks = savedExemplars if savedExemplars is not None else (
+        np.zeros(0, np.uint32), np.zeros((0, 0, 128)))
+    exemplarTable = ExemplarTable(exemplarBlocks.shape[1], exemplarBlocks.dtype)
+    exemplarTable.Adopt(exemplarRows, exemplarBlocks)
+
+    keptRows = np.ones(len(savedArray), bool)
+    leaderRows = np.arange(len(savedArray))
+
+    for group in groups:
+
+        leader = group[0]
+
+        for row in group[1:]:
+
+            if savedArray['ExemplarCount'][row] > 0:
+                mergedEncodings = np.array(exemplarTable.Exemplars(row)[
+                                           :savedArray['ExemplarCount'][row]])
+            else:
+                mergedEncodings = [savedArray['FaceEncoding'][row]]
+
+            for mergedEncoding in mergedEncodings:
+
+                if exemplarTable.exemplarLimit == 0:
+                    break
+
+                exemplars, exemplarCount, centroid, changedPositions = AddExemplar(exemplarTable.Exemplars(leader),
+                                                                                   savedArray['ExemplarCount'][leader],
+                                                                                   savedArray['FaceEncoding'][leader], mergedEncoding)
+
+                if exemplars is not None:
+                    for position in changedPositions:
+                        exemplarTable.SetExemplar(
+                            leader, position, exemplars[position])
+                    savedArray['ExemplarCount'][leader] = exemplarCount
+                    savedArray['FaceEncoding'][leader] = centroid
+
+            savedArray['FrameSaved'][leader] = max(
+                savedArray['FrameSaved'][leader], savedArray['FrameSaved'][row])
+
+            keptRows[row] = False
+            leaderRows[row] = leader
+
+    # Kept rows past the new end fill the merged-away rows' places before it, in order
+    newRowCount = int(np.count_nonzero(keptRows))
+    newRows = np.arange(len(savedArray))
+    newRows[newRowCount:][keptRows[newRowCount:]] = np.flatnonzero(
+        ~keptRows[:newRowCount])
+
+    keyMap = np.zeros(len(savedArray) + 1, np.uint32)
+    keyMap[1:] = newRows[leaderRows] + 1
+
+    compactedArray = np.zeros(newRowCount, savedArray.dtype)
+    compactedArray[newRows[keptRows]] = savedArray[keptRows]
+    compactedArray['Key'] = np.arange(1, newRowCount + 1)
+
+    # Merged-away rows' exemplars went to their leader - the rest follow their row
+    exemplarRows, exemplarBlocks = exemplarTable.Arrays()
+    keptSlots = keptRows[exemplarRows]
+    compactedExemplars = (newRows[exemplarRows[keptSlots]].astype(
+        np.uint32), exemplarBlocks[keptSlots])
+
+    compactedNames = list(names)
+
+    folderMoves = []
+    for row in np.flatnonzero(~keptRows):
+
+        oldName = names[savedArray['NameId'][row]]
+        newName = names[savedArray['NameId'][leaderRows[row]]]
+
+        if oldName != newName:
+            folderMoves.append((oldName, newName))
+
+    return compactedArray, compactedNames, compactedExemplars, keyMap, folderMoves
+
+
+def MeasureLookup(encodings, faceCount=64, repeat=3):
+    # Seconds one CheckDatabase-sized lookup takes against these encodings (full scan, best of repeat)
+
+    encodings = np.asarray(encodings, np.float64).reshape(-1, 128)
+
+    if len(encodings) == 0:
+        return 0.0
+
+    databaseMatcher = EncodingMatcher(partitionMinimumSize=len(encodings) + 1)
+    databaseMatcher.Sync(encodings)
+
+    faceEncodings = encodings[np.random.default_rng(0).choice(
+        len(encodings), faceCount)]
+
+    bestSeconds = np.inf
+    for attempt in range(repeat):
+        startTime = time.perf_counter()
+        databaseMatcher.Match(faceEncodings)
+        bestSeconds = min(bestSeconds, time.perf_counter() - startTime)
+
+    return bestSeconds
+
+
+def CompactDatabase(databaseArray, databaseJournal, groups, planPath=defaultPlanPath,
+                    sightingsPath='./Data/Sightings/', screenshotsPath='./Data/Screenshots/', dryRun=False):
+    # Merges duplicate Unknown rows and rewrites the database without them
+
+    # Inputs:   databaseArray (a FaceDatabase.DatabaseStore - nothing else may be changing it or logging sightings)
+    #           databaseJournal (OpenDatabaseBackend - Rewrite makes the switch)
+    #           groups (FindDuplicates / DuplicateSearch result)
+    #           planPath (where the steps after the rewrite are kept until they're done)
+    #           sightingsPath, screenshotsPath (renumbered / moved to match)
+    #           dryRun (True = report only)
+
+    # Process:  rows tagged since the search ran are left out of their group (a tagged first row keeps it)
+    #           MergeGroups, report what the lookups save
+    #           save the plan, Rewrite the database (the commit point), FinishCompaction
+
+    # Returns:  compactedArray (a new DatabaseStore journaled to databaseJournal, or databaseArray if nothing merged -
+    #               databaseMatcher has to be rebuilt for it)
+
+    unknownRows = set(UnknownRows(databaseArray).tolist())
+
+    groups = [np.array([group[0]] + [row for row in group[1:] if row in unknownRows])
+              for group in groups]
+    groups = [group for group in groups if len(group) > 1]
+
+    if len(groups) == 0:
+        print('Compaction: no duplicate Unknown rows found')
+        return databaseArray
+
+    savedArray = databaseArray.ToArray()
+    savedExemplars = databaseArray.exemplars.Arrays()
+
+    compactedArray, compactedNames, compactedExemplars, keyMap, folderMoves = MergeGroups(
+        savedArray, databaseArray.names, groups, savedExemplars)
+
+    # What every CheckDatabase lookup stops paying for
+    mergedRows = len(savedArray) - len(compactedArray)
+    encodingBytes = savedArray['FaceEncoding'].nbytes + \
+        savedExemplars[1].nbytes
+    compactedBytes = compactedArray['FaceEncoding'].nbytes + \
+        compactedExemplars[1].nbytes
+    lookupSeconds = MeasureLookup(savedArray['FaceEncoding'])
+    compactedSeconds = MeasureLookup(compactedArray['FaceEncoding'])
+
+    print('\nCompaction: {0} duplicate Unknown rows merged into {1} identities'.format(
+        mergedRows, len(groups)))
+    print('    database rows {0} -> {1} ({2:0.1f}% fewer rows per lookup)'.format(
+        len(savedArray), len(compactedArray), 100 * mergedRows / len(savedArray)))
+    print('    encodings {0:0.1f} MB -> {1:0.1f} MB'.format(
+        encodingBytes / 1e6, compactedBytes / 1e6))
+    print('    full scan lookup (64 faces) {0:0.2f} ms -> {1:0.2f} ms'.format(
+        lookupSeconds * 1000, compactedSeconds * 1000))
+    print('    {0} screenshot folders to move'.format(len(folderMoves)))
+
+    if dryRun:
+        return databaseArray
+
+    oldNames = [oldName for oldName, newName in folderMoves]
+    newNames = [newName for oldName, newName in folderMoves]
+
+    with open(planPath + '.tmp', 'wb') as planFile:
+        np.savez(planFile, keyMap=keyMap, oldNames=np.array(oldNames, np.str_), newNames=np.array(newNames, np.str_),
+                 oldRowCount=len(savedArray), newRowCount=len(compactedArray))
+    ReplaceFile(planPath + '.tmp', planPath)
+
+    databaseJournal.Rewrite(compactedArray, compactedNames, compactedExemplars)
+
+    FinishCompaction(len(compactedArray), planPath,
+                     sightingsPath, screenshotsPath)
+
+    # Same layout as the store it replaces (LoadArray's column types / read-only columns)
+    newDatabaseArray = DatabaseStore(databaseArray.databaseStructure, len(compactedArray),
+                                     databaseArray.readOnlyColumns, databaseArray.columnTypes,
+                                     ExemplarTable(databaseArray.exemplars.exemplarLimit, databaseArray.exemplars.exemplarType))
+    for name in compactedNames:
+        newDatabaseArray.InternName(name)
+    newDatabaseArray.Extend(compactedArray)
+    newDatabaseArray.exemplars.Adopt(*compactedExemplars)
+    newDatabaseArray.changeLog = databaseArray.changeLog
+
+    return newDatabaseArray
+
+
+def MoveFolder(oldFolder, newFolder):
+    # Renames a screenshot folder, or moves its .jpg's into newFolder if that's already there
+    #   (same file name in both: the moved one gets the old folder's name added)
+
+    if not os.path.exists(newFolder):
+        os.rename(oldFolder, newFolder)
+        return
+
+    oldName = os.path.basename(os.path.normpath(oldFolder))
+
+    for fileName in sorted(os.listdir(oldFolder)):
+
+        newPath = os.path.join(newFolder, fileName)
+        if os.path.exists(newPath):
+            fileStem, fileExtension = os.path.splitext(fileName)
+            newPath = os.path.join(
+                newFolder, fileStem + '-' + oldName + fileExtension)
+
+        os.rename(os.path.join(oldFolder, fileName), newPath)
+
+    os.rmdir(oldFolder)
+
+
+def FinishCompaction(rowCount, planPath=defaultPlanPath, sightingsPath='./Data/Sightings/',
+                     screenshotsPath='./Data/Screenshots/'):
+    # Carries out the steps after the database rewrite (LoadArray calls this too, in case a crash interrupted them)
+
+    # Inputs:   rowCount (rows in the database as loaded - tells whether the rewrite happened)
+    #           planPath, sightingsPath, screenshotsPath (see CompactDatabase)
+
+    # Process:  no plan: nothing to do
+    #           the database still has its old row count: the rewrite never committed - the plan is dropped
+    #           sightings: segments with a changed key get a renumbered copy, the copies are swapped in
+    #               once they're all written (see RemapSegments)
+    #           screenshot folders: each merged-away row's folder is folded into its first row's
+    #               (names never change otherwise, so no move lands on a folder that's still to move)
+    #           each finished step is logged next to the plan, so a second run skips it
+
+    # Returns:  void
+
+    if not os.path.exists(planPath):
+        return
+
+    progressPath = os.path.splitext(planPath)[0] + '.progress'
+
+    with np.load(planPath) as plan:
+        keyMap = plan['keyMap']
+        folderMoves = list(zip(plan['oldNames'].tolist(),
+                               plan['newNames'].tolist()))
+        newRowCount = int(plan['newRowCount'])
+
+    if rowCount != newRowCount:
+
+        print('Compaction was interrupted before the database was rewritten ({0} rows, {1} expected) - nothing changed'.format(
+            rowCount, newRowCount))
+
+        for leftoverPath in (progressPath, planPath):
+            if os.path.exists(leftoverPath):
+                os.remove(leftoverPath)
+        return
+
+    finishedSteps = set()
+    if os.path.exists(progressPath):
+        with open(progressPath, 'r', encoding='utf-8') as progressFile:
+            finishedSteps = set(progressFile.read().split('\n'))
+
+    progressFile = open(progressPath, 'a', encoding='utf-8')
+
+    def StepDone(step):
+        progressFile.write(step + '\n')
+        progressFile.flush()
+        os.fsync(progressFile.fileno())
+
+    # The sightings log - no segment is replaced until every copy is written, so none is renumbered twice
+    if os.path.isdir(sightingsPath):
+
+        if 'sightings' not in finishedSteps:
+            remappedRows = RemapSegments(sightingsPath, keyMap)
+            print('    {0} sightings renumbered'.format(remappedRows))
+            StepDone('sightings')
+
+        ReplaceRemappedSegments(sightingsPath)
+
+    # Screenshot folders - the first unlogged move whose folder is gone already happened before a crash
+    for stepIndex, (fromName, toName) in enumerate(folderMoves):
+
+        if 'move ' + str(stepIndex) in finishedSteps:
+            continue
+
+        fromFolder = os.path.join(screenshotsPath, fromName)
+        if os.path.isdir(fromFolder):
+            MoveFolder(fromFolder, os.path.join(screenshotsPath, toName))
+
+        StepDone('move ' + str(stepIndex))
+
+    progressFile.close()
+
+    os.remove(planPath)
+    os.remove(progressPath)
+
+
+if __name__ == '__main__':
+
+    # Imported here - DatabasingFromWebcam.py imports this file
+    import DatabasingFromWebcam as Webcam  # database layout, settings, LoadArray
+
+    parser = argparse.ArgumentParser(
+        description='Merge duplicate Unknown rows in ./Data/Database/ (close the webcam program first).')
+    parser.add_argument('--backend', default=Webcam.databaseBackend, choices=('npy', 'sqlite'),
+                        help='database to compact (default: databaseBackend in DatabasingFromWebcam.py)')
+    parser.add_argument('--tolerance', type=float, default=Webcam.compactionTolerance,
+                        help='Unknown rows at least this close are merged')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report what would be merged, change nothing')
+    arguments = parser.parse_args()
+
+    databaseJournal = Webcam.OpenDatabaseBackend(arguments.backend, Webcam.databaseStructure, Webcam.journalFlushInterval,
+                                                 Webcam.checkpointInterval, Webcam.encodingStorage)
+
+    # LoadArray finishes a compaction a crash interrupted (not on a dry run - it writes nothing) - matching isn't needed here
+    databaseArray = Webcam.LoadArray(Webcam.databaseStructure, EncodingMatcher(), databaseJournal,
+                                     Webcam.encodingStorage, Webcam.exemplarLimit, readOnly=arguments.dry_run)
+
+    unknownRows = UnknownRows(databaseArray)
+    print('Searching {0} Unknown rows (of {1}) for duplicates'.format(
+        len(unknownRows), len(databaseArray)))
+
+    searchStart = time.perf_counter()
+    groups = FindDuplicates(
+        databaseArray['FaceEncoding'][unknownRows], arguments.tolerance, unknownRows)
+    print('Search took {0:0.1f} s'.format(time.perf_counter() - searchStart))
+
+    CompactDatabase(databaseArray, databaseJournal,
+                    groups, dryRun=arguments.dry_run)
+
+    databaseJournal.Stop()
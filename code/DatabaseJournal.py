@@ -0,0 +1,414 @@
+# Crash-safe database persistence for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# testDatabase2.npy used to be written once, when q was pressed - a crash lost the whole session
+# Every change to databaseArray is now appended to a journal file next to it:
+#   new rows (AppendDatabase, BuildArray), new names and 'NameId' changes (PromoteUnknown),
+#   'FrameSaved' updates (TakeScreenshots), new exemplars (RefreshExemplars - just the one encoding)
+# A background thread flushes the journal to disk every few seconds (cheap - only the changes are written)
+# Every so often a full checkpoint of databaseArray is written to a temporary file and renamed over
+#   testDatabase2.npy (never half-written), and the journal starts over
+# On startup BuildArray loads the checkpoint and replays the journal on top of it
+# Rewrite replaces the database outright (DatabaseCompaction.py removes and renumbers rows) - the new files
+#   are written as testDatabase2.rewrite.npy first, then moved into place with the journal emptied
+
+
+import os  # atomic rename, fsync
+import json  # one journal entry per line
+import base64  # face encodings inside journal lines
+import threading  # flush / checkpoint thread
+import time  # flush and checkpoint intervals
+import numpy as np  # array library
+from EncodingStorage import SaveDatabase, LoadDatabase, ParseFrameSaved, CheckpointPaths, BlockPath, ExemplarPath  # checkpoint file layout, old 'FrameSaved' text
+
+
+def EncodeValue(value):
+    # Turns a database value into something json can write
+
+    if isinstance(value, dict):
+        return {name: EncodeValue(item) for name, item in value.items()}
+
+    if isinstance(value, np.ndarray):
+        return {'array': base64.b64encode(np.ascontiguousarray(value).tobytes()).decode('ascii'),
+                'dtype': value.dtype.str, 'shape': list(value.shape)}
+
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+
+def DecodeValue(value):
+    # Reverses EncodeValue
+
+    if isinstance(value, dict) and 'array' in value:
+        return np.frombuffer(base64.b64decode(value['array']), np.dtype(value['dtype'])).reshape(value['shape'])
+
+    if isinstance(value, dict):
+        return {name: DecodeValue(item) for name, item in value.items()}
+
+    return value
+
+
+def UpgradeValues(databaseArray, values):
+    # Translates a journal entry written before names were interned and 'FrameSaved' was epoch seconds
+
+    # Inputs:   databaseArray (DatabaseStore being replayed into)
+    #           values (column name -> value, may use 'Name' / text 'FrameSaved')
+
+    # Returns:  values (current columns only)
+
+    values = dict(values)
+
+    if 'Name' in values:
+        values['NameId'] = databaseArray.InternName(values.pop('Name'))
+
+    if isinstance(values.get('FrameSaved'), str):
+        values['FrameSaved'] = ParseFrameSaved(values['FrameSaved'])
+
+    return values
+
+
+def ReplayExemplars(databaseArray, rowIndex, exemplars):
+    # Sets journaled exemplars of one row
+
+    # Inputs:   databaseArray (DatabaseStore being replayed into)
+    #           exemplars (position -> encoding, or a whole old 'Exemplars' block - its unused positions are zeros)
+
+    # Process:  positions past exemplarLimit (journaled with a bigger one) are left out, so are unused ones
+
+    if not isinstance(exemplars, dict):
+        exemplars = dict(enumerate(exemplars))
+
+    for position, exemplar in exemplars.items():
+        if position < databaseArray.exemplars.exemplarLimit and np.any(exemplar):
+            databaseArray.SetExemplar(rowIndex, position, exemplar)
+
+
+class DatabaseJournal:
+    # Append-only change log plus periodic checkpoints for a DatabaseStore
+
+    # Inputs:   checkpointPath (the compacted database, testDatabase2.npy)
+    #           flushInterval (seconds between journal flushes)
+    #           checkpointInterval (seconds between full checkpoints)
+    #           encodingStorage (how checkpoints store 'FaceEncoding', see EncodingStorage.encodingStorages)
+    #           blockColumns (array columns kept in their own block files, see EncodingStorage.BlockColumns)
+
+    # Process:  Exists / Load open the checkpoint (EncodingStorage.LoadDatabase)
+    #           DatabaseStore calls Record for every change it makes
+    #           the background thread writes recorded entries to the journal and fsyncs it
+    #           CheckpointDue / Checkpoint: rotate the journal, then write the snapshot in the background
+    #               (journal.old is only deleted once the new checkpoint is safely renamed into place)
+    #           Replay re-applies journal.old and the journal to a freshly loaded DatabaseStore
+    #           Rewrite swaps in a database that isn't the old one plus changes (rows removed / renumbered)
+
+    def __init__(self, checkpointPath='./Data/Database/testDatabase2.npy', flushInterval=2.0, checkpointInterval=300.0, encodingStorage='float64',
+                 blockColumns=('FaceEncoding',)):
+
+        self.checkpointPath = checkpointPath
+        self.journalPath = os.path.splitext(checkpointPath)[0] + '.journal'
+        self.oldJournalPath = self.journalPath + '.old'
+        self.rewritePath = os.path.splitext(checkpointPath)[0] + '.rewrite.npy'
+
+        self.flushInterval = flushInterval
+        self.checkpointInterval = checkpointInterval
+        self.encodingStorage = encodingStorage
+        self.blockColumns = blockColumns
+
+        # Entries recorded but not written yet - journalLock only guards the list, so Record never waits on the disk
+        self.pendingEntries = []
+        self.journalLock = threading.Lock()
+
+        # Guards journalFile (writes and fsyncs vs. Checkpoint / FinishRewrite swapping it) - always taken before journalLock
+        self.fileLock = threading.Lock()
+
+        # Snapshot waiting for the background thread to write it
+        self.pendingCheckpoint = None
+        self.lastCheckpointTime = time.monotonic()
+
+        # Counters
+        self.recordedEntries = 0
+        self.writtenCheckpoints = 0
+
+        self.journalFile = open(self.journalPath, 'a', encoding='utf-8')
+
+        self.stopEvent = threading.Event()
+        self.wakeEvent = threading.Event()
+        self.thread = threading.Thread(
+            target=self.BackgroundLoop, name='DatabaseJournal', daemon=True)
+        self.thread.start()
+
+    def Exists(self):
+        return os.path.exists(self.checkpointPath)
+
+    def Load(self):
+        # The checkpoint, encodings memory-mapped - see EncodingStorage.LoadDatabase
+        #   (a Rewrite a crash interrupted is finished first)
+
+        self.FinishRewrite()
+
+        return LoadDatabase(self.checkpointPath, self.encodingStorage, self.blockColumns)
+
+    def Record(self, entry):
+        # Queues one change - called by DatabaseStore on the main loop, never touches the disk
+
+        # Inputs:   entry (dict: 'op' plus the values needed to redo the change)
+
+        line = json.dumps(EncodeValue(entry))
+
+        with self.journalLock:
+            self.pendingEntries.append(line)
+            self.recordedEntries += 1
+
+    def Flush(self):
+        # Writes every pending entry to the journal and makes sure it reached the disk
+
+        # Process:  take the pending entries (a moment under journalLock)
+        #           write and fsync them holding only fileLock - Record carries on meanwhile
+
+        with self.fileLock:
+
+            with self.journalLock:
+                pendingEntries = self.pendingEntries
+                self.pendingEntries = []
+
+            if len(pendingEntries) > 0:
+                self.journalFile.write('\n'.join(pendingEntries) + '\n')
+                self.journalFile.flush()
+                os.fsync(self.journalFile.fileno())
+
+    def CheckpointDue(self):
+        # True once checkpointInterval has passed and no checkpoint is still being written
+
+        return self.pendingCheckpoint is None and \
+            time.monotonic() - self.lastCheckpointTime >= self.checkpointInterval
+
+    def Checkpoint(self, savedArray, savedNames, savedExemplars=None, wait=False):
+        # Starts a compacted checkpoint
+
+        # Inputs:   savedArray, savedNames, savedExemplars (databaseArray.Snapshot() - safe to hand to another thread,
+        #               savedExemplars None = no exemplars)
+        #           wait (True = return only once the checkpoint is on disk)
+
+        # Process:  flush, then move the journal aside as journal.old and start a fresh journal
+        #               (everything in journal.old is in savedArray, everything after goes to the new journal)
+        #           the background thread writes savedArray and removes journal.old
+
+        # Returns:  void
+
+        # A checkpoint still being written owns journal.old - let it finish first
+        while self.pendingCheckpoint is not None and self.thread.is_alive():
+            self.wakeEvent.set()
+            time.sleep(0.01)
+
+        with self.fileLock:
+
+            with self.journalLock:
+                pendingEntries = self.pendingEntries
+                self.pendingEntries = []
+
+            if len(pendingEntries) > 0:
+                self.journalFile.write('\n'.join(pendingEntries) + '\n')
+
+            self.journalFile.flush()
+            os.fsync(self.journalFile.fileno())
+            self.journalFile.close()
+
+            # If an older journal.old is still around (crash during a checkpoint), keep both sets of entries
+            if os.path.exists(self.oldJournalPath):
+                with open(self.oldJournalPath, 'a', encoding='utf-8') as oldJournal, open(self.journalPath, 'r', encoding='utf-8') as journal:
+                    oldJournal.write(journal.read())
+                os.remove(self.journalPath)
+            else:
+                os.replace(self.journalPath, self.oldJournalPath)
+
+            self.journalFile = open(self.journalPath, 'a', encoding='utf-8')
+
+            self.pendingCheckpoint = (savedArray, list(savedNames), savedExemplars)
+            self.lastCheckpointTime = time.monotonic()
+
+        self.wakeEvent.set()
+
+        if wait:
+            while self.pendingCheckpoint is not None and self.thread.is_alive():
+                time.sleep(0.01)
+
+    def WriteCheckpoint(self, savedArray, savedNames, savedExemplars):
+        # Runs on the background thread: temporary files, fsync, rename over testDatabase2.npy
+        #   (and its .encodings / .exemplars / .index / .names files)
+
+        SaveDatabase(self.checkpointPath, savedArray,
+                     savedNames, self.encodingStorage, savedExemplars)
+
+        # The checkpoint now holds everything journal.old did
+        if os.path.exists(self.oldJournalPath):
+            os.remove(self.oldJournalPath)
+
+        self.writtenCheckpoints += 1
+
+    def Rewrite(self, savedArray, savedNames, savedExemplars=None):
+        # Replaces the whole database - rows can be gone or renumbered, so the journal can't be replayed over it
+
+        # Inputs:   savedArray, savedNames, savedExemplars (the new database - has to include every change recorded so far)
+
+        # Process:  let a checkpoint still being written finish
+        #           SaveDatabase to testDatabase2.rewrite.npy (+ its block / index / names files)
+        #               - once its column file is there the rewrite is committed
+        #           FinishRewrite moves it into place
+
+        # Returns:  void
+
+        while self.pendingCheckpoint is not None and self.thread.is_alive():
+            self.wakeEvent.set()
+            time.sleep(0.01)
+
+        SaveDatabase(self.rewritePath, savedArray,
+                     savedNames, self.encodingStorage, savedExemplars)
+
+        self.FinishRewrite()
+
+    def FinishRewrite(self):
+        # Moves a committed rewrite into place (Load calls this too, in case a crash interrupted it)
+
+        # Process:  block, exemplar, index and names files replace the checkpoint's
+        #           the journals are emptied - everything in them is in the rewrite
+        #           the column file goes last: until it's moved the rewrite still counts as unfinished
+
+        # Returns:  True if there was a rewrite to finish
+
+        rewriteColumnsPath = CheckpointPaths(self.rewritePath)[0]
+
+        if not os.path.exists(rewriteColumnsPath):
+            return False
+
+        movedPaths = [(BlockPath(self.rewritePath, columnName), BlockPath(self.checkpointPath, columnName))
+                      for columnName in set(self.blockColumns) | {'FaceEncoding'}]
+        movedPaths += list(zip(CheckpointPaths(self.rewritePath)
+                               [2:], CheckpointPaths(self.checkpointPath)[2:]))
+        movedPaths.append((ExemplarPath(self.rewritePath),
+                           ExemplarPath(self.checkpointPath)))
+
+        for rewrittenPath, checkpointPath in movedPaths:
+            if os.path.exists(rewrittenPath):
+                os.replace(rewrittenPath, checkpointPath)
+
+        with self.fileLock:
+
+            with self.journalLock:
+                self.pendingEntries = []
+
+            self.journalFile.close()
+            self.journalFile = open(self.journalPath, 'w', encoding='utf-8')
+            os.fsync(self.journalFile.fileno())
+
+            if os.path.exists(self.oldJournalPath):
+                os.remove(self.oldJournalPath)
+
+        os.replace(rewriteColumnsPath, self.checkpointPath)
+
+        self.lastCheckpointTime = time.monotonic()
+        self.writtenCheckpoints += 1
+
+        return True
+
+    def BackgroundLoop(self):
+        # Flushes the journal every flushInterval seconds, writes checkpoints when asked
+
+        while not self.stopEvent.is_set():
+
+            self.wakeEvent.wait(self.flushInterval)
+            self.wakeEvent.clear()
+
+            try:
+                self.Flush()
+
+                if self.pendingCheckpoint is not None:
+                    self.WriteCheckpoint(*self.pendingCheckpoint)
+                    self.pendingCheckpoint = None
+
+            # Handle any and all of the weird reasons a write might fail - try again next time
+            except Exception as error:
+                print('ERROR: Unable to write database journal: ' + str(error))
+
+                # Don't leave Checkpoint(wait=True) waiting forever
+                self.pendingCheckpoint = None
+
+    def Replay(self, databaseArray):
+        # Re-applies the journal to a DatabaseStore freshly loaded from the checkpoint
+
+        # Inputs:   databaseArray (DatabaseStore, its own journal not attached yet)
+
+        # Process:  journal.old (a checkpoint that never finished), then the journal
+        #           new rows / names the checkpoint already has are skipped, value / exemplar changes are simply applied again
+        #           entries from before names were interned are translated (UpgradeValues),
+        #               ones from when 'Exemplars' was a column become one exemplar change per exemplar
+        #           a torn last line (crash mid-write) ends the replay, an op it doesn't know is a ValueError
+
+        # Returns:  replayedEntries (how many entries changed something)
+
+        replayedEntries = 0
+
+        for journalPath in (self.oldJournalPath, self.journalPath):
+
+            if not os.path.exists(journalPath):
+                continue
+
+            with open(journalPath, 'r', encoding='utf-8') as journal:
+                for line in journal:
+
+                    try:
+                        entry = DecodeValue(json.loads(line))
+                    except ValueError:
+                        break
+
+                    if entry['op'] == 'append':
+
+                        if entry['row'] < len(databaseArray):
+                            continue
+
+                        values = UpgradeValues(databaseArray, entry['values'])
+                        exemplars = values.pop('Exemplars', ())
+
+                        rowIndex = databaseArray.Append(**values)
+                        ReplayExemplars(databaseArray, rowIndex, exemplars)
+
+                    elif entry['op'] == 'name':
+
+                        if entry['id'] < len(databaseArray.names):
+                            continue
+
+                        databaseArray.InternName(entry['name'])
+
+                    elif entry['op'] == 'set':
+
+                        values = UpgradeValues(databaseArray, {entry['column']: entry['value']})
+                        ReplayExemplars(databaseArray, entry['row'], values.pop('Exemplars', ()))
+
+                        for columnName, value in values.items():
+                            databaseArray.SetValue(
+                                columnName, entry['row'], value)
+
+                    elif entry['op'] == 'exemplar':
+
+                        ReplayExemplars(databaseArray, entry['row'], {entry['position']: entry['value']})
+
+                    else:
+                        raise ValueError('unknown journal op ' + str(entry['op']))
+
+                    replayedEntries += 1
+
+        return replayedEntries
+
+    def Stop(self):
+        # Flushes what's left, finishes any checkpoint, ends the background thread
+
+        self.stopEvent.set()
+        self.wakeEvent.set()
+        self.thread.join()
+
+        self.Flush()
+        if self.pendingCheckpoint is not None:
+            self.WriteCheckpoint(*self.pendingCheckpoint)
+            self.pendingCheckpoint = None
+
+        self.journalFile.close()
@@ -8,12 +8,31 @@
 # Saves data in machine-friendly bits and human-friendly .jpg files
 
 
-import face_recognition
 import cv2  # required for webcam capture
+import gc  # startup objects moved out of the garbage collector's way
 import os  # listdir lists files found in folder
 import numpy as np  # array library
-from datetime import datetime, timedelta  # code execution timing
+import time  # 'FrameSaved' epoch seconds
+from datetime import datetime  # code execution timing, screenshot names
 from shutil import copy2, move  # file moving
+from FaceMatching import EncodingMatcher, AddExemplar  # batched nearest-identity lookup, exemplar upkeep
+from FaceDatabase import DatabaseStore, ExemplarTable  # growable column store behind databaseArray, sparse exemplars
+from CaptureSources import CaptureSource, SourceScheduler  # one or more cameras / video files, fair detection scheduling
+from FaceDetection import DetectFaces, DetectionPool, DetectionPlanner, WarmModels  # face finding / encoding, in or out of process
+from FaceTracking import TrackingFrame, TrackFaces  # cheap optical flow tracking between detections
+from FaceAssociation import AssociateFaces  # this frame's faces paired with last frame's
+from Enrollment import EncodeImageFiles, EncodingCache, FirstOfEachFace  # parallel, cached BuildArray encoding
+from ScreenshotWriter import ScreenshotWriter  # .jpg encoding and disk writes off the main loop
+from TagPrompt import TagPrompt  # tagging questions asked without pausing the main loop
+from DatabaseJournal import DatabaseJournal  # crash-safe change log and checkpoints
+from SqliteDatabase import SqliteDatabase  # the same database kept in SQLite instead
+from EncodingStorage import EncodingType, BlockColumns, frameSavedFormat  # memory-mapped, compact database files
+from Metrics import pipelineMetrics, MetricsServer, GarbageCollectionWatch  # per-stage latency, counters, local HTTP endpoint, GC pauses
+from FrameBuffers import FrameBuffer  # scratch image reused every frame
+from MotionGate import MotionGate  # skips detection on frames where nothing moved
+from BackgroundTask import BackgroundTask  # staged startup - database load, model load, enrollment
+from SightingsLog import SightingsLog  # who was seen where and when, queryable by time
+from DatabaseCompaction import DuplicateSearch, CompactDatabase, FinishCompaction  # merging duplicate Unknown rows
 
 
 def AppendDatabase(liveArray, databaseArray, databaseStructure, frameCountTrigger):
@@ -23,22 +42,21 @@ def AppendDatabase(liveArray, databaseArray, databaseStructure, frameCountTrigge
     # If the face couldn't be ID'd and has been in frame for at least frameCountTrigger frames:
     # AppendDatabase creates a new database record for the new face and assigns
     #   'Key' = database length + 1,
-    #   'Name' = 'unknown' + 'Key'
+    #   'NameId' = interned 'Unknown' + 'Key' (or the next free number - see DatabaseStore.UnknownName)
     #   'FaceEncoding' = liveArray current row's 'FaceEncoding'
     # current row in liveArray is updated with the new database row's 'Key' and 'Name' values
     # workingArray is returned as a taller databaseArray
 
     # Inputs:   liveArray (may contain 'ForeignKey' = 0, 'Name' = '' rows),
-    #           databaseArray (a fixed dimm numpy array),
+    #           databaseArray (a FaceDatabase.DatabaseStore - grows in place),
     #           databaseStructure (numpy column names and expected data types - used to keep databaseArray organized)
     #           frameCountTrigger (how soon after a faces appears does AppendDatabase logic fire?)
 
     # Process:  for each row in liveArray where 'ForeignKey' = 0 and 'FrameCount' >= frameCountTrigger
-    #               build a new row for databaseArray
-    #               edit liveArray in-line using data from newDatabaseRow
-    #               append newDatabaseRow to a workingArray for each new face
+    #               append a new row to workingArray (no full copy - the store doubles its capacity when full)
+    #               edit liveArray in-line using data from the new database row
 
-    # Returns:  workingArray (a fixed dimm numpy array slightly taller than databaseArray)
+    # Returns:  workingArray (the same DatabaseStore, slightly taller)
 
     workingArray = databaseArray
 
@@ -47,55 +65,161 @@ def AppendDatabase(liveArray, databaseArray, databaseStructure, frameCountTrigge
         #   and face has been in frame for at least frameCountTrigger frames
         if row['ForeignKey'] == 0 and row['FrameCount'] >= frameCountTrigger:
 
-            # Build new row of data in the same shape as databaseArray
-            newDatabaseRow = np.array([((len(workingArray) + 1), ('Unknown' + str(
-                len(workingArray) + 1)), '', row['FaceEncoding'])], databaseStructure)
+            # Append a new row of data to the end of workingArray (slightly taller now)
+            newDatabaseRow = workingArray.Append(Key=(len(workingArray) + 1), NameId=workingArray.InternName(workingArray.UnknownName(
+                len(workingArray) + 1)), FrameSaved=0, FaceEncoding=row['FaceEncoding'])
 
             # Update liveArray's row['ForeignKey'] with the ['Key'] in databaseArray that contains the data for this person
-            row['ForeignKey'] = newDatabaseRow['Key']
+            row['ForeignKey'] = workingArray['Key'][newDatabaseRow]
 
             # Update liveArray's row['Name'] with the unknownX assigned by newDatabaseRow's 'Unknown' + len(databaseArray)+1
-            row['Name'] = newDatabaseRow[0]['Name']
+            row['Name'] = workingArray.Name(newDatabaseRow)
 
-            # Append newDatabaseRow to the end of workingArray and reinitialize workingArray (slightly taller now)
-            workingArray = np.append(workingArray, newDatabaseRow, axis=0)
+            # The new database row is this face's own encoding
+            row['Distance'] = 0
 
             # Announce a new row as been added
-            print(newDatabaseRow[0]['Name'] + ' appended to database')
+            print(workingArray.Name(newDatabaseRow) + ' appended to database')
+            pipelineMetrics.Count('new_unknowns')
 
     return workingArray
 
 
-def BuildArray(databaseStructure):
+def OpenDatabaseBackend(databaseBackend, databaseStructure, flushInterval, checkpointInterval, encodingStorage='float64'):
+    # Opens where databaseArray is kept - both kinds load, record changes and checkpoint the same way
+
+    # Inputs:   databaseBackend ('npy' = testDatabase2.npy + journal, 'sqlite' = testDatabase2.sqlite)
+    #           databaseStructure (numpy column names and expected data types)
+    #           flushInterval (seconds between journal flushes / SQLite transactions - what a crash can lose)
+    #           checkpointInterval (seconds between checkpoints)
+    #           encodingStorage ('float64' / 'float32' / 'int8' - see EncodingStorage.encodingStorages)
+
+    # Returns:  databaseJournal (DatabaseJournal or SqliteDatabase)
+
+    if databaseBackend == 'npy':
+        return DatabaseJournal('./Data/Database/testDatabase2.npy', flushInterval, checkpointInterval, encodingStorage,
+                               BlockColumns(databaseStructure))
+
+    if databaseBackend == 'sqlite':
+        return SqliteDatabase('./Data/Database/testDatabase2.sqlite', databaseStructure, flushInterval,
+                              checkpointInterval, encodingStorage)
+
+    raise ValueError("databaseBackend must be 'npy' or 'sqlite'")
+
+
+def BuildArray(databaseStructure, databaseMatcher, databaseJournal, enrollmentWorkers=0, encodingStorage='float64',
+               exemplarLimit=0):
     # Builds databaseArray
-    # Checks for pre-built testDatabase2.npy
+    # Checks for pre-built testDatabase2.npy (or .sqlite), replays testDatabase2.journal on top of it
     # Checks for new .jpgs in ./
     # workingArray becomes databaseArray
 
     # Inputs:   databaseStructure (numpy column names and expected data types - used to keep databaseArray organized)
+    #           databaseMatcher (FaceMatching.EncodingMatcher - built here at load time, kept in step with new rows)
+    #           databaseJournal (OpenDatabaseBackend - loaded / replayed here, then records every change to workingArray)
+    #           enrollmentWorkers (worker processes for encoding pictures, 0 = one per CPU core)
+    #           encodingStorage ('float64' / 'float32' / 'int8' - see EncodingStorage.encodingStorages)
+    #           exemplarLimit (most encodings kept per identity, 0 = 'FaceEncoding' only)
+
+    # Process:  LoadArray, EncodePictures, EnrollPictures one after the other
+    #               (the webcam loop runs them as separate startup stages instead)
+
+    # Returns:  workingArray (a FaceDatabase.DatabaseStore - becomes databaseArray)
+
+    workingArray = LoadArray(databaseStructure, databaseMatcher,
+                             databaseJournal, encodingStorage, exemplarLimit)
+
+    knownFaceFiles, encodedFacesLists = EncodePictures(enrollmentWorkers)
+
+    EnrollPictures(workingArray, databaseMatcher,
+                   knownFaceFiles, encodedFacesLists)
+
+    # Return all the data sources compiled into one uniform list for live processing (and saving)
+    return workingArray
+
+
+def LoadArray(databaseStructure, databaseMatcher, databaseJournal, encodingStorage='float64', exemplarLimit=0, readOnly=False):
+    # Loads databaseArray from disk (first stage of BuildArray)
+
+    # Inputs:   same as BuildArray
+    #           readOnly (True = write nothing back - no checkpoint, no finished compaction, changes aren't journaled;
+    #                     DatabaseCompaction.py --dry-run)
+
+    # Process:  if the database exists, load it (encodings are memory-mapped, not read in)
+    #           replay any changes journaled after it was saved (recovers a session that crashed)
+    #           finish a compaction a crash interrupted (sightings / screenshot folders, see DatabaseCompaction.py)
+    #           hook the journal up, lay the encodings out for matching
 
-    # Process:  if the database exists, load it
-    #           if there are pictures in ./
-    #               for each picture in ./
-    #                   encode, check for similar encodings in database, add new row to database,
-    #                       move picture to /Data/UploadedOriginals/ (gets .jpg out of the way for next program launch)
+    # Returns:  workingArray (a FaceDatabase.DatabaseStore)
 
-    # Returns:  workingArray (a fixed dimm numpy array - becomes databaseArray)
+    # Initialize an empty workingArray, but be specific on data structure
+    #   (exemplars go in their own table - only identities that have some take up room for them)
+    workingArray = DatabaseStore(databaseStructure, readOnlyColumns=('FaceEncoding',), columnTypes={
+                                 'FaceEncoding': EncodingType(encodingStorage)},
+                                 exemplars=ExemplarTable(exemplarLimit, EncodingType(encodingStorage)))
 
-    # Get the time and date, format it into something database friendly (fixed char count)
-    currentTimeAndDate = datetime.now().strftime("%H:%M:%S-%d%b%Y")
+    # If database exists, load it into workingArray's columns
+    indexArray = None
+    if databaseJournal.Exists():
 
-    # If database exists, load it
-    if os.path.exists('./Data/Database/testDatabase2.npy'):
+        columnArray, encodingBlocks, indexArray, names, exemplarArrays = databaseJournal.Load()
+        workingArray.Adopt(columnArray, encodingBlocks, names)
+
+        if exemplarArrays is not None:
+            workingArray.exemplars.Adopt(*exemplarArrays, len(workingArray))
 
-        workingArray = np.load('./Data/Database/testDatabase2.npy')
         print('\nDatabase load successful!\n')
 
-    # Otherwise initialize an empty workingArray, but be specific on data structure
     else:
-        workingArray = np.array([], databaseStructure)
         print('\nCould not find database, building...\n')
 
+    # Redo every change made since testDatabase2.npy was last written
+    replayedEntries = databaseJournal.Replay(workingArray)
+
+    # Saved with a bigger exemplarLimit - Adopt cut the extra exemplars off
+    #   (and a row can't count exemplars it has no slot for, like ones saved without their exemplar file)
+    exemplarCounts = workingArray.columns['ExemplarCount'][:len(workingArray)]
+    np.minimum(exemplarCounts, exemplarLimit, out=exemplarCounts)
+    exemplarCounts[workingArray.exemplars.Slots(
+        np.arange(len(workingArray))) < 0] = 0
+
+    # Squared lengths / int8 codes saved with the checkpoint - Sync won't need to read every encoding
+    #   (not after a replay - a journaled centroid change would leave its row's squared length stale)
+    if indexArray is not None and replayedEntries == 0:
+        databaseMatcher.LoadIndex(indexArray)
+
+    if replayedEntries > 0:
+        print('Recovered ' + str(replayedEntries) +
+              ' unsaved database changes from the journal\n')
+
+        # Fold the recovered changes into a fresh testDatabase2.npy (background thread)
+        if not readOnly:
+            databaseJournal.Checkpoint(*workingArray.Snapshot())
+
+    if not readOnly:
+        FinishCompaction(len(workingArray))
+
+        # From here on every new row / changed value is journaled
+        workingArray.changeLog = databaseJournal
+
+    # Lay the loaded encodings out for matching (builds the PartitionIndex for big databases)
+    SyncMatcher(databaseMatcher, workingArray)
+
+    return workingArray
+
+
+def EncodePictures(enrollmentWorkers=0, inProcess=True):
+    # Encodes the .jpg's waiting in ./ (second stage of BuildArray - doesn't touch databaseArray,
+    #   so it can run in the background while the webcam loop is already matching)
+
+    # Inputs:   enrollmentWorkers (worker processes for encoding pictures, 0 = one per CPU core)
+    #           inProcess (False = always in worker processes - see Enrollment.EncodeImageFiles)
+
+    # Process:  encode all pictures in ./ across worker processes (skipping pictures in ./Data/EncodingCache/)
+
+    # Returns:  knownFaceFiles (.jpg file names, sorted)
+    #           encodedFacesLists (faces x 128 array per picture)
+
     # Load only the .jpg file names in ./ to the knownFaceFiles list
     # File name is assumed to be the name of the person pictured!
     knownFaceFiles = [f for f in os.listdir(
@@ -104,18 +228,60 @@ def BuildArray(databaseStructure):
 
     print('\nEncoding pictures found in ./\n')
 
-    # Build workingArray from .jpg's found in ./
-    for currentFile in knownFaceFiles:
+    # Encode every .jpg across the worker pool, pictures seen before come straight from the cache
+    # Returns a (faces x 128) array of face encodings per picture (one row per face found)
+    encodedFacesLists, cachedCount = EncodeImageFiles(
+        ['./' + currentFile for currentFile in knownFaceFiles], enrollmentWorkers, EncodingCache(), inProcess)
+
+    if cachedCount > 0:
+        print('{0} of {1} pictures already encoded (cache)\n'.format(
+            cachedCount, len(knownFaceFiles)))
+
+    return knownFaceFiles, encodedFacesLists
 
-        # Load current image file into a numpy array
-        currentImageArray = face_recognition.load_image_file(
-            './' + currentFile)
 
-        # Pass the current image numpy array to .face_encodings
-        encodedFacesList = face_recognition.face_encodings(currentImageArray)
-        # Returns a list of (128)-dimensional face encodings (one per face found)
+def EnrollPictures(workingArray, databaseMatcher, knownFaceFiles, encodedFacesLists):
+    # Adds EncodePictures' faces to workingArray (last stage of BuildArray - run on the main thread)
 
-        # Does supplied image contain a (recognizable) face? How many?
+    # Inputs:   workingArray (a FaceDatabase.DatabaseStore - grows in place)
+    #           databaseMatcher (kept in step with the new rows)
+    #           knownFaceFiles, encodedFacesLists (from EncodePictures)
+
+    # Process:  check every encoding against the database, and against each other, in one batch
+    #           for each picture in ./
+    #               add new row to database if it's a new face,
+    #                   move picture to /Data/UploadedOriginals/ (gets .jpg out of the way for next program launch)
+
+    # Returns:  void
+
+    # Get the time and date as epoch seconds ('FrameSaved' format)
+    currentTimeAndDate = int(time.time())
+
+    # Does supplied image contain a (recognizable) face? How many?
+    # One face is the only case where naming a face is possible
+    singleFaceFiles = [fileIndex for fileIndex, encodedFacesList in enumerate(
+        encodedFacesLists) if len(encodedFacesList) == 1]
+    singleFaceEncodings = np.array([encodedFacesLists[fileIndex][0]
+                                    for fileIndex in singleFaceFiles], np.float64).reshape(-1, 128)
+
+    # Compare every single-face picture against the database in one batch
+    matchIndexes, matchDistances = databaseMatcher.Match(singleFaceEncodings)
+
+    # ...and against each other (two pictures of the same new person only add one row)
+    duplicateOf = FirstOfEachFace(
+        singleFaceEncodings, databaseMatcher.tolerance)
+
+    # Position of each single-face picture in the batch
+    batchIndexOf = {fileIndex: batchIndex for batchIndex,
+                    fileIndex in enumerate(singleFaceFiles)}
+
+    # workingArray row each single-face picture ended up as
+    singleFaceRows = np.full(len(singleFaceFiles), -1, np.int64)
+
+    # Build workingArray from .jpg's found in ./
+    for fileIndex, currentFile in enumerate(knownFaceFiles):
+
+        encodedFacesList = encodedFacesLists[fileIndex]
 
         # If there are no faces found
         if len(encodedFacesList) == 0:
@@ -123,25 +289,24 @@ def BuildArray(databaseStructure):
 
         # If there is one face found
         if len(encodedFacesList) == 1:
-            # This is the only case where naming a face is possible
             # Remember - the identification is driven by the picture's file name!
 
-            # Compare the current face encoding against the database
-            facesFound = face_recognition.compare_faces(
-                encodedFacesList[0], workingArray['FaceEncoding'])
+            batchIndex = batchIndexOf[fileIndex]
+
+            # Where this face is already in the database (or earlier in this batch), if anywhere
+            matchedRow = matchIndexes[batchIndex]
+            if matchedRow < 0 and duplicateOf[batchIndex] >= 0:
+                matchedRow = singleFaceRows[duplicateOf[batchIndex]]
 
             # If the encoded face isn't already in the database
-            # Aka: if none of the bools in the facesFound list are True
-            if not any(facesFound):
+            # Aka: if the nearest database face is too far away to be a match
+            if matchedRow < 0:
                 # The encoded face is the primary key
                 # When processing the live feed, the .compare_faces list should NEVER contain 2 True values
 
-                # Build new row of data
-                newRowOfData = np.array(
-                    [((len(workingArray) + 1), currentFile.replace('.jpg', ''), currentTimeAndDate, encodedFacesList[0])], databaseStructure)
-
-                # Add the new row to the end of workingArray
-                workingArray = np.append(workingArray, newRowOfData, axis=0)
+                # Add a new row of data to the end of workingArray
+                singleFaceRows[batchIndex] = workingArray.Append(Key=(len(workingArray) + 1), NameId=workingArray.InternName(currentFile.replace('.jpg', '')),
+                                                                 FrameSaved=currentTimeAndDate, FaceEncoding=encodedFacesList[0])
 
                 print('{0:<22}{1}'.format(currentFile,
                                           'Encoding Success! Moving file to /Data/UploadedOriginals/'))
@@ -159,12 +324,12 @@ def BuildArray(databaseStructure):
                 except:
                     print('ERROR: Unable to move ' + currentFile)
 
-            # If the initial .compare_faces came back with a True value
+            # If the initial match came back with a database row
             else:
                 # This could get weird in the wild.
                 # At the very least we should print the ID results
                 print('{0:<22}{1}'.format(currentFile, 'Already in database as ' +
-                                          workingArray[facesFound.index(True)]['Name']))
+                                          workingArray.Name(matchedRow)))
                 # This also might be the cleanest line of code I've ever written
 
         # If too many faces were found
@@ -174,8 +339,64 @@ def BuildArray(databaseStructure):
             print('{0:<22}{1}'.format(
                 currentFile, 'Too many people in picture. People found: ' + str(len(encodedFacesList))))
 
-    # Return all the data sources compiled into one uniform list for live processing (and saving)
-    return workingArray
+    # Let the matcher (and its index) see the new rows
+    SyncMatcher(databaseMatcher, workingArray)
+
+
+def SyncMatcher(databaseMatcher, databaseArray):
+    # Brings databaseMatcher up to date with databaseArray's centroids ('FaceEncoding') and exemplars
+
+    databaseMatcher.Sync(databaseArray['FaceEncoding'],
+                         databaseArray.exemplars, databaseArray['ExemplarCount'])
+
+
+def RefreshExemplars(databaseArray, databaseMatcher, matchIndexes, matchDistances, faceEncodings, exemplarWindow):
+    # Keeps each identity's exemplars in step with how it looks now (lighting, angle, glasses...)
+
+    # Inputs:   databaseArray (a FaceDatabase.DatabaseStore)
+    #           databaseMatcher (told which centroids moved)
+    #           matchIndexes, matchDistances (databaseMatcher.Match results - distance to the nearest exemplar)
+    #           faceEncodings (the faces that were matched)
+    #           exemplarWindow ((exemplarSpread, exemplarTolerance) - a match at least exemplarSpread from every
+    #                               exemplar adds something new, one within exemplarTolerance is sure enough to trust)
+
+    # Process:  for each match inside the window
+    #               FaceMatching.AddExemplar, then the exemplars it changed go back through SetExemplar
+    #                   (usually just the new one), 'ExemplarCount' and 'FaceEncoding' (the centroid) through SetValue
+    #                   - journaled like any other change
+    #           closer matches add nothing new, further ones (up to tolerance) aren't sure enough
+
+    # Returns:  refreshedRows (database rows that changed)
+
+    exemplarSpread, exemplarTolerance = exemplarWindow
+
+    refreshedRows = []
+
+    for matchIndex, matchDistance, faceEncoding in zip(matchIndexes, matchDistances, faceEncodings):
+
+        if matchIndex < 0 or not exemplarSpread <= matchDistance <= exemplarTolerance:
+            continue
+
+        exemplars, exemplarCount, centroid, changedPositions = AddExemplar(databaseArray.exemplars.Exemplars(matchIndex),
+                                                                           databaseArray['ExemplarCount'][matchIndex],
+                                                                           databaseArray['FaceEncoding'][matchIndex], faceEncoding)
+
+        # The sighting was more alike than anything it would replace
+        if exemplars is None:
+            continue
+
+        for position in changedPositions:
+            databaseArray.SetExemplar(
+                matchIndex, position, exemplars[position])
+        databaseArray.SetValue('ExemplarCount', matchIndex, exemplarCount)
+        databaseArray.SetValue('FaceEncoding', matchIndex, centroid)
+
+        refreshedRows.append(matchIndex)
+        pipelineMetrics.Count('exemplar_updates')
+
+    databaseMatcher.Refresh(refreshedRows)
+
+    return refreshedRows
 
 
 def ClickID(mouseClick, liveArray):
@@ -204,10 +425,8 @@ def ClickID(mouseClick, liveArray):
         xCord = mouseClick[0]
         yCord = mouseClick[1]
 
-        top = row['FaceLocation'][0] * 2
-        right = row['FaceLocation'][1] * 2
-        bottom = row['FaceLocation'][2] * 2
-        left = row['FaceLocation'][3] * 2
+        # 'FaceLocation' is in full frame pixels, same as the click
+        top, right, bottom, left = (int(value) for value in row['FaceLocation'])
 
         # print(row['Name'][0:7])
 
@@ -215,7 +434,7 @@ def ClickID(mouseClick, liveArray):
         if xCord > left and xCord < right and yCord > top and yCord < bottom:
 
             # And the mouse click landed in a non-ID'd box
-            if row['Name'][0:7] == 'Unknown':
+            if row['Name'].startswith('Unknown'):
 
                 return rowIndex, True
 
@@ -236,11 +455,8 @@ def PaintBoxes(inputFrame, liveArray):
 
     for row in liveArray:
 
-        # Scale back up face locations - processing was scaled to 1/2 size
-        top = row['FaceLocation'][0] * 2
-        right = row['FaceLocation'][1] * 2
-        bottom = row['FaceLocation'][2] * 2
-        left = row['FaceLocation'][3] * 2
+        # 'FaceLocation' is already in full frame pixels (DetectFaces scales it back up)
+        top, right, bottom, left = (int(value) for value in row['FaceLocation'])
 
         # Draw a box around the face
         cv2.rectangle(inputFrame, (left, top), (right, bottom), (0, 0, 255), 2)
@@ -253,7 +469,8 @@ def PaintBoxes(inputFrame, liveArray):
                     font, 1.0, (255, 255, 255), 1)
 
 
-def ProcessFrame(inputFrame, lastFrameArray, databaseArray, liveDataStructure, databaseRecheckTrigger):
+def ProcessFrame(inputFrame, lastFrameArray, databaseArray, databaseMatcher, liveDataStructure, databaseRecheckTrigger, faceDetections=None,
+                 detectionScale=0.5, searchRegions=None, exemplarWindow=None, liveTable=None, frameBuffer=None):
     # Builds workingArray from inputFrame
     # ID's faces in workingArray using multiple sources (lastFrameArray, databaseArray),
     #   organized by processor cost
@@ -263,289 +480,359 @@ def ProcessFrame(inputFrame, lastFrameArray, databaseArray, liveDataStructure, d
 
     # Inputs:   inputFrame (the cv2 webcam capture)
     #           lastFrameArray (a copy of last frame's liveArray aka - the work ProcessFrame did last frame)
-    #           databaseArray (a fixed dimm numpy array),
+    #           databaseArray (a FaceDatabase.DatabaseStore),
+    #           databaseMatcher (FaceMatching.EncodingMatcher - contiguous copy of databaseArray's 'FaceEncoding')
     #           liveDataStructure (numpy column names and expected data types - used to keep liveArray organized)
+    #           faceDetections (faceLocations, faceEncodings from a DetectionPool worker - None = detect here)
+    #           detectionScale, searchRegions (from the source's DetectionPlanner - see FaceDetection.DetectFaces)
+    #           exemplarWindow ((exemplarSpread, exemplarTolerance) - see RefreshExemplars, None = exemplars never change)
+    #           liveTable (FrameBuffers.LiveTable workingArray is built in - None = a new array every frame)
+    #           frameBuffer (FrameBuffers.FrameBuffer DetectFaces shrinks the frame into - None = a new one every frame)
 
     # Process:  for each face found in inputFrame
     #               build a new workingArray row
     #                   set 'ForeignKey' = 0, 'Name' = 'Unknown', capture face location, and face encoding data
-    #           for each in workingArray
-    #               check lastFrameArray for matching faces
-    #                   set 'ForeignKey' and 'Name' if a match comes back True
-    #               if lastFrameArray cannot ID the face (or if data is older than databaseRecheckTrigger)
-    #                   check databaseArray for matching faces
-    #                       set 'ForeignKey' and 'Name' if a match comes back True
+    #           pair workingArray's faces with lastFrameArray's faces, all at once
+    #               (lowest total encoding distance + box overlap cost, each last frame face used once)
+    #               for each pair, carry over 'ForeignKey', 'Name' and 'FrameCount' + 1
+    #           queue faces with no pair (or whose last frame data is older than databaseRecheckTrigger)
+    #               for a databaseArray check
+    #           check all queued faces against databaseArray at once
+    #               set 'ForeignKey' and 'Name' to the nearest database face, if it's close enough
     #                       (some rows might remain 'ForeignKey' = 0, 'Name' = 'Unknown')
+    #               confident matches that look new become exemplars of their identity (RefreshExemplars)
 
-    # Returns:  workingArray (a fixed dimm numpy array - becomes liveArray)
-
-    def CheckLastFrame(row, inputEncoding):
-        # Checks inputEncoding against lastFrameArray's 'FaceEncoding' data
-
-        # if a match is found and last frame data is less than databaseRecheckTrigger frames old
-        #   set workingArray[row] data to lastFrameArray's matched index
-        #   return True
-
-        lastFrameMatches = face_recognition.compare_faces(
-            lastFrameArray['FaceEncoding'], inputEncoding)
+    # Returns:  workingArray (a fixed dimm numpy array - becomes liveArray;
+    #                         rows of liveTable, if given - good until the frame after next)
 
-        # If this frame contains the same face as last frame
-        if True in lastFrameMatches:
-
-            # Get the index of the true value
-            indexOfTrue = lastFrameMatches.index(True)
-
-            # If 'FrameCount' data in lastFrameArray is greater than databaseRecheckTrigger
-            # Aka if this row in lastFrameArray has been used to ID the current frame
-            #   too many times, force a database check
-            if lastFrameArray[indexOfTrue]['FrameCount'] >= databaseRecheckTrigger:
-
-                # Print debug line and return CheckLastFrame as false
-                # Forces CheckDatabase function to fire
-                # print('database recheck')
-                return False
-
-            # Get the name from the hard work we did last frame
-            workingArray[row]['ForeignKey'] = lastFrameArray[indexOfTrue]['ForeignKey']
-            workingArray[row]['Name'] = lastFrameArray[indexOfTrue]['Name']
-
-            # Iterate 'FrameCount' if this face is ID'd from last frame's data
-            workingArray[row]['FrameCount'] = lastFrameArray[indexOfTrue]['FrameCount'] + 1
-
-            # print(workingArray[row]['FrameCount'])
-
-            return True
-
-    def CheckDatabase(row, inputEncoding):
-        # Checks inputEncoding against databaseArray's 'FaceEncoding' data
-        # If a match can't be found here, ProcessFrame will return this row of workingArray
+    def CheckDatabase(rows):
+        # Checks every face in rows against databaseArray's 'FaceEncoding' data in one batch
+        # If a match can't be found here, ProcessFrame will return that row of workingArray
         #   as 'ForeignKey' = 0, 'Name' = 'Unknown' (unedited after initialization)
 
-        # if a match is found
+        # for each row, if the nearest database face is close enough
         #   set workingArray[row] data to databaseArray's matched index
 
-        databaseMatches = face_recognition.compare_faces(
-            databaseArray['FaceEncoding'], currentFaceEncoding)
+        # Bring the contiguous encoding matrix up to date with any rows AppendDatabase added
+        SyncMatcher(databaseMatcher, databaseArray)
 
-        # If a match was found, add it to the thisFrameNames list
-        if True in databaseMatches:
+        # One distance matrix for all faces x all identities, nearest identity per face
+        #   (re-ranked by each close identity's exemplars)
+        matchIndexes, matchDistances = databaseMatcher.Match(
+            workingArray['FaceEncoding'][rows])
 
-            indexOfTrue = databaseMatches.index(True)
+        for row, matchIndex, matchDistance in zip(rows, matchIndexes, matchDistances):
 
-            workingArray[row]['ForeignKey'] = databaseArray[indexOfTrue]['Key']
-            workingArray[row]['Name'] = databaseArray[indexOfTrue]['Name']
+            # If a match was found, copy its key, name and distance into workingArray
+            if matchIndex >= 0:
 
-    workingArray = np.array([], liveDataStructure)
+                workingArray[row]['ForeignKey'] = databaseArray['Key'][matchIndex]
+                workingArray[row]['Name'] = databaseArray.Name(matchIndex)
+                workingArray[row]['Distance'] = matchDistance
 
-    # Resize frame to 1/2 size for faster face recognition processing
-    smallFrame = cv2.resize(inputFrame, (0, 0), fx=0.5, fy=0.5)
+        if exemplarWindow is not None:
+            RefreshExemplars(databaseArray, databaseMatcher, matchIndexes, matchDistances,
+                             workingArray['FaceEncoding'][rows], exemplarWindow)
 
-    # Convert the image from BGR color (which OpenCV uses) to RGB color (which face_recognition uses)
-    rgbSmallFrame = smallFrame[:, :, ::-1]
+    # Find and encode the faces in inputFrame (high cost function!)
+    #   unless a DetectionPool worker already did it
+    if faceDetections is None:
+        stageTimes = {}
+        faceDetections = DetectFaces(
+            inputFrame, stageTimes, detectionScale, searchRegions, frameBuffer)
+        pipelineMetrics.ObserveAll(stageTimes)
 
-    # Check rgbSmallFrame for faces (high cost function!)
-    faceLocations = face_recognition.face_locations(
-        rgbSmallFrame)
+    faceLocations, faceEncodings = faceDetections
+
+    # Allocate one workingArray row per face in one go, using the liveDataStructure column names and data types
+    #   (or take them from liveTable's spare table - no allocation)
+    if liveTable is None:
+        workingArray = np.zeros(len(faceLocations), liveDataStructure)
+    else:
+        workingArray = liveTable.Rows(len(faceLocations))
 
     # If faces are found
     if len(faceLocations) > 0:
 
-        # Get face encodings at each faceLocations' x/y cord
-        faceEncodings = face_recognition.face_encodings(
-            rgbSmallFrame, faceLocations)
+        # Fill workingArray a column at a time
+        workingArray['ForeignKey'] = 0
+        workingArray['Name'] = 'Unknown'
+        workingArray['FrameCount'] = 1
+        workingArray['FaceLocation'] = faceLocations
+        workingArray['FaceEncoding'] = faceEncodings
 
-        # Combine faceLocations, faceEncodings for easier iterating
-        faceData = zip(faceLocations, faceEncodings)
+    lastFrameStart = time.perf_counter()
 
-        # For each faceLocation, faceEncoding in faceData
-        for faceLoc, faceEnc in faceData:
+    # Which face last frame is which face this frame (every face at once, no name used twice)
+    currentRows, lastRows, pairDistances = AssociateFaces(
+        workingArray, lastFrameArray, databaseMatcher.tolerance)
 
-            # Create a new workingArray row using the liveDataStructure column names and data types
-            newLiveRow = np.array(
-                [(0, 'Unknown', 1, faceLoc, faceEnc)], liveDataStructure)
+    # Rows ID'd from last frame's data
+    lastFrameIds = np.zeros(len(workingArray), bool)
 
-            # Append newLiveRow to workingArray and reinitialize workingArray (slightly taller now)
-            workingArray = np.append(workingArray, newLiveRow, axis=0)
+    for currentRow, lastRow, pairDistance in zip(currentRows, lastRows, pairDistances):
 
-    # For each item in workingArray's 'FaceEncoding' column
-    for currentRow, currentFaceEncoding in enumerate(workingArray['FaceEncoding']):
+        # If this row in lastFrameArray has been used to ID the current frame
+        #   too many times, force a database check
+        if lastFrameArray[lastRow]['FrameCount'] >= databaseRecheckTrigger:
+            pipelineMetrics.Count('database_rechecks')
+            continue
 
-        # If there was a face last frame, check the last frame data first
-        if len(lastFrameArray) > 0:
+        # Get the name from the hard work we did last frame
+        workingArray[currentRow]['ForeignKey'] = lastFrameArray[lastRow]['ForeignKey']
+        workingArray[currentRow]['Name'] = lastFrameArray[lastRow]['Name']
 
-            # Check last frame, returns True if it finds a match
-            if not CheckLastFrame(currentRow, currentFaceEncoding):
+        # Iterate 'FrameCount' if this face is ID'd from last frame's data
+        workingArray[currentRow]['FrameCount'] = lastFrameArray[lastRow]['FrameCount'] + 1
+        workingArray[currentRow]['Distance'] = pairDistance
 
-                # Check databaseArray for matches
-                CheckDatabase(currentRow, currentFaceEncoding)
-                # Iterating across a large database is expensive!
-                # This code only fires when CheckLastFrame returns false
+        lastFrameIds[currentRow] = True
 
-        # If there was NO face last frame
-        else:
+    # Rows that the last frame's data couldn't ID (no pair, or due a recheck), checked against the database together
+    databaseCheckRows = np.nonzero(~lastFrameIds)[0]
+
+    if len(lastFrameArray) > 0 and len(workingArray) > 0:
+        pipelineMetrics.Observe(
+            'lastframe', time.perf_counter() - lastFrameStart)
 
-            # Check databaseArray for matches
-            CheckDatabase(currentRow, currentFaceEncoding)
+    # Check databaseArray for matches
+    if len(databaseCheckRows) > 0:
+        with pipelineMetrics.Time('database'):
+            CheckDatabase(databaseCheckRows)
+        pipelineMetrics.Count('database_lookups', len(databaseCheckRows))
+        # Iterating across a large database is expensive!
+        # This code only fires for rows the last frame couldn't ID, and only once per frame
 
     # Return processing results
     return workingArray
 
 
-def PromoteUnknown(newNameInput, liveArrayRow, liveArray, databaseArray):
+def PromoteUnknown(newNameInput, databaseRow, liveArrays, databaseArray, screenshotWriter):
     # Handles folder renaming
     # Updates liveArray
     # Updates databaseArray
 
+    # Runs on the main loop's thread once TagPrompt has the user's answer - the loop never waits on the user
+    #   or on the disk
+
     # Inputs:   newNameInput (user's text input)
-    #           liveArrayRow (which box in liveArray the user clicked on - found by ClickID)
-    #           liveArray (for retrieving databaseArray's key and editing liveArray name data)
+    #           databaseRow (which database row the clicked box pointed to - found by ClickID, asked about by TagPrompt)
+    #           liveArrays (every source's lastFrameArray - any box showing this row gets the new name)
     #           databaseArray (editing databaseArray name data)
+    #           screenshotWriter (ScreenshotWriter - renames the folder on its thread, after any screenshots
+    #                             still queued for the old name)
 
-    # Process:  if user input is not blank
-    #               use liveArray's 'ForeignKey' to point to a row in databaseArray
+    # Process:  if user input is not blank, the row is still 'Unknown' and the name isn't taken
+    #               update 'Name in databaseArray with user's text input
+    #               update 'Name in every liveArray row with this 'ForeignKey'
 
     #               use the 'Name in databaseArray to set the current file path
     #               use the user's text input to set the new file path
-    #               rename file path
-
-    #               update 'Name in liveArray with user's text input
-    #               update 'Name in databaseArray with user's text input
+    #               queue the rename (if it fails, the main loop gets it back and RevertPromotion undoes the name)
 
     # Returns:  void
 
-    if newNameInput != '' and newNameInput.isalpha():
+    if newNameInput == '' or not newNameInput.isalpha():
+        print('Unacceptable characters used - unable to update record')
+        return
 
-        databaseRow = liveArray[liveArrayRow]['ForeignKey'] - 1
+    currentName = databaseArray.Name(databaseRow)
 
-        currentName = databaseArray[databaseRow]['Name']
+    # Tagged by an earlier answer while this question was waiting
+    if not currentName.startswith('Unknown'):
+        print(currentName + ' is already tagged - unable to update record')
+        return
 
-        currentFilePath = './Data/Screenshots/' + \
-            databaseArray[databaseRow]['Name']
+    currentFilePath = './Data/Screenshots/' + currentName
 
-        newFilePath = './Data/Screenshots/' + newNameInput
+    newFilePath = './Data/Screenshots/' + newNameInput
 
-        try:
-            os.rename(currentFilePath, newFilePath)
+    # Someone else already has this name (or its folder) - same as the rename failing
+    nameId = databaseArray.nameIds.get(newNameInput)
+    if os.path.exists(newFilePath) or (nameId is not None and np.any(databaseArray['NameId'] == nameId)):
+        print('Unable to update record ' + currentName +
+              ' - ' + newNameInput + ' is already used')
+        return
 
-            liveArray[liveArrayRow]['Name'] = newNameInput
+    databaseArray.SetValue(
+        'NameId', databaseRow, databaseArray.InternName(newNameInput))
 
-            databaseArray[databaseRow]['Name'] = newNameInput
+    for liveArray in liveArrays:
+        liveArray['Name'][liveArray['ForeignKey'] == databaseRow + 1] = newNameInput
 
-            print(currentName +
-                  ' updated in database and /Data/Screenshots/ to ' + newNameInput)
+    screenshotWriter.RenameFolder(currentFilePath, newFilePath,
+                                  (databaseRow, currentName, newNameInput))
 
-        except:
+    print(currentName +
+          ' updated in database and /Data/Screenshots/ to ' + newNameInput)
 
-            print('Unable to update record ' + currentName)
 
-    else:
-        print('Unacceptable characters used - unable to update record')
+def RevertPromotion(databaseRow, currentName, newNameInput, liveArrays, databaseArray):
+    # Undoes a PromoteUnknown whose folder rename failed (the tag ScreenshotWriter.FailedRenames hands back)
 
+    # Inputs:   databaseRow, currentName, newNameInput (the row, its old name and the name it was given)
+    #           liveArrays, databaseArray (same as PromoteUnknown)
 
-def SaveArray(databaseArray):
+    # Process:  if the row still has the new name, it goes back to the old one in databaseArray
+    #               (journaled like the change was) and in every liveArray
+
+    # Returns:  void
+
+    if databaseArray.Name(databaseRow) != newNameInput:
+        return
+
+    databaseArray.SetValue(
+        'NameId', databaseRow, databaseArray.InternName(currentName))
+
+    for liveArray in liveArrays:
+        liveArray['Name'][liveArray['ForeignKey'] == databaseRow + 1] = currentName
+
+    print('Unable to rename /Data/Screenshots/' + currentName +
+          ' - ' + newNameInput + ' changed back to ' + currentName)
+
+
+def SaveArray(databaseArray, databaseJournal):
     # Saves databaseArray
     # Prints a report of what's being saved
 
-    # Inputs:   databaseArray (a fixed dimm numpy array)
+    # Inputs:   databaseArray (a FaceDatabase.DatabaseStore)
+    #           databaseJournal (DatabaseJournal - writes the final checkpoint)
 
-    # Process:  for each row in databaseArray
-    #               print 'Key', 'Name', 'FrameSaved', type('FaceEncoding')
-    #           save databaseArray as testDatabase2.npy
+    # Process:  pack databaseArray's columns into one fixed dimm numpy array
+    #           for each row in databaseArray
+    #               print 'Key', name, 'FrameSaved', type('FaceEncoding')
+    #           save databaseArray as testDatabase2.npy + .encodings.npy + .index.npy
+    #               (temporary files + rename, the journal starts over)
+    #               or, with SQLite, fold the WAL into testDatabase2.sqlite (every row is already in it)
 
     # Returns:  void
 
+    # One structured array - EncodingStorage.SaveDatabase splits it into the checkpoint files
+    savedArray = databaseArray.ToArray()
+
     # Prove there's data in the array before saving
     print('\n\nDatabase contents just before saving:\n')
     print('{0:3}  {1:<18} {2:<22} {3}\n'.format(
         'Key', 'Name', 'FrameSaved', "type('FaceEncoding')"))
 
     # Print each row of data in databaseArray
-    for currentRow in databaseArray:
+    for currentRow in savedArray:
         print('{0:3}  {1:<18} {2:<22} {3}'.format(
-            currentRow['Key'], currentRow['Name'], currentRow['FrameSaved'], str(type(currentRow['FaceEncoding']))))
+            currentRow['Key'], databaseArray.names[currentRow['NameId']], FormatFrameSaved(currentRow['FrameSaved']),
+            str(type(currentRow['FaceEncoding']))))
         # Take the one non-string item 'FaceEncoding' and represent it as an object type
         # Aka: it's there - I promise!
 
     # Minimalist sanity check
-    print('\nArray length: ' + str(len(databaseArray)))
+    print('\nArray length: ' + str(len(savedArray)))
 
-    # Save array as a binary file (maintains float values)
-    np.save('./Data/Database/testDatabase2.npy', databaseArray)
+    # Save array as a binary file (maintains float values), wait until it's safely on disk
+    databaseJournal.Checkpoint(savedArray, databaseArray.names,
+                               databaseArray.exemplars.Arrays(), wait=True)
 
 
-def TakeScreenshots(inputFrame, liveArray, databaseArray, screenShotInterval, frameCountTrigger):
+def FormatFrameSaved(frameSaved):
+    # Epoch seconds -> the "%H:%M:%S-%d%b%Y" text screenshots are named with ('' for 0 = never)
+
+    if frameSaved == 0:
+        return ''
+
+    return datetime.fromtimestamp(int(frameSaved)).strftime(frameSavedFormat)
+
+
+def TakeScreenshots(inputFrame, liveArray, databaseArray, screenShotInterval, frameCountTrigger, screenshotWriter, screenShotCrop=False, screenShotCropPadding=0.25, currentTime=None):
     # Checks databaseArray's 'FrameSaved' at liveArray's 'ForeignKey'
-    # 'FrameSaved' is converted to datetime object
-    # If 'FrameSaved' is older than now by more than 1 minute
+    # If 'FrameSaved' is older than now by more than screenShotInterval seconds (or 0 - never saved)
     #   and face has been in frame for at least frameCountTrigger frames:
-    # Save timestamped .jpg to /Data/Screenshots/ liveArray's 'Name' /
-    # TODO: crop screenshot down to liveArray's 'FaceLocation'
-    #       OR paint one box?
-    #           would involve reworking PaintBoxes into PaintBox and TakeScreenshots into TakeScreenshot
-    #               and iterating across liveArray in main
+    # Save timestamped .jpg to /Data/Screenshots/ database name /
+    #   either the whole frame, or (screenShotCrop) just the face at liveArray's 'FaceLocation'
+    # The .jpg is encoded and written by screenshotWriter's background thread - the main loop never waits on the disk
 
     # Inputs:   inputFrame (numpy array representing pixels)
     #           liveArray (contains currently found face data)
     #           databaseArray (contains data on when last screenshot was taken)
     #           frameCountTrigger (how soon after a faces appears does TakeScreenshots logic fire?)
+    #           screenshotWriter (ScreenshotWriter - queues and writes the .jpg's)
+    #           screenShotCrop (True = save only the face, False = save the whole frame)
+    #           screenShotCropPadding (extra margin around a cropped face, as a fraction of the box size)
+    #           currentTime (epoch seconds the frame was filmed at - None = now; HeadlessBatch.py passes recording time)
 
-    # Process:  for each row in liveArray
-    #               check databaseArray's 'FrameSaved' at liveArrayrow's 'ForeignKey'
-    #               take screenshot if last screenshot is too old
-    #               update databaseArray with new 'FrameSaved' data
+    # Process:  pick liveArray rows with a database row and enough 'FrameCount' (one per database row)
+    #           one comparison of their 'FrameSaved' against now decides which screenshots are due
+    #           queue each due screenshot
+    #           update databaseArray with new 'FrameSaved' data (only if the screenshot was queued)
 
     # Returns:  void
 
-    # Get the time and date, format it into something database friendly (fixed char count)
-    currentTimeAndDate = datetime.now().strftime("%H:%M:%S-%d%b%Y")
+    # Get the time and date as epoch seconds ('FrameSaved'), and as text (.jpg file names)
+    if currentTime is None:
+        currentTime = time.time()
+    currentTime = int(currentTime)
+    currentTimeAndDate = FormatFrameSaved(currentTime)
 
-    def SaveJPG(inputName):
+    # PaintBoxes draws on inputFrame after this, so full frame screenshots need their own copy
+    #   (made once, shared by every face saved this frame)
+    frameCopy = []
+
+    def SaveJPG(inputName, databaseRow, faceLocation):
 
         filePath = './Data/Screenshots/' + inputName + '/'
 
-        try:
+        if screenShotCrop:
 
-            # If the named folder doesn't exist in /Screenshots
-            if not os.path.exists(filePath):
-                # Make named folder
-                os.makedirs(filePath)
+            # 'FaceLocation' is already in full frame pixels
+            top, right, bottom, left = faceLocation.astype(int)
 
-            # Save date and time stamped .jpg
-            cv2.imwrite(filePath + currentTimeAndDate +
-                        '.jpg', inputFrame)
+            # Pad the box, keep it inside the frame
+            padding = int(screenShotCropPadding * max(bottom - top, right - left))
+            top = max(top - padding, 0)
+            left = max(left - padding, 0)
+            bottom = min(bottom + padding, inputFrame.shape[0])
+            right = min(right + padding, inputFrame.shape[1])
 
-            # Update databaseArray's 'FrameSaved' to process against next time face appears in frame
-            databaseArray[databaseRow]['FrameSaved'] = currentTimeAndDate
+            screenshot = inputFrame[top:bottom, left:right].copy()
 
-            print('Screenshot of ' + inputName +
-                  ' saved and FrameSaved timestamp updated.')
+        else:
 
-        # Handle any and all of the weird reasons a mkdr or save .jpg command might fail
-        except:
-            print('ERROR: Unable to save screenshot for ' + inputName)
+            if len(frameCopy) == 0:
+                frameCopy.append(inputFrame.copy())
 
-    for row in liveArray:
+            screenshot = frameCopy[0]
 
-        # If face has been in frame for at least frameCountTrigger frames
-        if row['FrameCount'] >= frameCountTrigger:
+        # Queue date and time stamped .jpg for the writer thread
+        if screenshotWriter.Submit(filePath + currentTimeAndDate + '.jpg', screenshot):
 
-            # liveArray contains a reference (forign key) to the databaseArray
-            # The '-1': the key for the first row is 1, but the INDEX of the first row is 0
-            databaseRow = int(row['ForeignKey']-1)
+            # Update databaseArray's 'FrameSaved' to process against next time face appears in frame
+            databaseArray.SetValue(
+                'FrameSaved', databaseRow, currentTime)
 
-            # If a screenshot has never been saved, take Screenshot (new database record)
-            if databaseArray[databaseRow]['FrameSaved'] == '':
-                SaveJPG(databaseArray[databaseRow]['Name'])
+            print('Screenshot of ' + inputName +
+                  ' queued and FrameSaved timestamp updated.')
 
-            # If a screenshot has been saved before, get the date it was save from databaseArray's 'FrameSaved'
-            else:
-                lastSave = datetime.strptime(
-                    databaseArray[databaseRow]['FrameSaved'], "%H:%M:%S-%d%b%Y")
+        # Writer is behind - leave 'FrameSaved' alone so the screenshot is tried again next frame
+        else:
+            print('Screenshot of ' + inputName + ' skipped, ' +
+                  str(screenshotWriter.Backlog()) + ' screenshots waiting to be written')
 
-                # If the most recent screenshot is older than X minutes
-                if datetime.now() >= lastSave + timedelta(seconds=screenShotInterval):
+    # liveArray rows that have been in frame for at least frameCountTrigger frames
+    #   (and have a database row - AppendDatabase gives every one of them one)
+    liveRows = np.flatnonzero((liveArray['FrameCount'] >= frameCountTrigger) & (
+        liveArray['ForeignKey'] > 0))
 
-                    SaveJPG(databaseArray[databaseRow]['Name'])
+    # liveArray contains a reference (forign key) to the databaseArray
+    # The '-1': the key for the first row is 1, but the INDEX of the first row is 0
+    # The same person twice in one frame only gets one screenshot
+    databaseRows, firstLiveRows = np.unique(
+        liveArray['ForeignKey'][liveRows].astype(np.int64) - 1, return_index=True)
+    liveRows = liveRows[firstLiveRows]
+
+    # Never saved (0), or the most recent screenshot is older than screenShotInterval - all faces at once
+    lastSaved = databaseArray['FrameSaved'][databaseRows]
+    isDue = (lastSaved == 0) | (currentTime - lastSaved >= screenShotInterval)
+
+    for liveRow, databaseRow in zip(liveRows[isDue], databaseRows[isDue]):
+        SaveJPG(databaseArray.Name(databaseRow),
+                databaseRow, liveArray[liveRow]['FaceLocation'])
 
 
 def ClickedInWindow(event, x, y, flags, param):
@@ -553,139 +840,558 @@ def ClickedInWindow(event, x, y, flags, param):
     # Of all the data .setMouseCallback returns,
     #   this ClickedInWindow function is only interested in one event: a left mouse click
 
-    # Reference a variable from outside this function (public), don't create a new variable (private)
-    global mouseClick
-    # global variables are usually bad, but might be necessary
-    #   because of how this tool is used to capture cv2.setMouseCallback data
-    #   (no opportunity to set an external variable)
+    # param is the CaptureSource whose window was clicked (passed to cv2.setMouseCallback)
+    #   - each source remembers its own last click
 
     if event == cv2.EVENT_LBUTTONDOWN:
 
-        # If a left mouse button click is detected, set the global mouseClick
+        # If a left mouse button click is detected, set the source's mouseClick
         #   to the current click's x/y coordinates.
-        mouseClick = [x, y]
+        param.mouseClick = [x, y]
 
 
 # Setup timing
 startTime = datetime.now()
 
 # Define the 'column' names and data type of the database and live arrays
+#   'Distance' is how far the face's encoding was from whatever ID'd it (SightingsLog records it)
 liveDataStructure = np.dtype(
-    [('ForeignKey', 'uint32'), ('Name', 'U15'), ('FrameCount', 'uint32'), ('FaceLocation', 'uint32', (4)), ('FaceEncoding', 'float64', (128))])
+    [('ForeignKey', 'uint32'), ('Name', 'U15'), ('FrameCount', 'uint32'), ('FaceLocation', 'uint32', (4)), ('FaceEncoding', 'float64', (128)),
+     ('Distance', 'float32')])
 
+# 'NameId' points into databaseArray.names, 'FrameSaved' is epoch seconds (0 = never)
+# 'FaceEncoding' is the centroid of the identity's exemplars once it has any ('ExemplarCount' = 0: it's the only encoding)
+#   - the exemplars themselves are in databaseArray.exemplars (FaceDatabase.ExemplarTable), not a column
+exemplarLimit = 4           # Most encodings kept per identity (see RefreshExemplars)
 databaseStructure = np.dtype(
-    [('Key', 'uint32'), ('Name', 'U15'), ('FrameSaved', 'U18'), ('FaceEncoding', 'float64', (128))])
+    [('Key', 'uint32'), ('NameId', 'uint32'), ('FrameSaved', 'int64'), ('FaceEncoding', 'float64', (128)),
+     ('ExemplarCount', 'uint8')])
 
 
 # Initialize global variables
-lastFrameArray = np.array([], liveDataStructure)
-processThisFrame = True
+#   (lastFrameArray, tracking state and mouse clicks live in each CaptureSource)
 userClickedOnUnknown = False
-mouseClick = [-1, -1]
+captureSources = [0]        # Webcam device indexes and / or video file paths, one window each,
+#                               all sharing one databaseArray
+maxDetectionsPerSecond = 0  # Full detections allowed per second across every source (0 = no limit)
+sourceReportInterval = 30   # Seconds between per-source FPS / lag reports in the terminal (0 = only at exit)
+metricsLogInterval = 60     # Seconds between per-stage p50/p95/p99 log lines (0 = only at exit)
+metricsPort = 0             # Serve per-stage metrics as text on http://127.0.0.1:metricsPort/metrics (0 = off)
 screenShotInterval = 60     # Measured in seconds
+screenShotCrop = False      # True = screenshots are cropped to the face, False = whole frame
+screenShotCropPadding = 0.25  # Margin around a cropped face, as a fraction of the face box
+screenShotQueueSize = 16    # Screenshots allowed to wait for the disk before new ones are skipped
 frameCountTrigger = 2       # How soon after a faces appears
 #                               does AppendDatabase and TakeScreenshots logic fire?
 databaseRecheckTrigger = 5  # How many frames can ProcessFrame use lastFrameArray's
 #                               data before a database recheck?
 #                             Prevents liveArray from latching onto a bad ID (for too long)
+partitionMinimumSize = 10000  # Database size where matching switches from a full scan
+#                               to searching the closest k-means buckets (0 = always full scan)
+partitionCount = 0          # k-means buckets for big databases (0 = about 4 * sqrt(database size))
+probeCount = 8              # Buckets searched per face - see BenchmarkIndex.py for picking these
+captureBufferSize = 2       # Frames held between each source's capture thread and the main loop
+captureBufferPolicy = 'latest'  # 'latest' = always process the newest frame, drop the rest
+#                                 'all' = process every frame in order (capture waits when full)
+detectionWorkers = 0        # Worker processes for face detection / encoding
+#                               (0 = detect in this process, one frame at a time)
+journalFlushInterval = 2    # Seconds between database journal flushes (what a crash can lose)
+checkpointInterval = 300    # Seconds between full testDatabase2.npy checkpoints
+exemplarSpread = 0.25       # A confident match at least this far from all of an identity's exemplars becomes a new one
+exemplarTolerance = 0.5     # ...if it's this close (stricter than the 0.6 match tolerance)
+databaseBackend = 'npy'     # Where the database is kept: 'npy' (testDatabase2.npy + journal) or 'sqlite'
+#                               (testDatabase2.sqlite - other processes can read it while this one runs,
+#                               filled from testDatabase2.npy the first time, see SqliteDatabase.py)
+compactionTolerance = 0.4   # Unknown rows this close are merged as one person (DatabaseCompaction.py)
+backgroundCompaction = False  # True = look for duplicate Unknown rows on a low-priority thread, merge them on exit
+sightingsFlushInterval = 2  # Seconds between ./Data/Sightings/ writes (every identification is logged there)
+enrollmentWorkers = 0       # Worker processes BuildArray encodes new .jpg's with (0 = one per CPU core)
+encodingStorage = 'float64'  # How face encodings are stored: 'float64' (full precision),
+#                               'float32' (half the memory), 'int8' (float32 on disk, searched as int8 -
+#                               1/8 the memory, closest candidates re-checked at float32)
+detectEveryNFrames = 1      # Full detection / encoding every N frames per source, faces are tracked in between
+#                               (1 = detect every frame, only used when detectionWorkers = 0)
+detectionScale = 0.5        # Frames are shrunk to this before searching for faces (fixed unless adaptiveDetection)
+adaptiveDetection = False   # True = each source picks its own scale from the face sizes it sees and detectionTimeBudget,
+#                               and only searches around last frame's faces between full frame sweeps
+detectionTimeBudget = 0.1   # Seconds a full frame detection should take (adaptiveDetection)
+minimumFacePixels = 64      # Height the smallest face seen is kept at after shrinking (adaptiveDetection)
+fullSweepInterval = 10      # Every Nth detection searches the whole frame for new faces (adaptiveDetection)
+searchRegionPadding = 1.0   # Margin searched around last frame's faces, as a fraction of the face box (adaptiveDetection)
+motionGating = False        # True = a frame that hardly changed since its source's last detection skips detection
+#                               (and tracking) - last frame's boxes still stand (see MotionGate.py)
+motionSampleWidth = 80      # Width frames are shrunk to before they're compared (motionGating)
+motionPixelThreshold = 20   # Gray levels a shrunk pixel has to change by to count as changed (motionGating)
+motionChangedFraction = 0.002  # Share of shrunk pixels that have to change for a frame to count as moved (motionGating)
+motionForcedInterval = 5.0  # Seconds a source can go without a detection, however still the picture (motionGating)
+reuseFrameBuffers = True    # True = frames are shrunk into, and liveArrays built in, the same buffers every frame
+#                               (False = new arrays every frame - compare the 'gc' stage in the metrics)
+
+# Only run the webcam loop when this file is run directly
+#   (DetectionPool's worker processes import this file too)
+if __name__ == '__main__':
+
+    # Check for and create file folders
+    if not os.path.exists('./Data/'):
+        os.makedirs('./Data/')
+        os.makedirs('./Data/Database/')
+        os.makedirs('./Data/UploadedOriginals/')
+        os.makedirs('./Data/Screenshots/')
+
+    # Terminal output
+    print('\nOpenCV and Facial Recognition Test App Mk3\n')
+    print('This program looks for pictures of people in ./')
+    print("The name of the file is assumed to be the pictured person's name.")
+    print('This program can also be updated with new faces once they appear in the webcam.')
+
+    # Lays databaseArray's encodings out as one contiguous matrix for ProcessFrame's lookups
+    databaseMatcher = EncodingMatcher(partitionMinimumSize=partitionMinimumSize,
+                                      partitionCount=partitionCount, probeCount=probeCount,
+                                      quantize=encodingStorage == 'int8')
+
+    # Journal every database change as it happens, checkpoint every few minutes
+    databaseJournal = OpenDatabaseBackend(databaseBackend, databaseStructure,
+                                          journalFlushInterval, checkpointInterval, encodingStorage)
+
+    # Every identification, appended to hourly files in ./Data/Sightings/ (see SightingsLog.py for queries)
+    sightingsLog = SightingsLog(flushInterval=sightingsFlushInterval)
+
+    # Startup runs in stages so the camera is on screen right away:
+    #   the capture sources open on this thread while the database loads, the models load
+    #   and new .jpg's are encoded on background threads
+    #   frames are shown (unprocessed) until the database and models are ready, then recognition starts
+    #   the encoded .jpg's join the database whenever they're done, with recognition already running
+
+    # Load .npy file (plus journaled changes) to RAM
+    databaseTask = BackgroundTask('DatabaseLoad', LoadArray, databaseStructure,
+                                  databaseMatcher, databaseJournal, encodingStorage, exemplarLimit)
+
+    # Encode any new .jpg's in ./ (added to databaseArray by the main loop)
+    enrollmentTask = BackgroundTask(
+        'Enrollment', EncodePictures, enrollmentWorkers, False)
+
+    # Open every capture source, each read on its own thread - stale frames never pile up while ProcessFrame works
+    sources = []
+    for sourceId, sourceSpec in enumerate(captureSources):
+        windowName = 'Video' if len(captureSources) == 1 else 'Video ' + str(sourceId)
+        detectionPlanner = DetectionPlanner(adaptiveDetection, detectionScale, detectionTimeBudget,
+                                            minimumFacePixels, fullSweepInterval, searchRegionPadding)
+        motionGate = MotionGate(motionGating, motionSampleWidth, motionPixelThreshold,
+                                motionChangedFraction, motionForcedInterval)
+        sources.append(CaptureSource(sourceId, sourceSpec, liveDataStructure, captureBufferSize, captureBufferPolicy,
+                                     windowName, detectionPlanner, reuseFrameBuffers, motionGate).Start())
+
+    # Decides whose frame gets worked on next
+    scheduler = SourceScheduler(sources, maxDetectionsPerSecond)
+
+    # Start the background .jpg writer
+    screenshotWriter = ScreenshotWriter(screenShotQueueSize)
+
+    # Tagging questions are asked on their own thread
+    tagPrompt = TagPrompt()
+
+    # Start the face detection worker processes (if any) - each loads its own copy of the models as it starts
+    #   otherwise load the models in this process, in the background
+    detectionPool = None
+    modelTask = None
+    if detectionWorkers > 0:
+        detectionPool = DetectionPool(
+            detectionWorkers, reuseFrameBuffers=reuseFrameBuffers)
+    else:
+        modelTask = BackgroundTask('ModelWarmup', WarmModels)
+
+    # Scratch image DetectFaces shrinks every frame into (shared - sources are processed one at a time)
+    frameBuffer = FrameBuffer() if reuseFrameBuffers else None
+
+    # Open new Qt window per source.
+    # This is normally done with .imshow('Video', frame)
+    #   but for .setMouseCallback to work it needs a named window.
+    for source in sources:
+        cv2.namedWindow(source.windowName)
+
+        # Listen for mouse events, if any happen push to ClickedInWindow (with the source they belong to)
+        cv2.setMouseCallback(source.windowName, ClickedInWindow, source)
+
+    # More terminal output
+    print('\n\n...\n')
+    print('\nLaunching OpenCV window.')
+    print('\nProgram instructions:')
+    print('    1. Click on an Unknown face to tag that person (type the name in this terminal - video keeps running).\n')
+    print('    2. Press q to quit!\n')
+    print('    3. Press d to force a full face detection (when detectEveryNFrames > 1 or motionGating is on).\n\n')
+
+    # Seconds from launch to the first frame on screen / the first frame run through recognition
+    firstFrameSeconds = None
+    firstRecognitionSeconds = None
+
+    # Show frames while the database loads and the models warm up
+    quitRequested = False
+    while not databaseTask.Done() or (modelTask is not None and not modelTask.Done()):
+
+        for source in sources:
+
+            ret, frame, captureTime = source.Read()
+            if not ret:
+                continue
+
+            source.FrameDone(captureTime)
+            font = cv2.FONT_HERSHEY_SIMPLEX
+            cv2.putText(frame, 'Loading...', (0, 30), font, 1, (0, 0, 255), 2)
+            cv2.imshow(source.windowName, frame)
+
+            if firstFrameSeconds is None:
+                firstFrameSeconds = (datetime.now() - startTime).total_seconds()
+                print('Time to first frame: {0:0.2f} s'.format(firstFrameSeconds))
 
-# Check for and create file folders
-if not os.path.exists('./Data/'):
-    os.makedirs('./Data/')
-    os.makedirs('./Data/Database/')
-    os.makedirs('./Data/UploadedOriginals/')
-    os.makedirs('./Data/Screenshots/')
+        # Hit 'q' on the keyboard to quit (the database still finishes loading, so it can be saved)
+        if cv2.waitKey(5) & 0xFF == ord('q'):
+            quitRequested = True
+            break
 
-# Terminal output
-print('\nOpenCV and Facial Recognition Test App Mk3\n')
-print('This program looks for pictures of people in ./')
-print("The name of the file is assumed to be the pictured person's name.")
-print('This program can also be updated with new faces once they appear in the webcam.')
+    databaseArray = databaseTask.Result()
+    print('Database loaded in {0:0.2f} s'.format(databaseTask.seconds))
 
-# Load .npy file and any new .jpg's to RAM
-databaseArray = BuildArray(databaseStructure)
+    # Search the Unknown rows loaded from disk for duplicates while the webcam runs
+    compactionTask = None
+    if backgroundCompaction:
+        compactionTask = DuplicateSearch(databaseArray, compactionTolerance)
 
-# Get a reference to the default webcam
-videoCapture = cv2.VideoCapture(0)
+    if modelTask is not None:
+        modelTask.Result()
+        print('Models loaded in {0:0.2f} s'.format(modelTask.seconds))
 
-print('\nSetup time: ' + str(datetime.now() - startTime))
+    # Local metrics endpoint (if turned on)
+    metricsServer = None
+    if metricsPort > 0:
+        metricsServer = MetricsServer(pipelineMetrics, metricsPort)
+        print('Metrics at http://127.0.0.1:' + str(metricsServer.port) + '/metrics\n')
 
-# Open new Qt window.
-# This is normally done with .imshow('Video', frame)
-#   but for .setMouseCallback to work it needs a named window.
-cv2.namedWindow('Video')
+    lastReportTime = datetime.now()
+    lastMetricsTime = datetime.now()
 
-# Listen for mouse events, if any happen push to ClickedInWindow
-cv2.setMouseCallback('Video', ClickedInWindow)
+    # Everything loaded so far (database, models, modules) lives for the whole run - keep the garbage collector
+    #   from walking through it on every full collection, then time its pauses frame by frame
+    gc.collect()
+    gc.freeze()
+    gcWatch = GarbageCollectionWatch().Start()
 
-# More terminal output
-print('\n\n...\n')
-print('\nLaunching OpenCV window.')
-print('\nProgram instructions:')
-print('    1. Click on an Unknown face to tag that person.\n')
-print('    2. Press q to quit!\n\n')
+    # The 'main' or 'live' function
+    while not quitRequested:
 
-# The 'main' or 'live' function
-while True:
+        # Which source's frame gets worked on this time around (None = nothing ready yet)
+        source = None
+        faceDetections = None
 
-    # FPS timing
-    newTime = datetime.now()
+        # False = MotionGate found nothing moved since the source's last detection
+        frameMoved = True
 
-    # Read a frame of video
-    ret, frame = videoCapture.read()
+        # With worker processes: keep one frame in flight per worker, fed from the sources in scheduler order,
+        #   then pick up the oldest finished frame
+        if detectionPool is not None:
 
-    # Process the faces in the frame and return an array row for each face found in frame
-    liveArray = ProcessFrame(
-        frame, lastFrameArray, databaseArray, liveDataStructure, databaseRecheckTrigger)
+            nextSource = None
+            while detectionPool.Pending() < detectionWorkers:
 
-    # For each row in liveArray that leaves ProcessFrame without a successful ID, create a new database row
-    databaseArray = AppendDatabase(
-        liveArray, databaseArray, databaseStructure, frameCountTrigger)
+                nextSource, detectionDue = scheduler.NextSource()
+                if nextSource is None:
+                    break
 
-    # Add .jpgs to image database on timed intervals, per face
-    TakeScreenshots(frame, liveArray, databaseArray,
-                    screenShotInterval, frameCountTrigger)
+                with pipelineMetrics.Time('capture'):
+                    ret, frame, captureTime = nextSource.Read()
+                if ret:
 
-    # Use the x/y cords and name of the found face to display the results on frame (building GUI)
-    PaintBoxes(frame, liveArray)
+                    # Nothing moved since this source's last detection - don't send it, show it with last frame's boxes
+                    if nextSource.motionGate.enabled:
+                        with pipelineMetrics.Time('motion'):
+                            frameMoved = nextSource.motionGate.Check(
+                                frame, nextSource.forceDetection)
 
-    # Paint FPS data on frame
-    difference = (datetime.now() - newTime)
-    fps = 'FPS: {:0.2f}'.format(1 / difference.microseconds * 1000000)
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    cv2.putText(frame, fps, (0, 30), font, 1, (0, 0, 255), 2)
+                    if not frameMoved:
+                        scheduler.Refund()
+                        source, detectionDue = nextSource, False
+                        break
+
+                    nextSource.motionGate.Detected()
+                    nextSource.forceDetection = False
+
+                    # Scale / search regions planned from this source's latest finished frame
+                    plannedScale, plannedRegions = nextSource.detectionPlanner.Plan(
+                        frame.shape, nextSource.lastFrameArray)
+                    detectionPool.Submit(
+                        frame, (nextSource, frame, captureTime, plannedScale, plannedRegions), plannedScale, plannedRegions)
+
+            # Fill the pipeline first, unless nothing else is waiting to be sent
+            if source is None and (detectionPool.Pending() >= detectionWorkers or
+                                   (detectionPool.Pending() > 0 and nextSource is None)):
+
+                (source, frame, captureTime, plannedScale, plannedRegions), faceLocations, faceEncodings = detectionPool.NextResult()
+                faceDetections = (faceLocations, faceEncodings)
+                detectionDue = True
+
+                source.detectionPlanner.Observe(
+                    plannedScale, plannedRegions, detectionPool.lastBusySeconds, faceLocations)
+
+                # resize / detection / encoding, as timed in the worker
+                pipelineMetrics.ObserveAll(detectionPool.lastStageTimes)
+
+                scheduler.Charge(source, detectionPool.lastBusySeconds)
+
+        else:
 
-    # Save ProcessFrame's work from this frame to help it ID against a smaller list next frame
-    lastFrameArray = liveArray
+            source, detectionDue = scheduler.NextSource(detectEveryNFrames)
 
-    # Display the resulting image
-    cv2.imshow('Video', frame)
+            if source is not None:
+                with pipelineMetrics.Time('capture'):
+                    ret, frame, captureTime = source.Read()
 
-    # Listen for user click, if click happens in an UnkwownX box, return which box was clicked on and a True flag
-    liveArrayRow, userClickedOnUnknown = ClickID(mouseClick, liveArray)
+                if not ret:
+                    source = None
+
+            # Nothing moved since this source's last detection - no detection (or tracking), no detection budget used
+            if source is not None and source.motionGate.enabled:
+
+                with pipelineMetrics.Time('motion'):
+                    frameMoved = source.motionGate.Check(
+                        frame, source.forceDetection)
+
+                if not frameMoved and detectionDue:
+                    scheduler.Refund()
+                    detectionDue = False
+
+        if source is not None:
+
+            frameStart = time.perf_counter()
+            pipelineMetrics.Count('frames')
+
+            # Between full detections, this source's frame gets by on tracking alone
+            if detectEveryNFrames > 1 and detectionPool is None and frameMoved:
+                grayFrame = TrackingFrame(frame)
+
+            if not frameMoved:
+
+                # Last frame's boxes (and names) still stand - 'FrameCount' keeps counting, as it does when tracking
+                liveArray = source.liveTable.Rows(len(source.lastFrameArray))
+                liveArray[...] = source.lastFrameArray
+                liveArray['FrameCount'] += 1
+                pipelineMetrics.Count('motion_skipped_frames')
+
+                # A still face is still due its databaseRecheckTrigger database recheck - the gate lets the next frame through
+                if np.any(liveArray['FrameCount'] >= databaseRecheckTrigger):
+                    source.forceDetection = True
+
+            elif detectionDue:
+
+                detectionStart = datetime.now()
+
+                # Worker processes had their scale / search regions planned (and motion reference moved)
+                #   when the frame was sent
+                if detectionPool is None:
+                    plannedScale, plannedRegions = source.detectionPlanner.Plan(
+                        frame.shape, source.lastFrameArray)
+                    source.motionGate.Detected()
+                    source.forceDetection = False
+
+                # Process the faces in the frame and return an array row for each face found in frame
+                liveArray = ProcessFrame(frame, source.lastFrameArray, databaseArray, databaseMatcher, liveDataStructure,
+                                         databaseRecheckTrigger, faceDetections, plannedScale, plannedRegions,
+                                         (exemplarSpread, exemplarTolerance), source.liveTable, frameBuffer)
+
+                if firstRecognitionSeconds is None:
+                    firstRecognitionSeconds = (datetime.now() - startTime).total_seconds()
+                    print('Time to first recognition: {0:0.2f} s'.format(firstRecognitionSeconds))
+
+                # Worker processes charge their own time (above)
+                if detectionPool is None:
+                    detectionSeconds = (datetime.now() -
+                                        detectionStart).total_seconds()
+                    scheduler.Charge(source, detectionSeconds)
+                    source.detectionPlanner.Observe(
+                        plannedScale, plannedRegions, detectionSeconds, liveArray['FaceLocation'])
+
+                source.framesSinceDetection = 0
+                allTracked = True
+                pipelineMetrics.Count('detections')
+
+            else:
 
-    # If ClickID returned True
-    if userClickedOnUnknown == True:
+                # Move last frame's boxes along with the faces - 'ForeignKey', 'Name' carry over, 'FrameCount' keeps counting
+                with pipelineMetrics.Time('tracking'):
+                    liveArray, allTracked = TrackFaces(
+                        source.lastGrayFrame, grayFrame, source.lastFrameArray, liveTable=source.liveTable)
 
-        # This line pauses the while loop until user inputs text
-        newNameInput = input('Tag this person: ')
+                source.framesSinceDetection += 1
+                pipelineMetrics.Count('tracked_frames')
 
-        # Updates record in liveArray, databaseArray, and record's /Screenshot/ folder
-        PromoteUnknown(newNameInput, liveArrayRow, liveArray, databaseArray)
+            if detectEveryNFrames > 1 and detectionPool is None and frameMoved:
 
-        # Reset user click to impossible coordinates
-        mouseClick = [-1, -1]
+                # Detect on demand next frame if a face got away from the tracker
+                #   or someone is due their databaseRecheckTrigger database recheck
+                source.forceDetection = not allTracked or \
+                    bool(np.any(liveArray['FrameCount'] >= databaseRecheckTrigger))
+
+                source.lastGrayFrame = grayFrame
 
-        # Reset while loop to run indefinitely
-        userClickedOnUnknown = False
+            # For each row in liveArray that leaves ProcessFrame without a successful ID, create a new database row
+            #   (every source appends to the same databaseArray - an unknown seen by two cameras is one row)
+            with pipelineMetrics.Time('append'):
+                databaseArray = AppendDatabase(
+                    liveArray, databaseArray, databaseStructure, frameCountTrigger)
 
-    # Hit 'q' on the keyboard to quit!
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+            # Log who ProcessFrame ID'd (tracked frames only move boxes - nothing new to log)
+            #   at the wall clock time the frame was captured
+            if detectionDue:
+                with pipelineMetrics.Time('sightings'):
+                    sightingsLog.Record(liveArray, source.sourceId,
+                                        time.time() - (time.perf_counter() - captureTime))
 
-# Release handle to the webcam
-videoCapture.release()
-cv2.destroyAllWindows()
+            # Add .jpgs to image database on timed intervals, per face
+            with pipelineMetrics.Time('screenshot'):
+                TakeScreenshots(frame, liveArray, databaseArray, screenShotInterval,
+                                frameCountTrigger, screenshotWriter, screenShotCrop, screenShotCropPadding)
+
+            with pipelineMetrics.Time('paint'):
 
-# Print and save the databaseArray in its final state before program exit
-SaveArray(databaseArray)
+                # Use the x/y cords and name of the found face to display the results on frame (building GUI)
+                PaintBoxes(frame, liveArray)
+
+                # Paint this source's FPS and lag (capture to now) on frame
+                source.FrameDone(captureTime)
+                fps = 'FPS: {0:0.2f}  lag: {1:0.0f} ms'.format(
+                    source.FPS(), source.lagSeconds * 1000)
+                font = cv2.FONT_HERSHEY_SIMPLEX
+                cv2.putText(frame, fps, (0, 30), font, 1, (0, 0, 255), 2)
+
+            # Save ProcessFrame's work from this frame to help it ID against a smaller list next frame
+            source.lastFrameArray = liveArray
+
+            # Display the resulting image
+            with pipelineMetrics.Time('display'):
+                cv2.imshow(source.windowName, frame)
+
+            # Only when loading was done before the camera's first frame arrived
+            if firstFrameSeconds is None:
+                firstFrameSeconds = (datetime.now() - startTime).total_seconds()
+                print('Time to first frame: {0:0.2f} s'.format(firstFrameSeconds))
+
+            pipelineMetrics.Observe(
+                'frame', time.perf_counter() - frameStart)
+
+            # Garbage collector pauses since the last frame (latency jitter the frame times above include)
+            gcSeconds, gcCollections = gcWatch.Take()
+            pipelineMetrics.Observe('gc', gcSeconds)
+            pipelineMetrics.Count('gc_collections', gcCollections)
+
+        # New .jpg's finished encoding in the background - add them to databaseArray
+        if enrollmentTask is not None and enrollmentTask.Done():
+            EnrollPictures(databaseArray, databaseMatcher,
+                           *enrollmentTask.Result())
+            enrollmentTask = None
+
+        # Periodically write a compacted copy of the database (written on the journal's thread -
+        #   only the small columns are copied here, the encodings are read from databaseArray's buffers)
+        if databaseJournal.CheckpointDue():
+            databaseJournal.Checkpoint(*databaseArray.Snapshot())
+
+        # Per-source FPS / lag in the terminal
+        if sourceReportInterval > 0 and (datetime.now() - lastReportTime).total_seconds() >= sourceReportInterval:
+            print('\n'.join(scheduler.Report()))
+            lastReportTime = datetime.now()
+
+        # Per-stage latency percentiles and counters in the terminal
+        if metricsLogInterval > 0 and (datetime.now() - lastMetricsTime).total_seconds() >= metricsLogInterval:
+            print(pipelineMetrics.Report())
+            lastMetricsTime = datetime.now()
+
+        for clickedSource in sources:
+
+            # Listen for user click, if click happens in an UnkwownX box, return which box was clicked on and a True flag
+            liveArrayRow, userClickedOnUnknown = ClickID(
+                clickedSource.mouseClick, clickedSource.lastFrameArray)
+
+            # If ClickID returned True
+            if userClickedOnUnknown == True:
+
+                databaseRow = int(
+                    clickedSource.lastFrameArray[liveArrayRow]['ForeignKey']) - 1
+
+                # Ask on tagPrompt's thread - the while loop keeps running while the user types
+                #   (a face not in the database yet has nothing to tag)
+                if databaseRow >= 0:
+                    tagPrompt.Ask(databaseRow, databaseArray.Name(databaseRow))
+
+                # Reset user click to impossible coordinates
+                clickedSource.mouseClick = [-1, -1]
+
+                # Reset while loop to run indefinitely
+                userClickedOnUnknown = False
+
+        # Updates record in liveArray, databaseArray, and record's /Screenshot/ folder for every answer typed so far
+        for databaseRow, newNameInput in tagPrompt.Answers():
+            PromoteUnknown(newNameInput, databaseRow, [source.lastFrameArray for source in sources],
+                           databaseArray, screenshotWriter)
+
+        # A folder rename that failed takes its name change back with it
+        for databaseRow, currentName, newNameInput in screenshotWriter.FailedRenames():
+            RevertPromotion(databaseRow, currentName, newNameInput, [source.lastFrameArray for source in sources],
+                            databaseArray)
+
+        keyPressed = cv2.waitKey(1) & 0xFF
+
+        # Hit 'q' on the keyboard to quit!
+        if keyPressed == ord('q'):
+            break
+
+        # Hit 'd' to run a full detection next frame on every source (detectEveryNFrames mode)
+        if keyPressed == ord('d'):
+            for forcedSource in sources:
+                forcedSource.forceDetection = True
+
+        # Every camera / video file stopped returning frames
+        if scheduler.AllEnded() and (detectionPool is None or detectionPool.Pending() == 0):
+            print('\nUnable to read from any capture source')
+            break
+
+    # Stop the capture threads, release handles to the webcams / files
+    for source in sources:
+        source.Stop()
+    print('\n' + '\n'.join(scheduler.Report()))
+    print(pipelineMetrics.Report())
+    gcWatch.Stop()
+
+    # Times a reused buffer had to grow (a bigger frame, more faces) - a steady stream of frames adds none
+    if reuseFrameBuffers:
+        print('Frame buffer allocations: detection {0}  live tables {1}'.format(
+            frameBuffer.allocations, sum(source.liveTable.allocations for source in sources)))
+
+    if metricsServer is not None:
+        metricsServer.Stop()
+
+    # Stop the detection workers, report how much work each one did
+    if detectionPool is not None:
+        detectionPool.Stop()
+        print('\n'.join(detectionPool.Report()))
+    cv2.destroyAllWindows()
+
+    # Pictures still encoding - finish them so they make it into this session's database
+    if enrollmentTask is not None:
+        print('\nWaiting for new pictures to finish encoding')
+        EnrollPictures(databaseArray, databaseMatcher,
+                       *enrollmentTask.Result())
+
+    # Finish writing any queued screenshots
+    screenshotWriter.Stop()
+    print(screenshotWriter.Report())
+
+    sightingsLog.Close()
+    print('Sightings logged: ' + str(sightingsLog.recordedSightings))
+
+    # Merge the duplicates the background search found - nothing is writing screenshots or sightings any more,
+    #   so keys can change now
+    if compactionTask is not None:
+        print('\nWaiting for the duplicate search to finish')
+        databaseArray = CompactDatabase(
+            databaseArray, databaseJournal, compactionTask.Result())
+
+    # Print and save the databaseArray in its final state before program exit
+    SaveArray(databaseArray, databaseJournal)
+    databaseJournal.Stop()
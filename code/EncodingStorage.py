@@ -0,0 +1,320 @@
+# Compact, memory-mapped database files for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# testDatabase2.npy used to hold every column, 'FaceEncoding' included, interleaved row by row
+#   and had to be read into RAM in full before the webcam could start
+# A checkpoint is now a set of files:
+#   testDatabase2.npy            every column except 'FaceEncoding' (small)
+#   testDatabase2.names.npy      interned names, 'NameId' n is row n
+#   testDatabase2.encodings.npy  'FaceEncoding' as one contiguous block (float64 or float32),
+#                                    padded with spare rows so new identities have somewhere to go
+#                                    (every array column gets a block file like this - see BlockColumns)
+#   testDatabase2.index.npy      per row: squared length, int8 copy of the encoding and its scale
+#                                    (what EncodingMatcher needs up front - no need to read every encoding)
+#   testDatabase2.exemplars.npz  FaceDatabase.ExemplarTable: 'Rows' and their 'Blocks' of extra encodings,
+#                                    only for the identities that have any
+# The encoding block is memory-mapped copy-on-write: pages are only read when matching touches them,
+#   and rows added this session never write back to the file
+# An old single-file testDatabase2.npy still loads, and is rewritten in the new layout at the next checkpoint
+#   (so does an old testDatabase2.exemplars.npy with a block for every row)
+# So do old ('Name' U15 / 'FrameSaved' U18 text) columns - names are interned, times parsed into epoch seconds
+
+
+import os  # atomic rename, fsync
+from datetime import datetime  # old 'FrameSaved' text
+import numpy as np  # array library
+
+
+# How 'FrameSaved' was written before it became epoch seconds
+frameSavedFormat = '%H:%M:%S-%d%b%Y'
+
+
+# How encodings are kept
+#   'float64':  same precision face_recognition produces
+#   'float32':  half the disk / RAM, distances agree to ~1e-6
+#   'int8':     float32 on disk, EncodingMatcher searches an int8 copy (1/8 the RAM of float64)
+#                   and re-ranks the closest candidates with the float32 encodings
+encodingStorages = ('float64', 'float32', 'int8')
+
+# Layout of testDatabase2.index.npy
+indexStructure = np.dtype(
+    [('SquaredNorm', 'float64'), ('Scale', 'float32'), ('Code', 'int8', (128))])
+
+
+def EncodingType(encodingStorage):
+    # numpy type 'FaceEncoding' is stored as
+
+    if encodingStorage not in encodingStorages:
+        raise ValueError('encodingStorage must be one of ' +
+                         str(encodingStorages))
+
+    return np.float64 if encodingStorage == 'float64' else np.float32
+
+
+def QuantizeEncodings(encodings):
+    # int8 copy of each encoding, scaled so its largest value lands on +/-127
+
+    # Returns:  codes (rows x 128 int8)
+    #           scales (per row - code * scale ~= encoding)
+
+    encodings = np.asarray(encodings, np.float32).reshape(-1, 128)
+
+    scales = np.abs(encodings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+
+    codes = np.rint(encodings / scales[:, None]).astype(np.int8)
+
+    return codes, scales.astype(np.float32)
+
+
+def BuildIndexArray(encodings):
+    # testDatabase2.index.npy rows for a block of encodings
+
+    encodings = np.asarray(encodings, np.float64).reshape(-1, 128)
+
+    indexArray = np.zeros(len(encodings), indexStructure)
+    indexArray['SquaredNorm'] = np.einsum('ij,ij->i', encodings, encodings)
+    indexArray['Code'], indexArray['Scale'] = QuantizeEncodings(encodings)
+
+    return indexArray
+
+
+def CheckpointPaths(checkpointPath):
+    # (columns file, encodings file, index file, names file) for a checkpoint
+
+    basePath = os.path.splitext(checkpointPath)[0]
+
+    return checkpointPath, basePath + '.encodings.npy', basePath + '.index.npy', basePath + '.names.npy'
+
+
+def BlockColumns(structure):
+    # Array columns of a structured dtype ('FaceEncoding') - each is kept in its own block file
+
+    return [columnName for columnName in structure.names if structure.fields[columnName][0].shape != ()]
+
+
+def BlockPath(checkpointPath, columnName):
+    # Block file for one array column ('FaceEncoding' keeps its original .encodings.npy name)
+
+    if columnName == 'FaceEncoding':
+        return CheckpointPaths(checkpointPath)[1]
+
+    return os.path.splitext(checkpointPath)[0] + '.' + columnName.lower() + '.npy'
+
+
+def ExemplarPath(checkpointPath):
+    # File the ExemplarTable is saved in
+
+    return os.path.splitext(checkpointPath)[0] + '.exemplars.npz'
+
+
+def ParseFrameSaved(frameSaved):
+    # Old 'FrameSaved' text -> epoch seconds ('' = never saved = 0)
+
+    if frameSaved == '':
+        return 0
+
+    return int(datetime.strptime(frameSaved, frameSavedFormat).timestamp())
+
+
+def MigrateColumns(columnArray):
+    # Converts old text columns to the current schema
+
+    # Inputs:   columnArray (columns with 'Name' / 'FrameSaved' stored as text)
+
+    # Process:  'Name' becomes 'NameId' into a list of unique names (first appearance order)
+    #           'FrameSaved' becomes int64 epoch seconds
+    #           every other column is copied as-is
+
+    # Returns:  migratedArray (same rows, 'NameId' uint32 and 'FrameSaved' int64)
+    #           names (interned names)
+
+    migratedStructure = []
+    for columnName in columnArray.dtype.names:
+        if columnName == 'Name':
+            migratedStructure.append(('NameId', 'uint32'))
+        elif columnName == 'FrameSaved':
+            migratedStructure.append(('FrameSaved', 'int64'))
+        else:
+            migratedStructure.append(
+                (columnName, columnArray.dtype.fields[columnName][0]))
+
+    migratedArray = np.zeros(len(columnArray), migratedStructure)
+
+    for columnName in columnArray.dtype.names:
+        if columnName not in ('Name', 'FrameSaved'):
+            migratedArray[columnName] = columnArray[columnName]
+
+    # np.unique sorts the names - put them back in the order they first appear
+    names, firstRows, nameInverse = np.unique(
+        columnArray['Name'], return_index=True, return_inverse=True)
+    nameOrder = np.argsort(firstRows)
+    names = names[nameOrder]
+    migratedArray['NameId'] = np.argsort(nameOrder)[nameInverse]
+
+    # Only a handful of distinct times per session - parse each one once
+    frameSavedTexts, frameSavedInverse = np.unique(
+        columnArray['FrameSaved'], return_inverse=True)
+    migratedArray['FrameSaved'] = np.array(
+        [ParseFrameSaved(str(frameSaved)) for frameSaved in frameSavedTexts], np.int64)[frameSavedInverse]
+
+    return migratedArray, [str(name) for name in names]
+
+
+def ReplaceFile(temporaryPath, finalPath):
+    # fsync a finished temporary file, then rename it over finalPath
+
+    with open(temporaryPath, 'rb+') as finishedFile:
+        os.fsync(finishedFile.fileno())
+
+    os.replace(temporaryPath, finalPath)
+
+
+def SaveDatabase(checkpointPath, savedArray, savedNames, encodingStorage='float64', savedExemplars=None):
+    # Writes a checkpoint in the four file layout (plus the exemplars)
+
+    # Inputs:   checkpointPath (./Data/Database/testDatabase2.npy)
+    #           savedArray (databaseArray.ToArray(), or the ColumnSnapshot from databaseArray.Snapshot())
+    #           savedNames (databaseArray.names - only ever grows, so older column files still line up with it)
+    #           encodingStorage (see encodingStorages)
+    #           savedExemplars (databaseArray.exemplars.Arrays() / .Snapshot(), None = no exemplars)
+
+    # Process:  encodings (and every other array column) go into a memory-mapped .npy with room for twice as many rows
+    #               (the spare rows are never written, so they don't take disk space on most filesystems)
+    #           exemplars, index, names, then the column file are written
+    #           every file goes to a temporary name first and is renamed into place;
+    #               the column file goes last - until it's replaced the old checkpoint is still the one that loads
+
+    # Returns:  void
+
+    columnsPath, encodingsPath, indexPath, namesPath = CheckpointPaths(
+        checkpointPath)
+
+    rowCount = len(savedArray)
+    capacity = 64
+    while capacity < 2 * rowCount:
+        capacity *= 2
+
+    for columnName in BlockColumns(savedArray.dtype):
+
+        blockPath = BlockPath(checkpointPath, columnName)
+
+        encodingBlock = np.lib.format.open_memmap(blockPath + '.tmp', mode='w+', dtype=EncodingType(
+            encodingStorage), shape=(capacity,) + savedArray.dtype.fields[columnName][0].shape)
+        encodingBlock[:rowCount] = savedArray[columnName]
+        encodingBlock.flush()
+
+        # From what was written - a snapshot's encodings can still change while this runs
+        if columnName == 'FaceEncoding':
+            indexArray = BuildIndexArray(encodingBlock[:rowCount])
+
+        del encodingBlock
+        ReplaceFile(blockPath + '.tmp', blockPath)
+
+    exemplarRows, exemplarBlocks = savedExemplars if savedExemplars is not None else (
+        np.zeros(0, np.uint32), np.zeros((0, 0, 128)))
+
+    exemplarPath = ExemplarPath(checkpointPath)
+    with open(exemplarPath + '.tmp', 'wb') as exemplarFile:
+        np.savez(exemplarFile, Rows=np.asarray(exemplarRows, np.uint32),
+                 Blocks=np.asarray(exemplarBlocks, EncodingType(encodingStorage)))
+    ReplaceFile(exemplarPath + '.tmp', exemplarPath)
+
+    with open(indexPath + '.tmp', 'wb') as indexFile:
+        np.save(indexFile, indexArray)
+    ReplaceFile(indexPath + '.tmp', indexPath)
+
+    with open(namesPath + '.tmp', 'wb') as namesFile:
+        np.save(namesFile, np.array(list(savedNames), np.str_))
+    ReplaceFile(namesPath + '.tmp', namesPath)
+
+    columnNames = [columnName for columnName in savedArray.dtype.names
+                   if columnName not in BlockColumns(savedArray.dtype)]
+
+    columnArray = np.zeros(rowCount, np.dtype(
+        [(columnName, savedArray.dtype.fields[columnName][0]) for columnName in columnNames]))
+    for columnName in columnNames:
+        columnArray[columnName] = savedArray[columnName]
+
+    with open(columnsPath + '.tmp', 'wb') as columnsFile:
+        np.save(columnsFile, columnArray)
+    ReplaceFile(columnsPath + '.tmp', columnsPath)
+
+    # The old one-block-per-row exemplar file is in exemplars.npz now
+    if os.path.exists(BlockPath(checkpointPath, 'Exemplars')):
+        os.remove(BlockPath(checkpointPath, 'Exemplars'))
+
+
+def LoadDatabase(checkpointPath, encodingStorage='float64', blockColumns=('FaceEncoding',)):
+    # Opens a checkpoint without reading the encodings
+
+    # Inputs:   checkpointPath (./Data/Database/testDatabase2.npy)
+    #           encodingStorage (see encodingStorages)
+    #           blockColumns (array columns to look for block files of - BlockColumns(databaseStructure))
+
+    # Process:  four file layout: load the column file and names, memory-map the encoding block
+    #               (and any other block file that's there) copy-on-write,
+    #               load the exemplars and the index (if it has the same number of rows)
+    #           old single-file layout: pull 'FaceEncoding' out of it into a contiguous block
+    #           old text columns: MigrateColumns
+
+    # Returns:  columnArray (structured array, every column but the array columns)
+    #           encodingBlocks (column name -> rows x column shape - may have spare rows past len(columnArray);
+    #                           always has 'FaceEncoding', other array columns only if they were saved)
+    #           indexArray (indexStructure rows, or None if there isn't a usable one)
+    #           names (interned names 'NameId' points into)
+    #           exemplarArrays ((rows, blocks) for ExemplarTable.Adopt, None if there aren't any saved)
+
+    columnsPath, encodingsPath, indexPath, namesPath = CheckpointPaths(
+        checkpointPath)
+
+    columnArray = np.load(columnsPath)
+
+    # Old layout - everything in one structured array, names as text
+    if 'FaceEncoding' in columnArray.dtype.names:
+        encodingBlock = np.ascontiguousarray(
+            columnArray['FaceEncoding'], EncodingType(encodingStorage))
+        columnArray, names = MigrateColumns(columnArray[[
+            columnName for columnName in columnArray.dtype.names if columnName != 'FaceEncoding']])
+        return columnArray, {'FaceEncoding': encodingBlock}, None, names, None
+
+    if 'Name' in columnArray.dtype.names:
+        columnArray, names = MigrateColumns(columnArray)
+    else:
+        names = [str(name) for name in np.load(namesPath)]
+
+    encodingBlocks = {'FaceEncoding': np.load(encodingsPath, mmap_mode='c')}
+
+    for columnName in blockColumns:
+        if columnName != 'FaceEncoding' and os.path.exists(BlockPath(checkpointPath, columnName)):
+            encodingBlocks[columnName] = np.load(
+                BlockPath(checkpointPath, columnName), mmap_mode='c')
+
+    # Stored at a different precision than asked for - convert (the next checkpoint stores it the new way)
+    for columnName, encodingBlock in encodingBlocks.items():
+        if encodingBlock.dtype != EncodingType(encodingStorage):
+            encodingBlocks[columnName] = encodingBlock[:len(columnArray)].astype(
+                EncodingType(encodingStorage))
+
+    exemplarArrays = None
+    if os.path.exists(ExemplarPath(checkpointPath)):
+        with np.load(ExemplarPath(checkpointPath)) as exemplarFile:
+            exemplarArrays = (exemplarFile['Rows'], exemplarFile['Blocks'].astype(
+                EncodingType(encodingStorage)))
+
+    # Older checkpoint - a block for every row, only the rows counting exemplars use theirs
+    elif os.path.exists(BlockPath(checkpointPath, 'Exemplars')) and 'ExemplarCount' in columnArray.dtype.names:
+        denseBlocks = np.load(
+            BlockPath(checkpointPath, 'Exemplars'), mmap_mode='r')
+        exemplarRows = np.flatnonzero(
+            columnArray['ExemplarCount'][:len(denseBlocks)] > 0)
+        exemplarArrays = (exemplarRows, denseBlocks[exemplarRows].astype(
+            EncodingType(encodingStorage)))
+
+    indexArray = None
+    if os.path.exists(indexPath):
+        indexArray = np.load(indexPath)
+        if len(indexArray) != len(columnArray):
+            indexArray = None
+
+    return columnArray, encodingBlocks, indexArray, names, exemplarArrays
@@ -0,0 +1,175 @@
+# Bulk enrollment helpers for DatabasingFromWebcam.py's BuildArray
+# Copyright Doug Hardy and John Granholm
+
+# Encodes the .jpg's found in ./ across a pool of worker processes
+# Remembers every picture's encodings on disk, keyed by a hash of the file's contents,
+#   so re-running on the same pictures (or restarting after a crash) skips the encoding work
+# Finds pictures of the same person within one batch with blocked distance matrices
+
+
+import os  # cache folder, atomic rename
+import hashlib  # picture content hashes
+from concurrent.futures import ProcessPoolExecutor, as_completed  # encoding workers
+import multiprocessing  # 'spawn' worker context
+import numpy as np  # array library
+from FaceDetection import LoadModels  # face_recognition, imported on first use
+
+
+def FileHash(filePath):
+    # SHA-1 of a file's contents (a renamed copy of a picture hashes the same)
+
+    fileHash = hashlib.sha1()
+
+    with open(filePath, 'rb') as imageFile:
+        for chunk in iter(lambda: imageFile.read(1 << 20), b''):
+            fileHash.update(chunk)
+
+    return fileHash.hexdigest()
+
+
+def EncodeImageFile(filePath):
+    # Runs in each worker process: load one picture, encode every face in it
+
+    # Returns:  filePath
+    #           faceEncodings (faces x 128, zero rows if no face was found)
+
+    face_recognition = LoadModels()
+
+    currentImageArray = face_recognition.load_image_file(filePath)
+
+    faceEncodings = face_recognition.face_encodings(currentImageArray)
+
+    return filePath, np.array(faceEncodings, np.float64).reshape(-1, 128)
+
+
+class EncodingCache:
+    # Content hash -> face encodings, one small .npy per picture
+
+    # Inputs:   cachePath (folder the .npy files live in)
+
+    # Process:  Get returns a picture's encodings if it was encoded before
+    #           Put writes them to a temporary file, then renames it into place
+    #               (a crash never leaves a half-written cache file behind)
+
+    def __init__(self, cachePath='./Data/EncodingCache/'):
+
+        self.cachePath = cachePath
+        os.makedirs(self.cachePath, exist_ok=True)
+
+    def Get(self, contentHash):
+
+        cacheFile = os.path.join(self.cachePath, contentHash + '.npy')
+
+        if not os.path.exists(cacheFile):
+            return None
+
+        try:
+            return np.load(cacheFile)
+
+        # A damaged cache file just means the picture gets encoded again
+        except (OSError, ValueError):
+            return None
+
+    def Put(self, contentHash, faceEncodings):
+
+        cacheFile = os.path.join(self.cachePath, contentHash + '.npy')
+        temporaryFile = cacheFile + '.tmp'
+
+        with open(temporaryFile, 'wb') as outputFile:
+            np.save(outputFile, faceEncodings)
+
+        os.replace(temporaryFile, cacheFile)
+
+
+def EncodeImageFiles(filePaths, workerCount, encodingCache, inProcess=True):
+    # Encodes a batch of pictures, in parallel, skipping any the cache already knows
+
+    # Inputs:   filePaths (pictures to encode)
+    #           workerCount (encoding worker processes, 0 = one per CPU core)
+    #           encodingCache (EncodingCache)
+    #           inProcess (False = never encode in this process, even one picture - the caller is a background
+    #               thread while the main loop is running dlib, and dlib's models aren't safe to share between threads)
+
+    # Process:  hash every picture, pull cached encodings
+    #           send the rest to a process pool (or encode them here, if it's one worker and inProcess allows it)
+    #           cache each picture the moment its worker finishes
+
+    # Returns:  faceEncodingsList (faces x 128 array per picture, in filePaths order)
+    #           cachedCount (how many pictures were skipped thanks to the cache)
+
+    contentHashes = [FileHash(filePath) for filePath in filePaths]
+
+    faceEncodingsList = [encodingCache.Get(
+        contentHash) for contentHash in contentHashes]
+
+    uncachedIndexes = [index for index, faceEncodings in enumerate(
+        faceEncodingsList) if faceEncodings is None]
+
+    cachedCount = len(filePaths) - len(uncachedIndexes)
+
+    if workerCount <= 0:
+        workerCount = os.cpu_count() or 1
+    workerCount = min(workerCount, len(uncachedIndexes))
+
+    # Not worth starting processes for a single picture
+    if workerCount <= 1 and inProcess:
+
+        for index in uncachedIndexes:
+            filePath, faceEncodingsList[index] = EncodeImageFile(
+                filePaths[index])
+            encodingCache.Put(contentHashes[index], faceEncodingsList[index])
+
+    elif len(uncachedIndexes) > 0:
+
+        with ProcessPoolExecutor(max(1, workerCount), mp_context=multiprocessing.get_context('spawn')) as executor:
+
+            pendingFiles = {executor.submit(
+                EncodeImageFile, filePaths[index]): index for index in uncachedIndexes}
+
+            for finishedFile in as_completed(pendingFiles):
+                index = pendingFiles[finishedFile]
+                filePath, faceEncodingsList[index] = finishedFile.result()
+                encodingCache.Put(
+                    contentHashes[index], faceEncodingsList[index])
+
+    return faceEncodingsList, cachedCount
+
+
+def FirstOfEachFace(faceEncodings, tolerance, blockSize=1024):
+    # Finds pictures of the same person within one batch
+
+    # Inputs:   faceEncodings (pictures x 128, in enrollment order)
+    #           tolerance (same match cut-off as EncodingMatcher)
+    #           blockSize (rows per distance block - memory stays blockSize x pictures)
+
+    # Process:  walk the batch in order, a picture is kept unless it matches an earlier kept picture
+    #           each block of rows is measured against everything before it in one distance matrix,
+    #               then settled row by row inside the block
+
+    # Returns:  duplicateOf (per picture: index of the earlier kept picture it matches, -1 if it's kept)
+
+    faceEncodings = np.asarray(faceEncodings, np.float64).reshape(-1, 128)
+
+    duplicateOf = np.full(len(faceEncodings), -1, np.int64)
+    squaredNorms = np.einsum('ij,ij->i', faceEncodings, faceEncodings)
+
+    for blockStart in range(0, len(faceEncodings), blockSize):
+
+        blockEnd = min(blockStart + blockSize, len(faceEncodings))
+
+        # Distances from this block to every picture up to the end of the block
+        squaredDistances = squaredNorms[blockStart:blockEnd, None] + squaredNorms[None, :blockEnd] \
+            - 2.0 * (faceEncodings[blockStart:blockEnd] @ faceEncodings[:blockEnd].T)
+
+        isClose = squaredDistances <= tolerance * tolerance
+
+        for row in range(blockStart, blockEnd):
+
+            # Only earlier pictures that were kept count
+            earlierMatches = np.flatnonzero(
+                isClose[row - blockStart, :row] & (duplicateOf[:row] < 0))
+
+            if len(earlierMatches) > 0:
+                duplicateOf[row] = earlierMatches[0]
+
+    return duplicateOf
@@ -0,0 +1,160 @@
+# Last frame association for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Decides which face in this frame is which face from last frame, for every face at once
+# Cost of pairing two faces = encoding distance + overlapWeight * (1 - box overlap)
+#   pairs further apart than the matching tolerance are never made
+# SolveAssignment picks the pairing with the lowest total cost,
+#   so each face from last frame is carried over to at most one face in this frame
+#   (two people side by side can't both take the same last frame name)
+
+
+import numpy as np  # array library
+from FaceMatching import defaultTolerance  # same match cut-off as the database lookups
+
+
+# Cost given to pairs that aren't allowed - anything this high is dropped from the result
+blockedCost = 1e6
+
+# How much box overlap counts next to encoding distance (distance matches run 0 - 0.6)
+defaultOverlapWeight = 0.3
+
+
+def SolveAssignment(costMatrix):
+    # Minimum total cost pairing of rows to columns (Hungarian algorithm, shortest augmenting paths)
+
+    # Inputs:   costMatrix (rows x columns, any shape)
+
+    # Process:  one row at a time, grow a path of tight (zero reduced cost) edges to a free column,
+    #               raising the row potentials / lowering the column potentials along the way,
+    #               then flip the path - every row assigned so far stays assigned
+    #           the inner step works on every column at once (faces per frame are few, O(n^3) is fine)
+
+    # Returns:  rowIndexes, columnIndexes (paired positions, min(rows, columns) pairs, sorted by row)
+
+    costMatrix = np.asarray(costMatrix, np.float64)
+
+    # The algorithm wants rows <= columns
+    transposed = costMatrix.shape[0] > costMatrix.shape[1]
+    if transposed:
+        costMatrix = costMatrix.T
+
+    rowCount, columnCount = costMatrix.shape
+
+    if rowCount == 0:
+        return np.array([], np.int64), np.array([], np.int64)
+
+    # Potentials and assignments are 1-based, column 0 is where each row's path starts
+    rowPotentials = np.zeros(rowCount + 1)
+    columnPotentials = np.zeros(columnCount + 1)
+    columnOwners = np.zeros(columnCount + 1, np.int64)
+    previousColumns = np.zeros(columnCount + 1, np.int64)
+
+    for row in range(1, rowCount + 1):
+
+        columnOwners[0] = row
+        currentColumn = 0
+
+        smallestSlack = np.full(columnCount + 1, np.inf)
+        usedColumns = np.zeros(columnCount + 1, bool)
+
+        # Grow the path until it reaches a column nobody owns
+        while True:
+
+            usedColumns[currentColumn] = True
+            currentRow = columnOwners[currentColumn]
+
+            freeColumns = ~usedColumns[1:]
+            slack = costMatrix[currentRow - 1] - \
+                rowPotentials[currentRow] - columnPotentials[1:]
+
+            improved = freeColumns & (slack < smallestSlack[1:])
+            smallestSlack[1:][improved] = slack[improved]
+            previousColumns[1:][improved] = currentColumn
+
+            candidateSlack = np.where(freeColumns, smallestSlack[1:], np.inf)
+            nextColumn = int(np.argmin(candidateSlack)) + 1
+            delta = candidateSlack[nextColumn - 1]
+
+            rowPotentials[columnOwners[usedColumns]] += delta
+            columnPotentials[usedColumns] -= delta
+            smallestSlack[1:][freeColumns] -= delta
+
+            currentColumn = nextColumn
+            if columnOwners[currentColumn] == 0:
+                break
+
+        # Flip the path back to its start
+        while currentColumn != 0:
+            previousColumn = previousColumns[currentColumn]
+            columnOwners[currentColumn] = columnOwners[previousColumn]
+            currentColumn = previousColumn
+
+    assignedColumns = np.nonzero(columnOwners[1:])[0]
+    rowIndexes = columnOwners[1:][assignedColumns] - 1
+    columnIndexes = assignedColumns
+
+    if transposed:
+        rowIndexes, columnIndexes = columnIndexes, rowIndexes
+
+    order = np.argsort(rowIndexes)
+
+    return rowIndexes[order], columnIndexes[order]
+
+
+def BoxOverlaps(boxes, otherBoxes):
+    # Intersection over union of every box against every other box
+
+    # Inputs:   boxes, otherBoxes ((top, right, bottom, left) rows)
+
+    # Returns:  overlaps (len(boxes) x len(otherBoxes), 0 = apart, 1 = the same box)
+
+    boxes = np.asarray(boxes, np.float64).reshape(-1, 1, 4)
+    otherBoxes = np.asarray(otherBoxes, np.float64).reshape(1, -1, 4)
+
+    overlapHeight = np.clip(np.minimum(boxes[..., 2], otherBoxes[..., 2]) -
+                            np.maximum(boxes[..., 0], otherBoxes[..., 0]), 0, None)
+    overlapWidth = np.clip(np.minimum(boxes[..., 1], otherBoxes[..., 1]) -
+                           np.maximum(boxes[..., 3], otherBoxes[..., 3]), 0, None)
+    overlapArea = overlapHeight * overlapWidth
+
+    boxArea = (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 1] - boxes[..., 3])
+    otherBoxArea = (otherBoxes[..., 2] - otherBoxes[..., 0]) * \
+        (otherBoxes[..., 1] - otherBoxes[..., 3])
+
+    return overlapArea / np.maximum(boxArea + otherBoxArea - overlapArea, 1e-9)
+
+
+def AssociateFaces(workingArray, lastFrameArray, tolerance=defaultTolerance, overlapWeight=defaultOverlapWeight):
+    # Pairs this frame's faces with last frame's faces
+
+    # Inputs:   workingArray (this frame's faces - 'FaceLocation', 'FaceEncoding')
+    #           lastFrameArray (last frame's liveArray)
+    #           tolerance (largest encoding distance a pair can have)
+    #           overlapWeight (how much box overlap counts - breaks ties between similar looking faces)
+
+    # Process:  encoding distance matrix, box overlap matrix, combined cost
+    #           block pairs past tolerance, solve the assignment, drop blocked pairs
+
+    # Returns:  currentRows, lastRows (paired positions in workingArray / lastFrameArray)
+    #           pairDistances (encoding distance of each pair)
+
+    if len(workingArray) == 0 or len(lastFrameArray) == 0:
+        return np.array([], np.int64), np.array([], np.int64), np.array([], np.float64)
+
+    encodingDistances = np.linalg.norm(workingArray['FaceEncoding'][:, None, :].astype(np.float64) -
+                                       lastFrameArray['FaceEncoding'][None, :, :], axis=2)
+
+    overlaps = BoxOverlaps(
+        workingArray['FaceLocation'], lastFrameArray['FaceLocation'])
+
+    costMatrix = encodingDistances + overlapWeight * (1 - overlaps)
+    costMatrix[encodingDistances > tolerance] = blockedCost
+
+    currentRows, lastRows = SolveAssignment(costMatrix)
+
+    allowed = costMatrix[currentRows, lastRows] < blockedCost
+
+    currentRows, lastRows = currentRows[allowed], lastRows[allowed]
+
+    return currentRows, lastRows, encodingDistances[currentRows, lastRows]
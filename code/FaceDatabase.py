@@ -0,0 +1,446 @@
+# Columnar face database store for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Replaces the structured databaseArray that was grown with np.append (a full copy per new row)
+# Each column ('Key', 'NameId', 'FrameSaved', 'FaceEncoding') lives in its own contiguous array
+# Names are interned: 'NameId' points into one shared list of name strings (4 bytes per row instead of a U15's 60)
+# Columns grow by doubling their capacity, so adding N rows costs O(N) copies in total
+# 'FaceEncoding' is handed out read-only, ready to be matched against without another copy
+# Every change made through Append / SetValue is reported to changeLog (DatabaseJournal) if one is attached
+# Exemplars (an identity's extra encodings) are kept in a side table, ExemplarTable - only the few rows that
+#   have any take up room for them, and changing one exemplar logs that one encoding
+
+
+import numpy as np  # array library
+
+
+class DatabaseStore:
+    # Growable column store shaped by a numpy structured dtype
+
+    # Inputs:   databaseStructure (numpy column names and expected data types - one column per field)
+    #           capacity (rows to allocate up front)
+    #           readOnlyColumns (columns handed out as read-only views)
+    #           columnTypes (column name -> type to store it as instead, e.g. {'FaceEncoding': np.float32})
+
+    # Process:  store['ColumnName'] returns that column's filled rows as a view
+    #               (edits to writable columns land straight in the store - use SetValue so changeLog sees them)
+    #           Append adds one row, Extend adds every row of a structured array
+    #           Adopt takes over loaded arrays as columns without copying them (e.g. a memory-mapped encoding block)
+    #           SetValue changes one value
+    #           InternName turns a name into its 'NameId' (adding it to names if it's new), Name looks a row's name up
+    #           SetExemplar changes one exemplar in exemplars (the ExemplarTable - 'ExemplarCount' stays a column)
+    #           ToArray packs everything back into one structured array for saving
+    #               (names and exemplars.Arrays() are saved alongside)
+    #           Snapshot hands the same to a checkpoint without copying the encodings (see ColumnSnapshot)
+
+    def __init__(self, databaseStructure, capacity=64, readOnlyColumns=('FaceEncoding',), columnTypes=None, exemplars=None):
+
+        self.databaseStructure = np.dtype(databaseStructure)
+        self.readOnlyColumns = readOnlyColumns
+        self.columnTypes = columnTypes if columnTypes is not None else {}
+
+        # Each identity's extra encodings (no room for any unless an ExemplarTable is given)
+        self.exemplars = exemplars if exemplars is not None else ExemplarTable(0)
+
+        # Filled rows
+        self.count = 0
+
+        # Allocated rows in each column (len(self.columns[columnName]))
+        self.columns = {}
+        for columnName in self.databaseStructure.names:
+            self.columns[columnName] = self.NewColumn(
+                columnName, max(1, capacity))
+
+        # Interned names - 'NameId' n is names[n], nameIds goes the other way
+        self.names = []
+        self.nameIds = {}
+
+        # Lowest 'UnknownN' number UnknownName hasn't checked yet
+        self.unknownNumber = 1
+
+        # DatabaseJournal recording Append / SetValue / InternName calls (None = changes aren't logged)
+        self.changeLog = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, columnName):
+        # View of the filled rows of one column
+
+        columnView = self.columns[columnName][:self.count]
+
+        if columnName in self.readOnlyColumns:
+            columnView = columnView.view()
+            columnView.flags.writeable = False
+
+        return columnView
+
+    def NewColumn(self, columnName, capacity):
+        # Allocates an empty column buffer with room for capacity rows
+
+        columnType, columnOffset = self.databaseStructure.fields[columnName][:2]
+
+        # Sub-array fields like ('FaceEncoding', 'float64', (128)) become capacity x 128 arrays
+        return np.zeros((capacity,) + columnType.shape, self.columnTypes.get(columnName, columnType.base))
+
+    def Reserve(self, rowCount):
+        # Makes sure there's room for rowCount rows without reallocating
+
+        # Process:  for each column that's too short, double its capacity until it fits
+        #               and copy the filled rows into the new buffer
+
+        # Returns:  void
+
+        for columnName in self.columns:
+
+            capacity = len(self.columns[columnName])
+            if rowCount <= capacity:
+                continue
+
+            newCapacity = max(1, capacity)
+            while newCapacity < rowCount:
+                newCapacity *= 2
+
+            newColumn = self.NewColumn(columnName, newCapacity)
+            newColumn[:self.count] = self.columns[columnName][:self.count]
+            self.columns[columnName] = newColumn
+
+    def Append(self, **rowValues):
+        # Adds one row
+
+        # Inputs:   rowValues (column name = value, missing columns are left zero / '')
+
+        # Returns:  rowIndex (index of the new row)
+
+        self.Reserve(self.count + 1)
+
+        rowIndex = self.count
+
+        for columnName, value in rowValues.items():
+            self.columns[columnName][rowIndex] = value
+
+        # Only count the row once it's fully written - readers never see half a row
+        self.count += 1
+
+        if self.changeLog is not None:
+            self.changeLog.Record(
+                {'op': 'append', 'row': rowIndex, 'values': rowValues})
+
+        return rowIndex
+
+    def SetValue(self, columnName, rowIndex, value):
+        # Changes one value (for example a 'Name' or 'FrameSaved')
+
+        # Returns:  void
+
+        self.columns[columnName][rowIndex] = value
+
+        if self.changeLog is not None:
+            self.changeLog.Record(
+                {'op': 'set', 'column': columnName, 'row': int(rowIndex), 'value': value})
+
+    def SetExemplar(self, rowIndex, position, encoding):
+        # Changes one of a row's exemplars (see ExemplarTable.SetExemplar)
+
+        # Returns:  void
+
+        self.exemplars.SetExemplar(rowIndex, position, encoding)
+
+        # Only the one encoding is logged, at the precision it's kept in
+        if self.changeLog is not None:
+            self.changeLog.Record({'op': 'exemplar', 'row': int(rowIndex), 'position': int(position),
+                                   'value': np.array(self.exemplars.Exemplars(rowIndex)[position])})
+
+    def InternName(self, name):
+        # 'NameId' for a name, adding it to names the first time it's seen
+
+        # Returns:  nameId
+
+        nameId = self.nameIds.get(name)
+
+        if nameId is None:
+            nameId = len(self.names)
+            self.names.append(name)
+            self.nameIds[name] = nameId
+
+            if self.changeLog is not None:
+                self.changeLog.Record(
+                    {'op': 'name', 'id': nameId, 'name': name})
+
+        return nameId
+
+    def UnknownName(self, key):
+        # 'Unknown' + key, or the next number up if that name is taken
+        #   (DatabaseCompaction.py keeps names when it moves rows, so a new row's key can be an old row's number)
+
+        # Returns:  name (not in names yet)
+
+        number = max(key, self.unknownNumber)
+
+        while 'Unknown' + str(number) in self.nameIds:
+            number += 1
+
+        self.unknownNumber = number + 1
+
+        return 'Unknown' + str(number)
+
+    def Name(self, rowIndex):
+        # Name of one row
+
+        return self.names[self.columns['NameId'][rowIndex]]
+
+    def Extend(self, structuredArray):
+        # Adds every row of a structured array (for example a loaded testDatabase2.npy)
+
+        # Returns:  void
+
+        self.Reserve(self.count + len(structuredArray))
+
+        for columnName in self.columns:
+            self.columns[columnName][self.count:self.count +
+                                     len(structuredArray)] = structuredArray[columnName]
+
+        self.count += len(structuredArray)
+
+    def Adopt(self, structuredArray, columnArrays, names=()):
+        # Loads an empty store from arrays without copying the big ones
+
+        # Inputs:   structuredArray (the small columns, one row per database row)
+        #           columnArrays (column name -> array used as that column's buffer as-is;
+        #                         may be longer than structuredArray - the extra rows are spare capacity;
+        #                         one saved with a different shape is copied into a fresh column - cut off or zero padded)
+        #           names (interned names 'NameId' points into)
+
+        # Returns:  void
+
+        for name in names:
+            self.InternName(name)
+
+        for columnName, columnArray in columnArrays.items():
+
+            columnShape = self.databaseStructure.fields[columnName][0].shape
+
+            if columnArray.shape[1:] != columnShape:
+                overlap = (slice(None),) + tuple(slice(0, min(savedSize, columnSize))
+                                                 for savedSize, columnSize in zip(columnArray.shape[1:], columnShape))
+                fittedColumn = self.NewColumn(columnName, len(columnArray))
+                fittedColumn[overlap] = columnArray[overlap]
+                columnArray = fittedColumn
+
+            self.columns[columnName] = columnArray
+
+        self.Reserve(len(structuredArray))
+
+        for columnName in structuredArray.dtype.names:
+            if columnName not in columnArrays:
+                self.columns[columnName][:len(
+                    structuredArray)] = structuredArray[columnName]
+
+        self.count = len(structuredArray)
+
+    def ToArray(self):
+        # Packs the filled rows into one structured array in databaseStructure's layout
+
+        # Returns:  structuredArray (same shape np.save has always written)
+
+        structuredArray = np.zeros(self.count, self.databaseStructure)
+
+        for columnName in self.columns:
+            structuredArray[columnName] = self.columns[columnName][:self.count]
+
+        return structuredArray
+
+    def Snapshot(self):
+        # What a checkpoint saves, cheap enough to take on the main loop
+
+        # Returns:  savedArray (ColumnSnapshot - stands in for ToArray())
+        #           savedNames (copy of names)
+        #           savedExemplars (exemplars.Snapshot() - stands in for exemplars.Arrays())
+
+        return ColumnSnapshot(self), list(self.names), self.exemplars.Snapshot()
+
+
+class ColumnSnapshot:
+    # A DatabaseStore's rows as of now, for a checkpoint written on another thread
+
+    # Inputs:   databaseStore (the DatabaseStore to take it of)
+
+    # Process:  the small columns are copied (a few bytes a row)
+    #           the array columns ('FaceEncoding') aren't - their buffers are kept, cut to the rows there are now
+    #               (the store only adds rows past those or moves to a bigger buffer, so they stay put)
+    #           a value changed in place afterwards (a centroid an exemplar moved) may or may not make it in -
+    #               it was journaled after the checkpoint began, so replaying the journal redoes it either way
+    #           snapshot[columnName], len(snapshot) and snapshot.dtype work like ToArray()'s structured array
+
+    def __init__(self, databaseStore):
+
+        self.dtype = databaseStore.databaseStructure
+        self.count = databaseStore.count
+
+        self.columns = {}
+        for columnName, column in databaseStore.columns.items():
+            if column.ndim > 1:
+                self.columns[columnName] = column[:self.count]
+            else:
+                self.columns[columnName] = column[:self.count].copy()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, columnName):
+        return self.columns[columnName]
+
+
+class ExemplarTable:
+    # Each identity's extra encodings ('Exemplars'), kept only for the rows that have some
+
+    # Inputs:   exemplarLimit (most exemplars per row)
+    #           exemplarType (type they're stored as, like 'FaceEncoding')
+    #           capacity (rows with exemplars to allocate up front)
+
+    # Process:  slot n holds database row rows[n]'s exemplars, blocks[n] (exemplarLimit x 128)
+    #               - a row only gets a slot when its first exemplar is set, most rows never do
+    #           slotOfRow goes the other way (-1 = no slot)
+    #           table[rows] gathers the blocks of rows that have slots (what EncodingMatcher re-ranks against)
+    #           Exemplars looks up one row's block (read-only, zeros if it has none)
+    #           SetExemplar writes one exemplar
+    #           Adopt / Arrays load from / copy out (rows, blocks) - how checkpoints store the table
+    #               (Snapshot gives the same without copying, see ColumnSnapshot)
+
+    def __init__(self, exemplarLimit, exemplarType=np.float64, capacity=16):
+
+        self.exemplarLimit = exemplarLimit
+        self.exemplarType = exemplarType
+
+        # Filled slots
+        self.count = 0
+
+        self.rows = np.zeros(max(1, capacity), np.uint32)
+        self.blocks = np.zeros(
+            (max(1, capacity), exemplarLimit, 128), exemplarType)
+        self.slotOfRow = np.full(max(1, capacity), -1, np.int32)
+
+        self.emptyBlock = np.zeros((exemplarLimit, 128), exemplarType)
+        self.emptyBlock.flags.writeable = False
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, rowIndexes):
+        # Blocks of these rows (every one of them has to have a slot)
+
+        return self.blocks[self.slotOfRow[rowIndexes]]
+
+    def Slots(self, rowIndexes):
+        # Slot of each row (-1 = none)
+
+        rowIndexes = np.asarray(rowIndexes, np.int64)
+        slots = np.full(rowIndexes.shape, -1, np.int32)
+
+        inTable = rowIndexes < len(self.slotOfRow)
+        slots[inTable] = self.slotOfRow[rowIndexes[inTable]]
+
+        return slots
+
+    def Exemplars(self, rowIndex):
+        # One row's block (exemplarLimit x 128, read-only)
+
+        slot = int(self.Slots(rowIndex))
+        if slot < 0:
+            return self.emptyBlock
+
+        block = self.blocks[slot].view()
+        block.flags.writeable = False
+
+        return block
+
+    def Reserve(self, slotCount, rowCount):
+        # Makes sure there's room for slotCount slots and rows up to rowCount (doubling, like DatabaseStore)
+
+        capacity = len(self.rows)
+        if slotCount > capacity:
+
+            while capacity < slotCount:
+                capacity *= 2
+
+            newRows = np.zeros(capacity, np.uint32)
+            newRows[:self.count] = self.rows[:self.count]
+            newBlocks = np.zeros(
+                (capacity, self.exemplarLimit, 128), self.exemplarType)
+            newBlocks[:self.count] = self.blocks[:self.count]
+
+            # Blocks first - a reader that sees the new rows finds their blocks there
+            self.blocks = newBlocks
+            self.rows = newRows
+
+        capacity = len(self.slotOfRow)
+        if rowCount > capacity:
+
+            while capacity < rowCount:
+                capacity *= 2
+
+            newSlotOfRow = np.full(capacity, -1, np.int32)
+            newSlotOfRow[:len(self.slotOfRow)] = self.slotOfRow
+            self.slotOfRow = newSlotOfRow
+
+    def SetExemplar(self, rowIndex, position, encoding):
+        # Writes exemplar number position of a row, giving the row a slot the first time
+
+        # Returns:  void
+
+        slot = int(self.Slots(rowIndex))
+
+        if slot < 0:
+            self.Reserve(self.count + 1, rowIndex + 1)
+
+            slot = self.count
+            self.rows[slot] = rowIndex
+            self.blocks[slot] = 0
+            self.slotOfRow[rowIndex] = slot
+
+            self.count += 1
+
+        self.blocks[slot, position] = encoding
+
+    def Adopt(self, rowIndexes, blocks, rowCount=None):
+        # Loads an empty table
+
+        # Inputs:   rowIndexes, blocks (Arrays() as saved - blocks saved with a different exemplarLimit
+        #               are cut off or zero padded)
+        #           rowCount (rows in the database - slots for rows past it are dropped, None = keep them all)
+
+        # Returns:  void
+
+        rowIndexes = np.asarray(rowIndexes, np.int64)
+        blocks = np.asarray(blocks)
+
+        keptSlots = np.ones(len(rowIndexes), bool)
+        if rowCount is not None:
+            keptSlots = rowIndexes < rowCount
+
+        rowIndexes = rowIndexes[keptSlots]
+        overlap = min(blocks.shape[1], self.exemplarLimit)
+
+        self.Reserve(len(rowIndexes), int(rowIndexes.max()) +
+                     1 if len(rowIndexes) > 0 else 0)
+
+        self.rows[:len(rowIndexes)] = rowIndexes
+        self.blocks[:len(rowIndexes)] = 0
+        self.blocks[:len(rowIndexes), :overlap] = blocks[keptSlots, :overlap]
+        self.slotOfRow[rowIndexes] = np.arange(len(rowIndexes))
+
+        self.count = len(rowIndexes)
+
+    def Arrays(self):
+        # Copies of the filled slots for saving
+
+        # Returns:  rowIndexes (database row of each slot)
+        #           blocks (slots x exemplarLimit x 128)
+
+        return self.rows[:self.count].copy(), self.blocks[:self.count].copy()
+
+    def Snapshot(self):
+        # Arrays() without the copies - the filled slots of the current buffers
+        #   (slots are only ever added past them, a block changed in place afterwards is journaled)
+
+        return self.rows[:self.count], self.blocks[:self.count]
@@ -0,0 +1,522 @@
+# Face detection and encoding for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# DetectFaces is the expensive half of ProcessFrame: shrink the frame, find faces, encode them
+#   face boxes come back in full frame pixels, whatever scale the search ran at
+# DetectionPlanner picks each detection's scale and search regions (adaptiveDetection):
+#   the scale follows the size of the faces being seen and the detection time budget,
+#   the search covers padded regions around last frame's faces, with a full frame sweep every few detections
+# DetectionPool runs DetectFaces on several worker processes at once
+#   frames travel to the workers through shared memory (no pickling of pixels)
+#   results come back in the same order the frames went in
+# Per-worker throughput is counted so the pool size can be tuned
+
+
+import multiprocessing  # worker processes, task / result queues
+import time  # worker busy time, pool wall-clock time
+from multiprocessing import shared_memory  # frame hand-off to workers
+from collections import deque  # free shared memory slots
+import cv2  # frame resizing
+import numpy as np  # array library
+from FrameBuffers import FrameBuffer  # scratch image reused every frame
+
+
+# face_recognition loads dlib's detection and encoding models when it's imported (a few seconds)
+#   - LoadModels imports it on first use, so startup can do it while the camera is already showing frames
+face_recognition = None
+
+
+def LoadModels():
+    # Imports face_recognition (loads the models) the first time it's called
+
+    # Returns:  the face_recognition module
+
+    global face_recognition
+
+    if face_recognition is None:
+        import face_recognition
+
+    return face_recognition
+
+
+def WarmModels():
+    # Loads the models and runs the face detector once (its first call is slower than the rest)
+
+    LoadModels().face_locations(np.zeros((64, 64, 3), np.uint8))
+
+
+def DetectFaces(inputFrame, stageTimes=None, detectionScale=0.5, searchRegions=None, frameBuffer=None):
+    # Finds and encodes every face in inputFrame
+
+    # Inputs:   inputFrame (the cv2 webcam capture, BGR)
+    #           stageTimes (dict filled with 'resize' / 'detection' / 'encoding' seconds - None = don't time)
+    #           detectionScale (how much each searched region is shrunk before the search, 0.5 = 1/2 size)
+    #           searchRegions (list of (top, right, bottom, left) full frame boxes to search - None = whole frame)
+    #           frameBuffer (FrameBuffers.FrameBuffer the shrunk RGB region is built in - None = new arrays every call)
+
+    # Process:  for each search region
+    #               crop it out, resize to detectionScale, convert BGR to RGB
+    #                   (in place on frameBuffer, if there is one - no allocation, no copy inside face_recognition)
+    #               find face locations (high cost function!)
+    #               encode the face at each location
+    #               move the locations back to full frame pixels
+
+    # Returns:  faceLocations (list of (top, right, bottom, left) in full frame coordinates)
+    #           faceEncodings (list of (128) face encodings, one per location)
+
+    LoadModels()
+
+    frameHeight, frameWidth = inputFrame.shape[:2]
+
+    if searchRegions is None:
+        searchRegions = [(0, frameWidth, frameHeight, 0)]
+
+    faceLocations = []
+    faceEncodings = []
+    resizeSeconds = detectionSeconds = encodingSeconds = 0.0
+
+    for regionTop, regionRight, regionBottom, regionLeft in searchRegions:
+
+        startTime = time.perf_counter()
+
+        regionFrame = inputFrame[regionTop:regionBottom, regionLeft:regionRight]
+
+        if frameBuffer is None:
+
+            # Resize the region for faster face recognition processing
+            smallFrame = cv2.resize(
+                regionFrame, (0, 0), fx=detectionScale, fy=detectionScale)
+
+            # Convert the image from BGR color (which OpenCV uses) to RGB color (which face_recognition uses)
+            rgbSmallFrame = smallFrame[:, :, ::-1]
+
+        else:
+
+            # The size cv2.resize works out from fx / fy, so it resizes straight into the buffer
+            smallShape = (round(regionFrame.shape[0] * detectionScale),
+                          round(regionFrame.shape[1] * detectionScale), 3)
+
+            rgbSmallFrame = cv2.resize(regionFrame, (0, 0), dst=frameBuffer.View(smallShape),
+                                       fx=detectionScale, fy=detectionScale)
+            cv2.cvtColor(rgbSmallFrame, cv2.COLOR_BGR2RGB, dst=rgbSmallFrame)
+
+        resizeTime = time.perf_counter()
+
+        # Check rgbSmallFrame for faces (high cost function!)
+        regionLocations = face_recognition.face_locations(
+            rgbSmallFrame)
+
+        detectionTime = time.perf_counter()
+
+        # Get face encodings at each regionLocations' x/y cord
+        if len(regionLocations) > 0:
+            faceEncodings.extend(face_recognition.face_encodings(
+                rgbSmallFrame, regionLocations))
+
+        resizeSeconds += resizeTime - startTime
+        detectionSeconds += detectionTime - resizeTime
+        encodingSeconds += time.perf_counter() - detectionTime
+
+        # Scale back up, offset by where the region sits in the frame
+        for top, right, bottom, left in regionLocations:
+            faceLocations.append((min(regionTop + int(top / detectionScale), frameHeight - 1),
+                                  min(regionLeft + int(right / detectionScale), frameWidth - 1),
+                                  min(regionTop + int(bottom / detectionScale), frameHeight - 1),
+                                  min(regionLeft + int(left / detectionScale), frameWidth - 1)))
+
+    if stageTimes is not None:
+        stageTimes['resize'] = resizeSeconds
+        stageTimes['detection'] = detectionSeconds
+        stageTimes['encoding'] = encodingSeconds
+
+    return faceLocations, faceEncodings
+
+
+def SearchRegions(faceLocations, frameShape, regionPadding=1.0, maximumCoverage=0.6):
+    # Padded boxes around faceLocations for DetectFaces to search
+
+    # Inputs:   faceLocations (top, right, bottom, left full frame boxes - usually last frame's 'FaceLocation')
+    #           frameShape (inputFrame.shape)
+    #           regionPadding (margin on every side, as a fraction of the face box - how far a face can move)
+    #           maximumCoverage (fraction of the frame above which searching the whole frame is simpler)
+
+    # Process:  pad every box, keep it inside the frame
+    #           merge regions that overlap (a face inside two regions would be found and encoded twice)
+
+    # Returns:  searchRegions (list of (top, right, bottom, left), None = search the whole frame)
+
+    frameHeight, frameWidth = frameShape[:2]
+
+    searchRegions = []
+    for top, right, bottom, left in np.asarray(faceLocations, np.int64).reshape(-1, 4).tolist():
+        padding = int(regionPadding * max(bottom - top, right - left))
+        searchRegions.append((max(top - padding, 0), min(right + padding, frameWidth),
+                              min(bottom + padding, frameHeight), max(left - padding, 0)))
+
+    if len(searchRegions) == 0:
+        return None
+
+    # Keep merging until no two regions overlap
+    mergedAny = True
+    while mergedAny:
+        mergedAny = False
+
+        for first in range(len(searchRegions)):
+            for second in range(first + 1, len(searchRegions)):
+
+                firstTop, firstRight, firstBottom, firstLeft = searchRegions[first]
+                secondTop, secondRight, secondBottom, secondLeft = searchRegions[second]
+
+                if firstTop < secondBottom and secondTop < firstBottom and firstLeft < secondRight and secondLeft < firstRight:
+                    searchRegions[first] = (min(firstTop, secondTop), max(firstRight, secondRight),
+                                            max(firstBottom, secondBottom), min(firstLeft, secondLeft))
+                    del searchRegions[second]
+                    mergedAny = True
+                    break
+
+            if mergedAny:
+                break
+
+    coveredPixels = sum((bottom - top) * (right - left)
+                        for top, right, bottom, left in searchRegions)
+    if coveredPixels > maximumCoverage * frameHeight * frameWidth:
+        return None
+
+    return searchRegions
+
+
+class DetectionPlanner:
+    # Picks the scale and search regions for one source's next detection
+
+    # Inputs:   adaptive (False = always the whole frame at defaultScale, like before)
+    #           defaultScale (fixed scale, and where adaptive mode starts out)
+    #           detectionTimeBudget (seconds a detection should take - full frame sweeps are scaled to fit)
+    #           minimumFacePixels (face height, in the shrunk image, the smallest face seen should keep)
+    #           fullSweepInterval (every Nth detection searches the whole frame - finds people who just walked in)
+    #           regionPadding (see SearchRegions)
+    #           minimumScale, maximumScale (limits on the scale picked)
+
+    # Process:  Plan returns (detectionScale, searchRegions) for the next detection:
+    #               whole frame when there's no face to search around, or a full sweep is due
+    #               otherwise padded regions around last frame's faces
+    #               scale = the smaller of budgetScale and faceScale
+    #           Observe learns from a finished detection:
+    #               faceScale - big enough to keep the smallest face found at minimumFacePixels tall
+    #                   (no faces found = no limit, the budget decides)
+    #               budgetScale - from full sweeps only, search time grows with the pixels searched (scale squared)
+    #                   so the scale that would have hit detectionTimeBudget is scale * sqrt(budget / seconds)
+
+    def __init__(self, adaptive=False, defaultScale=0.5, detectionTimeBudget=0.1, minimumFacePixels=64,
+                 fullSweepInterval=10, regionPadding=1.0, minimumScale=0.125, maximumScale=1.0):
+
+        self.adaptive = adaptive
+        self.defaultScale = defaultScale
+        self.detectionTimeBudget = detectionTimeBudget
+        self.minimumFacePixels = minimumFacePixels
+        self.fullSweepInterval = fullSweepInterval
+        self.regionPadding = regionPadding
+        self.minimumScale = minimumScale
+        self.maximumScale = maximumScale
+
+        self.budgetScale = defaultScale
+        self.faceScale = maximumScale
+        self.detectionsSinceSweep = 0
+
+        # Counters for Report
+        self.fullSweeps = 0
+        self.regionSearches = 0
+
+    def Plan(self, frameShape, lastFrameArray):
+        # Inputs:   frameShape (inputFrame.shape)
+        #           lastFrameArray (this source's last liveArray)
+
+        # Returns:  detectionScale
+        #           searchRegions (None = whole frame)
+
+        if not self.adaptive:
+            return self.defaultScale, None
+
+        detectionScale = float(
+            np.clip(min(self.budgetScale, self.faceScale), self.minimumScale, self.maximumScale))
+
+        searchRegions = None
+        if self.detectionsSinceSweep + 1 < self.fullSweepInterval:
+            searchRegions = SearchRegions(
+                lastFrameArray['FaceLocation'], frameShape, self.regionPadding)
+
+        return detectionScale, searchRegions
+
+    def Observe(self, detectionScale, searchRegions, detectionSeconds, faceLocations):
+        # Inputs:   detectionScale, searchRegions (what Plan returned for this detection)
+        #           detectionSeconds (how long it took)
+        #           faceLocations (what it found, full frame coordinates)
+
+        if not self.adaptive:
+            return
+
+        if searchRegions is None:
+            self.detectionsSinceSweep = 0
+            self.fullSweeps += 1
+
+            if detectionSeconds > 0:
+                fittedScale = detectionScale * \
+                    np.sqrt(self.detectionTimeBudget / detectionSeconds)
+
+                # Move half way there - one slow frame shouldn't halve the resolution
+                self.budgetScale = float(np.clip((self.budgetScale + fittedScale) / 2,
+                                                 self.minimumScale, self.maximumScale))
+
+        else:
+            self.detectionsSinceSweep += 1
+            self.regionSearches += 1
+
+        faceHeights = [bottom - top for top, right,
+                       bottom, left in faceLocations if bottom > top]
+
+        if len(faceHeights) > 0:
+            self.faceScale = float(np.clip(self.minimumFacePixels / min(faceHeights),
+                                           self.minimumScale, self.maximumScale))
+        elif searchRegions is None:
+            self.faceScale = self.maximumScale
+
+    def Report(self):
+        # One line summary
+
+        if not self.adaptive:
+            return 'Detection scale: {0:0.3f} (fixed)'.format(self.defaultScale)
+
+        return 'Detection scale: budget {0:0.3f}  faces {1:0.3f}  full sweeps: {2}  region searches: {3}'.format(
+            self.budgetScale, self.faceScale, self.fullSweeps, self.regionSearches)
+
+
+def DetectionWorker(workerId, taskQueue, resultQueue, reuseFrameBuffers=True):
+    # Runs in each worker process until it's handed None
+
+    # Inputs:   workerId (position in the pool, used for throughput reporting)
+    #           taskQueue (sequence, slotIndex, memoryName, frameShape, frameType, detectionScale, searchRegions) per frame
+    #           resultQueue (where finished frames go)
+    #           reuseFrameBuffers (shrink every frame into the same scratch image - see FrameBuffers.py)
+
+    # Process:  load the face_recognition models
+    #           attach to the frame's shared memory block (once per block)
+    #           wrap it in a numpy array without copying, run DetectFaces
+    #           send back the locations, encodings, how long the work took and DetectFaces' stage times
+
+    attachedMemory = {}
+
+    # Scratch image every frame this worker handles is shrunk into
+    frameBuffer = FrameBuffer() if reuseFrameBuffers else None
+
+    # Load the models before the first frame arrives (pool start overlaps the rest of startup)
+    LoadModels()
+
+    while True:
+
+        task = taskQueue.get()
+
+        if task is None:
+            break
+
+        sequence, slotIndex, memoryName, frameShape, frameType, detectionScale, searchRegions = task
+
+        if memoryName not in attachedMemory:
+
+            # Slots only get a new block when a bigger frame shows up - let go of blocks that were replaced
+            if len(attachedMemory) >= 64:
+                for memoryBlock in attachedMemory.values():
+                    memoryBlock.close()
+                attachedMemory = {}
+
+            attachedMemory[memoryName] = shared_memory.SharedMemory(
+                name=memoryName)
+
+        inputFrame = np.ndarray(
+            frameShape, frameType, buffer=attachedMemory[memoryName].buf)
+
+        startTime = time.perf_counter()
+
+        stageTimes = {}
+        faceLocations, faceEncodings = DetectFaces(
+            inputFrame, stageTimes, detectionScale, searchRegions, frameBuffer)
+
+        resultQueue.put((sequence, slotIndex, workerId, faceLocations,
+                         np.array(faceEncodings, np.float64).reshape(-1, 128), time.perf_counter() - startTime, stageTimes))
+
+        # Drop the numpy view before the memory block could be closed
+        del inputFrame
+
+    for memoryBlock in attachedMemory.values():
+        memoryBlock.close()
+
+
+class DetectionPool:
+    # Pool of DetectionWorker processes fed through shared memory slots
+
+    # Inputs:   workerCount (worker processes to start)
+    #           slotCount (frames that can be in flight at once, default two per worker)
+    #           reuseFrameBuffers (each worker shrinks every frame into the same scratch image)
+
+    # Process:  Submit copies a frame into a free slot and queues it for the next idle worker
+    #           NextResult waits for the oldest submitted frame's result
+    #               (workers finish out of order - results are held until their turn comes)
+    #           a slot is reused as soon as its frame's result comes back
+    #           Stop shuts the workers down and frees the shared memory
+    #           Report lists frames and frames/s for each worker
+
+    def __init__(self, workerCount, slotCount=0, reuseFrameBuffers=True):
+
+        self.workerCount = max(1, workerCount)
+        self.slotCount = slotCount if slotCount > 0 else 2 * self.workerCount
+
+        # 'spawn' workers start clean - no half-copied capture thread or dlib state from this process
+        context = multiprocessing.get_context('spawn')
+
+        self.taskQueue = context.Queue()
+        self.resultQueue = context.Queue()
+
+        self.workers = []
+        for workerId in range(self.workerCount):
+            worker = context.Process(target=DetectionWorker, args=(
+                workerId, self.taskQueue, self.resultQueue, reuseFrameBuffers), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+        # Shared memory block per slot, created (or grown) when a frame needs it
+        self.slotMemory = [None] * self.slotCount
+        self.freeSlots = deque(range(self.slotCount))
+
+        # Caller's payload (usually the frame itself) for each frame in flight
+        self.slotPayloads = [None] * self.slotCount
+
+        # Sequence numbers hand out in Submit order, results go back out in the same order
+        self.nextSubmitSequence = 0
+        self.nextResultSequence = 0
+        self.finishedResults = {}
+
+        # Worker seconds (and DetectFaces' stage times) spent on the frame NextResult returned last
+        self.lastBusySeconds = 0.0
+        self.lastStageTimes = {}
+
+        # Throughput counters
+        self.workerFrames = [0] * self.workerCount
+        self.workerBusySeconds = [0.0] * self.workerCount
+        self.startTime = time.perf_counter()
+
+    def Pending(self):
+        # Frames submitted but not handed back by NextResult yet
+
+        return self.nextSubmitSequence - self.nextResultSequence
+
+    def Submit(self, inputFrame, payload=None, detectionScale=0.5, searchRegions=None):
+        # Queues inputFrame for detection
+
+        # Inputs:   inputFrame (the cv2 webcam capture)
+        #           payload (anything the caller wants back with the result - e.g. the frame to draw on)
+        #           detectionScale, searchRegions (see DetectFaces)
+
+        # Process:  if every slot is busy, wait for a result to free one up
+        #           copy inputFrame into the slot's shared memory, queue the task
+
+        # Returns:  sequence (this frame's place in line)
+
+        while len(self.freeSlots) == 0:
+            self.CollectResult()
+
+        slotIndex = self.freeSlots.popleft()
+
+        # Replace the slot's memory block if this frame doesn't fit
+        if self.slotMemory[slotIndex] is None or self.slotMemory[slotIndex].size < inputFrame.nbytes:
+            self.FreeSlotMemory(slotIndex)
+            self.slotMemory[slotIndex] = shared_memory.SharedMemory(
+                create=True, size=inputFrame.nbytes)
+
+        slotFrame = np.ndarray(
+            inputFrame.shape, inputFrame.dtype, buffer=self.slotMemory[slotIndex].buf)
+        slotFrame[...] = inputFrame
+        del slotFrame
+
+        sequence = self.nextSubmitSequence
+        self.nextSubmitSequence += 1
+
+        self.slotPayloads[slotIndex] = payload
+
+        self.taskQueue.put((sequence, slotIndex, self.slotMemory[slotIndex].name,
+                            inputFrame.shape, inputFrame.dtype.str, detectionScale, searchRegions))
+
+        return sequence
+
+    def CollectResult(self):
+        # Waits for any worker to finish a frame and files the result away by sequence
+
+        sequence, slotIndex, workerId, faceLocations, faceEncodings, busySeconds, stageTimes = self.resultQueue.get()
+
+        self.finishedResults[sequence] = (
+            self.slotPayloads[slotIndex], faceLocations, list(faceEncodings), busySeconds, stageTimes)
+
+        self.slotPayloads[slotIndex] = None
+        self.freeSlots.append(slotIndex)
+
+        self.workerFrames[workerId] += 1
+        self.workerBusySeconds[workerId] += busySeconds
+
+    def NextResult(self):
+        # Hands back the oldest submitted frame's result
+
+        # Returns:  payload (whatever was passed to Submit)
+        #           faceLocations, faceEncodings (same as DetectFaces)
+        #           (the worker's time spent on it is left in lastBusySeconds, DetectFaces' stage times in lastStageTimes)
+
+        if self.Pending() == 0:
+            raise RuntimeError('NextResult called with no frames submitted')
+
+        while self.nextResultSequence not in self.finishedResults:
+            self.CollectResult()
+
+        payload, faceLocations, faceEncodings, self.lastBusySeconds, self.lastStageTimes = self.finishedResults.pop(
+            self.nextResultSequence)
+        self.nextResultSequence += 1
+
+        return payload, faceLocations, faceEncodings
+
+    def FreeSlotMemory(self, slotIndex):
+        # Releases one slot's shared memory block
+
+        if self.slotMemory[slotIndex] is not None:
+            self.slotMemory[slotIndex].close()
+            self.slotMemory[slotIndex].unlink()
+            self.slotMemory[slotIndex] = None
+
+    def Stop(self):
+        # Shuts the workers down and frees every shared memory block
+
+        for worker in self.workers:
+            self.taskQueue.put(None)
+
+        for worker in self.workers:
+            worker.join(5)
+            if worker.is_alive():
+                worker.terminate()
+
+        for slotIndex in range(self.slotCount):
+            self.FreeSlotMemory(slotIndex)
+
+    def Report(self):
+        # Throughput summary: whole pool, then each worker
+
+        # Returns:  reportLines (list of strings ready to print)
+
+        elapsed = max(time.perf_counter() - self.startTime, 1e-9)
+        totalFrames = sum(self.workerFrames)
+
+        reportLines = ['Detection workers: {0}  frames: {1}  frames/s: {2:0.2f}'.format(
+            self.workerCount, totalFrames, totalFrames / elapsed)]
+
+        for workerId in range(self.workerCount):
+
+            busySeconds = self.workerBusySeconds[workerId]
+
+            reportLines.append('    worker {0}: {1} frames  busy {2:0.1f}%  {3:0.2f} frames/s while busy'.format(
+                workerId, self.workerFrames[workerId], 100 * busySeconds / elapsed,
+                self.workerFrames[workerId] / busySeconds if busySeconds > 0 else 0.0))
+
+        return reportLines
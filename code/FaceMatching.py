@@ -0,0 +1,677 @@
+# Face encoding matcher for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Matches against databaseArray's 'FaceEncoding' column as one contiguous matrix
+# Compares every face found in a frame against every identity in one NumPy operation
+# Returns the nearest identity (and its distance) for each face, not just the first match
+# Large databases can be searched through PartitionIndex (k-means buckets) instead of every row
+# Compact databases can be searched through an int8 copy of the encodings, then re-ranked exactly
+# An identity can hold a few exemplar encodings (FaceDatabase.ExemplarTable) - 'FaceEncoding' is then their centroid:
+#   the search runs over centroids (one row per identity, however many exemplars it has),
+#   then each face's closest few identities are re-ranked by their nearest exemplar
+
+
+import numpy as np  # array library
+from EncodingStorage import QuantizeEncodings  # int8 copies of encodings
+
+
+# Same cut-off face_recognition.compare_faces uses: a distance at or below this is a match
+defaultTolerance = 0.6
+
+# Databases smaller than this are always searched exactly - a full scan is already fast
+defaultPartitionMinimumSize = 10000
+
+# How many of the closest buckets PartitionIndex searches for each face
+defaultProbeCount = 8
+
+# Candidates per face measured exactly after an int8 search (or against their exemplars)
+defaultRerankCount = 16
+
+
+def NearestCentroids(encodings, centroids, centroidCount, chunkSize=8192):
+    # Finds the centroidCount closest centroids for each encoding
+
+    # Inputs:   encodings (rows x 128)
+    #           centroids (partitions x 128)
+    #           centroidCount (how many centroids to return per row)
+    #           chunkSize (rows per distance matrix - keeps memory flat for big databases)
+
+    # Process:  for each chunk of rows, build the rows x centroids distance matrix
+    #               keep the centroidCount smallest per row
+
+    # Returns:  nearest (rows x centroidCount centroid indexes, closest first)
+
+    centroidCount = min(centroidCount, len(centroids))
+    centroidNorms = np.einsum('ij,ij->i', centroids, centroids)
+
+    nearest = np.empty((len(encodings), centroidCount), np.int64)
+
+    for chunkStart in range(0, len(encodings), chunkSize):
+
+        chunk = encodings[chunkStart:chunkStart + chunkSize]
+
+        # |a|^2 is the same for every centroid, so it can be left out of the ranking
+        squaredDistances = centroidNorms[None, :] - 2.0 * (chunk @ centroids.T)
+
+        if centroidCount == 1:
+            nearest[chunkStart:chunkStart + len(chunk), 0] = np.argmin(
+                squaredDistances, axis=1)
+
+        else:
+            closest = np.argpartition(
+                squaredDistances, centroidCount - 1, axis=1)[:, :centroidCount]
+            closestDistances = np.take_along_axis(
+                squaredDistances, closest, axis=1)
+            nearest[chunkStart:chunkStart + len(chunk)] = np.take_along_axis(
+                closest, np.argsort(closestDistances, axis=1), axis=1)
+
+    return nearest
+
+
+def TrainPartitions(encodings, partitionCount, iterations=10, seed=0):
+    # k-means over the database encodings
+
+    # Inputs:   encodings (rows x 128)
+    #           partitionCount (how many buckets to split the database into)
+    #           iterations (Lloyd iterations - a handful is plenty for bucketing)
+    #           seed (keeps bucket layout repeatable between runs)
+
+    # Process:  train on a sample of at most 64 rows per bucket, duplicate rows counted once
+    #               (no more buckets than distinct rows - a database full of duplicates gets a few full buckets,
+    #               not many empty ones sharing a centroid)
+    #           start from randomly chosen rows, then alternate assign / re-average
+    #           buckets that end up empty are re-seeded from the rows furthest from their own centroid,
+    #               a different row each
+
+    # Returns:  centroids (partitionCount x 128)
+
+    randomGenerator = np.random.default_rng(seed)
+
+    partitionCount = max(1, min(partitionCount, len(encodings)))
+
+    sampleSize = min(len(encodings), partitionCount * 64)
+    sample = np.unique(encodings[randomGenerator.choice(
+        len(encodings), sampleSize, replace=False)], axis=0)
+    sampleSize = len(sample)
+
+    partitionCount = min(partitionCount, sampleSize)
+
+    centroids = sample[randomGenerator.choice(
+        sampleSize, partitionCount, replace=False)].copy()
+
+    for iteration in range(iterations):
+
+        assignments = NearestCentroids(sample, centroids, 1)[:, 0]
+
+        # Sum and count the rows landing in each bucket
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=partitionCount)
+
+        emptyBuckets = counts == 0
+        centroids[~emptyBuckets] = sums[~emptyBuckets] / \
+            counts[~emptyBuckets, None]
+
+        if emptyBuckets.any():
+            rowDistances = np.einsum('ij,ij->i', sample - centroids[assignments],
+                                     sample - centroids[assignments])
+            furthestRows = np.argsort(rowDistances)[::-1][:int(emptyBuckets.sum())]
+            centroids[emptyBuckets] = sample[furthestRows]
+
+    return centroids
+
+
+def AddExemplar(exemplars, exemplarCount, faceEncoding, newEncoding):
+    # Adds a sighting to an identity's exemplars
+
+    # Inputs:   exemplars (exemplarLimit x 128, the identity's block in the ExemplarTable)
+    #           exemplarCount (exemplars in use - 0 = 'FaceEncoding' is still the only one)
+    #           faceEncoding (the identity's 'FaceEncoding')
+    #           newEncoding (the sighting)
+
+    # Process:  the first time, 'FaceEncoding' becomes exemplar 0
+    #           room left: newEncoding goes in the next position
+    #           full: of newEncoding and exemplars 1 onwards, drop the one closest to any other exemplar
+    #               (the most redundant - exemplar 0, the picture or first sighting the identity started from,
+    #               always stays so the identity can't drift off to someone else)
+    #               and newEncoding takes its position
+    #           centroid = mean of the exemplars
+
+    # Returns:  exemplars (new block), exemplarCount, centroid (new 'FaceEncoding')
+    #           changedPositions (exemplars that differ from the old block - all that has to be saved)
+    #           (None x 4 if newEncoding was the most redundant - nothing changes)
+
+    exemplarLimit = len(exemplars)
+
+    candidates = np.array(exemplars, np.float64)
+    changedPositions = [exemplarCount]
+    if exemplarCount == 0:
+        candidates[0] = faceEncoding
+        exemplarCount = 1
+        changedPositions = [0, 1]
+
+    candidates = np.vstack(
+        [candidates[:exemplarCount], np.asarray(newEncoding, np.float64).reshape(1, 128)])
+
+    if len(candidates) > exemplarLimit:
+
+        pairDistances = np.linalg.norm(
+            candidates[:, None, :] - candidates[None, :, :], axis=2)
+        np.fill_diagonal(pairDistances, np.inf)
+
+        nearestOther = pairDistances.min(axis=1)
+        nearestOther[0] = np.inf
+
+        # (a tie keeps the exemplars already there)
+        if nearestOther[-1] <= nearestOther.min():
+            return None, None, None, None
+
+        dropped = int(np.argmin(nearestOther))
+
+        candidates[dropped] = candidates[-1]
+        candidates = candidates[:-1]
+        changedPositions = [dropped]
+
+    newExemplars = np.zeros_like(exemplars)
+    newExemplars[:len(candidates)] = candidates
+
+    return newExemplars, len(candidates), candidates.mean(axis=0), changedPositions
+
+
+class PartitionIndex:
+    # Approximate nearest neighbour index (inverted file)
+    # Splits the database into k-means buckets; a face is only compared against the rows
+    #   in the probeCount buckets closest to it instead of against every row
+
+    # Inputs:   partitionCount (number of buckets)
+    #           probeCount (buckets searched per face - more is slower but misses fewer matches)
+
+    # Process:  Train builds the buckets from the current database
+    #           Add drops newly appended database rows into their closest bucket
+    #           Candidates returns the database rows worth comparing for a frame's faces
+
+    def __init__(self, partitionCount, probeCount=defaultProbeCount):
+
+        self.partitionCount = partitionCount
+        self.probeCount = probeCount
+
+        self.centroids = np.zeros((0, 128), np.float64)
+
+        # Database row numbers in each bucket, plus an array copy for searching
+        self.partitionRows = []
+        self.partitionArrays = []
+        self.partitionSizes = np.zeros(0, np.int64)
+
+        # How many database rows the index has seen
+        self.rowCount = 0
+
+        # Database size when the buckets were last trained
+        self.trainedSize = 0
+
+    def Train(self, encodingMatrix):
+        # Builds the buckets from scratch
+
+        # Inputs:   encodingMatrix (every database encoding, row i = databaseArray row i)
+
+        # Returns:  void
+
+        self.centroids = TrainPartitions(encodingMatrix, self.partitionCount)
+
+        self.partitionRows = [[] for centroid in self.centroids]
+        self.partitionArrays = [None for centroid in self.centroids]
+        self.partitionSizes = np.zeros(len(self.centroids), np.int64)
+        self.rowCount = 0
+
+        self.Add(encodingMatrix)
+
+        self.trainedSize = len(encodingMatrix)
+
+    def Add(self, newEncodings):
+        # Puts rows appended to the database into their closest bucket
+
+        # Inputs:   newEncodings (the new rows only, in database order)
+
+        # Returns:  void
+
+        if len(newEncodings) == 0:
+            return
+
+        assignments = NearestCentroids(newEncodings, self.centroids, 1)[:, 0]
+
+        for offset, partition in enumerate(assignments):
+            self.partitionRows[partition].append(self.rowCount + offset)
+
+            # Array copy is stale now, rebuilt the next time this bucket is searched
+            self.partitionArrays[partition] = None
+
+        self.partitionSizes += np.bincount(assignments,
+                                           minlength=len(self.centroids))
+        self.rowCount += len(newEncodings)
+
+    def Candidates(self, faceEncodings):
+        # Database rows that live in any of the buckets closest to any face in the frame
+
+        # Inputs:   faceEncodings (faces x 128)
+
+        # Process:  only buckets holding rows are probed - a face far from everything
+        #               still gets the probeCount closest buckets that have something in them
+
+        # Returns:  candidateRows (sorted, unique database row numbers - empty only if the index is)
+
+        filledPartitions = np.flatnonzero(self.partitionSizes)
+
+        if len(filledPartitions) == 0:
+            return np.zeros(0, np.int64)
+
+        probedPartitions = filledPartitions[np.unique(NearestCentroids(
+            faceEncodings, self.centroids[filledPartitions], self.probeCount))]
+
+        rowArrays = []
+
+        for partition in probedPartitions:
+
+            if self.partitionArrays[partition] is None:
+                self.partitionArrays[partition] = np.array(
+                    self.partitionRows[partition], np.int64)
+
+            rowArrays.append(self.partitionArrays[partition])
+
+        # Buckets never share rows, so sorting is enough to keep the candidates unique
+        return np.sort(np.concatenate(rowArrays))
+
+
+class EncodingMatcher:
+    # Works on the database encodings as a contiguous (identities x 128) matrix
+    #   plus the squared length of each row, so the distance from every face in a frame
+    #   to every identity is a single matrix multiply
+    # Once the database passes partitionMinimumSize a PartitionIndex narrows down
+    #   which rows get compared
+    # With quantize on, the search runs over an int8 copy of the encodings and only each face's
+    #   rerankCount closest candidates are measured exactly against the (float, possibly memory-mapped) encodings
+    # With exemplars, the encodings are centroids - each face's rerankCount closest identities are
+    #   measured against their exemplars, and the nearest exemplar is the identity's distance
+
+    # Inputs:   tolerance (largest euclidean distance that still counts as a match)
+    #           partitionMinimumSize (database size where the PartitionIndex kicks in, 0 = never)
+    #           partitionCount (PartitionIndex buckets, 0 = pick from database size)
+    #           probeCount (PartitionIndex buckets searched per face)
+    #           quantize (search the int8 copy, re-rank with the float encodings)
+    #           rerankCount (candidates per face measured exactly when quantize is on / against their exemplars)
+
+    # Process:  LoadIndex takes squared lengths / int8 codes saved with the database (skips reading every encoding)
+    #           Sync picks up new database rows (and adds them to the index), and the exemplars
+    #           Refresh redoes rows whose 'FaceEncoding' changed (a new exemplar moved the centroid)
+    #           Match builds the faces x identities distance matrix and picks the nearest identity per face
+
+    def __init__(self, tolerance=defaultTolerance, partitionMinimumSize=defaultPartitionMinimumSize,
+                 partitionCount=0, probeCount=defaultProbeCount, quantize=False, rerankCount=defaultRerankCount):
+
+        self.tolerance = tolerance
+        self.partitionMinimumSize = partitionMinimumSize
+        self.partitionCount = partitionCount
+        self.probeCount = probeCount
+        self.quantize = quantize
+        self.rerankCount = rerankCount
+
+        # Row i of encodingMatrix is row i of databaseArray ('Key' = i + 1)
+        self.encodingMatrix = np.zeros((0, 128), np.float64)
+
+        # Rows whose squared length (and int8 code) have been worked out
+        self.rowCount = 0
+
+        # Per row: |row|^2, int8 code and its scale - the filled parts of buffers that grow by doubling
+        self.squaredNormBuffer = np.zeros(0, np.float64)
+        self.codeBuffer = np.zeros((0, 128), np.int8)
+        self.scaleBuffer = np.zeros(0, np.float32)
+        self.SetViews()
+
+        # Stays None (exact search) until the database is big enough
+        self.partitionIndex = None
+
+        # databaseArray.exemplars / ['ExemplarCount'] (None = one encoding per identity)
+        self.exemplarMatrix = None
+        self.exemplarCounts = None
+
+    def __len__(self):
+        return len(self.encodingMatrix)
+
+    def SetViews(self):
+        # Points squaredNorms / codes / scales at the filled part of their buffers
+
+        self.squaredNorms = self.squaredNormBuffer[:self.rowCount]
+        self.codes = self.codeBuffer[:self.rowCount]
+        self.scales = self.scaleBuffer[:self.rowCount]
+
+    def Reserve(self, rowCount):
+        # Grows the per-row buffers by doubling, same as DatabaseStore's columns
+
+        if rowCount <= len(self.squaredNormBuffer):
+            return
+
+        newCapacity = max(64, 2 * len(self.squaredNormBuffer), rowCount)
+
+        newNorms = np.zeros(newCapacity, np.float64)
+        newNorms[:self.rowCount] = self.squaredNorms
+        self.squaredNormBuffer = newNorms
+
+        # int8 codes are only kept when they're searched
+        if self.quantize:
+            newCodes = np.zeros((newCapacity, 128), np.int8)
+            newCodes[:self.rowCount] = self.codes
+            self.codeBuffer = newCodes
+
+            newScales = np.ones(newCapacity, np.float32)
+            newScales[:self.rowCount] = self.scales
+            self.scaleBuffer = newScales
+
+        self.SetViews()
+
+    def LoadIndex(self, indexArray):
+        # Takes the per-row values EncodingStorage saved with the database
+
+        # Inputs:   indexArray (EncodingStorage.indexStructure rows, one per database row)
+
+        # Process:  copy squared lengths (and int8 codes) so Sync doesn't have to read every encoding
+
+        # Returns:  void
+
+        self.rowCount = 0
+        self.Reserve(len(indexArray))
+
+        self.squaredNormBuffer[:len(indexArray)] = indexArray['SquaredNorm']
+
+        if self.quantize:
+            self.codeBuffer[:len(indexArray)] = indexArray['Code']
+            self.scaleBuffer[:len(indexArray)] = indexArray['Scale']
+
+        self.rowCount = len(indexArray)
+        self.SetViews()
+
+        self.partitionIndex = None
+
+    def Sync(self, databaseEncodings, databaseExemplars=None, exemplarCounts=None):
+        # Brings encodingMatrix up to date with databaseArray['FaceEncoding']
+
+        # Inputs:   databaseEncodings (databaseArray['FaceEncoding'])
+        #           databaseExemplars, exemplarCounts (databaseArray.exemplars / ['ExemplarCount'],
+        #               None = match against 'FaceEncoding' alone - databaseExemplars[rows] gives those rows'
+        #               exemplarLimit x 128 blocks, an ExemplarTable or a rows x exemplarLimit x 128 array)
+
+        # Process:  databaseArray only ever grows at the end, so only the new rows need their squared length
+        #           DatabaseStore hands out a contiguous float64 / float32 view (maybe memory-mapped) - it's used as-is, no copy
+        #               (anything else, like a structured array column, gets copied into contiguous memory)
+        #           if databaseArray got shorter it was replaced - rebuild from scratch
+        #           new rows are added to the PartitionIndex's buckets as they arrive,
+        #               the buckets are retrained whenever the database doubles in size
+        #           ('Name' changes from PromoteUnknown don't touch the encodings - nothing to do)
+        #           the exemplars are kept as-is (read only at re-rank time)
+
+        # Returns:  void
+
+        self.exemplarMatrix = databaseExemplars
+        self.exemplarCounts = exemplarCounts
+
+        if len(databaseEncodings) < self.rowCount:
+            self.rowCount = 0
+            self.SetViews()
+            self.partitionIndex = None
+
+        encodingType = databaseEncodings.dtype if databaseEncodings.dtype in (
+            np.float32, np.float64) else np.float64
+
+        self.encodingMatrix = np.ascontiguousarray(
+            databaseEncodings, encodingType).reshape(-1, 128)
+
+        previousCount = self.rowCount
+        newEncodings = self.encodingMatrix[previousCount:]
+
+        if len(newEncodings) > 0:
+
+            self.Reserve(len(self.encodingMatrix))
+
+            newEncodings64 = newEncodings.astype(np.float64)
+            self.squaredNormBuffer[previousCount:len(self.encodingMatrix)] = np.einsum(
+                'ij,ij->i', newEncodings64, newEncodings64)
+
+            if self.quantize:
+                self.codeBuffer[previousCount:len(self.encodingMatrix)], self.scaleBuffer[previousCount:len(self.encodingMatrix)] = \
+                    QuantizeEncodings(newEncodings)
+
+            self.rowCount = len(self.encodingMatrix)
+            self.SetViews()
+
+        self.SyncPartitionIndex(newEncodings)
+
+    def Refresh(self, rows):
+        # Redoes the squared length (and int8 code) of rows whose 'FaceEncoding' was changed in place
+
+        # Inputs:   rows (database rows - encodingMatrix already holds their new values)
+
+        # Process:  a refreshed row stays in its PartitionIndex bucket until the next retrain
+        #               (a centroid only moves a little when an exemplar is added)
+
+        # Returns:  void
+
+        rows = np.asarray(rows, np.int64)
+        rows = rows[rows < self.rowCount]
+
+        if len(rows) == 0:
+            return
+
+        refreshedEncodings = self.encodingMatrix[rows].astype(np.float64)
+        self.squaredNorms[rows] = np.einsum(
+            'ij,ij->i', refreshedEncodings, refreshedEncodings)
+
+        if self.quantize:
+            self.codes[rows], self.scales[rows] = QuantizeEncodings(
+                refreshedEncodings)
+
+    def SyncPartitionIndex(self, newEncodings):
+        # Builds, grows or retrains the PartitionIndex after encodingMatrix changed
+
+        # Inputs:   newEncodings (rows just appended to encodingMatrix)
+
+        # Returns:  void
+
+        if self.partitionMinimumSize <= 0 or len(self.encodingMatrix) < self.partitionMinimumSize:
+            return
+
+        if self.partitionIndex is None or len(self.encodingMatrix) >= 2 * self.partitionIndex.trainedSize:
+
+            # Roughly 4 * sqrt(identities) buckets keeps bucket size and bucket count balanced
+            partitionCount = self.partitionCount
+            if partitionCount <= 0:
+                partitionCount = int(4 * np.sqrt(len(self.encodingMatrix)))
+
+            self.partitionIndex = PartitionIndex(
+                partitionCount, self.probeCount)
+            self.partitionIndex.Train(self.encodingMatrix)
+
+        elif len(newEncodings) > 0:
+            self.partitionIndex.Add(newEncodings)
+
+    def Distances(self, faceEncodings, rows=None):
+        # Euclidean distance from each face encoding to each database encoding
+
+        # Inputs:   faceEncodings (faces x 128)
+        #           rows (only measure against these database rows, None = all of them)
+
+        # Process:  |a - b|^2 = |a|^2 + |b|^2 - 2 a.b for all pairs at once
+
+        # Returns:  distanceMatrix (faces x identities, or faces x rows)
+
+        faceEncodings = np.asarray(faceEncodings, np.float64).reshape(-1, 128)
+
+        encodingMatrix = self.encodingMatrix
+        squaredNorms = self.squaredNorms
+
+        if rows is not None:
+            encodingMatrix = encodingMatrix[rows]
+            squaredNorms = squaredNorms[rows]
+
+        squaredDistances = np.einsum('ij,ij->i', faceEncodings, faceEncodings)[:, None] \
+            + squaredNorms[None, :] \
+            - 2.0 * (faceEncodings.astype(encodingMatrix.dtype) @ encodingMatrix.T)
+
+        # Rounding can push identical encodings slightly below zero
+        np.maximum(squaredDistances, 0.0, out=squaredDistances)
+
+        return np.sqrt(squaredDistances)
+
+    def CoarseDistances(self, faceEncodings, rows=None, chunkSize=65536):
+        # Approximate squared distances from the int8 codes (only good for ranking)
+
+        # Inputs:   faceEncodings (faces x 128)
+        #           rows (only measure against these database rows, None = all of them)
+        #           chunkSize (codes widened to float32 this many rows at a time)
+
+        # Returns:  squaredDistances (faces x identities, or faces x rows)
+
+        faceEncodings = np.asarray(faceEncodings, np.float32).reshape(-1, 128)
+
+        codes = self.codes
+        scales = self.scales
+        squaredNorms = self.squaredNorms
+
+        if rows is not None:
+            codes = codes[rows]
+            scales = scales[rows]
+            squaredNorms = squaredNorms[rows]
+
+        dotProducts = np.empty((len(faceEncodings), len(codes)), np.float32)
+
+        for chunkStart in range(0, len(codes), chunkSize):
+            chunkEnd = chunkStart + chunkSize
+            dotProducts[:, chunkStart:chunkEnd] = (faceEncodings @ codes[chunkStart:chunkEnd].astype(np.float32).T) \
+                * scales[None, chunkStart:chunkEnd]
+
+        return np.einsum('ij,ij->i', faceEncodings, faceEncodings)[:, None] + squaredNorms[None, :] - 2.0 * dotProducts
+
+    def ExemplarDistances(self, faceEncodings, shortlist, shortlistDistances):
+        # Distance from each face to the nearest exemplar of each identity on its shortlist
+
+        # Inputs:   faceEncodings (faces x 128)
+        #           shortlist (faces x candidates, database rows)
+        #           shortlistDistances (faces x candidates, exact distances to 'FaceEncoding')
+
+        # Process:  identities with exemplars: the closest of their exemplarCount exemplars
+        #           identities without: 'FaceEncoding' is their only encoding - shortlistDistances as-is
+
+        # Returns:  exemplarDistances (faces x candidates)
+
+        exemplarDistances = shortlistDistances.copy()
+
+        shortlistCounts = self.exemplarCounts[shortlist]
+        faceIndexes, positions = np.nonzero(shortlistCounts > 0)
+
+        if len(faceIndexes) == 0:
+            return exemplarDistances
+
+        exemplarRows = shortlist[faceIndexes, positions]
+
+        # (pairs x exemplarLimit x 128) - only the shortlisted identities' exemplars are read
+        exemplars = np.asarray(self.exemplarMatrix[exemplarRows], np.float64)
+        distances = np.sqrt(
+            ((exemplars - faceEncodings[faceIndexes][:, None, :]) ** 2).sum(axis=2))
+
+        # Slots past exemplarCount are empty
+        distances[np.arange(exemplars.shape[1])[None, :] >=
+                  shortlistCounts[faceIndexes, positions][:, None]] = np.inf
+
+        exemplarDistances[faceIndexes, positions] = distances.min(axis=1)
+
+        return exemplarDistances
+
+    def Match(self, faceEncodings):
+        # Finds the nearest database identity for every face in a frame
+
+        # Inputs:   faceEncodings (faces x 128)
+
+        # Process:  narrow the search down to the PartitionIndex's candidate rows (big databases only)
+        #           quantize off: build the distance matrix, take each face's closest row
+        #           quantize on:  rank by the int8 codes, measure each face's rerankCount best exactly,
+        #                             take the closest of those
+        #           exemplars:    each face's rerankCount closest centroids (by either of the above)
+        #                             are measured by their nearest exemplar, take the closest of those
+        #           throw away anything further away than tolerance
+
+        # Returns:  matchIndexes (databaseArray row per face, -1 if nothing is close enough)
+        #           matchDistances (distance to that row, inf if the database is empty)
+
+        faceEncodings = np.asarray(faceEncodings, np.float64).reshape(-1, 128)
+
+        matchIndexes = np.full(len(faceEncodings), -1, np.int64)
+        matchDistances = np.full(len(faceEncodings), np.inf, np.float64)
+
+        if len(faceEncodings) == 0 or len(self.encodingMatrix) == 0:
+            return matchIndexes, matchDistances
+
+        candidateRows = None
+        if self.partitionIndex is not None:
+            candidateRows = self.partitionIndex.Candidates(faceEncodings)
+
+            # Nothing in the index yet - fall back to the full scan
+            if len(candidateRows) == 0:
+                candidateRows = None
+
+        faceRange = np.arange(len(faceEncodings))
+
+        if self.quantize:
+
+            coarseDistances = self.CoarseDistances(
+                faceEncodings, candidateRows)
+
+            # Each face's shortlist of the closest rows by int8 code
+            shortlistSize = min(self.rerankCount, coarseDistances.shape[1])
+            shortlist = np.argpartition(
+                coarseDistances, shortlistSize - 1, axis=1)[:, :shortlistSize]
+
+            if candidateRows is not None:
+                shortlist = candidateRows[shortlist]
+
+            # Exact distance from each face to its own shortlist (faces x shortlistSize)
+            shortlistEncodings = self.encodingMatrix[shortlist.ravel()].astype(np.float64).reshape(
+                len(faceEncodings), shortlistSize, 128)
+            shortlistDistances = np.sqrt(
+                ((shortlistEncodings - faceEncodings[:, None, :]) ** 2).sum(axis=2))
+
+        elif self.exemplarCounts is not None:
+
+            distanceMatrix = self.Distances(faceEncodings, candidateRows)
+
+            # Each face's shortlist of the closest centroids
+            shortlistSize = min(self.rerankCount, distanceMatrix.shape[1])
+            shortlistPositions = np.argpartition(
+                distanceMatrix, shortlistSize - 1, axis=1)[:, :shortlistSize]
+            shortlistDistances = np.take_along_axis(
+                distanceMatrix, shortlistPositions, axis=1)
+
+            shortlist = shortlistPositions
+            if candidateRows is not None:
+                shortlist = candidateRows[shortlistPositions]
+
+        else:
+
+            distanceMatrix = self.Distances(faceEncodings, candidateRows)
+
+            nearestIndexes = np.argmin(distanceMatrix, axis=1)
+            matchDistances = distanceMatrix[faceRange, nearestIndexes]
+
+            # Translate candidate positions back into database rows
+            if candidateRows is not None:
+                nearestIndexes = candidateRows[nearestIndexes]
+
+        if self.quantize or self.exemplarCounts is not None:
+
+            if self.exemplarCounts is not None:
+                shortlistDistances = self.ExemplarDistances(
+                    faceEncodings, shortlist, shortlistDistances)
+
+            nearestPositions = np.argmin(shortlistDistances, axis=1)
+            nearestIndexes = shortlist[faceRange, nearestPositions]
+            matchDistances = shortlistDistances[faceRange, nearestPositions]
+
+        isMatch = matchDistances <= self.tolerance
+        matchIndexes[isMatch] = nearestIndexes[isMatch]
+
+        return matchIndexes, matchDistances
@@ -0,0 +1,102 @@
+# Lightweight face tracking for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Carries last frame's faces forward without running face detection or encoding
+# Each face box is moved by the median optical flow of a grid of points inside it
+# A box whose points can't be followed is reported as lost so the caller can run a full detection
+
+
+import cv2  # optical flow
+import numpy as np  # array library
+
+
+def TrackingFrame(inputFrame, scale=0.5):
+    # Small grayscale copy of inputFrame for optical flow
+
+    # Inputs:   inputFrame (the cv2 webcam capture, BGR)
+    #           scale (TrackFaces has to be given the same one)
+
+    # Returns:  grayFrame
+
+    smallFrame = cv2.resize(inputFrame, (0, 0), fx=scale, fy=scale)
+
+    return cv2.cvtColor(smallFrame, cv2.COLOR_BGR2GRAY)
+
+
+def TrackFaces(previousGrayFrame, currentGrayFrame, lastFrameArray, gridSize=4, scale=0.5, liveTable=None):
+    # Moves every face in lastFrameArray to where it is in the current frame
+
+    # Inputs:   previousGrayFrame (TrackingFrame of the frame lastFrameArray was built from)
+    #           currentGrayFrame (TrackingFrame of the current frame)
+    #           lastFrameArray (last frame's liveArray - 'FaceLocation' in full frame pixels)
+    #           gridSize (points per side of the grid followed inside each box)
+    #           scale (the TrackingFrame scale)
+    #           liveTable (FrameBuffers.LiveTable trackedArray is built in - None = a new array)
+
+    # Process:  lay a gridSize x gridSize grid over the middle of each face box (in TrackingFrame pixels)
+    #           follow all grid points into the current frame with pyramidal Lucas-Kanade optical flow
+    #           shift each box by the median movement of its points that were followed
+    #               (a box with less than half its points followed is left in place and flagged lost)
+    #           'ForeignKey', 'Name' and 'FaceEncoding' carry over, 'FrameCount' counts this frame too
+
+    # Returns:  trackedArray (the new liveArray)
+    #           allTracked (False if any face was lost - time for a full detection)
+
+    if liveTable is None:
+        trackedArray = lastFrameArray.copy()
+    else:
+        trackedArray = liveTable.Rows(len(lastFrameArray))
+        trackedArray[...] = lastFrameArray
+
+    if len(trackedArray) == 0:
+        return trackedArray, True
+
+    trackedArray['FrameCount'] += 1
+
+    # Grid points covering the middle 60% of every box, one block of gridSize^2 points per face
+    gridSteps = np.linspace(0.2, 0.8, gridSize)
+    gridPoints = []
+
+    for faceLocation in trackedArray['FaceLocation']:
+        top, right, bottom, left = faceLocation.astype(np.float32) * scale
+        xPoints = left + gridSteps * (right - left)
+        yPoints = top + gridSteps * (bottom - top)
+        gridPoints.append(np.stack(np.meshgrid(
+            xPoints, yPoints), axis=-1).reshape(-1, 2))
+
+    previousPoints = np.concatenate(
+        gridPoints).astype(np.float32).reshape(-1, 1, 2)
+
+    currentPoints, pointStatus, pointError = cv2.calcOpticalFlowPyrLK(
+        previousGrayFrame, currentGrayFrame, previousPoints, None, winSize=(15, 15), maxLevel=2)
+
+    pointMovement = (currentPoints - previousPoints).reshape(
+        len(trackedArray), gridSize * gridSize, 2)
+    pointStatus = pointStatus.reshape(
+        len(trackedArray), gridSize * gridSize).astype(bool)
+
+    # Full frame size, boxes are moved in full frame pixels
+    frameHeight = int(round(currentGrayFrame.shape[0] / scale))
+    frameWidth = int(round(currentGrayFrame.shape[1] / scale))
+    allTracked = True
+
+    for row in range(len(trackedArray)):
+
+        if pointStatus[row].sum() < (gridSize * gridSize) // 2:
+            allTracked = False
+            continue
+
+        xShift, yShift = np.median(
+            pointMovement[row][pointStatus[row]], axis=0) / scale
+
+        top, right, bottom, left = trackedArray[row]['FaceLocation'].astype(
+            np.int64)
+
+        # Keep the shifted box inside the frame ('FaceLocation' can't go negative)
+        trackedArray[row]['FaceLocation'] = (
+            np.clip(round(top + yShift), 0, frameHeight - 1),
+            np.clip(round(right + xShift), 0, frameWidth - 1),
+            np.clip(round(bottom + yShift), 0, frameHeight - 1),
+            np.clip(round(left + xShift), 0, frameWidth - 1))
+
+    return trackedArray, allTracked
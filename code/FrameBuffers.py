@@ -0,0 +1,75 @@
+# Reusable per-frame buffers for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Every frame used to allocate the same things over again: the shrunk frame, its RGB copy
+#   (face_recognition copies the [:, :, ::-1] view into a contiguous image) and a new liveArray
+# FrameBuffer keeps one block of memory for the scratch image - cv2 resizes and converts into it in place
+# LiveTable keeps two liveArray tables and hands them out in turn - one is being filled while the other
+#   is still lastFrameArray
+# Both only allocate again when a frame needs more room than they have (a bigger frame, more faces)
+#   - allocations counts those, so a steady stream of frames can be seen to cost none
+
+
+import numpy as np  # array library
+
+
+class FrameBuffer:
+    # One growable block of memory, reused for a scratch image every frame
+
+    # Process:  View hands out a contiguous array of the asked for shape on the block
+    #               (the block is replaced by a bigger one when it's too small - never shrunk)
+    #           whatever the last View held is overwritten by the next one
+
+    def __init__(self):
+
+        self.block = np.empty(0, np.uint8)
+        self.allocations = 0
+
+    def View(self, shape, dtype=np.uint8):
+        # Inputs:   shape, dtype (of the array wanted)
+
+        # Returns:  array (contiguous, contents left over from whatever used the block last)
+
+        byteCount = int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+        if byteCount > len(self.block):
+            self.block = np.empty(byteCount, np.uint8)
+            self.allocations += 1
+
+        return self.block[:byteCount].view(dtype).reshape(shape)
+
+
+class LiveTable:
+    # Two fixed capacity liveArray tables, used in turn
+
+    # Inputs:   liveDataStructure (liveArray's numpy columns)
+    #           capacity (faces per frame a table holds before it has to grow)
+
+    # Process:  Rows hands out the first rowCount rows of the table it didn't hand out last time, zeroed
+    #               (the other table is still lastFrameArray - ProcessFrame / TrackFaces read it while filling these)
+    #           a table that's too small is replaced by one twice the size
+    #           rows handed out are only good until the call after next - keep a copy to hold on to them longer
+
+    def __init__(self, liveDataStructure, capacity=16):
+
+        self.tables = [np.zeros(max(1, capacity), liveDataStructure)
+                       for table in range(2)]
+        self.nextTable = 0
+        self.allocations = 0
+
+    def Rows(self, rowCount):
+        # Returns:  liveArray (rowCount zeroed rows - a view on one of the tables)
+
+        table = self.tables[self.nextTable]
+
+        if rowCount > len(table):
+            table = np.zeros(max(rowCount, 2 * len(table)), table.dtype)
+            self.tables[self.nextTable] = table
+            self.allocations += 1
+
+        self.nextTable = 1 - self.nextTable
+
+        liveArray = table[:rowCount]
+        liveArray.view(np.uint8)[...] = 0
+
+        return liveArray
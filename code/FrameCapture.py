@@ -0,0 +1,166 @@
+# Threaded webcam capture for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Reads the camera on its own thread so the driver's buffer never fills up with stale frames
+#   while ProcessFrame is busy
+# Frames wait in a small ring buffer until the main loop asks for one
+# Counts captured, delivered and dropped frames
+
+
+import threading  # capture thread, buffer lock
+import time  # capture timestamps
+from collections import deque  # ring buffer
+
+
+# Buffer policies
+#   'latest':  main loop always gets the newest frame, anything older is dropped (live display)
+#   'all':     main loop gets every frame in order, capture waits when the buffer is full (recordings)
+bufferPolicies = ('latest', 'all')
+
+
+class CaptureThread:
+    # Wraps a cv2.VideoCapture in a background reader thread
+
+    # Inputs:   videoCapture (an opened cv2.VideoCapture)
+    #           bufferSize (frames held between the capture thread and the main loop)
+    #           bufferPolicy ('latest' or 'all' - see bufferPolicies)
+
+    # Process:  Start launches the reader thread
+    #           the reader thread pushes (frameNumber, captureTime, frame) into the ring buffer,
+    #               dropping the oldest frame when the buffer is full ('latest')
+    #               or waiting for room ('all')
+    #           Read hands a frame to the main loop, same (ret, frame) shape as videoCapture.read()
+    #           Stop ends the thread (the caller still releases videoCapture)
+
+    def __init__(self, videoCapture, bufferSize=2, bufferPolicy='latest'):
+
+        if bufferPolicy not in bufferPolicies:
+            raise ValueError('bufferPolicy must be one of ' +
+                             str(bufferPolicies))
+
+        self.videoCapture = videoCapture
+        self.bufferSize = max(1, bufferSize)
+        self.bufferPolicy = bufferPolicy
+
+        self.frameBuffer = deque()
+        self.bufferCondition = threading.Condition()
+
+        self.running = False
+        self.captureEnded = False
+        self.thread = None
+
+        # Counters
+        self.capturedFrames = 0
+        self.deliveredFrames = 0
+        self.droppedFrames = 0
+
+        # Frame number and capture time of the frame Read returned last
+        self.lastFrameNumber = -1
+        self.lastCaptureTime = 0.0
+
+    def Start(self):
+        # Launches the capture thread
+
+        self.running = True
+        self.thread = threading.Thread(
+            target=self.CaptureLoop, name='CaptureThread', daemon=True)
+        self.thread.start()
+
+        return self
+
+    def CaptureLoop(self):
+        # Runs on the capture thread until Stop is called or the camera stops returning frames
+
+        while self.running:
+
+            ret, frame = self.videoCapture.read()
+
+            if not ret:
+                break
+
+            with self.bufferCondition:
+
+                # 'all': wait for the main loop to make room
+                while self.bufferPolicy == 'all' and self.running and len(self.frameBuffer) >= self.bufferSize:
+                    self.bufferCondition.wait(0.1)
+
+                # 'latest': make room by throwing away the oldest frame
+                if len(self.frameBuffer) >= self.bufferSize:
+                    self.frameBuffer.popleft()
+                    self.droppedFrames += 1
+
+                self.frameBuffer.append(
+                    (self.capturedFrames, time.perf_counter(), frame))
+                self.capturedFrames += 1
+
+                self.bufferCondition.notify_all()
+
+        with self.bufferCondition:
+            self.captureEnded = True
+            self.bufferCondition.notify_all()
+
+    def Read(self, timeout=None):
+        # Hands the next frame to the main loop
+
+        # Inputs:   timeout (seconds to wait for a frame, None = wait as long as it takes)
+
+        # Process:  wait until the buffer has a frame
+        #           'latest': take the newest frame, drop the rest
+        #           'all':    take the oldest frame
+
+        # Returns:  ret (False once the camera has stopped and the buffer is empty, or on timeout)
+        #           frame (None when ret is False)
+
+        with self.bufferCondition:
+
+            if not self.bufferCondition.wait_for(lambda: len(self.frameBuffer) > 0 or self.captureEnded, timeout):
+                return False, None
+
+            if len(self.frameBuffer) == 0:
+                return False, None
+
+            if self.bufferPolicy == 'latest':
+                frameNumber, captureTime, frame = self.frameBuffer.pop()
+                self.droppedFrames += len(self.frameBuffer)
+                self.frameBuffer.clear()
+
+            else:
+                frameNumber, captureTime, frame = self.frameBuffer.popleft()
+
+            self.deliveredFrames += 1
+            self.lastFrameNumber = frameNumber
+            self.lastCaptureTime = captureTime
+
+            # Wake the capture thread if it was waiting for room
+            self.bufferCondition.notify_all()
+
+        return True, frame
+
+    def FrameWaiting(self):
+        # True if Read would return a frame right away
+
+        with self.bufferCondition:
+            return len(self.frameBuffer) > 0
+
+    def Ended(self):
+        # True once the camera / file has stopped and every buffered frame was read
+
+        with self.bufferCondition:
+            return self.captureEnded and len(self.frameBuffer) == 0
+
+    def Stop(self):
+        # Ends the capture thread and waits for it to finish its current read
+
+        self.running = False
+
+        with self.bufferCondition:
+            self.bufferCondition.notify_all()
+
+        if self.thread is not None:
+            self.thread.join()
+
+    def Report(self):
+        # One line summary of the counters
+
+        return 'Frames captured: {0}  processed: {1}  dropped: {2}'.format(
+            self.capturedFrames, self.deliveredFrames, self.droppedFrames)
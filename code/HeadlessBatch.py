@@ -0,0 +1,361 @@
+# Headless batch processing for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Runs recorded video files and folders of images through the same ProcessFrame / AppendDatabase /
+#   TakeScreenshots logic as the webcam loop, with no window, no mouse and no input()
+# Frames are processed as fast as the CPU allows (every frame, in order - nothing is dropped to keep up)
+# Every processed frame's sightings are streamed to an NDJSON (one JSON object per frame)
+#   or CSV (one row per face) file as they happen
+# Times recorded in the database and the output are recording time:
+#   --start (or the file's modification time) plus the frame's position in the video
+
+# Run:      python3 HeadlessBatch.py lobby.mp4 ./Frames/ --output sightings.ndjson
+#           python3 HeadlessBatch.py lobby.mp4 --output sightings.csv --workers 4
+#           (the database, ./*.jpg enrollment and the settings at the bottom of DatabasingFromWebcam.py are shared)
+
+
+import os  # input folders, file times
+import sys  # exit status
+import csv  # CSV output
+import json  # NDJSON output
+import argparse  # command line
+from datetime import datetime  # --start
+import cv2  # video decoding, image loading
+import numpy as np  # array library
+from FaceMatching import EncodingMatcher  # batched nearest-identity lookup
+from FrameCapture import CaptureThread  # decodes video on a background thread
+from FaceDetection import DetectionPool, DetectionPlanner  # face finding / encoding in worker processes, detection scale
+from ScreenshotWriter import ScreenshotWriter  # .jpg encoding and disk writes off the main loop
+from SightingsLog import SightingsLog  # binary, time indexed sightings in ./Data/Sightings/
+from FrameBuffers import FrameBuffer, LiveTable  # scratch image and liveArray tables reused every frame
+import DatabasingFromWebcam as Webcam  # ProcessFrame and friends, database layout and settings
+
+
+# Files read from an image folder, in file name order
+imageExtensions = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def ReadFrames(inputPath, imageFrameRate, bufferSize=8):
+    # Yields every frame of a video file or image folder, in order
+
+    # Inputs:   inputPath (video file, or folder of images)
+    #           imageFrameRate (frames per second an image folder is treated as)
+    #           bufferSize (decoded video frames held ahead of ProcessFrame)
+
+    # Process:  video: decoded on a CaptureThread ('all' policy - never drops a frame)
+    #           folder: each image loaded in turn (unreadable files are skipped)
+
+    # Yields:   frameNumber
+    #           seconds (position in the recording)
+    #           frame
+
+    if os.path.isdir(inputPath):
+
+        imageFiles = sorted(fileName for fileName in os.listdir(inputPath)
+                            if fileName.lower().endswith(imageExtensions))
+
+        for frameNumber, imageFile in enumerate(imageFiles):
+
+            frame = cv2.imread(os.path.join(inputPath, imageFile))
+
+            if frame is None:
+                print('ERROR: Unable to read ' + imageFile)
+                continue
+
+            yield frameNumber, frameNumber / imageFrameRate, frame
+
+        return
+
+    videoCapture = cv2.VideoCapture(inputPath)
+
+    if not videoCapture.isOpened():
+        print('ERROR: Unable to open ' + inputPath)
+        return
+
+    frameRate = videoCapture.get(cv2.CAP_PROP_FPS) or imageFrameRate
+
+    captureThread = CaptureThread(videoCapture, bufferSize, 'all').Start()
+
+    try:
+        while True:
+
+            ret, frame = captureThread.Read()
+
+            if not ret:
+                break
+
+            yield captureThread.lastFrameNumber, captureThread.lastFrameNumber / frameRate, frame
+
+    finally:
+        captureThread.Stop()
+        videoCapture.release()
+
+
+class SightingsWriter:
+    # Streams sightings to an NDJSON or CSV file
+
+    # Inputs:   outputPath (.ndjson / .jsonl = one JSON object per frame, .csv = one row per face)
+    #           flushEvery (frames between flushes - the file can be read while the batch runs)
+
+    csvColumns = ['source', 'frame', 'seconds', 'time', 'key', 'name',
+                  'top', 'right', 'bottom', 'left', 'frameCount']
+
+    def __init__(self, outputPath, flushEvery=100):
+
+        self.outputFormat = 'csv' if outputPath.lower().endswith('.csv') else 'ndjson'
+        self.flushEvery = flushEvery
+        self.writtenFrames = 0
+        self.writtenSightings = 0
+
+        self.outputFile = open(outputPath, 'w', encoding='utf-8', newline='')
+
+        if self.outputFormat == 'csv':
+            self.csvWriter = csv.writer(self.outputFile)
+            self.csvWriter.writerow(self.csvColumns)
+
+    def Write(self, sourceName, frameNumber, seconds, frameTime, liveArray):
+        # Writes one frame's sightings
+
+        # Inputs:   sourceName (input file / folder)
+        #           frameNumber, seconds (position in the recording)
+        #           frameTime (epoch seconds the frame was filmed at)
+        #           liveArray (ProcessFrame's result, after AppendDatabase)
+
+        # Face boxes are written in full frame pixels
+        sightings = [{'key': int(row['ForeignKey']), 'name': str(row['Name']),
+                      'location': [int(value) for value in row['FaceLocation']],
+                      'frameCount': int(row['FrameCount'])} for row in liveArray]
+
+        if self.outputFormat == 'csv':
+            for sighting in sightings:
+                self.csvWriter.writerow([sourceName, frameNumber, round(seconds, 3), round(frameTime, 3),
+                                         sighting['key'], sighting['name']] + sighting['location'] + [sighting['frameCount']])
+
+        else:
+            self.outputFile.write(json.dumps({'source': sourceName, 'frame': frameNumber, 'seconds': round(seconds, 3),
+                                              'time': round(frameTime, 3), 'faces': sightings}) + '\n')
+
+        self.writtenFrames += 1
+        self.writtenSightings += len(sightings)
+
+        if self.writtenFrames % self.flushEvery == 0:
+            self.outputFile.flush()
+
+    def Close(self):
+        self.outputFile.close()
+
+
+def ProcessInput(inputPath, startTime, arguments, databaseArray, databaseMatcher, databaseJournal, screenshotWriter, sightingsWriter, detectionPool,
+                 sightingsLog=None, inputNumber=0):
+    # Runs one video file / image folder through the pipeline
+
+    # Inputs:   inputPath (video file or image folder)
+    #           startTime (epoch seconds the recording started)
+    #           arguments (parsed command line)
+    #           databaseArray, databaseMatcher, databaseJournal (shared by every input)
+    #           screenshotWriter, sightingsWriter
+    #           detectionPool (DetectionPool, or None = detect in this process)
+    #           sightingsLog (SightingsLog, None = don't log) and inputNumber (logged as the sightings' source)
+
+    # Process:  for each frame (through the worker processes, if any - results come back in frame order)
+    #               ProcessFrame, AppendDatabase, TakeScreenshots at the frame's recording time
+    #               write the frame's sightings (and log them, at the frame's recording time)
+    #               checkpoint the database on the same schedule as the webcam loop
+
+    # Returns:  databaseArray
+    #           processedFrames
+
+    # Each input is its own recording - nothing carries over from the last one
+    lastFrameArray = np.array([], Webcam.liveDataStructure)
+    processedFrames = 0
+
+    # Same buffer reuse as the webcam loop
+    liveTable = LiveTable(Webcam.liveDataStructure) if Webcam.reuseFrameBuffers else None
+    frameBuffer = FrameBuffer() if Webcam.reuseFrameBuffers else None
+
+    # Same detection scale / search region settings as the webcam loop
+    detectionPlanner = DetectionPlanner(Webcam.adaptiveDetection, Webcam.detectionScale, Webcam.detectionTimeBudget,
+                                        Webcam.minimumFacePixels, Webcam.fullSweepInterval, Webcam.searchRegionPadding)
+
+    def HandleFrame(frameNumber, seconds, frame, faceDetections, plannedScale=None, plannedRegions=None):
+
+        nonlocal databaseArray, lastFrameArray, processedFrames
+
+        frameTime = startTime + seconds
+
+        # Detecting here - plan it now (worker frames were planned when they were sent)
+        if faceDetections is None:
+            plannedScale, plannedRegions = detectionPlanner.Plan(
+                frame.shape, lastFrameArray)
+            detectionStart = datetime.now()
+
+        liveArray = Webcam.ProcessFrame(frame, lastFrameArray, databaseArray, databaseMatcher, Webcam.liveDataStructure,
+                                        Webcam.databaseRecheckTrigger, faceDetections, plannedScale, plannedRegions,
+                                        (Webcam.exemplarSpread, Webcam.exemplarTolerance), liveTable, frameBuffer)
+
+        if faceDetections is None:
+            detectionPlanner.Observe(plannedScale, plannedRegions,
+                                     (datetime.now() - detectionStart).total_seconds(), liveArray['FaceLocation'])
+        else:
+            detectionPlanner.Observe(plannedScale, plannedRegions,
+                                     detectionPool.lastBusySeconds, faceDetections[0])
+
+        databaseArray = Webcam.AppendDatabase(
+            liveArray, databaseArray, Webcam.databaseStructure, Webcam.frameCountTrigger)
+
+        if screenshotWriter is not None:
+            Webcam.TakeScreenshots(frame, liveArray, databaseArray, Webcam.screenShotInterval, Webcam.frameCountTrigger,
+                                   screenshotWriter, Webcam.screenShotCrop, Webcam.screenShotCropPadding, frameTime)
+
+        sightingsWriter.Write(inputPath, frameNumber,
+                              seconds, frameTime, liveArray)
+
+        if sightingsLog is not None:
+            sightingsLog.Record(liveArray, inputNumber, frameTime)
+
+        lastFrameArray = liveArray
+        processedFrames += 1
+
+        if databaseJournal.CheckpointDue():
+            databaseJournal.Checkpoint(*databaseArray.Snapshot())
+
+    for frameNumber, seconds, frame in ReadFrames(inputPath, arguments.image_fps):
+
+        if detectionPool is None:
+            HandleFrame(frameNumber, seconds, frame, None)
+            continue
+
+        # One frame in flight per worker, handled in frame order
+        #   (planned from the last frame handled - a few frames behind, the region padding covers it)
+        plannedScale, plannedRegions = detectionPlanner.Plan(
+            frame.shape, lastFrameArray)
+        detectionPool.Submit(frame, (frameNumber, seconds, frame, plannedScale, plannedRegions),
+                             plannedScale, plannedRegions)
+
+        if detectionPool.Pending() >= arguments.workers:
+            (doneNumber, doneSeconds, doneFrame, doneScale, doneRegions), faceLocations, faceEncodings = detectionPool.NextResult()
+            Webcam.pipelineMetrics.ObserveAll(detectionPool.lastStageTimes)
+            HandleFrame(doneNumber, doneSeconds, doneFrame,
+                        (faceLocations, faceEncodings), doneScale, doneRegions)
+
+    # Frames still with the workers
+    while detectionPool is not None and detectionPool.Pending() > 0:
+        (doneNumber, doneSeconds, doneFrame, doneScale, doneRegions), faceLocations, faceEncodings = detectionPool.NextResult()
+        Webcam.pipelineMetrics.ObserveAll(detectionPool.lastStageTimes)
+        HandleFrame(doneNumber, doneSeconds, doneFrame,
+                    (faceLocations, faceEncodings), doneScale, doneRegions)
+
+    return databaseArray, processedFrames
+
+
+def ParseArguments():
+
+    parser = argparse.ArgumentParser(
+        description='Run recorded video / image folders through the face database without a GUI.')
+    parser.add_argument('inputs', nargs='+',
+                        help='video files and/or folders of images')
+    parser.add_argument('--output', default='sightings.ndjson',
+                        help='sightings file (.ndjson / .jsonl or .csv)')
+    parser.add_argument('--workers', type=int, default=Webcam.detectionWorkers,
+                        help='face detection worker processes (0 = detect in this process)')
+    parser.add_argument('--start', default=None,
+                        help='when the recording started, e.g. 2024-01-31T09:00:00 (default: file modification time)')
+    parser.add_argument('--image-fps', type=float, default=1.0,
+                        help='frames per second an image folder is treated as (default 1)')
+    parser.add_argument('--no-screenshots', action='store_true',
+                        help="don't save screenshots to ./Data/Screenshots/")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    arguments = ParseArguments()
+
+    for folderPath in ('./Data/Database/', './Data/UploadedOriginals/', './Data/Screenshots/'):
+        os.makedirs(folderPath, exist_ok=True)
+
+    # Same database setup as the webcam loop
+    databaseMatcher = EncodingMatcher(partitionMinimumSize=Webcam.partitionMinimumSize,
+                                      partitionCount=Webcam.partitionCount, probeCount=Webcam.probeCount,
+                                      quantize=Webcam.encodingStorage == 'int8')
+
+    databaseJournal = Webcam.OpenDatabaseBackend(Webcam.databaseBackend, Webcam.databaseStructure,
+                                                 Webcam.journalFlushInterval, Webcam.checkpointInterval,
+                                                 Webcam.encodingStorage)
+
+    databaseArray = Webcam.BuildArray(Webcam.databaseStructure, databaseMatcher, databaseJournal,
+                                      Webcam.enrollmentWorkers, Webcam.encodingStorage, Webcam.exemplarLimit)
+
+    # Screenshots wait for the disk instead of being skipped - every run saves the same ones
+    screenshotWriter = None
+    if not arguments.no_screenshots:
+        screenshotWriter = ScreenshotWriter(
+            Webcam.screenShotQueueSize, blockWhenFull=True)
+
+    detectionPool = None
+    if arguments.workers > 0:
+        detectionPool = DetectionPool(
+            arguments.workers, reuseFrameBuffers=Webcam.reuseFrameBuffers)
+
+    sightingsWriter = SightingsWriter(arguments.output)
+    sightingsLog = SightingsLog(flushInterval=Webcam.sightingsFlushInterval)
+
+    batchStart = datetime.now()
+    totalFrames = 0
+    exitStatus = 0
+
+    try:
+        for inputNumber, inputPath in enumerate(arguments.inputs):
+
+            if not os.path.exists(inputPath):
+                print('ERROR: ' + inputPath + ' not found')
+                exitStatus = 1
+                continue
+
+            if arguments.start is not None:
+                startTime = datetime.fromisoformat(arguments.start).timestamp()
+            else:
+                startTime = os.path.getmtime(inputPath)
+
+            inputStart = datetime.now()
+
+            databaseArray, processedFrames = ProcessInput(inputPath, startTime, arguments, databaseArray, databaseMatcher,
+                                                          databaseJournal, screenshotWriter, sightingsWriter, detectionPool,
+                                                          sightingsLog, inputNumber)
+
+            inputSeconds = (datetime.now() - inputStart).total_seconds()
+            print('{0}: {1} frames in {2:0.1f} s ({3:0.1f} frames/s)'.format(
+                inputPath, processedFrames, inputSeconds, processedFrames / max(inputSeconds, 1e-9)))
+
+            totalFrames += processedFrames
+
+    # Ctrl-C still saves everything processed so far
+    except KeyboardInterrupt:
+        print('\nInterrupted')
+        exitStatus = 1
+
+    batchSeconds = (datetime.now() - batchStart).total_seconds()
+
+    sightingsWriter.Close()
+    sightingsLog.Close()
+
+    if detectionPool is not None:
+        detectionPool.Stop()
+        print('\n'.join(detectionPool.Report()))
+
+    if screenshotWriter is not None:
+        screenshotWriter.Stop()
+        print(screenshotWriter.Report())
+
+    print('\n{0} frames, {1} sightings in {2:0.1f} s ({3:0.1f} frames/s) - written to {4}'.format(
+        totalFrames, sightingsWriter.writtenSightings, batchSeconds, totalFrames / max(batchSeconds, 1e-9), arguments.output))
+    print(Webcam.pipelineMetrics.Report())
+
+    # Final checkpoint (no per-row printout like SaveArray - batches can add a lot of rows)
+    databaseJournal.Checkpoint(*databaseArray.Snapshot(), wait=True)
+    databaseJournal.Stop()
+
+    print('Database saved: ' + str(len(databaseArray)) + ' rows')
+
+    sys.exit(exitStatus)
@@ -0,0 +1,222 @@
+# Per-stage latency and counters for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Times each stage of a frame (capture, resize, detection, encoding, last-frame check, database check,
+#   append, screenshot, paint, display, ...) and keeps the most recent samples of each
+#   for rolling p50 / p95 / p99
+# Counts events worth watching (database rechecks, new unknowns, ...)
+# Exported two ways:
+#   Report - one log line, printed every metricsLogInterval seconds
+#   MetricsServer - plain text over HTTP on localhost (Prometheus text format), for watching production boxes
+# pipelineMetrics is the one registry everything records into
+# GarbageCollectionWatch times the garbage collector's pauses, so GC time per frame can be recorded as a stage
+
+
+import gc  # garbage collection callbacks
+import time  # stage timing
+import threading  # registry lock, HTTP server thread
+from collections import deque  # rolling samples
+from contextlib import contextmanager  # Time blocks
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # metrics endpoint
+import numpy as np  # percentiles
+
+
+class Metrics:
+    # Rolling stage timings plus counters
+
+    # Inputs:   sampleCount (most recent samples kept per stage - percentiles cover these)
+
+    # Process:  Time('stage') times a with-block, Observe records a duration measured elsewhere
+    #               (e.g. DetectFaces' stage times from a worker process)
+    #           Count bumps a counter
+    #           Percentiles / Report / Exposition read everything back (safe from another thread)
+
+    def __init__(self, sampleCount=1024):
+
+        self.sampleCount = sampleCount
+
+        # Stage name -> recent durations (seconds), in first-seen order
+        self.stageSamples = {}
+        self.stageTotals = {}
+
+        # Counter name -> count
+        self.counters = {}
+
+        self.metricsLock = threading.Lock()
+        self.startTime = time.perf_counter()
+
+    @contextmanager
+    def Time(self, stage):
+        # with pipelineMetrics.Time('detection'): ...
+
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.Observe(stage, time.perf_counter() - startTime)
+
+    def Observe(self, stage, seconds):
+
+        with self.metricsLock:
+
+            if stage not in self.stageSamples:
+                self.stageSamples[stage] = deque(maxlen=self.sampleCount)
+                self.stageTotals[stage] = [0, 0.0]
+
+            self.stageSamples[stage].append(seconds)
+            self.stageTotals[stage][0] += 1
+            self.stageTotals[stage][1] += seconds
+
+    def ObserveAll(self, stageTimes):
+        # Records a dict of stage -> seconds (DetectFaces' stageTimes)
+
+        for stage, seconds in stageTimes.items():
+            self.Observe(stage, seconds)
+
+    def Count(self, counter, amount=1):
+
+        with self.metricsLock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def Percentiles(self):
+        # Returns:  stage -> (p50, p95, p99) in seconds over the rolling window
+
+        with self.metricsLock:
+            stageSamples = {stage: np.array(samples)
+                            for stage, samples in self.stageSamples.items()}
+
+        return {stage: tuple(np.percentile(samples, (50, 95, 99))) for stage, samples in stageSamples.items()
+                if len(samples) > 0}
+
+    def Report(self):
+        # One log line: p50 / p95 / p99 in ms per stage, then the counters
+
+        stageParts = ['{0} {1:0.1f}/{2:0.1f}/{3:0.1f}'.format(stage, p50 * 1000, p95 * 1000, p99 * 1000)
+                      for stage, (p50, p95, p99) in self.Percentiles().items()]
+
+        with self.metricsLock:
+            counterParts = ['{0}={1}'.format(counter, count)
+                            for counter, count in self.counters.items()]
+
+        return 'Stage ms p50/p95/p99: ' + '  '.join(stageParts) + ' | ' + '  '.join(counterParts)
+
+    def Exposition(self, prefix='facedatabase'):
+        # Everything in Prometheus text format
+
+        lines = ['# TYPE {0}_stage_seconds summary'.format(prefix)]
+
+        percentiles = self.Percentiles()
+
+        with self.metricsLock:
+            stageTotals = {stage: list(totals)
+                           for stage, totals in self.stageTotals.items()}
+            counters = dict(self.counters)
+
+        for stage, stagePercentiles in percentiles.items():
+
+            for quantile, value in zip(('0.5', '0.95', '0.99'), stagePercentiles):
+                lines.append('{0}_stage_seconds{{stage="{1}",quantile="{2}"}} {3:.6f}'.format(
+                    prefix, stage, quantile, value))
+
+            lines.append('{0}_stage_seconds_count{{stage="{1}"}} {2}'.format(
+                prefix, stage, stageTotals[stage][0]))
+            lines.append('{0}_stage_seconds_sum{{stage="{1}"}} {2:.6f}'.format(
+                prefix, stage, stageTotals[stage][1]))
+
+        for counter, count in counters.items():
+            lines.append('# TYPE {0}_{1}_total counter'.format(prefix, counter))
+            lines.append('{0}_{1}_total {2}'.format(prefix, counter, count))
+
+        lines.append('{0}_uptime_seconds {1:.1f}'.format(
+            prefix, time.perf_counter() - self.startTime))
+
+        return '\n'.join(lines) + '\n'
+
+
+class GarbageCollectionWatch:
+    # Adds up how long the garbage collector stops the program for
+
+    # Process:  Start hooks into gc.callbacks, Stop unhooks
+    #           each collection's pause is added up here - not in Metrics, the collector can run
+    #               while metricsLock is held
+    #           Take hands back the pauses since the last Take and starts over (called once per frame)
+
+    def __init__(self):
+
+        self.collectionStart = None
+        self.seconds = 0.0
+        self.collections = 0
+
+    def Callback(self, phase, info):
+
+        if phase == 'start':
+            self.collectionStart = time.perf_counter()
+
+        elif self.collectionStart is not None:
+            self.seconds += time.perf_counter() - self.collectionStart
+            self.collections += 1
+            self.collectionStart = None
+
+    def Start(self):
+
+        gc.callbacks.append(self.Callback)
+
+        return self
+
+    def Stop(self):
+
+        if self.Callback in gc.callbacks:
+            gc.callbacks.remove(self.Callback)
+
+    def Take(self):
+        # Returns:  seconds (collector pauses since the last Take)
+        #           collections (how many)
+
+        seconds, collections = self.seconds, self.collections
+        self.seconds = 0.0
+        self.collections = 0
+
+        return seconds, collections
+
+
+class MetricsServer:
+    # Serves a Metrics registry as plain text over HTTP (GET /metrics, or any path)
+
+    # Inputs:   metrics (the Metrics registry)
+    #           port (0 = let the OS pick one - see self.port)
+    #           host (defaults to localhost only)
+
+    def __init__(self, metrics, port=9100, host='127.0.0.1'):
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(handler):
+
+                body = metrics.Exposition().encode('utf-8')
+
+                handler.send_response(200)
+                handler.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            # Keep the terminal for the program's own output
+            def log_message(handler, *arguments):
+                pass
+
+        self.httpServer = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.port = self.httpServer.server_address[1]
+
+        self.thread = threading.Thread(
+            target=self.httpServer.serve_forever, name='MetricsServer', daemon=True)
+        self.thread.start()
+
+    def Stop(self):
+
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+
+# The registry ProcessFrame, AppendDatabase and the main loop record into
+pipelineMetrics = Metrics()
@@ -0,0 +1,112 @@
+# Motion gating for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# A camera watching an empty (or unchanging) doorway doesn't need face detection on every frame
+# Each frame is shrunk to a tiny grayscale sample and compared with the sample of the frame the last detection ran on
+#   - if hardly any pixels changed, last frame's liveArray still stands and the frame skips detection altogether
+# Only detections move the reference, so a slow change keeps adding up until it counts
+# A detection still runs every forcedInterval seconds, however still the picture is
+#   (and whenever the source is told to - the 'd' key, a face lost by the tracker)
+# The skipped share is counted per source, so idle cameras can be seen costing next to nothing
+
+
+import time  # forced detection interval
+import cv2  # shrinking, grayscale
+import numpy as np  # array library
+
+
+class MotionGate:
+    # Per-source frame differencing in front of face detection
+
+    # Inputs:   enabled (False = every frame goes through, nothing is counted)
+    #           sampleWidth (width frames are shrunk to before comparing - area averaging evens out sensor noise)
+    #           pixelThreshold (gray levels a sample pixel has to change by to count as changed)
+    #           changedFraction (share of sample pixels that have to change for the frame to count as moved)
+    #           forcedInterval (seconds after the last detection that one is run anyway)
+
+    # Process:  Check shrinks the frame into a reused sample, compares it with the reference sample
+    #               True = worth processing (moved, forced, or no reference yet), False = skip it
+    #           Detected makes the frame Check just looked at the new reference (call it when it's detected on)
+    #           Report gives the skip ratio
+
+    def __init__(self, enabled=True, sampleWidth=80, pixelThreshold=20, changedFraction=0.002, forcedInterval=5.0):
+
+        self.enabled = enabled
+        self.sampleWidth = sampleWidth
+        self.pixelThreshold = pixelThreshold
+        self.changedFraction = changedFraction
+        self.forcedInterval = forcedInterval
+
+        # Shrunk copies of the current frame (color, then gray), and of the last frame detected on
+        self.smallSample = None
+        self.sample = None
+        self.reference = None
+        self.lastDetectionTime = 0.0
+
+        # Counters
+        self.checkedFrames = 0
+        self.skippedFrames = 0
+
+    def Check(self, inputFrame, forceDetection=False):
+        # Inputs:   inputFrame (the cv2 capture, BGR)
+        #           forceDetection (the source's own flag - always worth processing)
+
+        # Returns:  True if the frame should be processed, False if nothing moved since the last detection
+
+        if not self.enabled:
+            return True
+
+        self.checkedFrames += 1
+
+        frameHeight, frameWidth = inputFrame.shape[:2]
+        sampleWidth = min(self.sampleWidth, frameWidth)
+        sampleShape = (max(1, round(frameHeight * sampleWidth / frameWidth)), sampleWidth)
+
+        # Same buffers every frame, new ones only if the frame size changes
+        if self.sample is None or self.sample.shape != sampleShape:
+            self.smallSample = np.empty(sampleShape + (3,), np.uint8)
+            self.sample = np.empty(sampleShape, np.uint8)
+
+        cv2.resize(inputFrame, (sampleShape[1], sampleShape[0]),
+                   dst=self.smallSample, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.smallSample, cv2.COLOR_BGR2GRAY, dst=self.sample)
+
+        if forceDetection or self.reference is None or self.reference.shape != sampleShape or \
+                time.perf_counter() - self.lastDetectionTime >= self.forcedInterval:
+            return True
+
+        changedPixels = np.count_nonzero(
+            cv2.absdiff(self.sample, self.reference) > self.pixelThreshold)
+
+        if changedPixels > self.changedFraction * self.sample.size:
+            return True
+
+        self.skippedFrames += 1
+
+        return False
+
+    def Detected(self):
+        # The frame Check just looked at is being detected on - it's what later frames are compared with
+
+        if not self.enabled or self.sample is None:
+            return
+
+        if self.reference is None or self.reference.shape != self.sample.shape:
+            self.reference = self.sample.copy()
+        else:
+            np.copyto(self.reference, self.sample)
+
+        self.lastDetectionTime = time.perf_counter()
+
+    def SkipRatio(self):
+        # Share of checked frames that were skipped
+
+        return self.skippedFrames / self.checkedFrames if self.checkedFrames > 0 else 0.0
+
+    def Report(self):
+
+        if not self.enabled:
+            return 'Motion gate: off'
+
+        return 'Motion gate: skipped {0} of {1} frames ({2:0.1f}%)'.format(
+            self.skippedFrames, self.checkedFrames, 100 * self.SkipRatio())
@@ -0,0 +1,178 @@
+# Background screenshot writer for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Moves TakeScreenshots' JPEG encoding and disk writes off the main loop
+# Screenshots wait in a bounded queue; when the disk can't keep up, new screenshots are turned away
+#   (and counted) instead of stalling the webcam feed
+# PromoteUnknown's folder renames go through the same queue, so a screenshot queued under the old name
+#   is written before its folder is renamed
+# A rename that fails is handed back (FailedRenames) so the main loop can undo the name change it went with
+
+
+import os  # folder creation and renames
+import queue  # bounded screenshot (and rename) queue
+import threading  # writer thread
+import cv2  # JPEG encoding
+
+
+class ScreenshotWriter:
+    # One writer thread fed by a bounded queue
+
+    # Inputs:   queueSize (screenshots allowed to wait before Submit starts turning them away)
+    #           blockWhenFull (True = Submit waits for room instead - no screenshot is ever turned away;
+    #                          for HeadlessBatch.py, where the disk setting the pace is fine)
+
+    # Process:  Submit queues (filePath, image) without waiting (unless blockWhenFull)
+    #           RenameFolder queues a folder rename (never turned away - waits for room if it has to)
+    #           the writer thread makes the folder (first time only) and writes the .jpg, or renames the folder
+    #           FailedRenames returns the tags of renames that failed since the last call, without waiting
+    #           Stop writes whatever is still queued, then ends the thread
+
+    def __init__(self, queueSize=8, blockWhenFull=False):
+
+        self.screenshotQueue = queue.Queue(max(1, queueSize))
+        self.blockWhenFull = blockWhenFull
+
+        # Folders known to exist - saves an os.makedirs check per screenshot
+        self.knownFolders = set()
+
+        # Tags of failed renames, waiting for FailedRenames
+        self.failedRenames = queue.Queue()
+
+        # Counters
+        self.queuedScreenshots = 0
+        self.writtenScreenshots = 0
+        self.droppedScreenshots = 0
+        self.failedScreenshots = 0
+        self.renamedFolders = 0
+        self.deepestQueue = 0
+
+        self.thread = threading.Thread(
+            target=self.WriteLoop, name='ScreenshotWriter', daemon=True)
+        self.thread.start()
+
+    def Submit(self, filePath, image):
+        # Queues one screenshot
+
+        # Inputs:   filePath (where the .jpg goes - folder is created if needed)
+        #           image (pixels to save - must not be drawn on afterwards, pass a copy)
+
+        # Returns:  True if queued, False if the queue was full (backpressure - try again later)
+
+        try:
+            self.screenshotQueue.put(
+                ('write', filePath, image), self.blockWhenFull)
+
+        except queue.Full:
+            self.droppedScreenshots += 1
+            return False
+
+        self.queuedScreenshots += 1
+        self.deepestQueue = max(
+            self.deepestQueue, self.screenshotQueue.qsize())
+
+        return True
+
+    def RenameFolder(self, folderPath, newFolderPath, tag=None):
+        # Queues a folder rename behind every screenshot already waiting
+
+        # Inputs:   folderPath (current folder - nothing happens if it was never made)
+        #           newFolderPath (what it becomes - the rename fails if it's already there)
+        #           tag (handed back by FailedRenames if the rename fails, None = nobody needs to know)
+
+        # Returns:  void
+
+        self.screenshotQueue.put(('rename', folderPath, (newFolderPath, tag)))
+
+    def Rename(self, folderPath, newFolderPath, tag):
+        # Runs on the writer thread
+
+        try:
+
+            if os.path.exists(folderPath):
+
+                # os.rename would quietly replace an empty folder on some systems
+                if os.path.exists(newFolderPath):
+                    raise FileExistsError(newFolderPath)
+
+                os.rename(folderPath, newFolderPath)
+
+            self.knownFolders.discard(os.path.normpath(folderPath))
+            self.renamedFolders += 1
+
+        # Handle any and all of the weird reasons a rename might fail - the main loop undoes what went with it
+        except Exception:
+            print('ERROR: Unable to rename ' + folderPath + ' to ' + newFolderPath)
+
+            if tag is not None:
+                self.failedRenames.put(tag)
+
+    def FailedRenames(self):
+        # Tags of every rename that failed since the last call
+
+        # Returns:  list of tags, oldest first - empty almost always
+
+        failedTags = []
+
+        while True:
+
+            try:
+                failedTags.append(self.failedRenames.get_nowait())
+
+            except queue.Empty:
+                break
+
+        return failedTags
+
+    def WriteLoop(self):
+        # Runs on the writer thread until Stop queues None
+
+        while True:
+
+            screenshot = self.screenshotQueue.get()
+
+            if screenshot is None:
+                break
+
+            action, filePath, image = screenshot
+
+            if action == 'rename':
+                self.Rename(filePath, *image)
+                continue
+
+            folderPath = os.path.normpath(os.path.dirname(filePath))
+
+            try:
+
+                # If the named folder doesn't exist in /Screenshots, make it
+                if folderPath not in self.knownFolders:
+                    os.makedirs(folderPath, exist_ok=True)
+                    self.knownFolders.add(folderPath)
+
+                if not cv2.imwrite(filePath, image):
+                    raise OSError('cv2.imwrite failed')
+
+                self.writtenScreenshots += 1
+
+            # Handle any and all of the weird reasons a mkdr or save .jpg command might fail
+            except Exception:
+                self.failedScreenshots += 1
+                print('ERROR: Unable to save screenshot ' + filePath)
+
+    def Backlog(self):
+        # Screenshots waiting to be written
+
+        return self.screenshotQueue.qsize()
+
+    def Stop(self):
+        # Finishes the queued screenshots and ends the writer thread
+
+        self.screenshotQueue.put(None)
+        self.thread.join()
+
+    def Report(self):
+        # One line summary of the counters
+
+        return 'Screenshots queued: {0}  written: {1}  failed: {2}  turned away (queue full): {3}  deepest queue: {4}'.format(
+            self.queuedScreenshots, self.writtenScreenshots, self.failedScreenshots,
+            self.droppedScreenshots, self.deepestQueue)
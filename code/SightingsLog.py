@@ -0,0 +1,526 @@
+# Append-only sightings log for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Records every identification ProcessFrame makes: who ('Key'), which capture source, when, where (box)
+#   and how close the match was ('Distance')
+# Rows are fixed size binary records, buffered and appended in batches to one segment file per hour
+#   (./Data/Sightings/YYYYMMDD-HH.sightings, UTC) - the file name is the time index
+# ./Data/Sightings/index.npz lists, per key, the hours it was seen in (how often, when last),
+#   so key lookups only open the hours that key was actually seen in
+#   finished hours are added to it by the first query after they finish
+# Queries: LastSeen(key), Sightings(key, startTime, endTime), HourlyCounts(startTime, endTime, key)
+# DatabaseCompaction.py renumbers keys - RemapSegments / ReplaceRemappedSegments rewrite the segments that change
+
+# Run:      python3 SightingsLog.py last 12
+#           python3 SightingsLog.py between 12 2024-01-31T09:00 2024-01-31T17:00
+#           python3 SightingsLog.py hourly 2024-01-31T00:00 2024-02-01T00:00 [--key 12]
+
+
+import os  # segment files
+import sys  # command line
+import time  # flush timing, epoch seconds
+import argparse  # command line
+from datetime import datetime, timezone  # segment names, command line times
+import numpy as np  # array library
+
+
+# One sighting - 28 bytes on disk
+sightingStructure = np.dtype([('Time', 'float64'), ('Key', 'uint32'), ('Source', 'uint16'),
+                              ('Box', 'uint16', (4)), ('Distance', 'float32'), ('Spare', 'uint16')])
+
+# Which hours each key was seen in - one row per key per hour
+indexStructure = np.dtype(
+    [('Key', 'uint32'), ('Hour', 'int64'), ('Count', 'int64'), ('Last', 'float64')])
+
+# Segment file names (UTC hour the sightings in it were made)
+segmentFormat = '%Y%m%d-%H'
+segmentExtension = '.sightings'
+
+
+def SegmentHour(segmentName):
+    # Hours since the epoch for a segment file name
+
+    hourStart = datetime.strptime(segmentName[:-len(segmentExtension)], segmentFormat).replace(
+        tzinfo=timezone.utc)
+
+    return int(hourStart.timestamp()) // 3600
+
+
+def SegmentName(hour):
+    return datetime.fromtimestamp(hour * 3600, timezone.utc).strftime(segmentFormat) + segmentExtension
+
+
+def RemapSegments(sightingsPath, keyMap, chunkRows=1 << 20):
+    # Writes a renumbered copy of every segment that has a 'Key' keyMap changes (DatabaseCompaction.py)
+
+    # Inputs:   sightingsPath (folder the segments are in - left as it is)
+    #           keyMap (old 'Key' -> new 'Key'; keys past its end, rows a crash lost, become 0)
+    #           chunkRows (sightings renumbered at a time - memory stays flat for big segments)
+
+    # Process:  each segment is read chunkRows at a time - one without a changed key isn't written at all
+    #           a changed one is renumbered into X.sightings.remapping, fsynced, renamed to X.sightings.remapped
+    #               (so a .remapped copy is always whole; one left by a crash is kept, a .remapping is redone)
+    #           a half written row at the end is dropped
+    #           ReplaceRemappedSegments swaps the copies in
+
+    # Returns:  remappedRows (sightings in the segments that were copied)
+
+    remappedRows = 0
+
+    for fileName in sorted(os.listdir(sightingsPath)):
+
+        if not fileName.endswith(segmentExtension):
+            continue
+
+        segmentPath = os.path.join(sightingsPath, fileName)
+        rowCount = os.path.getsize(segmentPath) // sightingStructure.itemsize
+
+        if rowCount == 0 or os.path.exists(segmentPath + '.remapped'):
+            continue
+
+        sightings = np.memmap(segmentPath, sightingStructure, 'r', shape=(rowCount,))
+        remappedFile = None
+
+        for chunkStart in range(0, rowCount, chunkRows):
+
+            chunk = np.array(sightings[chunkStart:chunkStart + chunkRows])
+            knownKeys = chunk['Key'] < len(keyMap)
+            remappedKeys = np.where(
+                knownKeys, keyMap[np.where(knownKeys, chunk['Key'], 0)], 0)
+
+            # Unchanged so far - nothing to write unless a later chunk changes
+            if remappedFile is None:
+                if np.array_equal(remappedKeys, chunk['Key']):
+                    continue
+                remappedFile = open(segmentPath + '.remapping', 'wb')
+                np.array(sightings[:chunkStart]).tofile(remappedFile)
+
+            chunk['Key'] = remappedKeys
+            chunk.tofile(remappedFile)
+
+        del sightings
+
+        if remappedFile is not None:
+            remappedFile.flush()
+            os.fsync(remappedFile.fileno())
+            remappedFile.close()
+            os.replace(segmentPath + '.remapping', segmentPath + '.remapped')
+            remappedRows += rowCount
+
+    return remappedRows
+
+
+def ReplaceRemappedSegments(sightingsPath):
+    # Moves RemapSegments' copies over their segments (only once every copy is written)
+
+    # Process:  index.npz goes first (its keys would be the old ones - the first query rebuilds it)
+    #           each X.sightings.remapped is renamed over X.sightings - one already renamed is simply gone
+
+    # Returns:  replacedSegments
+
+    remappedNames = sorted(fileName for fileName in os.listdir(sightingsPath)
+                           if fileName.endswith(segmentExtension + '.remapped'))
+
+    if len(remappedNames) == 0:
+        return 0
+
+    indexPath = os.path.join(sightingsPath, 'index.npz')
+    if os.path.exists(indexPath):
+        os.remove(indexPath)
+
+    for remappedName in remappedNames:
+        os.replace(os.path.join(sightingsPath, remappedName),
+                   os.path.join(sightingsPath, remappedName[:-len('.remapped')]))
+
+    return len(remappedNames)
+
+
+class SightingsLog:
+    # Buffered writer and query API over the hourly segment files
+
+    # Inputs:   sightingsPath (folder the segments live in)
+    #           flushRows (buffered sightings that trigger a write)
+    #           flushInterval (seconds a sighting can wait in the buffer)
+
+    # Process:  Record buffers one frame's identified faces
+    #           Flush groups the buffer by hour and appends each group to its segment
+    #               (a crash can only lose the unflushed buffer - a half written row at the end is ignored)
+    #           queries flush first, so they see everything recorded so far
+
+    def __init__(self, sightingsPath='./Data/Sightings/', flushRows=256, flushInterval=2):
+
+        self.sightingsPath = sightingsPath
+        self.flushRows = flushRows
+        self.flushInterval = flushInterval
+
+        os.makedirs(self.sightingsPath, exist_ok=True)
+
+        self.pendingRows = []
+        self.pendingCount = 0
+        self.lastFlushTime = time.perf_counter()
+
+        # Key / hour index (see UpdateIndex) - loaded on the first query
+        self.index = None
+        self.indexedRowCounts = {}
+        self.currentSummaries = {}
+
+        # Segment name -> hour, parsed once
+        self.segmentHours = {}
+
+        self.recordedSightings = 0
+
+    def Record(self, liveArray, sourceId, timestamp):
+        # Buffers every identified face in liveArray
+
+        # Inputs:   liveArray (after AppendDatabase - 'ForeignKey' = 0 rows are skipped)
+        #           sourceId (capture source / batch input number)
+        #           timestamp (epoch seconds the frame was captured)
+
+        identified = liveArray[liveArray['ForeignKey'] != 0]
+
+        if len(identified) > 0:
+
+            sightings = np.zeros(len(identified), sightingStructure)
+            sightings['Time'] = timestamp
+            sightings['Key'] = identified['ForeignKey']
+            sightings['Source'] = sourceId
+            sightings['Box'] = np.clip(identified['FaceLocation'], 0, 65535)
+            sightings['Distance'] = identified['Distance']
+
+            self.pendingRows.append(sightings)
+            self.pendingCount += len(sightings)
+            self.recordedSightings += len(sightings)
+
+        if self.pendingCount >= self.flushRows or \
+                (self.pendingCount > 0 and time.perf_counter() - self.lastFlushTime >= self.flushInterval):
+            self.Flush()
+
+    def Flush(self):
+        # Appends the buffer to the segment files
+
+        self.lastFlushTime = time.perf_counter()
+
+        if self.pendingCount == 0:
+            return
+
+        sightings = np.concatenate(self.pendingRows)
+        self.pendingRows = []
+        self.pendingCount = 0
+
+        hours = (sightings['Time'] // 3600).astype(np.int64)
+
+        for hour in np.unique(hours):
+
+            segmentPath = os.path.join(self.sightingsPath, SegmentName(hour))
+
+            with open(segmentPath, 'ab') as segmentFile:
+
+                # Drop a half written row left by a crash, so every row stays aligned
+                extraBytes = segmentFile.tell() % sightingStructure.itemsize
+                if extraBytes > 0:
+                    segmentFile.truncate(segmentFile.tell() - extraBytes)
+                    segmentFile.seek(0, os.SEEK_END)
+
+                sightings[hours == hour].tofile(segmentFile)
+
+    def Close(self):
+        self.Flush()
+
+    def Segments(self, startTime=None, endTime=None):
+        # (hour, segment name) pairs, oldest first, whose hour overlaps startTime - endTime
+        #   (epoch seconds, None = open ended)
+
+        firstHour = -np.inf if startTime is None else startTime // 3600
+        lastHour = np.inf if endTime is None else endTime // 3600
+
+        segments = []
+
+        for fileName in os.listdir(self.sightingsPath):
+
+            if not fileName.endswith(segmentExtension):
+                continue
+
+            if fileName not in self.segmentHours:
+                self.segmentHours[fileName] = SegmentHour(fileName)
+
+            if firstHour <= self.segmentHours[fileName] <= lastHour:
+                segments.append((self.segmentHours[fileName], fileName))
+
+        return sorted(segments)
+
+    def RowCount(self, segmentName):
+        return os.path.getsize(os.path.join(self.sightingsPath, segmentName)) // sightingStructure.itemsize
+
+    def ReadSegment(self, segmentName):
+        # Every whole row in one segment (memory-mapped - an hour of sightings is never copied in full)
+
+        rowCount = self.RowCount(segmentName)
+
+        if rowCount == 0:
+            return np.zeros(0, sightingStructure)
+
+        return np.memmap(os.path.join(self.sightingsPath, segmentName), sightingStructure, 'r', shape=(rowCount,))
+
+    def Summarize(self, hour, segmentName):
+        # One hour's keys, how often each was seen and when last
+
+        # Returns:  summary (indexStructure rows, one per key)
+
+        sightings = self.ReadSegment(segmentName)
+
+        keys, keyRows, counts = np.unique(
+            sightings['Key'], return_inverse=True, return_counts=True)
+
+        summary = np.zeros(len(keys), indexStructure)
+        summary['Key'] = keys
+        summary['Hour'] = hour
+        summary['Count'] = counts
+        summary['Last'] = -np.inf
+        np.maximum.at(summary['Last'], keyRows, sightings['Time'])
+
+        return summary
+
+    def UpdateIndex(self):
+        # Brings the key / hour index up to date with the segment files
+
+        # Process:  load ./Data/Sightings/index.npz the first time
+        #           summarize finished hours that aren't in it yet, or that grew since
+        #               (a batch run can add an old recording to an old hour)
+        #           save it again if anything changed
+        #           hours still being written are summarized in memory only (cached until they grow)
+
+        # Returns:  index (indexStructure rows for finished hours, sorted by key, then hour)
+        #           currentSummaries (one Summarize result per hour still being written, sorted by key)
+
+        indexPath = os.path.join(self.sightingsPath, 'index.npz')
+
+        if self.index is None:
+
+            self.index = np.zeros(0, indexStructure)
+            self.indexedRowCounts = {}
+
+            if os.path.exists(indexPath):
+                with np.load(indexPath) as savedIndex:
+                    self.index = savedIndex['index']
+                    self.indexedRowCounts = dict(
+                        zip(savedIndex['hours'].tolist(), savedIndex['rowCounts'].tolist()))
+
+        currentHour = time.time() // 3600
+
+        changedHours = []
+        changedSummaries = []
+        currentSummaries = []
+
+        for hour, segmentName in self.Segments():
+
+            rowCount = self.RowCount(segmentName)
+
+            if hour >= currentHour:
+
+                if self.currentSummaries.get(hour, (-1, None))[0] != rowCount:
+                    self.currentSummaries[hour] = (
+                        rowCount, self.Summarize(hour, segmentName))
+
+                currentSummaries.append(self.currentSummaries[hour][1])
+
+            elif self.indexedRowCounts.get(hour) != rowCount:
+                changedHours.append(hour)
+                changedSummaries.append(self.Summarize(hour, segmentName))
+                self.indexedRowCounts[hour] = rowCount
+
+        if len(changedHours) > 0:
+
+            keptRows = ~np.isin(self.index['Hour'], changedHours)
+            self.index = np.concatenate(
+                [self.index[keptRows]] + changedSummaries)
+            self.index = self.index[np.lexsort(
+                (self.index['Hour'], self.index['Key']))]
+
+            temporaryPath = indexPath + '.tmp.npz'
+            np.savez(temporaryPath, index=self.index, hours=np.array(list(self.indexedRowCounts.keys()), np.int64),
+                     rowCounts=np.array(list(self.indexedRowCounts.values()), np.int64))
+            os.replace(temporaryPath, indexPath)
+
+        # Hours that finished since they were cached move into the saved index above
+        for hour in [hour for hour in self.currentSummaries if hour < currentHour]:
+            del self.currentSummaries[hour]
+
+        return self.index, currentSummaries
+
+    def KeyHours(self, key, startTime=None, endTime=None):
+        # Index rows for one key (hours it was seen in), oldest first
+
+        index, currentSummaries = self.UpdateIndex()
+
+        # Every part is sorted by key, so the key's rows are one slice of each
+        #   (current hours are newer than any finished hour - appending them keeps hour order)
+        keyRows = np.concatenate([summary[np.searchsorted(summary['Key'], key, 'left'):
+                                          np.searchsorted(summary['Key'], key, 'right')]
+                                  for summary in [index] + currentSummaries])
+
+        if startTime is not None:
+            keyRows = keyRows[keyRows['Hour'] >= startTime // 3600]
+        if endTime is not None:
+            keyRows = keyRows[keyRows['Hour'] <= endTime // 3600]
+
+        return keyRows
+
+    def LastSeen(self, key):
+        # Most recent sighting of key
+
+        # Returns:  one sightingStructure row, or None if key was never seen
+
+        self.Flush()
+
+        keyRows = self.KeyHours(key)
+
+        if len(keyRows) == 0:
+            return None
+
+        # The hour holding the latest sighting (a batch run can add older recordings later,
+        #   so that isn't always the newest hour the key appears in)
+        lastHour = int(keyRows['Hour'][np.argmax(keyRows['Last'])])
+
+        sightings = self.ReadSegment(SegmentName(lastHour))
+        keyRows = np.nonzero(sightings['Key'] == key)[0]
+
+        return np.array(sightings[keyRows[np.argmax(sightings['Time'][keyRows])]])
+
+    def Sightings(self, key, startTime=None, endTime=None):
+        # Every sighting of key from startTime up to (not including) endTime, oldest first
+
+        # Inputs:   key (databaseArray 'Key')
+        #           startTime, endTime (epoch seconds, None = open ended)
+
+        # Returns:  sightings (sightingStructure array)
+
+        self.Flush()
+
+        foundSightings = []
+
+        # Only the hours the key was seen in are opened
+        for hour in self.KeyHours(key, startTime, endTime)['Hour']:
+
+            sightings = self.ReadSegment(SegmentName(hour))
+
+            keep = sightings['Key'] == key
+            if startTime is not None:
+                keep &= sightings['Time'] >= startTime
+            if endTime is not None:
+                keep &= sightings['Time'] < endTime
+
+            foundSightings.append(np.array(sightings[keep]))
+
+        if len(foundSightings) == 0:
+            return np.zeros(0, sightingStructure)
+
+        foundSightings = np.concatenate(foundSightings)
+
+        return foundSightings[np.argsort(foundSightings['Time'], kind='stable')]
+
+    def HourlyCounts(self, startTime, endTime, key=None):
+        # Sightings per hour from startTime up to endTime
+
+        # Inputs:   startTime, endTime (epoch seconds)
+        #           key (None = everybody - answered from file sizes alone)
+
+        # Returns:  hourStarts (epoch seconds each hour starts)
+        #           counts (sightings in each hour)
+
+        self.Flush()
+
+        firstHour = int(startTime // 3600)
+        hourStarts = np.arange(firstHour, int(
+            np.ceil(endTime / 3600)), dtype=np.int64) * 3600
+        counts = np.zeros(len(hourStarts), np.int64)
+
+        # (an endTime right on the hour lists that hour's segment too - it's outside the range)
+        if key is None:
+            hours = [hour for hour, segmentName in self.Segments(
+                startTime, endTime) if hour - firstHour < len(counts)]
+            counts[np.array(hours, np.int64) - firstHour] = [
+                self.RowCount(SegmentName(hour)) for hour in hours]
+        else:
+            keyRows = self.KeyHours(key, startTime, endTime)
+            keyRows = keyRows[keyRows['Hour'] - firstHour < len(counts)]
+            counts[keyRows['Hour'] - firstHour] = keyRows['Count']
+
+        # First / last hour only partly inside the range - count those row by row
+        for hour in {firstHour, firstHour + len(counts) - 1}:
+
+            if counts[hour - firstHour] == 0 or (hour * 3600 >= startTime and hour * 3600 + 3600 <= endTime):
+                continue
+
+            sightings = self.ReadSegment(SegmentName(hour))
+            keep = (sightings['Time'] >= startTime) & (
+                sightings['Time'] < endTime)
+            if key is not None:
+                keep &= sightings['Key'] == key
+            counts[hour - firstHour] = np.count_nonzero(keep)
+
+        return hourStarts, counts
+
+
+def FormatSighting(sighting):
+    # One line of text for a sighting row
+
+    return '{0}  key {1}  source {2}  box {3}  distance {4:0.3f}'.format(
+        datetime.fromtimestamp(float(sighting['Time'])).strftime(
+            '%Y-%m-%d %H:%M:%S'), int(sighting['Key']), int(sighting['Source']),
+        [int(value) for value in sighting['Box']], float(sighting['Distance']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Look up who was seen when in ./Data/Sightings/.')
+    parser.add_argument('--path', default='./Data/Sightings/',
+                        help='sightings folder')
+    queries = parser.add_subparsers(dest='query', required=True)
+
+    lastQuery = queries.add_parser('last', help='when a key was last seen')
+    lastQuery.add_argument('key', type=int)
+
+    betweenQuery = queries.add_parser(
+        'between', help='every sighting of a key between two local times')
+    betweenQuery.add_argument('key', type=int)
+    betweenQuery.add_argument('start', help='e.g. 2024-01-31T09:00')
+    betweenQuery.add_argument('end')
+
+    hourlyQuery = queries.add_parser(
+        'hourly', help='sightings per hour between two local times')
+    hourlyQuery.add_argument('start')
+    hourlyQuery.add_argument('end')
+    hourlyQuery.add_argument('--key', type=int, default=None)
+
+    arguments = parser.parse_args()
+
+    sightingsLog = SightingsLog(arguments.path)
+    queryStart = time.perf_counter()
+
+    if arguments.query == 'last':
+
+        lastSighting = sightingsLog.LastSeen(arguments.key)
+
+        if lastSighting is None:
+            print('Key ' + str(arguments.key) + ' was never seen')
+            sys.exit(1)
+
+        print(FormatSighting(lastSighting))
+
+    if arguments.query == 'between':
+
+        for sighting in sightingsLog.Sightings(arguments.key, datetime.fromisoformat(arguments.start).timestamp(),
+                                               datetime.fromisoformat(arguments.end).timestamp()):
+            print(FormatSighting(sighting))
+
+    if arguments.query == 'hourly':
+
+        hourStarts, counts = sightingsLog.HourlyCounts(datetime.fromisoformat(arguments.start).timestamp(),
+                                                       datetime.fromisoformat(arguments.end).timestamp(), arguments.key)
+
+        for hourStart, count in zip(hourStarts, counts):
+            print('{0}  {1}'.format(datetime.fromtimestamp(
+                int(hourStart)).strftime('%Y-%m-%d %H:00'), count))
+
+    print('({0:0.1f} ms)'.format((time.perf_counter() - queryStart) * 1000))
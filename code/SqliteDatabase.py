@@ -0,0 +1,623 @@
+# SQLite database backend for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# The .npy checkpoint (EncodingStorage / DatabaseJournal) is loaded and rewritten as a whole,
+#   and a second process can't safely read it while the webcam loop is writing it
+# This keeps databaseArray in one SQLite file instead, ./Data/Database/testDatabase2.sqlite:
+#   faces   one row per databaseArray row ('Row' = its index), 'FaceEncoding' (and every other array column)
+#               as a BLOB of raw float64 / float32
+#   names   interned names, 'NameId' n is row n
+#   exemplars   one row per exemplar in use ('Row', 'Position', 'Encoding' BLOB) - FaceDatabase.ExemplarTable
+# WAL mode: readers - other processes included - see the last committed state while changes are being written
+# Same interface as DatabaseJournal, so LoadArray / SaveArray don't care which one they're given:
+#   Record turns each change into its SQL statement right away (never touches the disk)
+#   the background thread writes everything recorded in one transaction every flushInterval seconds
+#       (a burst of AppendDatabase rows or TakeScreenshots 'FrameSaved' updates is one commit)
+#   Checkpoint folds the WAL back into the main file - every row is already saved, nothing is rewritten
+#   Load reads every encoding in one pass straight into one contiguous block for EncodingMatcher
+#   Rewrite replaces every row in one transaction (DatabaseCompaction.py)
+# An empty testDatabase2.sqlite is filled from testDatabase2.npy the first time it's loaded
+
+# Run:      python3 SqliteDatabase.py import     (testDatabase2.npy -> testDatabase2.sqlite)
+#           python3 SqliteDatabase.py export     (testDatabase2.sqlite -> testDatabase2.npy)
+
+
+import os  # database files
+import sys  # command line
+import queue  # reader connection pool
+import sqlite3  # the database
+import threading  # flush / checkpoint thread
+import time  # flush and checkpoint intervals
+import argparse  # command line
+import itertools  # runs of the same statement
+import pathlib  # read-only connection URI
+from contextlib import contextmanager  # pooled reader connections
+import numpy as np  # array library
+from EncodingStorage import EncodingType, BlockColumns, LoadDatabase, SaveDatabase  # encoding precision, .npy import / export
+
+
+# Rows read per fetch while bulk loading
+loadChunkRows = 4096
+
+
+def ColumnType(fieldType):
+    # SQLite type for one databaseStructure field
+
+    if fieldType.shape != ():
+        return 'BLOB'
+
+    if fieldType.kind == 'f':
+        return 'REAL'
+
+    return 'INTEGER'
+
+
+def DecodeBlobs(blobs, block, encodingType):
+    # Copies a chunk of BLOBs into block (rows x column shape)
+
+    # Inputs:   blobs (raw float64 / float32 bytes per row, None = zeros)
+    #           block (where they go - any float type)
+    #           encodingType (what a BLOB of neither size is read as)
+
+    # Process:  NULL rows are zeros
+    #           every other row at once when they're all the same precision (the usual case)
+    #           one at a time otherwise - encodingStorage was changed partway, or the column's shape
+    #               (a BLOB shorter than the column is zero padded, a longer one cut off)
+
+    elementCount = int(np.prod(block.shape[1:]))
+
+    block[:] = 0
+
+    presentRows = [row for row, blob in enumerate(blobs) if blob]
+    blobBytes = b''.join(blobs[row] for row in presentRows)
+
+    for blobType in (np.float64, np.float32):
+        if len(blobBytes) == np.dtype(blobType).itemsize * elementCount * len(presentRows):
+            block[presentRows] = np.frombuffer(blobBytes, blobType).reshape(
+                (len(presentRows),) + block.shape[1:])
+            return
+
+    for row in presentRows:
+
+        blob = blobs[row]
+
+        blobType = encodingType
+        for sizedType in (np.float64, np.float32):
+            if len(blob) == np.dtype(sizedType).itemsize * elementCount:
+                blobType = sizedType
+
+        values = np.frombuffer(
+            blob[:len(blob) - len(blob) % np.dtype(blobType).itemsize], blobType)[:elementCount]
+
+        block[row].reshape(-1)[:len(values)] = values
+
+
+def SqlValue(value, encodingType):
+    # A databaseArray value as something sqlite3 can bind (arrays become raw bytes at encodingType)
+
+    if isinstance(value, np.ndarray):
+
+        # All zeros - no need to spend a BLOB on them (NULL reads back as zeros)
+        if not value.any():
+            return None
+
+        return np.ascontiguousarray(value, encodingType).tobytes()
+
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+
+class SqliteDatabase:
+    # databaseArray's storage as one SQLite file (drop-in for DatabaseJournal)
+
+    # Inputs:   databasePath (./Data/Database/testDatabase2.sqlite)
+    #           databaseStructure (numpy column names and types - one table column per field)
+    #           flushInterval (seconds between write transactions)
+    #           checkpointInterval (seconds between WAL checkpoints)
+    #           encodingStorage ('FaceEncoding' BLOB precision, see EncodingStorage.encodingStorages)
+    #           readerCount (read-only connections kept open for Load / Query)
+    #           importPath (.npy checkpoint an empty database is filled from)
+
+    # Process:  the writer connection belongs to the background thread (and Stop / Import once it's gone)
+    #           Reader hands out pooled read-only connections, each query sees one consistent snapshot
+
+    def __init__(self, databasePath='./Data/Database/testDatabase2.sqlite', databaseStructure=None, flushInterval=2.0,
+                 checkpointInterval=300.0, encodingStorage='float64', readerCount=2,
+                 importPath='./Data/Database/testDatabase2.npy'):
+
+        self.databasePath = databasePath
+        self.databaseStructure = np.dtype(databaseStructure)
+        self.flushInterval = flushInterval
+        self.checkpointInterval = checkpointInterval
+        self.encodingStorage = encodingStorage
+        self.encodingType = EncodingType(encodingStorage)
+        self.importPath = importPath
+
+        # Array columns ('FaceEncoding') are BLOBs, every other column is a number
+        self.blockColumns = BlockColumns(self.databaseStructure)
+        self.columnNames = [columnName for columnName in self.databaseStructure.names
+                            if columnName not in self.blockColumns]
+
+        # (statement, parameters) recorded but not written yet - writeLock only guards the list, so Record never waits on a commit
+        self.pendingStatements = []
+        self.writeLock = threading.Lock()
+
+        # Guards the writer connection (transactions, WAL checkpoints) - always taken before writeLock
+        self.writerLock = threading.Lock()
+
+        self.pendingCheckpoint = False
+        self.lastCheckpointTime = time.monotonic()
+
+        # Counters
+        self.recordedEntries = 0
+        self.writtenTransactions = 0
+        self.writtenCheckpoints = 0
+
+        self.writer = sqlite3.connect(
+            databasePath, check_same_thread=False, timeout=30)
+        self.writer.execute('PRAGMA journal_mode=WAL')
+        # A commit is on disk when it returns - same promise as the journal's fsync
+        self.writer.execute('PRAGMA synchronous=FULL')
+
+        tableColumns = {columnName: '"{0}" {1}'.format(columnName, ColumnType(self.databaseStructure.fields[columnName][0])) +
+                        ('' if columnName in self.blockColumns else ' NOT NULL DEFAULT 0')
+                        for columnName in self.databaseStructure.names}
+
+        with self.writer:
+            self.writer.execute(
+                'CREATE TABLE IF NOT EXISTS faces (Row INTEGER PRIMARY KEY, ' + ', '.join(tableColumns.values()) + ')')
+            self.writer.execute(
+                'CREATE TABLE IF NOT EXISTS names (NameId INTEGER PRIMARY KEY, Name TEXT NOT NULL)')
+            self.writer.execute(
+                'CREATE TABLE IF NOT EXISTS exemplars (Row INTEGER, Position INTEGER, Encoding BLOB, PRIMARY KEY (Row, Position))')
+
+            # A database made before a column was added to databaseStructure gets it now (zero / NULL everywhere)
+            existingColumns = [tableInfo[1] for tableInfo in self.writer.execute(
+                'PRAGMA table_info(faces)')]
+            for columnName, columnDefinition in tableColumns.items():
+                if columnName not in existingColumns:
+                    self.writer.execute(
+                        'ALTER TABLE faces ADD COLUMN ' + columnDefinition)
+
+            # A database from when every row had an 'Exemplars' BLOB - the ones in use move to the exemplars table
+            if 'Exemplars' in existingColumns and 'Exemplars' not in tableColumns:
+                self.MigrateExemplars()
+
+        self.readerCount = readerCount
+        self.readers = queue.Queue()
+
+        self.stopEvent = threading.Event()
+        self.wakeEvent = threading.Event()
+        self.thread = threading.Thread(
+            target=self.BackgroundLoop, name='SqliteDatabase', daemon=True)
+        self.thread.start()
+
+    def MigrateExemplars(self):
+        # Moves old per-row 'Exemplars' BLOBs into the exemplars table (inside __init__'s transaction)
+
+        # Process:  each BLOB is read as encodingStorage's precision (what it was written with),
+        #               every exemplar in it that isn't zeros becomes a row of exemplars
+        #           the old column is emptied (SQLite can't drop it everywhere) and is never read again
+
+        elementBytes = 128 * np.dtype(self.encodingType).itemsize
+
+        for row, blob in self.writer.execute('SELECT Row, Exemplars FROM faces WHERE Exemplars IS NOT NULL').fetchall():
+
+            if len(blob) % elementBytes != 0:
+                continue
+
+            self.writer.executemany('INSERT OR REPLACE INTO exemplars (Row, Position, Encoding) VALUES (?, ?, ?)',
+                                    [(row, position, SqlValue(exemplar, self.encodingType)) for position, exemplar in
+                                     enumerate(np.frombuffer(blob, self.encodingType).reshape(-1, 128)) if exemplar.any()])
+
+        self.writer.execute(
+            'UPDATE faces SET Exemplars = NULL WHERE Exemplars IS NOT NULL')
+
+    @contextmanager
+    def Reader(self):
+        # A read-only connection from the pool, inside one read transaction (one snapshot for every query)
+
+        try:
+            connection = self.readers.get_nowait()
+        except queue.Empty:
+            connection = sqlite3.connect(pathlib.Path(self.databasePath).absolute().as_uri() + '?mode=ro',
+                                         uri=True, check_same_thread=False, isolation_level=None, timeout=30)
+
+        connection.execute('BEGIN')
+
+        try:
+            yield connection
+
+        finally:
+            connection.execute('COMMIT')
+
+            if self.readers.qsize() < self.readerCount:
+                self.readers.put(connection)
+            else:
+                connection.close()
+
+    def Query(self, statement, parameters=()):
+        # Runs one read-only query on a pooled connection
+
+        # Returns:  rows (list of tuples)
+
+        with self.Reader() as connection:
+            return connection.execute(statement, parameters).fetchall()
+
+    def RowCount(self):
+        return self.Query('SELECT COUNT(*) FROM faces')[0][0]
+
+    def Exists(self):
+        # True if there's a database to load (here, or a .npy checkpoint to fill this one from)
+
+        return self.RowCount() > 0 or os.path.exists(self.importPath)
+
+    def Load(self):
+        # Reads the whole database
+
+        # Process:  empty database and a .npy checkpoint next to it: Import it first
+        #           ReadAll: names, the small columns, then every encoding - fetched in chunks and copied
+        #               straight into one preallocated block per array column (converted to encodingStorage on the way)
+        #           all inside one read transaction, so rows written meanwhile can't tear the result
+
+        # Returns:  same as EncodingStorage.LoadDatabase:
+        #           columnArray (structured array, every column but the array columns)
+        #           encodingBlocks (column name -> rows x column shape, every array column)
+        #           indexArray (None - EncodingMatcher.Sync builds it)
+        #           names (interned names 'NameId' points into)
+        #           exemplarArrays ((rows, blocks) for ExemplarTable.Adopt, None if there aren't any)
+
+        if self.RowCount() == 0 and os.path.exists(self.importPath):
+            self.Import(self.importPath)
+
+        return self.ReadAll()
+
+    def ReadAll(self):
+        # Load without the import - see Load
+
+        columnStructure = np.dtype([(columnName, self.databaseStructure.fields[columnName][0])
+                                    for columnName in self.columnNames])
+
+        with self.Reader() as connection:
+
+            names = [name for (name,) in connection.execute(
+                'SELECT Name FROM names ORDER BY NameId')]
+
+            rowCount = connection.execute(
+                'SELECT COUNT(*) FROM faces').fetchone()[0]
+
+            columnArray = np.zeros(rowCount, columnStructure)
+            encodingBlocks = {columnName: np.zeros((rowCount,) + self.databaseStructure.fields[columnName][0].shape,
+                                                   self.encodingType) for columnName in self.blockColumns}
+
+            cursor = connection.execute('SELECT ' + ', '.join('"' + columnName + '"' for columnName in
+                                                              self.columnNames + self.blockColumns) + ' FROM faces ORDER BY Row')
+
+            loadedRows = 0
+
+            while True:
+
+                rows = cursor.fetchmany(loadChunkRows)
+                if len(rows) == 0:
+                    break
+
+                columns = list(zip(*rows))
+                chunkRows = slice(loadedRows, loadedRows + len(rows))
+
+                for columnIndex, columnName in enumerate(self.columnNames):
+                    columnArray[columnName][chunkRows] = columns[columnIndex]
+
+                # float64 or float32 BLOBs - whatever encodingStorage was when they were written
+                for columnIndex, columnName in enumerate(self.blockColumns, len(self.columnNames)):
+                    DecodeBlobs(columns[columnIndex], encodingBlocks[columnName][chunkRows], self.encodingType)
+
+                loadedRows += len(rows)
+
+            exemplarArrays = self.ReadExemplars(connection)
+
+        return columnArray, encodingBlocks, None, names, exemplarArrays
+
+    def ReadExemplars(self, connection):
+        # The exemplars table as ExemplarTable.Arrays() would give it (blocks as wide as the highest position used)
+
+        # Returns:  exemplarArrays ((rows, blocks), None if the table is empty)
+
+        exemplarEntries = connection.execute(
+            'SELECT Row, Position, Encoding FROM exemplars ORDER BY Row, Position').fetchall()
+
+        if len(exemplarEntries) == 0:
+            return None
+
+        entryRows, positions, blobs = zip(*exemplarEntries)
+        positions = np.array(positions)
+
+        exemplarRows, slots = np.unique(
+            np.array(entryRows, np.int64), return_inverse=True)
+
+        encodings = np.zeros((len(blobs), 128), self.encodingType)
+        DecodeBlobs(blobs, encodings, self.encodingType)
+
+        exemplarBlocks = np.zeros(
+            (len(exemplarRows), positions.max() + 1, 128), self.encodingType)
+        exemplarBlocks[slots, positions] = encodings
+
+        return exemplarRows, exemplarBlocks
+
+    def Import(self, checkpointPath):
+        # Replaces everything in the database with a .npy checkpoint
+
+        # Inputs:   checkpointPath (testDatabase2.npy)
+
+        # Process:  EncodingStorage.LoadDatabase, then one transaction: clear both tables, insert every name and row
+        #           (changes still in the .npy's journal aren't part of the checkpoint - they're left behind)
+
+        # Returns:  importedRows
+
+        columnArray, encodingBlocks, indexArray, names, exemplarArrays = LoadDatabase(
+            checkpointPath, self.encodingStorage, self.blockColumns)
+
+        # Block files have spare rows past the last one (array columns the checkpoint doesn't have stay NULL)
+        blockColumns = [
+            columnName for columnName in self.blockColumns if columnName in encodingBlocks]
+
+        journalPath = os.path.splitext(checkpointPath)[0] + '.journal'
+        if os.path.exists(journalPath) and os.path.getsize(journalPath) > 0:
+            print('WARNING: ' + journalPath + ' has changes that were never checkpointed - '
+                  "run once with databaseBackend = 'npy' to fold them in, then import again")
+
+        with self.writerLock:
+            self.WriteAll(columnArray, encodingBlocks,
+                          names, blockColumns, exemplarArrays)
+
+        print('Imported {0} rows from {1}'.format(
+            len(columnArray), checkpointPath))
+
+        return len(columnArray)
+
+    def Rewrite(self, savedArray, savedNames, savedExemplars=None):
+        # Replaces the whole database (DatabaseCompaction.py - rows can be gone or renumbered)
+
+        # Inputs:   savedArray, savedNames, savedExemplars (the new database - has to include every change recorded so far)
+
+        # Process:  changes still waiting to be written are dropped (savedArray has them),
+        #           then WriteAll in one transaction - a crash leaves either the old database or the new one
+
+        # Returns:  void
+
+        with self.writerLock:
+
+            with self.writeLock:
+                self.pendingStatements = []
+
+            self.WriteAll(savedArray, savedArray, savedNames,
+                          self.blockColumns, savedExemplars)
+
+    def WriteAll(self, columnArray, encodingBlocks, names, blockColumns, exemplarArrays=None):
+        # One transaction: clear every table, insert every name, row and exemplar (caller holds writerLock)
+
+        # Inputs:   columnArray (the small columns - a structured array)
+        #           encodingBlocks (column name -> rows x column shape, may have spare rows past len(columnArray))
+        #           names (interned names 'NameId' points into)
+        #           blockColumns (array columns to write - the rest stay NULL)
+        #           exemplarArrays (ExemplarTable.Arrays(), None = no exemplars)
+
+        with self.writer:
+
+            self.writer.execute('DELETE FROM faces')
+            self.writer.execute('DELETE FROM names')
+            self.writer.execute('DELETE FROM exemplars')
+
+            if exemplarArrays is not None:
+                self.writer.executemany('INSERT INTO exemplars (Row, Position, Encoding) VALUES (?, ?, ?)',
+                                        [(int(row), position, SqlValue(exemplar, self.encodingType))
+                                         for row, block in zip(*exemplarArrays)
+                                         for position, exemplar in enumerate(block) if exemplar.any()])
+
+            self.writer.executemany('INSERT INTO names (NameId, Name) VALUES (?, ?)',
+                                    enumerate(names))
+
+            for chunkStart in range(0, len(columnArray), loadChunkRows):
+
+                chunkRows = slice(chunkStart, min(
+                    chunkStart + loadChunkRows, len(columnArray)))
+
+                self.writer.executemany(self.InsertStatement(self.columnNames + blockColumns), zip(
+                    range(chunkRows.start, chunkRows.stop),
+                    *[columnArray[columnName][chunkRows].tolist() for columnName in self.columnNames],
+                    *[[SqlValue(encoding, self.encodingType) for encoding in encodingBlocks[columnName][chunkRows]]
+                      for columnName in blockColumns]))
+
+    def Export(self, checkpointPath):
+        # Writes the database out as a .npy checkpoint (EncodingStorage.SaveDatabase layout)
+
+        # Returns:  exportedRows
+
+        columnArray, encodingBlocks, indexArray, names, exemplarArrays = self.ReadAll()
+
+        savedArray = np.zeros(len(columnArray), self.databaseStructure)
+        for columnName in self.columnNames:
+            savedArray[columnName] = columnArray[columnName]
+        for columnName in self.blockColumns:
+            savedArray[columnName] = encodingBlocks[columnName]
+
+        SaveDatabase(checkpointPath, savedArray, names,
+                     self.encodingStorage, exemplarArrays)
+
+        return len(savedArray)
+
+    def InsertStatement(self, columnNames):
+        # INSERT for one row with these columns (plus 'Row' first)
+
+        return 'INSERT OR REPLACE INTO faces (Row' + ''.join(', "' + columnName + '"' for columnName in columnNames) + \
+            ') VALUES (' + ', '.join('?' * (len(columnNames) + 1)) + ')'
+
+    def Record(self, entry):
+        # Queues one change - called by DatabaseStore on the main loop, never touches the disk
+
+        # Inputs:   entry (dict: 'op' plus the values needed to redo the change, see DatabaseStore)
+
+        if entry['op'] == 'append':
+            values = entry['values']
+            columnNames = [columnName for columnName in self.databaseStructure.names
+                           if columnName in values]
+            statement = (self.InsertStatement(columnNames), tuple(
+                [entry['row']] + [SqlValue(values[columnName], self.encodingType) for columnName in columnNames]))
+
+        elif entry['op'] == 'name':
+            statement = ('INSERT OR REPLACE INTO names (NameId, Name) VALUES (?, ?)',
+                         (entry['id'], entry['name']))
+
+        elif entry['op'] == 'exemplar':
+            statement = ('INSERT OR REPLACE INTO exemplars (Row, Position, Encoding) VALUES (?, ?, ?)',
+                         (entry['row'], entry['position'], SqlValue(entry['value'], self.encodingType)))
+
+        elif entry['op'] == 'set':
+            if entry['column'] not in self.databaseStructure.names:
+                raise KeyError(entry['column'])
+            statement = ('UPDATE faces SET "' + entry['column'] + '" = ? WHERE Row = ?',
+                         (SqlValue(entry['value'], self.encodingType), entry['row']))
+
+        else:
+            raise ValueError('unknown journal op ' + str(entry['op']))
+
+        with self.writeLock:
+            self.pendingStatements.append(statement)
+            self.recordedEntries += 1
+
+    def Flush(self):
+        # Writes every pending change in one transaction (runs of the same statement go through executemany)
+
+        # Process:  take the pending statements (a moment under writeLock)
+        #           commit them holding only writerLock - Record carries on meanwhile
+
+        with self.writerLock:
+
+            with self.writeLock:
+                pendingStatements = self.pendingStatements
+                self.pendingStatements = []
+
+            if len(pendingStatements) == 0:
+                return
+
+            try:
+                with self.writer:
+                    for sql, statements in itertools.groupby(pendingStatements, key=lambda statement: statement[0]):
+                        self.writer.executemany(
+                            sql, [parameters for statementSql, parameters in statements])
+
+            # A failed write goes back in front of anything recorded since, and is tried again next flush
+            except Exception:
+                with self.writeLock:
+                    self.pendingStatements = pendingStatements + self.pendingStatements
+                raise
+
+            self.writtenTransactions += 1
+
+    def CheckpointDue(self):
+        # True once checkpointInterval has passed and no checkpoint is still waiting
+
+        return not self.pendingCheckpoint and \
+            time.monotonic() - self.lastCheckpointTime >= self.checkpointInterval
+
+    def Checkpoint(self, savedArray=None, savedNames=None, savedExemplars=None, wait=False):
+        # Flushes, then folds the WAL into the main database file on the background thread
+
+        # Inputs:   savedArray, savedNames, savedExemplars (unused - every change already went through Record)
+        #           wait (True = return only once it's done)
+
+        # Returns:  void
+
+        self.pendingCheckpoint = True
+        self.lastCheckpointTime = time.monotonic()
+        self.wakeEvent.set()
+
+        if wait:
+            while self.pendingCheckpoint and self.thread.is_alive():
+                time.sleep(0.01)
+
+    def WriteCheckpoint(self):
+
+        self.Flush()
+
+        # Readers in the middle of a query keep their part of the WAL - it goes next time
+        with self.writerLock:
+            self.writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+        self.writtenCheckpoints += 1
+
+    def BackgroundLoop(self):
+        # Writes a transaction every flushInterval seconds, checkpoints when asked
+
+        while not self.stopEvent.is_set():
+
+            self.wakeEvent.wait(self.flushInterval)
+            self.wakeEvent.clear()
+
+            try:
+                self.Flush()
+
+                if self.pendingCheckpoint:
+                    self.WriteCheckpoint()
+                    self.pendingCheckpoint = False
+
+            # Handle any and all of the weird reasons a write might fail - try again next time
+            except Exception as error:
+                print('ERROR: Unable to write SQLite database: ' + str(error))
+
+                # Don't leave Checkpoint(wait=True) waiting forever
+                self.pendingCheckpoint = False
+
+    def Replay(self, databaseArray):
+        # Nothing to redo - every committed transaction is already in the database a crash left behind
+
+        return 0
+
+    def Stop(self):
+        # Writes what's left, checkpoints, closes every connection
+
+        self.stopEvent.set()
+        self.wakeEvent.set()
+        self.thread.join()
+
+        self.WriteCheckpoint()
+        self.pendingCheckpoint = False
+
+        while not self.readers.empty():
+            self.readers.get_nowait().close()
+
+        self.writer.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Copy the face database between testDatabase2.npy and testDatabase2.sqlite.')
+    parser.add_argument('direction', choices=('import', 'export'),
+                        help='import: .npy -> .sqlite, export: .sqlite -> .npy')
+    parser.add_argument('--npy', default='./Data/Database/testDatabase2.npy',
+                        help='.npy checkpoint')
+    parser.add_argument('--sqlite', default='./Data/Database/testDatabase2.sqlite',
+                        help='SQLite database')
+
+    arguments = parser.parse_args()
+
+    # Same columns and encoding precision as the webcam loop
+    import DatabasingFromWebcam as Webcam  # databaseStructure, encodingStorage
+
+    if arguments.direction == 'import' and not os.path.exists(arguments.npy):
+        print('No database at ' + arguments.npy)
+        sys.exit(1)
+
+    sqliteDatabase = SqliteDatabase(arguments.sqlite, Webcam.databaseStructure, encodingStorage=Webcam.encodingStorage,
+                                    importPath=arguments.npy)
+
+    if arguments.direction == 'import':
+        sqliteDatabase.Import(arguments.npy)
+
+    if arguments.direction == 'export':
+        print('Exported {0} rows to {1}'.format(
+            sqliteDatabase.Export(arguments.npy), arguments.npy))
+
+    sqliteDatabase.Stop()
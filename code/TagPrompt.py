@@ -0,0 +1,88 @@
+# Terminal tagging prompt for DatabasingFromWebcam.py
+# Copyright Doug Hardy and John Granholm
+
+# Clicking an Unknown box used to stop the main loop at input() until the user finished typing
+# The question is now asked on its own thread - capture, recognition and screenshots keep going
+#   while the user types, and the main loop picks up finished answers between frames
+#   (anything that touches databaseArray still happens on the main thread)
+
+
+import queue  # questions waiting to be asked, answers waiting to be used
+import threading  # prompt thread
+
+
+class TagPrompt:
+    # One terminal prompt on its own thread
+
+    # Inputs:   promptFunction (reads one line of user text - input unless testing)
+
+    # Process:  Ask queues a question about one database row without waiting
+    #               (a row that's already waiting for an answer isn't asked about twice)
+    #           the prompt thread asks each question in turn
+    #           Answers returns every answer typed since the last call, without waiting
+
+    def __init__(self, promptFunction=input):
+
+        self.promptFunction = promptFunction
+
+        self.questionQueue = queue.Queue()
+        self.answerQueue = queue.Queue()
+
+        # Database rows asked about and not answered yet - only touched by the main thread
+        self.pendingRows = set()
+
+        self.thread = threading.Thread(
+            target=self.PromptLoop, name='TagPrompt', daemon=True)
+        self.thread.start()
+
+    def Ask(self, databaseRow, currentName):
+        # Queues one question
+
+        # Inputs:   databaseRow (which database row the clicked box points to)
+        #           currentName (what it's called now - shown in the prompt)
+
+        # Returns:  True if queued, False if that row is already waiting for an answer
+
+        if databaseRow in self.pendingRows:
+            return False
+
+        self.pendingRows.add(databaseRow)
+        self.questionQueue.put((databaseRow, currentName))
+
+        return True
+
+    def PromptLoop(self):
+        # Runs on the prompt thread - the only place input() is called
+
+        while True:
+
+            databaseRow, currentName = self.questionQueue.get()
+
+            # No terminal to read from (closed or redirected stdin) - answer blank, which tags nothing
+            try:
+                newNameInput = self.promptFunction('Tag ' + currentName + ': ')
+
+            except (EOFError, OSError):
+                newNameInput = ''
+
+            self.answerQueue.put((databaseRow, newNameInput.strip()))
+
+    def Answers(self):
+        # Every answer typed since the last call
+
+        # Returns:  list of (databaseRow, newNameInput), oldest first - empty most of the time
+
+        answers = []
+
+        while True:
+
+            try:
+                answers.append(self.answerQueue.get_nowait())
+
+            except queue.Empty:
+                break
+
+        for databaseRow, newNameInput in answers:
+            self.pendingRows.discard(databaseRow)
+
+        return answers
@@ -0,0 +1,45 @@
+# Shared setup for the tests
+# Copyright Doug Hardy and John Granholm
+
+# The modules live side by side in ../code/ (no package) - put it on the import path
+# Run:      python3 -m pytest -q        (from the repository root)
+
+
+import os  # code folder
+import sys  # import path
+import numpy as np  # array library
+import pytest  # fixtures
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'code'))
+
+
+def RandomEncodings(rowCount, seed=0):
+    # rowCount unit length 128-d encodings, far enough apart that none match another at 0.6
+
+    encodings = np.random.default_rng(seed).normal(size=(rowCount, 128))
+
+    return encodings / np.linalg.norm(encodings, axis=1, keepdims=True)
+
+
+def NearbyEncoding(encoding, distance, seed=0):
+    # An encoding exactly distance away from encoding
+
+    offset = np.random.default_rng(seed).normal(size=128)
+
+    return encoding + distance * offset / np.linalg.norm(offset)
+
+
+@pytest.fixture
+def databaseStructure():
+    import DatabasingFromWebcam as Webcam  # database layout
+
+    return Webcam.databaseStructure
+
+
+@pytest.fixture
+def liveDataStructure():
+    import DatabasingFromWebcam as Webcam  # liveArray layout
+
+    return Webcam.liveDataStructure
@@ -0,0 +1,173 @@
+# Tests for DatabaseCompaction.py (FindDuplicates, MergeGroups, FinishCompaction)
+# Copyright Doug Hardy and John Granholm
+
+
+import os  # sightings, screenshot folders
+import numpy as np  # array library
+from DatabaseCompaction import FindDuplicates, MergeGroups, FinishCompaction  # what's tested
+from FaceDatabase import DatabaseStore, ExemplarTable  # database being compacted
+from FaceMatching import EncodingMatcher  # LoadArray's matcher
+from DatabaseJournal import DatabaseJournal  # journal a dry run mustn't fold in
+from SightingsLog import sightingStructure, RemapSegments  # sightings to renumber
+from conftest import RandomEncodings, NearbyEncoding  # test encodings
+
+
+def test_FindDuplicatesGroupsCloseRows():
+
+    encodings = RandomEncodings(20)
+    encodings[7] = NearbyEncoding(encodings[2], 0.2)
+    encodings[15] = NearbyEncoding(encodings[2], 0.2, seed=1)
+    encodings[11] = NearbyEncoding(encodings[4], 0.3)
+
+    # Blocks smaller than the rows - pairs across blocks are found too
+    groups = FindDuplicates(encodings, 0.4, blockRows=6)
+
+    assert sorted(group.tolist() for group in groups) == [[2, 7, 15], [4, 11]]
+
+    # rowIndexes name the rows in the result
+    groups = FindDuplicates(encodings[[2, 7]], 0.4, rowIndexes=np.array([40, 90]))
+
+    assert [group.tolist() for group in groups] == [[40, 90]]
+
+
+def test_FindDuplicatesNoChains():
+
+    # Each row is 0.35 from the next - row 3 is over 0.6 from row 0, so it can't join its group
+    direction = RandomEncodings(1)[0]
+    encodings = np.array([step * 0.35 * direction for step in range(4)])
+
+    groups = FindDuplicates(encodings, 0.4)
+
+    assert all(np.linalg.norm(encodings[group] - encodings[group[0]], axis=1).max() <= 0.6 for group in groups)
+    assert 3 not in groups[0]
+
+
+def CompactionStore(databaseStructure, rowCount):
+    # 'UnknownN' rows, except row 2 is 'Bob'
+
+    databaseArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+    encodings = RandomEncodings(rowCount)
+
+    for row in range(rowCount):
+        name = 'Bob' if row == 2 else 'Unknown' + str(row + 1)
+        databaseArray.Append(Key=row + 1, NameId=databaseArray.InternName(name),
+                             FrameSaved=row, FaceEncoding=encodings[row])
+
+    return databaseArray
+
+
+def test_MergeGroupsKeepsKeysAndNames(databaseStructure):
+
+    databaseArray = CompactionStore(databaseStructure, 10)
+    savedArray = databaseArray.ToArray()
+
+    compactedArray, compactedNames, compactedExemplars, keyMap, folderMoves = MergeGroups(
+        savedArray, databaseArray.names, [np.array([2, 8]), np.array([3, 5, 9])], databaseArray.exemplars.Arrays())
+
+    # Row 5's place goes to row 7, the last row kept - every other row stays put
+    assert len(compactedArray) == 7
+    assert np.array_equal(compactedArray['Key'], np.arange(1, 8))
+    assert [compactedNames[nameId] for nameId in compactedArray['NameId']] == \
+        ['Unknown1', 'Unknown2', 'Bob', 'Unknown4', 'Unknown5', 'Unknown8', 'Unknown7']
+    assert np.array_equal(compactedArray['FaceEncoding'][5], savedArray['FaceEncoding'][7])
+
+    assert keyMap.tolist() == [0, 1, 2, 3, 4, 5, 4, 7, 6, 3, 4]
+    assert folderMoves == [('Unknown6', 'Unknown4'), ('Unknown9', 'Bob'), ('Unknown10', 'Unknown4')]
+
+    # The group leaders took their group's encodings as exemplars, 'FrameSaved' is the latest of the group
+    assert compactedExemplars[0].tolist() == [2, 3]
+    assert compactedArray['ExemplarCount'][[2, 3]].tolist() == [2, 3]
+    assert compactedArray['FrameSaved'][[2, 3]].tolist() == [8, 9]
+    assert np.allclose(compactedArray['FaceEncoding'][3], savedArray['FaceEncoding'][[3, 5, 9]].mean(axis=0))
+
+
+def test_FinishCompactionRewritesChangedSegmentsOnly(tmp_path, databaseStructure):
+
+    databaseArray = CompactionStore(databaseStructure, 10)
+
+    compactedArray, compactedNames, compactedExemplars, keyMap, folderMoves = MergeGroups(
+        databaseArray.ToArray(), databaseArray.names, [np.array([3, 5, 9])])
+
+    planPath = str(tmp_path / 'compaction.npz')
+    sightingsPath = str(tmp_path / 'Sightings')
+    screenshotsPath = str(tmp_path / 'Screenshots')
+
+    np.savez(planPath, keyMap=keyMap, oldNames=np.array([oldName for oldName, newName in folderMoves], np.str_),
+             newNames=np.array([newName for oldName, newName in folderMoves], np.str_),
+             oldRowCount=10, newRowCount=len(compactedArray))
+
+    os.makedirs(sightingsPath)
+    for hour, keys in (('20240101-00', [1, 2, 3, 5]), ('20240101-01', [10, 9, 6, 4])):
+        sightings = np.zeros(len(keys), sightingStructure)
+        sightings['Key'] = keys
+        sightings.tofile(os.path.join(sightingsPath, hour + '.sightings'))
+    open(os.path.join(sightingsPath, 'index.npz'), 'wb').close()
+    unchangedTime = os.stat(os.path.join(sightingsPath, '20240101-00.sightings')).st_mtime_ns
+
+    for name in databaseArray.names:
+        os.makedirs(os.path.join(screenshotsPath, name))
+        open(os.path.join(screenshotsPath, name, '1.jpg'), 'w').close()
+
+    # A crash after the renumbered copies were written - they're swapped in, not renumbered again
+    RemapSegments(sightingsPath, keyMap)
+
+    FinishCompaction(len(compactedArray), planPath, sightingsPath, screenshotsPath)
+
+    # Key 9 took key 6's place, 6 and 10 became 4
+    #   - only the hour with changed keys was rewritten, the stale index is gone
+    assert os.stat(os.path.join(sightingsPath, '20240101-00.sightings')).st_mtime_ns == unchangedTime
+    assert np.fromfile(os.path.join(sightingsPath, '20240101-01.sightings'),
+                       sightingStructure)['Key'].tolist() == [4, 6, 4, 4]
+    assert sorted(os.listdir(sightingsPath)) == ['20240101-00.sightings', '20240101-01.sightings']
+
+    # Merged-away folders fold into their leader's, nobody else's moves
+    assert sorted(os.listdir(screenshotsPath)) == \
+        ['Bob', 'Unknown1', 'Unknown2', 'Unknown4', 'Unknown5', 'Unknown7', 'Unknown8', 'Unknown9']
+    assert sorted(os.listdir(os.path.join(screenshotsPath, 'Unknown4'))) == \
+        ['1-Unknown10.jpg', '1-Unknown6.jpg', '1.jpg']
+
+    assert not os.path.exists(planPath)
+
+
+def test_FinishCompactionNeverCommitted(tmp_path, databaseStructure):
+
+    planPath = str(tmp_path / 'compaction.npz')
+    np.savez(planPath, keyMap=np.arange(11, dtype=np.uint32), oldNames=np.array([], np.str_),
+             newNames=np.array([], np.str_), oldRowCount=10, newRowCount=7)
+
+    # The database still has its old row count - the plan is dropped, nothing is touched
+    FinishCompaction(10, planPath, str(tmp_path / 'Sightings'), str(tmp_path / 'Screenshots'))
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_DryRunLoadWritesNothing(tmp_path, monkeypatch, databaseStructure):
+    import DatabasingFromWebcam as Webcam  # LoadArray
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('./Data/Database/')
+    checkpointPath = './Data/Database/testDatabase2.npy'
+
+    # Changes only in the journal, and a plan for a compaction that never committed
+    databaseJournal = DatabaseJournal(checkpointPath)
+    databaseArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+    databaseArray.changeLog = databaseJournal
+    for row, encoding in enumerate(RandomEncodings(3)):
+        databaseArray.Append(Key=row + 1, NameId=databaseArray.InternName('Unknown' + str(row + 1)),
+                             FaceEncoding=encoding)
+    databaseJournal.Stop()
+    journalSize = os.path.getsize(databaseJournal.journalPath)
+
+    np.savez('./Data/Database/compaction.npz', keyMap=np.arange(4, dtype=np.uint32), oldNames=np.array([], np.str_),
+             newNames=np.array([], np.str_), oldRowCount=3, newRowCount=2)
+
+    # --dry-run: the journal is replayed in memory, no checkpoint is written and the plan is left alone
+    databaseJournal = DatabaseJournal(checkpointPath)
+    loadedArray = Webcam.LoadArray(databaseStructure, EncodingMatcher(), databaseJournal, exemplarLimit=4, readOnly=True)
+    loadedArray.SetValue('FrameSaved', 0, 42)
+    databaseJournal.Stop()
+
+    assert np.array_equal(loadedArray['Key'], [1, 2, 3])
+    assert not os.path.exists(checkpointPath)
+    assert os.path.getsize(databaseJournal.journalPath) == journalSize
+    assert os.path.exists('./Data/Database/compaction.npz')
@@ -0,0 +1,143 @@
+# Tests for DatabaseJournal.py (journal replay, checkpoints)
+# Copyright Doug Hardy and John Granholm
+
+
+import os  # journal files
+import numpy as np  # array library
+import pytest  # raises
+from DatabaseJournal import DatabaseJournal  # what's tested
+from FaceDatabase import DatabaseStore, ExemplarTable  # journaled databaseArray
+from conftest import RandomEncodings  # test encodings
+
+
+def JournaledStore(databaseStructure, databaseJournal):
+    # An empty store whose changes go to databaseJournal
+
+    databaseArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+    databaseArray.changeLog = databaseJournal
+
+    return databaseArray
+
+
+def AppendRows(databaseArray, encodings):
+
+    for encoding in encodings:
+        key = len(databaseArray) + 1
+        databaseArray.Append(Key=key, NameId=databaseArray.InternName(databaseArray.UnknownName(key)),
+                             FaceEncoding=encoding)
+
+
+def ReloadedStore(databaseStructure, databaseJournal):
+    # What LoadArray does: the checkpoint (if there is one), then the journal on top
+
+    databaseArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+
+    if databaseJournal.Exists():
+        columnArray, encodingBlocks, indexArray, names, exemplarArrays = databaseJournal.Load()
+        databaseArray.Adopt(columnArray, encodingBlocks, names)
+        if exemplarArrays is not None:
+            databaseArray.exemplars.Adopt(*exemplarArrays, rowCount=len(databaseArray))
+
+    replayedEntries = databaseJournal.Replay(databaseArray)
+
+    return databaseArray, replayedEntries
+
+
+def test_ReplayStopsAtTornTail(tmp_path, databaseStructure):
+
+    checkpointPath = str(tmp_path / 'testDatabase2.npy')
+    encodings = RandomEncodings(6)
+
+    databaseJournal = DatabaseJournal(checkpointPath, flushInterval=0.05)
+    databaseArray = JournaledStore(databaseStructure, databaseJournal)
+
+    AppendRows(databaseArray, encodings[:5])
+    databaseArray.SetValue('FrameSaved', 2, 1700000000)
+    databaseArray.SetExemplar(3, 1, encodings[5])
+    databaseArray.SetValue('NameId', 4, databaseArray.InternName('Bob'))
+    databaseJournal.Stop()
+
+    # A crash half way through writing the next entry
+    with open(databaseJournal.journalPath, 'a', encoding='utf-8') as journal:
+        journal.write('{"op": "append", "row": 5, "values": {"Key": 6, "Fa')
+
+    reloadJournal = DatabaseJournal(checkpointPath)
+    reloadedArray, replayedEntries = ReloadedStore(databaseStructure, reloadJournal)
+    reloadJournal.Stop()
+
+    assert replayedEntries == 14
+    assert np.array_equal(reloadedArray.ToArray(), databaseArray.ToArray())
+    assert reloadedArray.names == databaseArray.names
+    assert reloadedArray.Name(4) == 'Bob'
+    assert np.array_equal(reloadedArray.exemplars.Exemplars(3), databaseArray.exemplars.Exemplars(3))
+
+
+def test_CheckpointThenJournal(tmp_path, databaseStructure):
+
+    checkpointPath = str(tmp_path / 'testDatabase2.npy')
+    encodings = RandomEncodings(8)
+
+    databaseJournal = DatabaseJournal(checkpointPath, flushInterval=0.05)
+    databaseArray = JournaledStore(databaseStructure, databaseJournal)
+
+    AppendRows(databaseArray, encodings[:5])
+    databaseArray.SetExemplar(1, 0, encodings[7])
+    databaseJournal.Checkpoint(*databaseArray.Snapshot(), wait=True)
+
+    # The checkpoint holds everything so far - journal.old is gone, the journal starts over
+    assert databaseJournal.writtenCheckpoints == 1
+    assert not os.path.exists(databaseJournal.oldJournalPath)
+
+    AppendRows(databaseArray, encodings[5:7])
+    databaseArray.SetValue('FrameSaved', 0, 42)
+    databaseJournal.Stop()
+
+    reloadJournal = DatabaseJournal(checkpointPath)
+    reloadedArray, replayedEntries = ReloadedStore(databaseStructure, reloadJournal)
+    reloadJournal.Stop()
+
+    assert replayedEntries == 5
+    assert np.array_equal(reloadedArray.ToArray(), databaseArray.ToArray())
+    assert np.array_equal(reloadedArray.exemplars.Exemplars(1), databaseArray.exemplars.Exemplars(1))
+
+
+def test_ReplayOldJournalFirst(tmp_path, databaseStructure):
+
+    checkpointPath = str(tmp_path / 'testDatabase2.npy')
+    encodings = RandomEncodings(7)
+
+    databaseJournal = DatabaseJournal(checkpointPath, flushInterval=0.05)
+    databaseArray = JournaledStore(databaseStructure, databaseJournal)
+    AppendRows(databaseArray, encodings[:5])
+    databaseJournal.Stop()
+
+    # A crash after the journal was moved aside, before its checkpoint was written
+    os.replace(databaseJournal.journalPath, databaseJournal.oldJournalPath)
+
+    databaseJournal = DatabaseJournal(checkpointPath, flushInterval=0.05)
+    databaseArray, replayedEntries = ReloadedStore(databaseStructure, databaseJournal)
+    databaseArray.changeLog = databaseJournal
+    AppendRows(databaseArray, encodings[5:])
+    databaseJournal.Stop()
+
+    reloadJournal = DatabaseJournal(checkpointPath)
+    reloadedArray, replayedEntries = ReloadedStore(databaseStructure, reloadJournal)
+    reloadJournal.Stop()
+
+    assert len(reloadedArray) == 7
+    assert np.array_equal(reloadedArray.ToArray(), databaseArray.ToArray())
+    assert np.array_equal(reloadedArray['Key'], np.arange(1, 8))
+
+
+def test_ReplayUnknownOp(tmp_path, databaseStructure):
+
+    checkpointPath = str(tmp_path / 'testDatabase2.npy')
+
+    databaseJournal = DatabaseJournal(checkpointPath)
+    databaseJournal.Record({'op': 'rename', 'row': 0})
+    databaseJournal.Stop()
+
+    reloadJournal = DatabaseJournal(checkpointPath)
+    with pytest.raises(ValueError, match='unknown journal op rename'):
+        ReloadedStore(databaseStructure, reloadJournal)
+    reloadJournal.Stop()
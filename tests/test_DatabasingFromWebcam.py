@@ -0,0 +1,172 @@
+# Tests for DatabasingFromWebcam.py (PromoteUnknown, RevertPromotion, TakeScreenshots)
+# Copyright Doug Hardy and John Granholm
+
+
+import os  # screenshot folders
+import numpy as np  # array library
+import pytest  # fixtures
+import DatabasingFromWebcam as Webcam  # what's tested
+from FaceDatabase import DatabaseStore, ExemplarTable  # database being tagged
+from ScreenshotWriter import ScreenshotWriter  # folder renames
+from conftest import RandomEncodings  # test encodings
+
+
+class RecordingWriter:
+    # Stands in for ScreenshotWriter - keeps the screenshots and renames it's given instead of doing them
+
+    def __init__(self):
+        self.screenshots = []
+        self.renames = []
+
+    def Submit(self, filePath, image):
+        self.screenshots.append(filePath)
+        return True
+
+    def Backlog(self):
+        return 0
+
+    def RenameFolder(self, folderPath, newFolderPath, tag=None):
+        self.renames.append((folderPath, newFolderPath, tag))
+
+
+@pytest.fixture
+def screenshotsFolder(tmp_path, monkeypatch):
+    # PromoteUnknown works in ./Data/Screenshots/
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('./Data/Screenshots/')
+
+    return './Data/Screenshots/'
+
+
+def TaggingStore(databaseStructure, rowCount):
+    # 'UnknownN' rows
+
+    databaseArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+
+    for row, encoding in enumerate(RandomEncodings(rowCount)):
+        databaseArray.Append(Key=row + 1, NameId=databaseArray.InternName('Unknown' + str(row + 1)),
+                             FaceEncoding=encoding)
+
+    return databaseArray
+
+
+def LiveRows(liveDataStructure, databaseArray, keys):
+    # One source's lastFrameArray showing these 'ForeignKey's
+
+    liveArray = np.zeros(len(keys), liveDataStructure)
+    liveArray['ForeignKey'] = keys
+    liveArray['Name'] = [databaseArray.Name(key - 1) for key in keys]
+
+    return liveArray
+
+
+def test_PromoteThenRevert(screenshotsFolder, databaseStructure, liveDataStructure):
+
+    databaseArray = TaggingStore(databaseStructure, 3)
+    liveArrays = [LiveRows(liveDataStructure, databaseArray, [2, 1]),
+                  LiveRows(liveDataStructure, databaseArray, [2, 2, 3])]
+    os.makedirs(screenshotsFolder + 'Unknown2')
+
+    recordingWriter = RecordingWriter()
+    Webcam.PromoteUnknown('Bob', 1, liveArrays, databaseArray, recordingWriter)
+
+    assert databaseArray.Name(1) == 'Bob'
+    assert liveArrays[0]['Name'].tolist() == ['Bob', 'Unknown1']
+    assert liveArrays[1]['Name'].tolist() == ['Bob', 'Bob', 'Unknown3']
+
+    # Bob's folder turns up before the writer gets to the rename - it fails and hands its tag back
+    os.makedirs(screenshotsFolder + 'Bob')
+    screenshotWriter = ScreenshotWriter()
+    for rename in recordingWriter.renames:
+        screenshotWriter.RenameFolder(*rename)
+    screenshotWriter.Stop()
+
+    failedTags = screenshotWriter.FailedRenames()
+    assert failedTags == [(1, 'Unknown2', 'Bob')]
+    assert os.path.isdir(screenshotsFolder + 'Unknown2')
+
+    for databaseRow, currentName, newNameInput in failedTags:
+        Webcam.RevertPromotion(databaseRow, currentName, newNameInput, liveArrays, databaseArray)
+
+    assert databaseArray['NameId'][1] == databaseArray.nameIds['Unknown2']
+    assert liveArrays[0]['Name'].tolist() == ['Unknown2', 'Unknown1']
+    assert liveArrays[1]['Name'].tolist() == ['Unknown2', 'Unknown2', 'Unknown3']
+
+
+def test_RevertSkipsRetaggedRow(screenshotsFolder, databaseStructure, liveDataStructure):
+
+    databaseArray = TaggingStore(databaseStructure, 2)
+    liveArrays = [LiveRows(liveDataStructure, databaseArray, [1])]
+
+    # The row was given another name since the failed rename - that one stays
+    databaseArray.SetValue('NameId', 0, databaseArray.InternName('Carol'))
+    Webcam.RevertPromotion(0, 'Unknown1', 'Bob', liveArrays, databaseArray)
+
+    assert databaseArray.Name(0) == 'Carol'
+
+
+def test_SecondAnswerRejected(screenshotsFolder, databaseStructure, liveDataStructure):
+
+    databaseArray = TaggingStore(databaseStructure, 2)
+    liveArrays = [LiveRows(liveDataStructure, databaseArray, [1])]
+    recordingWriter = RecordingWriter()
+
+    # Two answers for the same row were waiting - only the first one tags it
+    Webcam.PromoteUnknown('Bob', 0, liveArrays, databaseArray, recordingWriter)
+    Webcam.PromoteUnknown('Carol', 0, liveArrays, databaseArray, recordingWriter)
+
+    assert databaseArray.Name(0) == 'Bob'
+    assert liveArrays[0]['Name'].tolist() == ['Bob']
+    assert recordingWriter.renames == [
+        ('./Data/Screenshots/Unknown1', './Data/Screenshots/Bob', (0, 'Unknown1', 'Bob'))]
+
+
+def test_NameInUseRejected(screenshotsFolder, databaseStructure, liveDataStructure):
+
+    databaseArray = TaggingStore(databaseStructure, 3)
+    liveArrays = [LiveRows(liveDataStructure, databaseArray, [1, 2, 3])]
+    recordingWriter = RecordingWriter()
+
+    Webcam.PromoteUnknown('Bob', 0, liveArrays, databaseArray, recordingWriter)
+
+    # Another row already has the name, or a folder already has it
+    os.makedirs(screenshotsFolder + 'Carol')
+    Webcam.PromoteUnknown('Bob', 1, liveArrays, databaseArray, recordingWriter)
+    Webcam.PromoteUnknown('Carol', 2, liveArrays, databaseArray, recordingWriter)
+
+    # Not a name at all
+    Webcam.PromoteUnknown('Bob 2', 2, liveArrays, databaseArray, recordingWriter)
+
+    assert [databaseArray.Name(row) for row in range(3)] == ['Bob', 'Unknown2', 'Unknown3']
+    assert liveArrays[0]['Name'].tolist() == ['Bob', 'Unknown2', 'Unknown3']
+    assert len(recordingWriter.renames) == 1
+
+
+def test_ScreenshotsDue(databaseStructure, liveDataStructure):
+
+    currentTime = 1706691600
+    databaseArray = TaggingStore(databaseStructure, 4)
+
+    # Never saved, 1 s short of the interval, exactly the interval, long ago
+    databaseArray['FrameSaved'][:] = [0, currentTime - 59, currentTime - 60, currentTime - 3600]
+
+    # Key 3 twice in one frame, key 4 not in frame long enough yet
+    liveArray = LiveRows(liveDataStructure, databaseArray, [1, 2, 3, 3, 4])
+    liveArray['FrameCount'] = [5, 5, 5, 5, 2]
+    liveArray['FaceLocation'] = (10, 60, 60, 10)
+
+    recordingWriter = RecordingWriter()
+    Webcam.TakeScreenshots(np.zeros((120, 160, 3), np.uint8), liveArray, databaseArray, 60, 3,
+                           recordingWriter, currentTime=currentTime)
+
+    screenshotName = Webcam.FormatFrameSaved(currentTime) + '.jpg'
+    assert recordingWriter.screenshots == ['./Data/Screenshots/Unknown1/' + screenshotName,
+                                           './Data/Screenshots/Unknown3/' + screenshotName]
+    assert databaseArray['FrameSaved'].tolist() == [currentTime, currentTime - 59, currentTime, currentTime - 3600]
+
+    # Saved this frame - not due again next frame
+    Webcam.TakeScreenshots(np.zeros((120, 160, 3), np.uint8), liveArray, databaseArray, 60, 3,
+                           recordingWriter, currentTime=currentTime + 1)
+    assert len(recordingWriter.screenshots) == 3
+    assert recordingWriter.screenshots[2].startswith('./Data/Screenshots/Unknown2/')
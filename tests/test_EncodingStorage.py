@@ -0,0 +1,118 @@
+# Tests for EncodingStorage.py (checkpoint files)
+# Copyright Doug Hardy and John Granholm
+
+
+import os  # checkpoint files
+from datetime import datetime  # old 'FrameSaved' text
+import numpy as np  # array library
+import pytest  # parametrize
+from EncodingStorage import SaveDatabase, LoadDatabase, MigrateColumns, CheckpointPaths, ExemplarPath  # what's tested
+from FaceDatabase import DatabaseStore, ExemplarTable  # saved databaseArray
+from conftest import RandomEncodings  # test encodings
+
+
+@pytest.mark.parametrize('encodingStorage', ['float64', 'float32', 'int8'])
+def test_SaveLoadRoundTrip(tmp_path, databaseStructure, encodingStorage):
+
+    checkpointPath = str(tmp_path / 'testDatabase2.npy')
+    encodings = RandomEncodings(10)
+
+    databaseArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+    for row in range(10):
+        databaseArray.Append(Key=row + 1, NameId=databaseArray.InternName('Unknown' + str(row + 1)),
+                             FrameSaved=row, FaceEncoding=encodings[row])
+    databaseArray.SetExemplar(3, 1, encodings[0])
+    databaseArray.SetValue('ExemplarCount', 3, 2)
+
+    SaveDatabase(checkpointPath, databaseArray.ToArray(), databaseArray.names,
+                 encodingStorage, databaseArray.exemplars.Arrays())
+
+    columnArray, encodingBlocks, indexArray, names, exemplarArrays = LoadDatabase(
+        checkpointPath, encodingStorage)
+
+    # The encoding block is memory-mapped, with spare rows past the saved ones
+    encodingBlock = encodingBlocks['FaceEncoding']
+    assert isinstance(encodingBlock, np.memmap)
+    assert len(encodingBlock) >= 20
+    assert encodingBlock.dtype == (np.float64 if encodingStorage == 'float64' else np.float32)
+    assert np.allclose(encodingBlock[:10], encodings, atol=1e-6)
+
+    assert 'FaceEncoding' not in columnArray.dtype.names
+    assert np.array_equal(columnArray['Key'], np.arange(1, 11))
+    assert names == databaseArray.names
+
+    assert len(indexArray) == 10
+    assert np.allclose(indexArray['SquaredNorm'], 1.0, atol=1e-5)
+
+    assert exemplarArrays[0].tolist() == [3]
+    assert np.allclose(exemplarArrays[1][0, 1], encodings[0], atol=1e-6)
+
+    # No temporary files left behind
+    assert not [fileName for fileName in os.listdir(tmp_path) if fileName.endswith('.tmp')]
+
+
+def test_LoadOldDenseExemplars(tmp_path, databaseStructure):
+
+    checkpointPath = str(tmp_path / 'testDatabase2.npy')
+    encodings = RandomEncodings(3)
+
+    savedArray = np.zeros(3, databaseStructure)
+    savedArray['Key'] = [1, 2, 3]
+    savedArray['FaceEncoding'] = encodings
+    savedArray['ExemplarCount'] = [0, 2, 0]
+    SaveDatabase(checkpointPath, savedArray, ['Unknown1'])
+
+    # A checkpoint from before the ExemplarTable - a block for every row
+    os.remove(ExemplarPath(checkpointPath))
+    denseBlocks = np.zeros((3, 4, 128))
+    denseBlocks[1, :2] = encodings[[0, 2]]
+    np.save(os.path.splitext(checkpointPath)[0] + '.exemplars.npy', denseBlocks)
+
+    exemplarArrays = LoadDatabase(checkpointPath)[4]
+
+    assert exemplarArrays[0].tolist() == [1]
+    assert np.allclose(exemplarArrays[1][0], denseBlocks[1])
+
+    # The next checkpoint writes the sparse file and drops the dense one
+    SaveDatabase(checkpointPath, savedArray, ['Unknown1'], savedExemplars=exemplarArrays)
+
+    assert os.path.exists(ExemplarPath(checkpointPath))
+    assert not os.path.exists(os.path.splitext(checkpointPath)[0] + '.exemplars.npy')
+    assert os.path.exists(CheckpointPaths(checkpointPath)[1])
+
+
+def test_LoadBaselineSchema(tmp_path):
+
+    checkpointPath = str(tmp_path / 'testDatabase2.npy')
+    encodings = RandomEncodings(4)
+
+    # The original testDatabase2.npy - one structured array, 'Name' and 'FrameSaved' as text
+    baselineStructure = np.dtype(
+        [('Key', 'uint32'), ('Name', 'U15'), ('FrameSaved', 'U18'), ('FaceEncoding', 'float64', (128))])
+    baselineArray = np.zeros(4, baselineStructure)
+    baselineArray['Key'] = [1, 2, 3, 4]
+    baselineArray['Name'] = ['Unknown1', 'Bob', 'Unknown3', 'Bob']
+    baselineArray['FrameSaved'] = ['09:05:01-31Jan2024', '', '23:59:59-29Feb2024', '09:05:01-31Jan2024']
+    baselineArray['FaceEncoding'] = encodings
+    np.save(checkpointPath, baselineArray)
+
+    columnArray, encodingBlocks, indexArray, names, exemplarArrays = LoadDatabase(checkpointPath, 'float32')
+
+    # Names interned in the order they first appear, times as local epoch seconds (0 = never saved)
+    assert names == ['Unknown1', 'Bob', 'Unknown3']
+    assert columnArray['NameId'].tolist() == [0, 1, 2, 1]
+    assert columnArray['FrameSaved'].dtype == np.int64
+    assert columnArray['FrameSaved'].tolist() == [int(datetime(2024, 1, 31, 9, 5, 1).timestamp()), 0,
+                                                  int(datetime(2024, 2, 29, 23, 59, 59).timestamp()),
+                                                  int(datetime(2024, 1, 31, 9, 5, 1).timestamp())]
+    assert columnArray['Key'].tolist() == [1, 2, 3, 4]
+    assert 'FaceEncoding' not in columnArray.dtype.names
+
+    assert encodingBlocks['FaceEncoding'].dtype == np.float32
+    assert np.allclose(encodingBlocks['FaceEncoding'], encodings, atol=1e-6)
+    assert indexArray is None and exemplarArrays is None
+
+    # A column file from between the two - encodings already split out, names still text
+    migratedArray, migratedNames = MigrateColumns(baselineArray[['Key', 'Name', 'FrameSaved']])
+    assert migratedNames == names
+    assert np.array_equal(migratedArray, columnArray)
@@ -0,0 +1,89 @@
+# Tests for FaceAssociation.py (SolveAssignment, AssociateFaces)
+# Copyright Doug Hardy and John Granholm
+
+
+import itertools  # brute force pairings
+import numpy as np  # array library
+import pytest  # parametrize
+from FaceAssociation import SolveAssignment, BoxOverlaps, AssociateFaces  # what's tested
+from conftest import RandomEncodings, NearbyEncoding  # test encodings
+
+
+def BruteForceCost(costMatrix):
+    # Lowest total cost over every pairing (rows <= columns)
+
+    rowCount, columnCount = costMatrix.shape
+
+    return min(costMatrix[np.arange(rowCount), list(columns)].sum()
+               for columns in itertools.permutations(range(columnCount), rowCount))
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (3, 3), (5, 5), (2, 6), (6, 3)])
+def test_SolveAssignmentIsOptimal(shape):
+
+    randomGenerator = np.random.default_rng(sum(shape))
+
+    for trial in range(20):
+
+        costMatrix = randomGenerator.random(shape)
+        rowIndexes, columnIndexes = SolveAssignment(costMatrix)
+
+        # min(rows, columns) pairs, sorted by row, nothing used twice
+        assert len(rowIndexes) == min(shape)
+        assert np.array_equal(rowIndexes, np.sort(rowIndexes))
+        assert len(set(rowIndexes.tolist())) == len(set(columnIndexes.tolist())) == min(shape)
+
+        bestCost = BruteForceCost(costMatrix if shape[0] <= shape[1] else costMatrix.T)
+        assert np.isclose(costMatrix[rowIndexes, columnIndexes].sum(), bestCost)
+
+
+def test_SolveAssignmentBeatsGreedy():
+
+    # Greedy takes the 1.0 first and is left with 10.0 - the best total is 2 + 2
+    costMatrix = np.array([[1.0, 2.0],
+                           [2.0, 10.0]])
+
+    rowIndexes, columnIndexes = SolveAssignment(costMatrix)
+
+    assert columnIndexes.tolist() == [1, 0]
+
+
+def test_SolveAssignmentEmpty():
+
+    for shape in [(0, 0), (0, 3), (3, 0)]:
+        rowIndexes, columnIndexes = SolveAssignment(np.zeros(shape))
+        assert len(rowIndexes) == len(columnIndexes) == 0
+
+
+def test_BoxOverlaps():
+
+    boxes = [(0, 10, 10, 0), (0, 20, 10, 10), (5, 15, 15, 5)]
+
+    overlaps = BoxOverlaps(boxes, boxes)
+
+    assert np.allclose(np.diag(overlaps), 1.0)
+    assert overlaps[0, 1] == 0.0
+    assert np.isclose(overlaps[0, 2], 25 / 175)
+
+
+def test_AssociateFacesOneNamePerFace(liveDataStructure):
+
+    encodings = RandomEncodings(3)
+
+    lastFrameArray = np.zeros(2, liveDataStructure)
+    lastFrameArray['FaceEncoding'] = encodings[:2]
+    lastFrameArray['FaceLocation'] = [(0, 100, 100, 0), (0, 220, 100, 120)]
+
+    # Two people side by side who swapped places, plus a newcomer
+    workingArray = np.zeros(3, liveDataStructure)
+    workingArray['FaceEncoding'] = [NearbyEncoding(encodings[1], 0.1), NearbyEncoding(encodings[0], 0.1, seed=1),
+                                    encodings[2]]
+    workingArray['FaceLocation'] = [(0, 100, 100, 0), (0, 220, 100, 120), (0, 340, 100, 240)]
+
+    currentRows, lastRows, pairDistances = AssociateFaces(workingArray, lastFrameArray)
+
+    assert currentRows.tolist() == [0, 1]
+    assert lastRows.tolist() == [1, 0]
+    assert np.allclose(pairDistances, 0.1)
+
+    assert len(AssociateFaces(workingArray, lastFrameArray[:0])[0]) == 0
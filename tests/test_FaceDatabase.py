@@ -0,0 +1,140 @@
+# Tests for FaceDatabase.py (DatabaseStore, ExemplarTable)
+# Copyright Doug Hardy and John Granholm
+
+
+import numpy as np  # array library
+from FaceDatabase import DatabaseStore, ExemplarTable  # what's tested
+from conftest import RandomEncodings  # test encodings
+
+
+def FilledStore(databaseStructure, rowCount, capacity=1):
+    # A store with rowCount 'UnknownN' rows, appended one at a time
+
+    databaseArray = DatabaseStore(databaseStructure, capacity)
+    encodings = RandomEncodings(rowCount)
+
+    for row in range(rowCount):
+        databaseArray.Append(Key=row + 1, NameId=databaseArray.InternName('Unknown' + str(row + 1)),
+                             FrameSaved=row, FaceEncoding=encodings[row])
+
+    return databaseArray, encodings
+
+
+def test_AppendGrowsByDoubling(databaseStructure):
+
+    databaseArray, encodings = FilledStore(databaseStructure, 100)
+
+    assert len(databaseArray) == 100
+    assert len(databaseArray.columns['FaceEncoding']) == 128
+    assert np.array_equal(databaseArray['Key'], np.arange(1, 101))
+    assert np.array_equal(databaseArray['FaceEncoding'], encodings)
+    assert databaseArray.Name(41) == 'Unknown42'
+
+
+def test_ReadOnlyColumns(databaseStructure):
+
+    databaseArray, encodings = FilledStore(databaseStructure, 3)
+
+    assert not databaseArray['FaceEncoding'].flags.writeable
+    assert databaseArray['FrameSaved'].flags.writeable
+
+
+def test_ToArrayRoundTrip(databaseStructure):
+
+    databaseArray, encodings = FilledStore(databaseStructure, 10)
+    databaseArray.SetValue('FrameSaved', 4, 1234)
+
+    savedArray = databaseArray.ToArray()
+
+    assert savedArray.dtype == databaseStructure
+    assert savedArray['FrameSaved'][4] == 1234
+    assert np.array_equal(savedArray['FaceEncoding'], encodings)
+
+    reloadedArray = DatabaseStore(databaseStructure)
+    for name in databaseArray.names:
+        reloadedArray.InternName(name)
+    reloadedArray.Extend(savedArray)
+
+    assert np.array_equal(reloadedArray.ToArray(), savedArray)
+
+
+def test_AdoptKeepsBufferAndGrows(databaseStructure):
+
+    databaseArray, encodings = FilledStore(databaseStructure, 5)
+    savedArray = databaseArray.ToArray()
+
+    # A block with spare rows is used as it is - no copy until it runs out
+    encodingBlock = np.zeros((8, 128), np.float32)
+    encodingBlock[:5] = encodings
+
+    adoptedArray = DatabaseStore(databaseStructure, columnTypes={
+                                 'FaceEncoding': np.float32})
+    adoptedArray.Adopt(savedArray, {'FaceEncoding': encodingBlock}, databaseArray.names)
+
+    assert len(adoptedArray) == 5
+    assert adoptedArray.columns['FaceEncoding'] is encodingBlock
+    assert adoptedArray.names == databaseArray.names
+    assert np.array_equal(adoptedArray['Key'], savedArray['Key'])
+
+    for row in range(5, 10):
+        adoptedArray.Append(Key=row + 1, FaceEncoding=np.ones(128))
+
+    assert len(adoptedArray) == 10
+    assert adoptedArray.columns['FaceEncoding'] is not encodingBlock
+    assert np.allclose(adoptedArray['FaceEncoding'][:5], encodings)
+    assert np.array_equal(adoptedArray['Key'], np.arange(1, 11))
+
+
+def test_UnknownNameSkipsTakenNames(databaseStructure):
+
+    databaseArray, encodings = FilledStore(databaseStructure, 3)
+
+    # A compaction left 'Unknown3' on a row that isn't row 3 any more
+    assert databaseArray.UnknownName(3) == 'Unknown4'
+    assert databaseArray.UnknownName(2) == 'Unknown5'
+    assert databaseArray.UnknownName(9) == 'Unknown9'
+
+
+def test_SnapshotMatchesToArray(databaseStructure):
+
+    databaseArray, encodings = FilledStore(databaseStructure, 10)
+    savedArray, savedNames, savedExemplars = databaseArray.Snapshot()
+
+    databaseArray.Append(Key=11, FaceEncoding=np.ones(128))
+    databaseArray.SetValue('FrameSaved', 0, 99)
+    databaseArray.InternName('Bob')
+
+    # Later changes don't reach the small columns or the names
+    assert len(savedArray) == 10
+    assert savedArray['FrameSaved'][0] == 0
+    assert 'Bob' not in savedNames
+    assert np.array_equal(savedArray['FaceEncoding'], encodings)
+
+
+def test_ExemplarTableSparse():
+
+    exemplarTable = ExemplarTable(3, np.float32, capacity=1)
+    encodings = RandomEncodings(3)
+
+    exemplarTable.SetExemplar(1000, 0, encodings[0])
+    exemplarTable.SetExemplar(7, 2, encodings[1])
+    exemplarTable.SetExemplar(1000, 1, encodings[2])
+
+    # Only the two rows with exemplars have slots
+    assert len(exemplarTable) == 2
+    assert np.array_equal(exemplarTable.Slots([7, 8, 1000, 5000]), [1, -1, 0, -1])
+    assert np.allclose(exemplarTable.Exemplars(1000)[:2], encodings[[0, 2]])
+    assert not exemplarTable.Exemplars(8).any()
+    assert np.allclose(exemplarTable[[7]][0, 2], encodings[1])
+
+    rowIndexes, blocks = exemplarTable.Arrays()
+    assert np.array_equal(rowIndexes, [1000, 7])
+
+    # Adopt (a checkpoint reloaded) - a bigger limit pads, rows past rowCount are dropped
+    reloadedTable = ExemplarTable(4, np.float32)
+    reloadedTable.Adopt(rowIndexes, blocks, rowCount=500)
+
+    assert len(reloadedTable) == 1
+    assert np.allclose(reloadedTable.Exemplars(7)[2], encodings[1])
+    assert not reloadedTable.Exemplars(7)[3].any()
+    assert int(reloadedTable.Slots(1000)) == -1
@@ -0,0 +1,59 @@
+# Tests for FaceDetection.py (DetectionPool result order)
+# Copyright Doug Hardy and John Granholm
+
+
+from multiprocessing import shared_memory  # frames handed to the workers
+import numpy as np  # array library
+import FaceDetection  # what's tested
+
+
+def SwappingWorker(workerId, taskQueue, resultQueue, reuseFrameBuffers=True):
+    # Stands in for DetectionWorker (no face_recognition) - finishes every pair of frames second one first
+    #   one face per frame, its box filled with the frame's pixel value
+
+    heldTasks = []
+
+    while True:
+
+        task = taskQueue.get()
+
+        if task is None:
+            break
+
+        heldTasks.append(task)
+        if len(heldTasks) < 2:
+            continue
+
+        for sequence, slotIndex, memoryName, frameShape, frameType, detectionScale, searchRegions in reversed(heldTasks):
+
+            memoryBlock = shared_memory.SharedMemory(name=memoryName)
+            frameValue = int(np.ndarray(frameShape, frameType, buffer=memoryBlock.buf)[0, 0, 0])
+            memoryBlock.close()
+
+            resultQueue.put((sequence, slotIndex, workerId, [(frameValue,) * 4],
+                             np.full((1, 128), frameValue, np.float64), 0.001, {}))
+
+        heldTasks = []
+
+
+def test_NextResultInSubmitOrder(monkeypatch):
+
+    monkeypatch.setattr(FaceDetection, 'DetectionWorker', SwappingWorker)
+    detectionPool = FaceDetection.DetectionPool(1, slotCount=4)
+
+    try:
+        for frameValue in range(6):
+            detectionPool.Submit(np.full((8, 8, 3), frameValue, np.uint8), payload='frame' + str(frameValue))
+
+        # Results arrive 1, 0, 3, 2, ... - each one is held until the frames before it are handed back
+        results = [detectionPool.NextResult() for frameValue in range(6)]
+
+    finally:
+        detectionPool.Stop()
+
+    assert [payload for payload, faceLocations, faceEncodings in results] == ['frame' + str(value) for value in range(6)]
+    assert [faceLocations for payload, faceLocations, faceEncodings in results] == [[(value,) * 4] for value in range(6)]
+    assert all(np.all(faceEncodings[0] == value) for value, (payload, faceLocations, faceEncodings) in enumerate(results))
+
+    assert detectionPool.Pending() == 0 and detectionPool.finishedResults == {}
+    assert detectionPool.workerFrames == [6]
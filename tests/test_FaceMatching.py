@@ -0,0 +1,232 @@
+# Tests for FaceMatching.py (EncodingMatcher, PartitionIndex, AddExemplar)
+# Copyright Doug Hardy and John Granholm
+
+
+import numpy as np  # array library
+from FaceMatching import EncodingMatcher, PartitionIndex, TrainPartitions, AddExemplar  # what's tested
+from FaceDatabase import ExemplarTable  # exemplars to match against
+from EncodingStorage import BuildIndexArray, QuantizeEncodings  # saved index, int8 codes
+from conftest import RandomEncodings, NearbyEncoding  # test encodings
+
+
+def test_MatchPicksNearestNotFirst():
+
+    databaseEncodings = RandomEncodings(50)
+    faceEncoding = databaseEncodings[30].copy()
+
+    # Row 10 is within tolerance too, row 30 is closer
+    databaseEncodings[10] = NearbyEncoding(faceEncoding, 0.5)
+    databaseEncodings[30] = NearbyEncoding(faceEncoding, 0.1, seed=1)
+
+    databaseMatcher = EncodingMatcher()
+    databaseMatcher.Sync(databaseEncodings)
+
+    matchIndexes, matchDistances = databaseMatcher.Match([faceEncoding])
+
+    assert matchIndexes.tolist() == [30]
+    assert np.allclose(matchDistances, [0.1])
+
+
+def test_MatchWholeFrame():
+
+    databaseEncodings = RandomEncodings(20)
+    faceEncodings = np.array([NearbyEncoding(databaseEncodings[7], 0.2),
+                              RandomEncodings(1, seed=99)[0],
+                              NearbyEncoding(databaseEncodings[3], 0.3)])
+
+    databaseMatcher = EncodingMatcher()
+    databaseMatcher.Sync(databaseEncodings)
+
+    matchIndexes, matchDistances = databaseMatcher.Match(faceEncodings)
+
+    # A face nobody is close to gets -1 (its distance is still reported)
+    assert matchIndexes.tolist() == [7, -1, 3]
+    assert np.allclose(matchDistances[[0, 2]], [0.2, 0.3])
+    assert matchDistances[1] > databaseMatcher.tolerance
+
+
+def test_MatchEmpty():
+
+    databaseMatcher = EncodingMatcher()
+    databaseMatcher.Sync(np.zeros((0, 128)))
+
+    matchIndexes, matchDistances = databaseMatcher.Match(RandomEncodings(2))
+
+    assert matchIndexes.tolist() == [-1, -1]
+    assert np.isinf(matchDistances).all()
+
+    assert len(databaseMatcher.Match(np.zeros((0, 128)))[0]) == 0
+
+
+def test_SyncPicksUpNewRows():
+
+    databaseEncodings = RandomEncodings(10)
+
+    databaseMatcher = EncodingMatcher()
+    databaseMatcher.Sync(databaseEncodings[:4])
+    databaseMatcher.Sync(databaseEncodings)
+
+    assert databaseMatcher.rowCount == 10
+    assert np.allclose(databaseMatcher.squaredNorms, 1.0)
+    assert databaseMatcher.Match(databaseEncodings[8:9])[0].tolist() == [8]
+
+
+def test_PartitionIndexMatchesExactSearch():
+
+    databaseEncodings = RandomEncodings(2000)
+    faceEncodings = np.array([NearbyEncoding(databaseEncodings[row], 0.2, seed=row)
+                              for row in (0, 999, 1999)])
+
+    partitionedMatcher = EncodingMatcher(partitionMinimumSize=500)
+    partitionedMatcher.Sync(databaseEncodings)
+
+    assert partitionedMatcher.partitionIndex is not None
+    assert partitionedMatcher.Match(faceEncodings)[0].tolist() == [0, 999, 1999]
+
+
+def test_PartitionIndexGrowsAndRetrains():
+
+    databaseEncodings = RandomEncodings(1200)
+
+    databaseMatcher = EncodingMatcher(partitionMinimumSize=500)
+    databaseMatcher.Sync(databaseEncodings[:500])
+    trainedIndex = databaseMatcher.partitionIndex
+
+    # New rows drop into the existing buckets until the database doubles
+    databaseMatcher.Sync(databaseEncodings[:900])
+    assert databaseMatcher.partitionIndex is trainedIndex
+    assert trainedIndex.rowCount == 900
+    assert databaseMatcher.Match(databaseEncodings[850:851])[0].tolist() == [850]
+
+    databaseMatcher.Sync(databaseEncodings)
+    assert databaseMatcher.partitionIndex is not trainedIndex
+    assert databaseMatcher.partitionIndex.trainedSize == 1200
+
+
+def test_CandidatesSkipEmptyBuckets():
+
+    databaseEncodings = RandomEncodings(100)
+    faceEncoding = RandomEncodings(1, seed=7)[0]
+
+    partitionIndex = PartitionIndex(4, probeCount=1)
+    partitionIndex.Train(databaseEncodings)
+
+    # A bucket right on top of the face, with nothing in it
+    partitionIndex.centroids = np.vstack([partitionIndex.centroids, faceEncoding])
+    partitionIndex.partitionRows.append([])
+    partitionIndex.partitionArrays.append(None)
+    partitionIndex.partitionSizes = np.append(partitionIndex.partitionSizes, 0)
+
+    candidateRows = partitionIndex.Candidates(faceEncoding[None, :])
+
+    assert len(candidateRows) > 0
+    assert np.array_equal(candidateRows, np.unique(candidateRows))
+
+    # Nothing in the index at all
+    assert len(PartitionIndex(4).Candidates(faceEncoding[None, :])) == 0
+
+
+def test_TrainPartitionsDistinctCentroids():
+
+    # 5 people seen 40 times each - no more buckets than distinct rows, no two alike
+    databaseEncodings = np.repeat(RandomEncodings(5), 40, axis=0)
+
+    centroids = TrainPartitions(databaseEncodings, 16)
+
+    assert len(centroids) == 5
+    assert len(np.unique(centroids, axis=0)) == 5
+
+    # Nearly as many buckets as rows - buckets left empty are re-seeded from different rows
+    centroids = TrainPartitions(RandomEncodings(40), 32)
+
+    assert len(np.unique(centroids, axis=0)) == len(centroids)
+
+
+def test_QuantizedMatchesExactSearch():
+
+    databaseEncodings = RandomEncodings(1000).astype(np.float32)
+    faceEncodings = np.array([NearbyEncoding(databaseEncodings[row], 0.25, seed=row)
+                              for row in range(0, 1000, 97)])
+
+    exactMatcher = EncodingMatcher()
+    exactMatcher.Sync(databaseEncodings)
+    quantizedMatcher = EncodingMatcher(quantize=True)
+    quantizedMatcher.Sync(databaseEncodings)
+
+    exactIndexes, exactDistances = exactMatcher.Match(faceEncodings)
+    quantizedIndexes, quantizedDistances = quantizedMatcher.Match(faceEncodings)
+
+    # The int8 search only shortlists - reported distances are the exact ones
+    assert np.array_equal(quantizedIndexes, exactIndexes)
+    assert np.allclose(quantizedDistances, exactDistances, atol=1e-5)
+
+
+def test_LoadIndexSkipsReadingEncodings():
+
+    databaseEncodings = RandomEncodings(300).astype(np.float32)
+
+    databaseMatcher = EncodingMatcher(quantize=True)
+    databaseMatcher.LoadIndex(BuildIndexArray(databaseEncodings))
+
+    # A memory-mapped block Sync can't read (every row is in the index already)
+    unreadEncodings = databaseEncodings.copy()
+    unreadEncodings[:] = np.nan
+    databaseMatcher.Sync(unreadEncodings)
+
+    assert databaseMatcher.rowCount == 300
+    assert np.allclose(databaseMatcher.squaredNorms, 1.0, atol=1e-5)
+    assert np.array_equal(databaseMatcher.codes, QuantizeEncodings(databaseEncodings)[0])
+
+
+def test_AddExemplarFillsThenReplaces():
+
+    encodings = RandomEncodings(5)
+    exemplars = np.zeros((3, 128))
+
+    # The first sighting: 'FaceEncoding' becomes exemplar 0, the sighting exemplar 1
+    exemplars, exemplarCount, centroid, changedPositions = AddExemplar(exemplars, 0, encodings[0], encodings[1])
+    assert exemplarCount == 2 and changedPositions == [0, 1]
+    assert np.allclose(centroid, encodings[:2].mean(axis=0))
+
+    # Exemplars 1 and 2 almost the same
+    exemplars, exemplarCount, centroid, changedPositions = AddExemplar(
+        exemplars, 2, centroid, NearbyEncoding(encodings[1], 0.1))
+    assert exemplarCount == 3 and changedPositions == [2]
+
+    # Full: a sighting right next to one already there is the most redundant - nothing changes
+    assert AddExemplar(exemplars, 3, centroid, encodings[0] + 1e-3)[0] is None
+
+    # A new look replaces the more redundant of exemplars 1 and 2 - exemplar 0 always stays
+    newExemplars, exemplarCount, centroid, changedPositions = AddExemplar(exemplars, 3, centroid, encodings[3])
+    assert exemplarCount == 3 and changedPositions == [1]
+    assert np.array_equal(newExemplars[[0, 2]], exemplars[[0, 2]])
+    assert np.array_equal(newExemplars[1], encodings[3])
+    assert np.allclose(centroid, newExemplars.mean(axis=0))
+
+
+def test_MatchByNearestExemplar():
+
+    databaseEncodings = RandomEncodings(30)
+    faceEncoding = RandomEncodings(1, seed=5)[0]
+
+    # Row 12's centroid is far from the face, one of its exemplars isn't
+    exemplarTable = ExemplarTable(4)
+    exemplarTable.SetExemplar(12, 0, databaseEncodings[12])
+    exemplarTable.SetExemplar(12, 1, NearbyEncoding(faceEncoding, 0.3))
+    exemplarCounts = np.zeros(30, np.uint8)
+    exemplarCounts[12] = 2
+
+    # A stale exemplar past ExemplarCount doesn't count
+    exemplarTable.SetExemplar(20, 0, databaseEncodings[20])
+    exemplarTable.SetExemplar(20, 1, faceEncoding)
+    exemplarCounts[20] = 1
+
+    databaseMatcher = EncodingMatcher(rerankCount=30)
+    databaseMatcher.Sync(databaseEncodings)
+    assert databaseMatcher.Match([faceEncoding])[0].tolist() == [-1]
+
+    databaseMatcher.Sync(databaseEncodings, exemplarTable, exemplarCounts)
+    matchIndexes, matchDistances = databaseMatcher.Match([faceEncoding])
+
+    assert matchIndexes.tolist() == [12]
+    assert np.allclose(matchDistances, [0.3])
@@ -0,0 +1,64 @@
+# Tests for FrameBuffers.py (FrameBuffer, LiveTable)
+# Copyright Doug Hardy and John Granholm
+
+
+import numpy as np  # array library
+from FrameBuffers import FrameBuffer, LiveTable  # what's tested
+
+
+def test_FrameBufferReusesBlock():
+
+    frameBuffer = FrameBuffer()
+
+    smallView = frameBuffer.View((120, 160, 3))
+    assert smallView.shape == (120, 160, 3) and smallView.flags['C_CONTIGUOUS']
+    assert frameBuffer.allocations == 1
+
+    # Smaller or the same size - same memory, no allocation
+    sameView = frameBuffer.View((120, 160, 3))
+    floatView = frameBuffer.View((10, 10), np.float32)
+    assert np.shares_memory(smallView, sameView) and np.shares_memory(smallView, floatView)
+    assert frameBuffer.allocations == 1
+
+    frameBuffer.View((240, 320, 3))
+    assert frameBuffer.allocations == 2
+
+
+def test_LiveTableAlternates(liveDataStructure):
+
+    liveTable = LiveTable(liveDataStructure, capacity=4)
+
+    lastFrameArray = liveTable.Rows(3)
+    lastFrameArray['ForeignKey'] = [1, 2, 3]
+
+    # The next frame's rows don't touch lastFrameArray, and come zeroed
+    liveArray = liveTable.Rows(2)
+    assert not np.shares_memory(liveArray, lastFrameArray)
+    assert lastFrameArray['ForeignKey'].tolist() == [1, 2, 3]
+    assert liveArray['ForeignKey'].tolist() == [0, 0]
+
+    # The frame after next gets the first table back, zeroed
+    liveArray['ForeignKey'] = [7, 8]
+    nextArray = liveTable.Rows(3)
+    assert np.shares_memory(nextArray, lastFrameArray)
+    assert nextArray['ForeignKey'].tolist() == [0, 0, 0]
+
+    assert liveTable.allocations == 0
+
+
+def test_LiveTableGrows(liveDataStructure):
+
+    liveTable = LiveTable(liveDataStructure, capacity=2)
+
+    liveTable.Rows(1)
+    liveArray = liveTable.Rows(5)
+
+    assert len(liveArray) == 5 and liveArray.dtype == liveDataStructure
+    assert liveTable.allocations == 1
+
+    # The other table grows the next time round - after that, the same number of faces costs nothing
+    liveTable.Rows(5)
+    assert liveTable.allocations == 2
+    liveTable.Rows(5)
+    liveTable.Rows(0)
+    assert liveTable.allocations == 2
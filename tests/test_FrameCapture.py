@@ -0,0 +1,94 @@
+# Tests for FrameCapture.py (CaptureThread buffer policies)
+# Copyright Doug Hardy and John Granholm
+
+
+import threading  # stalled camera
+import numpy as np  # array library
+import pytest  # raises
+from FrameCapture import CaptureThread  # what's tested
+
+
+class FakeCapture:
+    # Stands in for cv2.VideoCapture - frameCount frames (each filled with its number), then nothing
+
+    def __init__(self, frameCount):
+        self.frames = [np.full((4, 4, 3), frameNumber, np.uint8) for frameNumber in range(frameCount)]
+
+    def read(self):
+        if len(self.frames) == 0:
+            return False, None
+        return True, self.frames.pop(0)
+
+
+def test_LatestDropsOldFrames():
+
+    captureThread = CaptureThread(FakeCapture(5), bufferSize=2, bufferPolicy='latest').Start()
+
+    # The main loop is busy until the camera has run dry - only the last two frames are still buffered
+    captureThread.thread.join()
+    assert captureThread.capturedFrames == 5
+    assert captureThread.droppedFrames == 3
+
+    # The newest one is handed over, the one before it dropped
+    ret, frame = captureThread.Read()
+    assert ret and frame[0, 0, 0] == 4
+    assert captureThread.lastFrameNumber == 4
+    assert captureThread.droppedFrames == 4 and captureThread.deliveredFrames == 1
+
+    assert captureThread.Ended()
+    assert captureThread.Read() == (False, None)
+    captureThread.Stop()
+
+
+def test_AllKeepsEveryFrame():
+
+    captureThread = CaptureThread(FakeCapture(5), bufferSize=2, bufferPolicy='all').Start()
+
+    # Capture waits for room instead of dropping - every frame comes out, in order
+    frameNumbers = []
+    while True:
+        ret, frame = captureThread.Read(timeout=5)
+        if not ret:
+            break
+        frameNumbers.append(int(frame[0, 0, 0]))
+
+    assert frameNumbers == [0, 1, 2, 3, 4]
+    assert captureThread.droppedFrames == 0
+    assert captureThread.capturedFrames == captureThread.deliveredFrames == 5
+    assert captureThread.Ended()
+    captureThread.Stop()
+
+
+def test_ReadTimeout():
+
+    class StalledCapture:
+        # A camera that stops delivering after its first frame, until it's let go
+
+        def __init__(self):
+            self.frameCount = 0
+            self.release = threading.Event()
+
+        def read(self):
+            if self.frameCount > 0:
+                self.release.wait(5)
+                return False, None
+            self.frameCount += 1
+            return True, np.zeros((4, 4, 3), np.uint8)
+
+    stalledCapture = StalledCapture()
+    captureThread = CaptureThread(stalledCapture, bufferPolicy='all').Start()
+
+    # The first frame, then nothing - Read gives up after timeout instead of hanging the main loop
+    assert captureThread.Read(timeout=5)[0]
+    assert captureThread.Read(timeout=0.1) == (False, None)
+    assert not captureThread.Ended()
+
+    stalledCapture.release.set()
+    captureThread.Stop()
+    assert captureThread.Ended()
+
+
+def test_UnknownPolicy():
+
+    with pytest.raises(ValueError):
+        CaptureThread(FakeCapture(1), bufferPolicy='oldest')
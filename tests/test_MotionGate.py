@@ -0,0 +1,100 @@
+# Tests for MotionGate.py
+# Copyright Doug Hardy and John Granholm
+
+
+import numpy as np  # array library
+from MotionGate import MotionGate  # what's tested
+
+
+def StillFrame(shape=(240, 320, 3), value=100):
+    return np.full(shape, value, np.uint8)
+
+
+def MovedFrame(frame, value=250):
+    # A person-sized block of the frame changes
+
+    movedFrame = frame.copy()
+    movedFrame[60:180, 100:200] = value
+
+    return movedFrame
+
+
+def test_StillFramesSkipped():
+
+    motionGate = MotionGate(forcedInterval=1e9)
+    frame = StillFrame()
+
+    # Nothing to compare with yet
+    assert motionGate.Check(frame)
+    motionGate.Detected()
+
+    assert not motionGate.Check(frame)
+    assert not motionGate.Check(frame + 5)
+
+    assert motionGate.skippedFrames == 2
+    assert motionGate.checkedFrames == 3
+    assert np.isclose(motionGate.SkipRatio(), 2 / 3)
+
+
+def test_MovedFramePassesUntilDetected():
+
+    motionGate = MotionGate(forcedInterval=1e9)
+    frame = StillFrame()
+    motionGate.Check(frame)
+    motionGate.Detected()
+
+    movedFrame = MovedFrame(frame)
+
+    # Only a detection moves the reference - until then the change keeps counting
+    assert motionGate.Check(movedFrame)
+    assert motionGate.Check(movedFrame)
+
+    motionGate.Detected()
+    assert not motionGate.Check(movedFrame)
+
+
+def test_ForcedDetections():
+
+    motionGate = MotionGate(forcedInterval=1e9)
+    frame = StillFrame()
+    motionGate.Check(frame)
+    motionGate.Detected()
+
+    # The source's own flag
+    assert motionGate.Check(frame, forceDetection=True)
+
+    # A frame the sample can't be compared with (another shape)
+    assert motionGate.Check(StillFrame((480, 320, 3)))
+
+    # forcedInterval seconds after the last detection
+    motionGate.forcedInterval = 0.0
+    assert motionGate.Check(frame)
+
+    assert motionGate.skippedFrames == 0
+
+
+def test_SmallChangeIgnored():
+
+    motionGate = MotionGate(forcedInterval=1e9)
+    frame = StillFrame()
+    motionGate.Check(frame)
+    motionGate.Detected()
+
+    # A few pixels of sensor noise, well under changedFraction of the sample
+    noisyFrame = frame.copy()
+    noisyFrame[0, 0] = 255
+
+    assert not motionGate.Check(noisyFrame)
+
+
+def test_Disabled():
+
+    motionGate = MotionGate(enabled=False)
+    frame = StillFrame()
+
+    assert motionGate.Check(frame)
+    motionGate.Detected()
+    assert motionGate.Check(frame)
+
+    assert motionGate.checkedFrames == 0
+    assert motionGate.Report() == 'Motion gate: off'
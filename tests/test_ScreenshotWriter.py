@@ -0,0 +1,160 @@
+# Tests for ScreenshotWriter.py (and TakeScreenshots, which feeds it)
+# Copyright Doug Hardy and John Granholm
+
+
+import os  # screenshot folders
+import threading  # holding the writer thread up
+import time  # waiting for the writer to catch up
+import cv2  # reading screenshots back
+import numpy as np  # array library
+import ScreenshotWriter as Writer  # imwrite the writer thread calls
+from ScreenshotWriter import ScreenshotWriter  # what's tested
+import DatabasingFromWebcam as Webcam  # TakeScreenshots
+from FaceDatabase import DatabaseStore, ExemplarTable  # 'FrameSaved'
+from conftest import RandomEncodings  # test encodings
+
+
+class SlowDisk:
+    # Stands in for cv2.imwrite - each write waits until the test lets it go
+
+    def __init__(self):
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        self.imwrite = cv2.imwrite
+
+    def __call__(self, filePath, image):
+        self.writing.set()
+        self.release.wait(5)
+        return self.imwrite(filePath, image)
+
+
+def ScreenshotStore(databaseStructure, liveDataStructure):
+    # One 'Unknown1' row in frame long enough for a screenshot, never saved
+
+    databaseArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+    databaseArray.Append(Key=1, NameId=databaseArray.InternName('Unknown1'), FaceEncoding=RandomEncodings(1)[0])
+
+    liveArray = np.zeros(1, liveDataStructure)
+    liveArray['ForeignKey'] = 1
+    liveArray['FrameCount'] = 5
+
+    return databaseArray, liveArray
+
+
+def test_SubmitBackpressure(tmp_path, monkeypatch):
+
+    slowDisk = SlowDisk()
+    monkeypatch.setattr(Writer.cv2, 'imwrite', slowDisk)
+
+    screenshotWriter = ScreenshotWriter(queueSize=2)
+    image = np.zeros((16, 16, 3), np.uint8)
+
+    # The first one is being written, the next two wait - the queue is full after that
+    assert screenshotWriter.Submit(str(tmp_path / '1.jpg'), image)
+    assert slowDisk.writing.wait(5)
+    assert screenshotWriter.Submit(str(tmp_path / '2.jpg'), image)
+    assert screenshotWriter.Submit(str(tmp_path / '3.jpg'), image)
+    assert not screenshotWriter.Submit(str(tmp_path / '4.jpg'), image)
+    assert not screenshotWriter.Submit(str(tmp_path / '5.jpg'), image)
+
+    assert screenshotWriter.Backlog() == 2
+    assert screenshotWriter.droppedScreenshots == 2
+    assert screenshotWriter.queuedScreenshots == 3
+    assert screenshotWriter.deepestQueue == 2
+
+    slowDisk.release.set()
+    screenshotWriter.Stop()
+
+    assert sorted(os.listdir(tmp_path)) == ['1.jpg', '2.jpg', '3.jpg']
+    assert screenshotWriter.writtenScreenshots == 3
+
+
+def test_FrameSavedOnlyOnceQueued(tmp_path, monkeypatch, databaseStructure, liveDataStructure):
+
+    monkeypatch.chdir(tmp_path)
+    slowDisk = SlowDisk()
+    monkeypatch.setattr(Writer.cv2, 'imwrite', slowDisk)
+
+    databaseArray, liveArray = ScreenshotStore(databaseStructure, liveDataStructure)
+    frame = np.zeros((120, 160, 3), np.uint8)
+
+    # Writer busy and its queue full - the screenshot is turned away and 'FrameSaved' stays 0 (due again next frame)
+    screenshotWriter = ScreenshotWriter(queueSize=1)
+    screenshotWriter.Submit(str(tmp_path / 'busy1.jpg'), frame)
+    assert slowDisk.writing.wait(5)
+    screenshotWriter.Submit(str(tmp_path / 'busy2.jpg'), frame)
+
+    Webcam.TakeScreenshots(frame, liveArray, databaseArray, 60, 3, screenshotWriter, currentTime=1706691600)
+    assert screenshotWriter.droppedScreenshots == 1
+    assert databaseArray['FrameSaved'][0] == 0
+
+    # The writer caught up - the next frame's screenshot goes through, then 'FrameSaved' is set
+    slowDisk.release.set()
+    while screenshotWriter.Backlog() > 0:
+        time.sleep(0.01)
+
+    Webcam.TakeScreenshots(frame, liveArray, databaseArray, 60, 3, screenshotWriter, currentTime=1706691601)
+    assert databaseArray['FrameSaved'][0] == 1706691601
+    screenshotWriter.Stop()
+
+    assert os.listdir('./Data/Screenshots/Unknown1/') == [Webcam.FormatFrameSaved(1706691601) + '.jpg']
+
+
+def test_CropClampedToFrame(tmp_path, monkeypatch, databaseStructure, liveDataStructure):
+
+    monkeypatch.chdir(tmp_path)
+
+    databaseArray, liveArray = ScreenshotStore(databaseStructure, liveDataStructure)
+    frame = np.zeros((120, 160, 3), np.uint8)
+
+    # A 40 x 40 face in the top left corner - half its padding would fall off the frame
+    liveArray['FaceLocation'] = (5, 45, 45, 5)
+
+    screenshotWriter = ScreenshotWriter()
+    Webcam.TakeScreenshots(frame, liveArray, databaseArray, 60, 3, screenshotWriter,
+                           screenShotCrop=True, screenShotCropPadding=0.25, currentTime=1706691600)
+
+    # ...and one in the bottom right corner
+    liveArray['FaceLocation'] = (100, 158, 118, 140)
+    Webcam.TakeScreenshots(frame, liveArray, databaseArray, 60, 3, screenshotWriter,
+                           screenShotCrop=True, screenShotCropPadding=0.5, currentTime=1706691700)
+    screenshotWriter.Stop()
+
+    screenshotShapes = [cv2.imread(os.path.join('./Data/Screenshots/Unknown1/', Webcam.FormatFrameSaved(currentTime) + '.jpg')).shape
+                        for currentTime in (1706691600, 1706691700)]
+
+    # 10 px padding: rows / columns 0 to 55; 9 px padding: rows 91 to 120, columns 131 to 160
+    assert screenshotShapes == [(55, 55, 3), (29, 29, 3)]
+
+
+def test_RenameAfterQueuedScreenshots(tmp_path):
+
+    screenshotWriter = ScreenshotWriter(queueSize=8)
+    image = np.zeros((16, 16, 3), np.uint8)
+
+    # Screenshots still waiting under the old name end up in the renamed folder
+    for fileName in ('1.jpg', '2.jpg', '3.jpg'):
+        assert screenshotWriter.Submit(str(tmp_path / 'Unknown1' / fileName), image)
+    screenshotWriter.RenameFolder(str(tmp_path / 'Unknown1'), str(tmp_path / 'Bob'), (0, 'Unknown1', 'Bob'))
+    screenshotWriter.Stop()
+
+    assert os.listdir(tmp_path) == ['Bob']
+    assert sorted(os.listdir(tmp_path / 'Bob')) == ['1.jpg', '2.jpg', '3.jpg']
+    assert screenshotWriter.writtenScreenshots == 3 and screenshotWriter.renamedFolders == 1
+    assert screenshotWriter.FailedRenames() == []
+
+
+def test_FailedRenameTagged(tmp_path):
+
+    os.makedirs(tmp_path / 'Unknown1')
+    os.makedirs(tmp_path / 'Bob')
+
+    screenshotWriter = ScreenshotWriter()
+    screenshotWriter.RenameFolder(str(tmp_path / 'Unknown1'), str(tmp_path / 'Bob'), (0, 'Unknown1', 'Bob'))
+    screenshotWriter.RenameFolder(str(tmp_path / 'Unknown1'), str(tmp_path / 'Bob'))
+    screenshotWriter.Stop()
+
+    # Only a rename with a tag is handed back - once
+    assert screenshotWriter.FailedRenames() == [(0, 'Unknown1', 'Bob')]
+    assert screenshotWriter.FailedRenames() == []
+    assert sorted(os.listdir(tmp_path)) == ['Bob', 'Unknown1']
@@ -0,0 +1,128 @@
+# Tests for SightingsLog.py (segments, key / hour index, queries)
+# Copyright Doug Hardy and John Granholm
+
+
+import os  # segment files
+import time  # current hour
+import numpy as np  # array library
+from SightingsLog import SightingsLog, SegmentName, SegmentHour  # what's tested
+
+
+# 2024-01-31 09:00 UTC
+hourStart = 1706691600
+
+
+def LiveRows(liveDataStructure, keys, distance=0.25):
+    # One frame's liveArray with these 'ForeignKey's (0 = not identified)
+
+    liveArray = np.zeros(len(keys), liveDataStructure)
+    liveArray['ForeignKey'] = keys
+    liveArray['FaceLocation'] = (10, 60, 60, 10)
+    liveArray['Distance'] = distance
+
+    return liveArray
+
+
+def FilledLog(sightingsPath, liveDataStructure):
+    # Key 1 either side of 10:00, key 2 only before, key 3 only after, a stranger in every frame
+
+    sightingsLog = SightingsLog(sightingsPath, flushRows=1000, flushInterval=1000)
+
+    for offset in (-1800, -60, -1, 0, 59, 1800):
+        keys = [1, 2 if offset < 0 else 3, 0]
+        sightingsLog.Record(LiveRows(liveDataStructure, keys), 0, hourStart + 3600 + offset)
+
+    return sightingsLog
+
+
+def test_SegmentNames():
+
+    assert SegmentName(hourStart // 3600) == '20240131-09.sightings'
+    assert SegmentHour('20240131-09.sightings') == hourStart // 3600
+
+
+def test_FlushWritesOneSegmentPerHour(tmp_path, liveDataStructure):
+
+    sightingsLog = FilledLog(str(tmp_path), liveDataStructure)
+
+    # Nothing reaches the disk until the buffer is flushed, strangers aren't logged
+    assert os.listdir(tmp_path) == []
+    assert sightingsLog.recordedSightings == 12
+
+    sightingsLog.Flush()
+
+    assert sorted(os.listdir(tmp_path)) == ['20240131-09.sightings', '20240131-10.sightings']
+    assert sightingsLog.RowCount('20240131-09.sightings') == 6
+    assert sightingsLog.RowCount('20240131-10.sightings') == 6
+
+
+def test_SightingsAcrossHourBoundary(tmp_path, liveDataStructure):
+
+    sightingsLog = FilledLog(str(tmp_path), liveDataStructure)
+
+    # 09:59:00 up to (not including) 10:00:59
+    sightings = sightingsLog.Sightings(1, hourStart + 3600 - 60, hourStart + 3600 + 59)
+
+    assert (sightings['Time'] - hourStart - 3600).tolist() == [-60, -1, 0]
+    assert (sightings['Key'] == 1).all()
+    assert np.allclose(sightings['Distance'], 0.25)
+
+    # Only the hours a key was seen in are opened - key 3 has nothing before 10:00
+    assert len(sightingsLog.Sightings(3, hourStart, hourStart + 3600)) == 0
+    assert len(sightingsLog.Sightings(3)) == 3
+
+    assert len(sightingsLog.Sightings(99)) == 0
+
+
+def test_LastSeen(tmp_path, liveDataStructure):
+
+    sightingsLog = FilledLog(str(tmp_path), liveDataStructure)
+
+    assert sightingsLog.LastSeen(1)['Time'] == hourStart + 3600 + 1800
+    assert sightingsLog.LastSeen(2)['Time'] == hourStart + 3600 - 1
+    assert sightingsLog.LastSeen(99) is None
+
+
+def test_HourlyCountsPartialHours(tmp_path, liveDataStructure):
+
+    sightingsLog = FilledLog(str(tmp_path), liveDataStructure)
+
+    # Whole hours come from the index (or file sizes), the part-hours at either end are counted row by row
+    hourStarts, counts = sightingsLog.HourlyCounts(hourStart, hourStart + 7200)
+    assert (hourStarts - hourStart).tolist() == [0, 3600]
+    assert counts.tolist() == [6, 6]
+
+    hourStarts, counts = sightingsLog.HourlyCounts(hourStart + 3600 - 60, hourStart + 3600 + 60)
+    assert counts.tolist() == [4, 4]
+
+    hourStarts, counts = sightingsLog.HourlyCounts(hourStart + 3000, hourStart + 7200, key=1)
+    assert counts.tolist() == [2, 3]
+
+
+def test_IndexSavedAndUpdated(tmp_path, liveDataStructure):
+
+    sightingsLog = FilledLog(str(tmp_path), liveDataStructure)
+    sightingsLog.LastSeen(1)
+
+    # Finished hours are in index.npz - a new log answers from it
+    assert os.path.exists(tmp_path / 'index.npz')
+    reopenedLog = SightingsLog(str(tmp_path))
+    assert reopenedLog.KeyHours(2)['Count'].tolist() == [3]
+
+    # A batch run adding an old recording to an old hour - the hour is summarized again
+    reopenedLog.Record(LiveRows(liveDataStructure, [2]), 1, hourStart + 3600 + 600)
+    assert reopenedLog.LastSeen(2)['Source'] == 1
+    assert (reopenedLog.KeyHours(2)['Hour'] - hourStart // 3600).tolist() == [0, 1]
+
+
+def test_CurrentHour(tmp_path, liveDataStructure):
+
+    sightingsLog = SightingsLog(str(tmp_path))
+    now = time.time()
+
+    sightingsLog.Record(LiveRows(liveDataStructure, [5]), 0, now)
+    assert sightingsLog.LastSeen(5)['Time'] == now
+
+    # Still being written - its summary is cached until it grows
+    sightingsLog.Record(LiveRows(liveDataStructure, [5]), 0, now + 0.5)
+    assert len(sightingsLog.Sightings(5)) == 2
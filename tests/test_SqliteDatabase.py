@@ -0,0 +1,178 @@
+# Tests for SqliteDatabase.py (SQLite backend)
+# Copyright Doug Hardy and John Granholm
+
+
+import numpy as np  # array library
+import pytest  # raises
+from SqliteDatabase import SqliteDatabase  # what's tested
+from EncodingStorage import SaveDatabase  # .npy checkpoints to import
+from FaceDatabase import DatabaseStore, ExemplarTable  # recorded databaseArray
+from conftest import RandomEncodings  # test encodings
+
+
+def OpenDatabase(tmp_path, databaseStructure):
+    # testDatabase2.sqlite in tmp_path - nothing to import, no timed flushes (the tests flush themselves)
+
+    return SqliteDatabase(str(tmp_path / 'testDatabase2.sqlite'), databaseStructure, flushInterval=1000,
+                          importPath=str(tmp_path / 'testDatabase2.npy'))
+
+
+def RecordedStore(databaseStructure, sqliteDatabase):
+    # An empty store whose changes go to sqliteDatabase
+
+    databaseArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+    databaseArray.changeLog = sqliteDatabase
+
+    return databaseArray
+
+
+def AppendRows(databaseArray, encodings):
+
+    for encoding in encodings:
+        key = len(databaseArray) + 1
+        databaseArray.Append(Key=key, NameId=databaseArray.InternName(databaseArray.UnknownName(key)),
+                             FaceEncoding=encoding)
+
+
+def LoadedStore(databaseStructure, sqliteDatabase):
+    # What LoadArray does with the SQLite backend
+
+    databaseArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+
+    columnArray, encodingBlocks, indexArray, names, exemplarArrays = sqliteDatabase.Load()
+    databaseArray.Adopt(columnArray, encodingBlocks, names)
+    if exemplarArrays is not None:
+        databaseArray.exemplars.Adopt(*exemplarArrays, rowCount=len(databaseArray))
+
+    return databaseArray
+
+
+def test_RecordFlushLoad(tmp_path, databaseStructure):
+
+    encodings = RandomEncodings(6)
+
+    sqliteDatabase = OpenDatabase(tmp_path, databaseStructure)
+    databaseArray = RecordedStore(databaseStructure, sqliteDatabase)
+
+    AppendRows(databaseArray, encodings[:5])
+    databaseArray.SetValue('FrameSaved', 2, 1700000000)
+    databaseArray.SetValue('NameId', 4, databaseArray.InternName('Bob'))
+    databaseArray.SetExemplar(3, 1, encodings[5])
+
+    # Nothing is written until the flush - then it's all one transaction
+    assert sqliteDatabase.RowCount() == 0
+    sqliteDatabase.Flush()
+    assert sqliteDatabase.writtenTransactions == 1
+    sqliteDatabase.Stop()
+
+    reloadDatabase = OpenDatabase(tmp_path, databaseStructure)
+    reloadedArray = LoadedStore(databaseStructure, reloadDatabase)
+    reloadDatabase.Stop()
+
+    assert np.array_equal(reloadedArray.ToArray(), databaseArray.ToArray())
+    assert reloadedArray.names == databaseArray.names
+    assert reloadedArray.Name(4) == 'Bob'
+    assert reloadedArray['FrameSaved'][2] == 1700000000
+    assert np.array_equal(reloadedArray.exemplars.Exemplars(3), databaseArray.exemplars.Exemplars(3))
+
+
+def test_ImportExport(tmp_path, databaseStructure):
+
+    checkpointPath = str(tmp_path / 'testDatabase2.npy')
+    encodings = RandomEncodings(8)
+
+    databaseArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+    AppendRows(databaseArray, encodings[:6])
+    databaseArray.SetExemplar(1, 0, encodings[7])
+    SaveDatabase(checkpointPath, databaseArray.ToArray(), databaseArray.names,
+                 savedExemplars=databaseArray.exemplars.Arrays())
+
+    # An empty database is filled from the .npy next to it the first time it's loaded
+    sqliteDatabase = OpenDatabase(tmp_path, databaseStructure)
+    assert sqliteDatabase.Exists()
+    loadedArray = LoadedStore(databaseStructure, sqliteDatabase)
+    assert sqliteDatabase.RowCount() == 6
+    assert np.array_equal(loadedArray.ToArray(), databaseArray.ToArray())
+    assert np.array_equal(loadedArray.exemplars.Exemplars(1), databaseArray.exemplars.Exemplars(1))
+
+    # A change made in SQLite goes back out to the .npy
+    loadedArray.changeLog = sqliteDatabase
+    AppendRows(loadedArray, encodings[6:7])
+    sqliteDatabase.Flush()
+
+    exportPath = str(tmp_path / 'exported.npy')
+    assert sqliteDatabase.Export(exportPath) == 7
+    sqliteDatabase.Stop()
+
+    exportDatabase = SqliteDatabase(str(tmp_path / 'exported.sqlite'), databaseStructure, flushInterval=1000,
+                                    importPath=exportPath)
+    exportedArray = LoadedStore(databaseStructure, exportDatabase)
+    exportDatabase.Stop()
+
+    assert np.array_equal(exportedArray.ToArray(), loadedArray.ToArray())
+    assert exportedArray.names == loadedArray.names
+    assert np.array_equal(exportedArray.exemplars.Exemplars(1), databaseArray.exemplars.Exemplars(1))
+
+
+def test_RewriteReplacesEveryRow(tmp_path, databaseStructure):
+
+    encodings = RandomEncodings(5)
+
+    sqliteDatabase = OpenDatabase(tmp_path, databaseStructure)
+    databaseArray = RecordedStore(databaseStructure, sqliteDatabase)
+    AppendRows(databaseArray, encodings)
+    databaseArray.SetExemplar(4, 0, encodings[0])
+    sqliteDatabase.Flush()
+
+    # A compacted database - two rows gone, the rest renumbered, exemplars dropped
+    compactedArray = DatabaseStore(databaseStructure, exemplars=ExemplarTable(4))
+    AppendRows(compactedArray, encodings[[0, 2, 3]])
+
+    # A change still waiting to be written is already part of what's rewritten - it's dropped
+    databaseArray.SetValue('FrameSaved', 4, 42)
+    sqliteDatabase.Rewrite(compactedArray.ToArray(), compactedArray.names)
+    sqliteDatabase.Flush()
+
+    rewrittenArray = LoadedStore(databaseStructure, sqliteDatabase)
+    sqliteDatabase.Stop()
+
+    assert len(rewrittenArray) == 3
+    assert np.array_equal(rewrittenArray.ToArray(), compactedArray.ToArray())
+    assert rewrittenArray.names == compactedArray.names
+    assert len(rewrittenArray.exemplars) == 0
+
+
+def test_ReaderSeesLastCommit(tmp_path, databaseStructure):
+
+    encodings = RandomEncodings(4)
+
+    sqliteDatabase = OpenDatabase(tmp_path, databaseStructure)
+    databaseArray = RecordedStore(databaseStructure, sqliteDatabase)
+    AppendRows(databaseArray, encodings[:2])
+    sqliteDatabase.Flush()
+
+    # Recorded but not flushed - readers don't see it
+    AppendRows(databaseArray, encodings[2:3])
+    assert sqliteDatabase.Query('SELECT Key FROM faces ORDER BY Row') == [(1,), (2,)]
+
+    # A reader part way through its transaction keeps its snapshot (taken at its first query) while the writer commits
+    with sqliteDatabase.Reader() as connection:
+        assert connection.execute('SELECT COUNT(*) FROM faces').fetchone()[0] == 2
+        sqliteDatabase.Flush()
+        assert connection.execute('SELECT COUNT(*) FROM faces').fetchone()[0] == 2
+
+    assert sqliteDatabase.RowCount() == 3
+    sqliteDatabase.Stop()
+
+
+def test_RecordUnknownOp(tmp_path, databaseStructure):
+
+    sqliteDatabase = OpenDatabase(tmp_path, databaseStructure)
+
+    with pytest.raises(ValueError, match='unknown journal op rename'):
+        sqliteDatabase.Record({'op': 'rename', 'row': 0})
+    with pytest.raises(KeyError):
+        sqliteDatabase.Record({'op': 'set', 'column': 'Nickname', 'row': 0, 'value': 1})
+
+    assert sqliteDatabase.recordedEntries == 0
+    sqliteDatabase.Stop()
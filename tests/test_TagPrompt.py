@@ -0,0 +1,62 @@
+# Tests for TagPrompt.py
+# Copyright Doug Hardy and John Granholm
+
+
+import time  # waiting on the prompt thread
+from TagPrompt import TagPrompt  # what's tested
+
+
+def WaitForAnswers(tagPrompt, answerCount):
+    # Answers never waits - collect them until answerCount have come in
+
+    answers = []
+    deadline = time.monotonic() + 5
+
+    while len(answers) < answerCount and time.monotonic() < deadline:
+        answers += tagPrompt.Answers()
+        time.sleep(0.01)
+
+    return answers
+
+
+def test_AnswersInOrder():
+
+    typedAnswers = iter([' Bob ', 'Carol'])
+    prompts = []
+
+    def PromptFunction(prompt):
+        prompts.append(prompt)
+        return next(typedAnswers)
+
+    tagPrompt = TagPrompt(PromptFunction)
+
+    assert tagPrompt.Ask(3, 'Unknown4')
+    assert tagPrompt.Ask(5, 'Unknown6')
+
+    assert WaitForAnswers(tagPrompt, 2) == [(3, 'Bob'), (5, 'Carol')]
+    assert prompts == ['Tag Unknown4: ', 'Tag Unknown6: ']
+
+
+def test_PendingRowAskedOnce():
+
+    tagPrompt = TagPrompt(lambda prompt: 'Bob')
+
+    # Clicked again while the first question is still waiting for its answer
+    assert tagPrompt.Ask(3, 'Unknown4')
+    assert not tagPrompt.Ask(3, 'Unknown4')
+
+    assert WaitForAnswers(tagPrompt, 1) == [(3, 'Bob')]
+
+    # Answered - it can be asked about again
+    assert tagPrompt.Ask(3, 'Unknown4')
+
+
+def test_NoTerminalAnswersBlank():
+
+    def PromptFunction(prompt):
+        raise EOFError
+
+    tagPrompt = TagPrompt(PromptFunction)
+    tagPrompt.Ask(0, 'Unknown1')
+
+    assert WaitForAnswers(tagPrompt, 1) == [(0, '')]